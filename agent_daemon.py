@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+备份代理守护进程
+常驻进程，通过 Unix 套接字执行 backup.sh 用到的辅助命令（读取配置、备份锁、写日志和备份历史），
+调用方不必每次启动新的 Python 进程，各模块只导入一次，SQLite 写入也集中在本进程中依次执行。
+
+协议:
+    请求: 命令参数，每个参数以 NUL 结尾，第一个参数为模块名，例如
+          printf '%s\\0' config_manager get_dbs --db_type mysql | nc -NU /run/backup-agent.sock
+    响应: 第一行为退出码，其余为命令的标准输出；标准错误写入本进程的日志
+
+命令与直接运行对应模块相同，例如 "backup_lock acquire --db_type mysql" 等价于
+"python3 backup_lock.py acquire --db_type mysql"。
+
+环境变量:
+    AGENT_SOCKET  套接字路径（默认 /run/backup-agent.sock）
+"""
+
+import io
+import os
+import sys
+import time
+import socket
+import signal
+import argparse
+import importlib
+import threading
+import traceback
+import socketserver
+from contextlib import redirect_stdout, redirect_stderr
+from datetime import datetime
+
+AGENT_SOCKET = os.environ.get('AGENT_SOCKET', "/run/backup-agent.sock")
+
+# 可通过代理执行的模块（均提供 argparse 命令行入口 main()）
+COMMANDS = ('config_manager', 'backup_lock', 'system_logger', 'backup_logger', 'notification_outbox',
+            'backup_artifacts', 'throttle')
+
+# 单个请求的最大字节数
+MAX_REQUEST_SIZE = 1024 * 1024
+
+# 客户端等待响应的超时（秒）
+CALL_TIMEOUT = 60
+
+# 各模块的 main() 通过 sys.argv 读取参数、向 sys.stdout 输出，同一时间只能执行一条命令
+_command_lock = threading.Lock()
+
+# 代理自身的日志输出：命令执行期间全局的 sys.stderr 被 redirect_stderr 替换为该命令的缓冲区，
+# 其他连接线程的日志不能写到那里，因此使用启动时的标准错误
+_log_stream = sys.__stderr__
+
+
+def _log(message):
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message}", file=_log_stream, flush=True)
+
+
+def run_command(argv):
+    """
+    在本进程内执行一条命令
+
+    Args:
+        argv: [模块名, 参数...]
+
+    Returns:
+        tuple: (退出码, 标准输出, 标准错误)
+    """
+    if not argv or argv[0] not in COMMANDS:
+        return 2, '', f"不支持的命令: {argv[0] if argv else ''}（可用: {', '.join(COMMANDS)}）\n"
+
+    module_name = argv[0]
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+
+    with _command_lock:
+        saved_argv = sys.argv
+        sys.argv = [f"{module_name}.py"] + list(argv[1:])
+        try:
+            module = importlib.import_module(module_name)
+            with redirect_stdout(stdout), redirect_stderr(stderr):
+                module.main()
+            code = 0
+        except SystemExit as e:
+            if e.code is None:
+                code = 0
+            elif isinstance(e.code, int):
+                code = e.code
+            else:
+                stderr.write(f"{e.code}\n")
+                code = 1
+        except Exception:
+            stderr.write(traceback.format_exc())
+            code = 1
+        finally:
+            sys.argv = saved_argv
+
+    return code, stdout.getvalue(), stderr.getvalue()
+
+
+class AgentRequestHandler(socketserver.StreamRequestHandler):
+    """读取一条 NUL 分隔的命令，执行后返回退出码和标准输出"""
+
+    def handle(self):
+        data = b''
+        while len(data) <= MAX_REQUEST_SIZE:
+            chunk = self.rfile.read1(65536)
+            if not chunk:
+                break
+            data += chunk
+        if len(data) > MAX_REQUEST_SIZE:
+            self.wfile.write(b"2\n")
+            return
+
+        argv = [arg.decode('utf-8', 'surrogateescape') for arg in data.split(b'\0')]
+        if argv and argv[-1] == '':
+            argv.pop()
+        if not argv:
+            # 启动时检测已有代理的探测连接
+            return
+
+        started = time.perf_counter()
+        code, output, errors = run_command(argv)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        command = ' '.join(argv[:2])
+        if errors:
+            for line in errors.rstrip('\n').splitlines():
+                _log(f"{command}: {line}")
+        if code != 0:
+            _log(f"{command} 退出码 {code}（{elapsed_ms:.1f} ms）")
+
+        try:
+            self.wfile.write(f"{code}\n".encode() + output.encode('utf-8', 'surrogateescape'))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class AgentServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """每个连接一个线程读写，命令本身由 _command_lock 保证依次执行"""
+    daemon_threads = True
+
+
+def _remove_stale_socket(path):
+    """删除上次异常退出遗留的套接字；已有代理在运行时返回 False"""
+    if not os.path.exists(path):
+        return True
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+        return False
+    except OSError:
+        os.remove(path)
+        return True
+    finally:
+        probe.close()
+
+
+def serve(path=AGENT_SOCKET):
+    """启动代理并一直运行，收到 SIGTERM/SIGINT 后退出"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if not _remove_stale_socket(path):
+        print(f"已有代理在运行: {path}", file=sys.stderr)
+        return False
+
+    # 启动时导入所有模块，第一条命令也不必等待导入
+    for module_name in COMMANDS:
+        importlib.import_module(module_name)
+
+    server = AgentServer(path, AgentRequestHandler)
+    os.chmod(path, 0o600)
+
+    def stop(signum, frame):
+        # shutdown() 会等待 serve_forever 退出，不能在同一线程中调用
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 备份代理已启动: {path}", flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 备份代理已停止", flush=True)
+    return True
+
+
+def call(argv, path=AGENT_SOCKET, timeout=CALL_TIMEOUT):
+    """
+    通过代理执行一条命令
+
+    Returns:
+        tuple: (退出码, 标准输出)
+
+    Raises:
+        OSError: 代理未运行或连接中断
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall(b''.join(arg.encode('utf-8', 'surrogateescape') + b'\0' for arg in argv))
+        sock.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+
+    response = b''.join(chunks)
+    status, _, output = response.partition(b'\n')
+    if not status.isdigit():
+        raise ConnectionError("代理响应不完整")
+    return int(status), output.decode('utf-8', 'surrogateescape')
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='备份代理守护进程')
+    parser.add_argument('--socket', default=AGENT_SOCKET, help='套接字路径')
+    subparsers = parser.add_subparsers(dest='command', help='可用命令')
+
+    subparsers.add_parser('serve', help='启动代理')
+    call_parser = subparsers.add_parser('call', help='通过代理执行一条命令')
+    call_parser.add_argument('argv', nargs=argparse.REMAINDER, help='模块名和参数')
+
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        if not serve(args.socket):
+            sys.exit(1)
+    elif args.command == 'call':
+        try:
+            code, output = call(args.argv, args.socket)
+        except OSError as e:
+            print(f"调用备份代理失败: {str(e)}", file=sys.stderr)
+            sys.exit(1)
+        sys.stdout.write(output)
+        sys.exit(code)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -11,12 +11,28 @@ from datetime import datetime, timedelta
 import secrets
 import re
 import pyotp
-import qrcode
 from io import BytesIO
 import base64
 
 # 导入数据库迁移模块
-from migrate_db import ensure_v22_tables
+from migrate_db import ensure_schema
+from schedule_model import CronSchedule, parse_cron, next_runs
+import metrics
+import profiling
+from metrics import TimedConnection
+from profiling import span
+
+# 同目录下的模块（Docker 中位于 /app，PYTHONPATH 指向该目录），启动时导入一次
+import backup_logger
+import notifications
+import optional_deps
+import artifact_index
+import artifact_crypto
+import backup_artifacts
+import restore_manager
+import restore_verify
+import throttle
+import storage
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-this-in-production'  # 生产环境请更改此密钥
@@ -27,10 +43,20 @@ login_manager.init_app(app)
 login_manager.login_view = 'login'
 login_manager.login_message = '请先登录以访问此页面'
 
+# 记录各路由的请求耗时
+metrics.init_app(app)
+# 请求步骤计时和抽样 cProfile（PROFILING_ENABLED=1 时开启）
+profiling.init_app(app)
+# notifications 模块在 Web 进程中共用，日志统一输出到 Flask 的 logger
+notifications.logger = app.logger
+
 # 获取项目根目录
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-BACKUP_DIR = os.path.join(BASE_DIR, 'backups')
-DB_FILE = os.path.join(BASE_DIR, 'backups', 'users.db')
+BACKUP_DIR = os.environ.get('BACKUP_BASE_DIR') or os.path.join(BASE_DIR, 'backups')
+DB_FILE = os.environ.get('BACKUP_DB_FILE') or os.path.join(BACKUP_DIR, 'users.db')
+
+# 下载备份时按文件后缀设置的类型
+COMPRESSION_MIMETYPES = {'.gz': 'application/gzip', '.zst': 'application/zstd'}
 
 # --- 用户模型和认证 ---
 
@@ -55,7 +81,7 @@ def load_user(user_id):
 
 def get_db_connection():
     """获取数据库连接"""
-    conn = sqlite3.connect(DB_FILE)
+    conn = sqlite3.connect(DB_FILE, factory=TimedConnection)
     conn.row_factory = sqlite3.Row
     return conn
 
@@ -188,13 +214,6 @@ def send_password_reset_email(username, reset_token):
         # 生成重置链接
         reset_url = f"{request.host_url}reset_password/{reset_token}"
 
-        # 导入邮件通知模块
-        sys.path.insert(0, BASE_DIR)
-        import importlib.util
-        spec = importlib.util.spec_from_file_location("notifications", "/app/notifications.py")
-        notifications = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(notifications)
-
         # 发送邮件
         notifier = notifications.EmailNotifier(email_config)
 
@@ -241,6 +260,7 @@ def get_totp_uri(secret, username):
 
 def generate_qr_code(uri):
     """生成二维码的 base64 编码"""
+    qrcode = optional_deps.load('qrcode')
     qr = qrcode.QRCode(version=1, box_size=10, border=5)
     qr.add_data(uri)
     qr.make(fit=True)
@@ -443,30 +463,8 @@ def delete_user_otp(user_id):
     finally:
         conn.close()
 
-def init_db():
-    """初始化数据库"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-# 在应用启动时初始化数据库和配置表
-init_db()
-sys.path.insert(0, BASE_DIR)
-from config_manager import init_config_tables
-init_config_tables()
-
-# 初始化备份锁表
-from backup_lock import init_backup_lock_table
-init_backup_lock_table()
+# 在应用启动时确保数据库结构为最新版本（版本未变时只读取一次 PRAGMA user_version）
+ensure_schema()
 
 # --- 辅助函数 ---
 
@@ -477,7 +475,6 @@ def load_config(user_id=None):
         user_id: 用户 ID（用于多用户隔离）
     """
     try:
-        sys.path.insert(0, BASE_DIR)
         from config_manager import get_all_config
         return get_all_config(user_id)
     except Exception as e:
@@ -492,6 +489,8 @@ def load_config(user_id=None):
                 'enabled': False,
                 'on_success': True,
                 'on_failure': True,
+                'digest_window': 0,
+                'immediate_on_failure': True,
                 'email': {
                     'enabled': False,
                     'smtp_server': '',
@@ -519,8 +518,6 @@ def save_config(config):
 
 def update_crontab():
     """从数据库读取计划并更新系统的 crontab。"""
-    import sys
-    sys.path.insert(0, BASE_DIR)
     from config_manager import get_backup_schedules
     from migrate_db import get_db_connection
 
@@ -535,15 +532,25 @@ def update_crontab():
 
     for schedule_key, schedule_info in schedules.items():
         if schedule_key.endswith('_postgresql'):
-            cron_expr = schedule_info.get('cron_expression')
-            user_id = schedule_info.get('user_id')
-            if cron_expr and schedule_info.get('enabled') and schedule_info.get('schedule_type') != 'disabled':
-                content += f"{cron_expr} root /usr/local/bin/backup.sh postgresql 自动 \"\" {user_id} >> /var/log/cron.log 2>&1\n"
+            db_type = 'postgresql'
         elif schedule_key.endswith('_mysql'):
-            cron_expr = schedule_info.get('cron_expression')
-            user_id = schedule_info.get('user_id')
-            if cron_expr and schedule_info.get('enabled') and schedule_info.get('schedule_type') != 'disabled':
-                content += f"{cron_expr} root /usr/local/bin/backup.sh mysql 自动 \"\" {user_id} >> /var/log/cron.log 2>&1\n"
+            db_type = 'mysql'
+        else:
+            continue
+
+        cron_expr = schedule_info.get('cron_expression')
+        user_id = schedule_info.get('user_id')
+        if not cron_expr or not schedule_info.get('enabled') or schedule_info.get('schedule_type') == 'disabled':
+            continue
+
+        # 无效的表达式会让 cron 忽略整个文件，写入前先校验
+        try:
+            schedule = parse_cron(cron_expr)
+        except ValueError as e:
+            print(f"跳过无效的备份计划 {schedule_key}: {e}")
+            continue
+
+        content += f"{schedule.expression} root /usr/local/bin/backup.sh {db_type} 自动 \"\" {user_id} >> /var/log/cron.log 2>&1\n"
 
     try:
         # 写入文件
@@ -563,61 +570,30 @@ def update_crontab():
 
 def _parse_cron_for_ui(cron_str):
     """解析cron表达式，返回一个适合UI填充的字典。"""
-    if not cron_str or cron_str == 'disabled':
-        return {'frequency': 'disabled'}
-
-    parts = cron_str.split()
-    if len(parts) != 5:
+    try:
+        schedule = parse_cron(cron_str)
+    except ValueError:
         return {'frequency': 'disabled'} # 格式不正确
 
-    minute, hour, day_of_month, month, day_of_week = parts
-
-    # 格式化时间
-    time_val = f"{int(hour):02d}:{int(minute):02d}"
-
-    # 判断频率
-    if day_of_month == '*' and day_of_week != '*':
-        return {
-            'frequency': 'weekly',
-            'time': time_val,
-            'weekday': day_of_week
-        }
-    elif day_of_month != '*' and day_of_week == '*':
-        return {
-            'frequency': 'monthly',
-            'time': time_val,
-            'day_of_month': day_of_month
-        }
-    elif day_of_month == '*' and day_of_week == '*':
-        return {
-            'frequency': 'daily',
-            'time': time_val
-        }
-    
-    return {'frequency': 'disabled'} # 无法识别的格式
+    if not schedule:
+        return {'frequency': 'disabled'}
+    return schedule.to_ui()
 
 def _humanize_cron(cron_str):
     """将cron表达式转换为人类可读的字符串。"""
-    if not cron_str or cron_str == 'disabled':
-        return "从不 (仅手动)"
-
-    parts = cron_str.split()
-    if len(parts) != 5:
+    try:
+        schedule = parse_cron(cron_str)
+    except ValueError:
         return "无效计划"
 
-    minute, hour, day_of_month, _, day_of_week = parts
-    time_str = f"{int(hour):02d}:{int(minute):02d}"
-
-    weekdays = {'0': '周日', '1': '周一', '2': '周二', '3': '周三', '4': '周四', '5': '周五', '6': '周六'}
+    if not schedule:
+        return "从不 (仅手动)"
+    return schedule.humanize()
 
-    if day_of_month == '*' and day_of_week != '*':
-        return f"每周{weekdays.get(day_of_week, '')} {time_str}"
-    elif day_of_month != '*' and day_of_week == '*':
-        return f"每月{day_of_month}号 {time_str}"
-    elif day_of_month == '*' and day_of_week == '*':
-        return f"每天 {time_str}"
-    
-    return "自定义计划"
+def _next_run_for_ui(cron_str):
+    """返回计划的下次执行时间字符串，未启用或无效时返回空字符串。"""
+    runs = next_runs({'schedule': cron_str}).get('schedule')
+    return runs[0].strftime('%Y-%m-%d %H:%M') if runs else ''
 
 
 def load_backup_history(user_id=None):
@@ -627,12 +603,8 @@ def load_backup_history(user_id=None):
         user_id: 用户 ID（用于多用户隔离）
     """
     try:
-        import importlib.util
-        spec = importlib.util.spec_from_file_location("backup_logger", "/app/backup_logger.py")
-        backup_logger = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(backup_logger)
-
-        db_history = backup_logger.get_recent_backups(limit=50, user_id=user_id)
+        with span('query_backup_history'):
+            db_history = backup_logger.get_recent_backups(limit=50, user_id=user_id)
 
         # 转换数据库格式为前端需要的格式
         formatted_history = []
@@ -1070,13 +1042,15 @@ def otp_settings():
 def index():
     """主页，显示配置、备份列表和备份历史。"""
     # 检查用户是否设置了 OTP
-    otp_config = get_user_otp_config(current_user.id)
+    with span('otp_config'):
+        otp_config = get_user_otp_config(current_user.id)
     if not otp_config or not otp_config.get('is_enabled'):
         # 用户未启用 OTP，重定向到 OTP 设置页面
         flash('欢迎使用数据库备份管理器！为了保障账户安全，请先设置两步验证', 'info')
         return redirect(url_for('otp_setup'))
 
-    config = load_config(user_id=current_user.id)
+    with span('load_config'):
+        config = load_config(user_id=current_user.id)
     # 确保关键字段存在
     config.setdefault('postgresql', [])
     config.setdefault('mysql', [])
@@ -1089,66 +1063,99 @@ def index():
     postgresql_schedule = next((v for k, v in user_schedules.items() if k.endswith('_postgresql')), None)
     mysql_schedule = next((v for k, v in user_schedules.items() if k.endswith('_mysql')), None)
 
-    schedules_ui = {
-        'postgresql': _parse_cron_for_ui(postgresql_schedule),
-        'mysql': _parse_cron_for_ui(mysql_schedule)
-    }
+    with span('schedules'):
+        schedules_ui = {
+            'postgresql': _parse_cron_for_ui(postgresql_schedule),
+            'mysql': _parse_cron_for_ui(mysql_schedule)
+        }
 
-    # 为数据库列表生成人类可读的计划描述
-    humanized_schedules = {
-        'postgresql': _humanize_cron(postgresql_schedule),
-        'mysql': _humanize_cron(mysql_schedule)
-    }
+        # 为数据库列表生成人类可读的计划描述
+        humanized_schedules = {
+            'postgresql': _humanize_cron(postgresql_schedule),
+            'mysql': _humanize_cron(mysql_schedule)
+        }
+
+        # 下次执行时间
+        next_run_times = {
+            'postgresql': _next_run_for_ui(postgresql_schedule),
+            'mysql': _next_run_for_ui(mysql_schedule)
+        }
 
     # 设置用户专属的备份目录
     user_backup_dir = BACKUP_DIR
     if current_user.is_authenticated:
         user_backup_dir = os.path.join(BACKUP_DIR, f'user_{current_user.id}')
 
-    # 确保用户备份目录存在
-    os.makedirs(user_backup_dir, exist_ok=True)
-
-    # 获取用户专属目录下的备份文件
-    backup_files = []
-    if os.path.exists(user_backup_dir):
-        backup_files = sorted(
-            [f for f in os.listdir(user_backup_dir) if f.endswith(('.gz', '.tar.gz'))],
-            key=lambda f: os.path.getmtime(os.path.join(user_backup_dir, f)),
-            reverse=True
-        )
-
-    # 分类备份文件
-    backups_by_type = {'postgresql': [], 'mysql': []}
-    one_week_ago = datetime.now() - timedelta(days=7)
-    retention_days_config = config.get('retention_days', {'postgresql': 7, 'mysql': 7})
-
-    for backup_file in backup_files:
-        file_path = os.path.join(user_backup_dir, backup_file)
-        creation_time = datetime.fromtimestamp(os.path.getmtime(file_path))
-
-        # 根据文件名确定数据库类型
-        if 'postgresql' in backup_file or 'pg' in backup_file.lower():
-            db_type = 'postgresql'
-            retention_days = retention_days_config.get('postgresql', 7)
-        elif 'mysql' in backup_file.lower():
-            db_type = 'mysql'
-            retention_days = retention_days_config.get('mysql', 7)
-        else:
-            # 无法识别类型，归为 postgresql 作为默认
-            db_type = 'postgresql'
-            retention_days = 7
-
-        # 只显示最近一周的备份
-        if creation_time >= one_week_ago:
-            deletion_time = creation_time + timedelta(days=retention_days)
-            backups_by_type[db_type].append({
-                'name': backup_file,
-                'delete_time': deletion_time.strftime('%Y-%m-%d %H:%M:%S')
-            })
-
-    backup_history = load_backup_history(user_id=current_user.id if current_user.is_authenticated else None)
-
-    return render_template('index.html', config=config, backups_by_type=backups_by_type, schedules_ui=schedules_ui, humanized_schedules=humanized_schedules, backup_history=backup_history)
+    with span('scan_backups'):
+        # 确保用户备份目录存在
+        os.makedirs(user_backup_dir, exist_ok=True)
+
+        # 获取用户专属目录下的备份文件
+        # .zst 为后台重新压缩后的备份（见 recompress.py），.dump 为 pg_dump -Fc 格式的单库备份
+        backup_suffixes = ('.gz', '.tar.gz', '.gz.enc', '.zst', '.zst.enc', '.dump', '.dump.enc')
+        file_times = {}
+        file_sizes = {}
+        # 热层，以及已移到冷层的备份（见 backup_artifacts.py migrate）
+        for directory in (user_backup_dir, storage.cold_path(user_backup_dir)):
+            if not directory or not os.path.isdir(directory):
+                continue
+            for f in os.listdir(directory):
+                if f.endswith(backup_suffixes) and f not in file_times:
+                    st = os.stat(os.path.join(directory, f))
+                    file_times[f] = st.st_mtime
+                    file_sizes[f] = st.st_size
+
+        # 本地已按保留策略清理、只剩远程副本的备份（见 storage.py）
+        remote_only = set()
+        try:
+            # 列表短时间缓存，不必每次加载页面都请求远程存储
+            prefix = storage.key_for(user_backup_dir) + '/'
+            for item in storage.list_remote_cached(prefix):
+                name = item['key'][len(prefix):]
+                if '/' not in name and name.endswith(backup_suffixes) and name not in file_times:
+                    file_times[name] = item['mtime']
+                    file_sizes[name] = item['size']
+                    remote_only.add(name)
+        except (OSError, ValueError, ImportError) as e:
+            print(f"读取远程存储失败: {e}", file=sys.stderr)
+
+        backup_files = sorted(file_times, key=file_times.get, reverse=True)
+
+        # 分类备份文件
+        backups_by_type = {'postgresql': [], 'mysql': []}
+        one_week_ago = datetime.now() - timedelta(days=7)
+        retention_days_config = config.get('retention_days', {'postgresql': 7, 'mysql': 7})
+
+        for backup_file in backup_files:
+            creation_time = datetime.fromtimestamp(file_times[backup_file])
+
+            # 根据文件名确定数据库类型
+            if 'postgresql' in backup_file or 'pg' in backup_file.lower():
+                db_type = 'postgresql'
+                retention_days = retention_days_config.get('postgresql', 7)
+            elif 'mysql' in backup_file.lower():
+                db_type = 'mysql'
+                retention_days = retention_days_config.get('mysql', 7)
+            else:
+                # 无法识别类型，归为 postgresql 作为默认
+                db_type = 'postgresql'
+                retention_days = 7
+
+            # 只显示最近一周的备份
+            if creation_time >= one_week_ago:
+                deletion_time = creation_time + timedelta(days=retention_days)
+                backups_by_type[db_type].append({
+                    'name': backup_file,
+                    'delete_time': deletion_time.strftime('%Y-%m-%d %H:%M:%S'),
+                    'size': file_sizes.get(backup_file, 0),
+                    'remote_only': backup_file in remote_only
+                })
+
+    with span('backup_history'):
+        backup_history = load_backup_history(user_id=current_user.id if current_user.is_authenticated else None)
+
+    with span('render_template'):
+        return render_template('index.html', config=config, backups_by_type=backups_by_type, schedules_ui=schedules_ui, humanized_schedules=humanized_schedules, next_run_times=next_run_times, backup_history=backup_history)
 
 @app.route('/add_db', methods=['POST'])
 @login_required
@@ -1158,7 +1165,6 @@ def add_db():
     edit_id = request.form.get('edit_id')  # 获取编辑ID
 
     if db_type in ['postgresql', 'mysql']:
-        sys.path.insert(0, BASE_DIR)
         from config_manager import add_database_connection, update_database_connection
 
         host = request.form.get('host')
@@ -1184,7 +1190,6 @@ def add_db():
 @app.route('/delete_db/<db_type>/<db_id>', methods=['GET', 'POST'])
 def delete_db(db_type, db_id):
     """根据ID删除一个数据库配置。"""
-    sys.path.insert(0, BASE_DIR)
     from config_manager import delete_database_connection
     delete_database_connection(db_id)
     return redirect(url_for('index'))
@@ -1193,7 +1198,6 @@ def delete_db(db_type, db_id):
 @login_required
 def get_db(db_type, db_id):
     """获取指定数据库配置的详情,用于编辑。"""
-    sys.path.insert(0, BASE_DIR)
     from config_manager import get_database_connection
     db = get_database_connection(db_id)
     if db:
@@ -1208,7 +1212,6 @@ def backup_now(db_type):
 
     try:
         # 检查备份锁
-        sys.path.insert(0, BASE_DIR)
         from backup_lock import is_backup_locked
 
         if is_backup_locked(db_type):
@@ -1263,7 +1266,6 @@ def backup_single(db_type, db_id):
 
     try:
         # 检查备份锁
-        sys.path.insert(0, BASE_DIR)
         from backup_lock import is_backup_locked
 
         if is_backup_locked(db_type):
@@ -1328,46 +1330,24 @@ def save_settings():
         return redirect(url_for('index'))
 
     try:
-        sys.path.insert(0, BASE_DIR)
         from config_manager import save_backup_schedule
 
         # 保存当前数据库类型的保留天数
         retention_days = int(request.form.get('retention_days', 7))
 
         frequency = request.form.get('frequency', 'disabled')
-
-        if frequency == 'disabled':
-            schedule_type = 'disabled'
-            cron_expr = ''
-        elif frequency == 'daily':
-            schedule_type = 'daily'
-            time_str = request.form.get('time', '02:00')
-            try:
-                hour, minute = time_str.split(':')
-            except (ValueError, AttributeError):
-                hour, minute = '2', '0'
-            cron_expr = f"{minute} {hour} * * *"
-        elif frequency == 'weekly':
-            schedule_type = 'weekly'
-            time_str = request.form.get('time', '02:00')
-            weekday = request.form.get('weekday', '0')
-            try:
-                hour, minute = time_str.split(':')
-            except (ValueError, AttributeError):
-                hour, minute = '2', '0'
-            cron_expr = f"{minute} {hour} * * {weekday}"
-        elif frequency == 'monthly':
-            schedule_type = 'monthly'
-            time_str = request.form.get('time', '02:00')
-            day_of_month = request.form.get('day_of_month', '1')
-            try:
-                hour, minute = time_str.split(':')
-            except (ValueError, AttributeError):
-                hour, minute = '2', '0'
-            cron_expr = f"{minute} {hour} {day_of_month} * *"
-        else:
-            schedule_type = 'disabled'
-            cron_expr = ''
+        if frequency not in ('daily', 'weekly', 'monthly'):
+            frequency = 'disabled'
+
+        # 校验表单并生成 cron 表达式，无效输入不会写入 crontab
+        schedule = CronSchedule.from_ui(
+            frequency,
+            request.form.get('time', '02:00'),
+            request.form.get('weekday', '0'),
+            request.form.get('day_of_month', '1')
+        )
+        schedule_type = frequency
+        cron_expr = schedule.expression if schedule else ''
 
         # 保存到数据库，传入当前用户的 ID
         save_backup_schedule(current_user.id, db_type, schedule_type, cron_expr, retention_days)
@@ -1376,8 +1356,9 @@ def save_settings():
         update_crontab()
 
     except (ValueError, TypeError) as e:
+        # 任一字段无效时整个表单（包括保留天数）都不保存，提示用户修改后重新提交
         print(f"保存设置时出错: {e}")
-        pass
+        flash(f'保存设置失败，未作任何修改: {str(e)}', 'danger')
 
     return redirect(url_for('index'))
 
@@ -1391,8 +1372,71 @@ def download_backup(filename):
 
     # 设置用户专属的备份目录
     user_backup_dir = os.path.join(BACKUP_DIR, f'user_{current_user.id}')
+    path = os.path.join(user_backup_dir, filename)
+    decrypt = artifact_crypto.is_encrypted(filename) and request.args.get('raw') != '1'
 
-    return send_from_directory(user_backup_dir, filename, as_attachment=True)
+    # 本地文件可能在热层或冷层
+    located = storage.locate(path)
+    if located and not decrypt:
+        return send_from_directory(os.path.dirname(located), filename, as_attachment=True)
+
+    # 本地文件已被清理时从远程存储读取
+    try:
+        reader, size = storage.open_artifact(path)
+    except FileNotFoundError:
+        return "文件不存在", 404
+    except (OSError, ValueError, ImportError) as e:
+        return f"读取备份文件失败: {str(e)}", 500
+
+    # 加密备份默认解密后下载（?raw=1 下载加密文件本身）
+    if decrypt:
+        try:
+            reader = artifact_crypto.DecryptingReader(reader)
+        except (ValueError, ImportError) as e:
+            return f"无法解密备份文件: {str(e)}", 500
+        size = reader.size
+        filename = filename[:-len(artifact_crypto.ENCRYPTED_SUFFIX)]
+    return _send_stream(reader, size, filename)
+
+
+def _send_stream(reader, size, filename):
+    """以附件形式流式发送 reader 的内容，支持 Range 请求（加密备份只解密请求范围涉及的加密块）"""
+    start, end = 0, size - 1
+    status = 200
+    match = re.fullmatch(r'bytes=(\d*)-(\d*)', request.headers.get('Range', '').strip())
+    if match and (match.group(1) or match.group(2)):
+        if match.group(1):
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(int(match.group(2)), size - 1)
+        else:
+            start = max(0, size - int(match.group(2)))
+        if start > end or start >= size:
+            reader.close()
+            response = make_response('', 416)
+            response.headers['Content-Range'] = f'bytes */{size}'
+            return response
+        status = 206
+
+    def generate():
+        with reader:
+            reader.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = reader.read(min(artifact_crypto.CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    mimetype = COMPRESSION_MIMETYPES.get(os.path.splitext(filename)[1], 'application/octet-stream')
+    response = app.response_class(generate(), status=status, mimetype=mimetype)
+    response.headers['Content-Length'] = str(max(0, end - start + 1))
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    if status == 206:
+        response.headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
 
 @app.route('/delete_backup/<filename>', methods=['POST'])
 @login_required
@@ -1405,9 +1449,10 @@ def delete_backup(filename):
     user_backup_dir = os.path.join(BACKUP_DIR, f'user_{current_user.id}')
 
     try:
-        os.remove(os.path.join(user_backup_dir, filename))
-    except OSError:
-        pass # 文件可能已被删除
+        # 分段索引和远程存储中的副本一并删除
+        storage.delete_artifact(os.path.join(user_backup_dir, filename))
+    except (OSError, ValueError, ImportError) as e:
+        print(f"删除备份文件失败: {e}", file=sys.stderr)
     return redirect(url_for('index'))
 
 @app.route('/download_log/<filename>')
@@ -1471,7 +1516,6 @@ def notifications():
 @login_required
 def debug_notifications():
     """通知配置调试页面"""
-    sys.path.insert(0, BASE_DIR)
     from config_manager import get_notification_config, get_db_connection
 
     # 获取数据库原始值
@@ -1506,13 +1550,14 @@ def save_notifications():
 def save_global_notification():
     """保存全局通知配置"""
     try:
-        sys.path.insert(0, BASE_DIR)
         from config_manager import save_global_notification_config
 
         # 获取表单数据（checkbox 选中时为 'on'，未选中时不存在）
         enabled = request.form.get('enabled') is not None
         on_success = request.form.get('on_success') is not None
         on_failure = request.form.get('on_failure') is not None
+        digest_window = int(request.form.get('digest_window', 0) or 0)
+        immediate_on_failure = request.form.get('immediate_on_failure') is not None
 
         # DEBUG: 记录接收到的表单数据
         app.logger.info(f"DEBUG save_global_notification: form.keys() = {list(request.form.keys())}")
@@ -1520,7 +1565,7 @@ def save_global_notification():
         app.logger.info(f"DEBUG save_global_notification: request.form.get('enabled') = {request.form.get('enabled')}")
 
         # 保存到数据库
-        save_global_notification_config(enabled, on_success, on_failure)
+        save_global_notification_config(enabled, on_success, on_failure, digest_window, immediate_on_failure)
 
         flash('全局通知设置已保存', 'success')
         return redirect(url_for('notifications'))
@@ -1535,7 +1580,6 @@ def save_global_notification():
 def save_email_notification():
     """保存邮件通知配置"""
     try:
-        sys.path.insert(0, BASE_DIR)
         from config_manager import save_email_notification_config
 
         # 邮件配置
@@ -1565,7 +1609,6 @@ def save_email_notification():
 def save_wechat_notification():
     """保存企业微信通知配置"""
     try:
-        sys.path.insert(0, BASE_DIR)
         from config_manager import save_wechat_notification_config
 
         # 企业微信配置
@@ -1591,7 +1634,6 @@ def save_wechat_notification():
 def save_notifications_all():
     """保存所有通知配置（旧版兼容）"""
     try:
-        sys.path.insert(0, BASE_DIR)
         from config_manager import save_notification_config
 
         # 获取表单数据（checkbox 选中时为 'on'，未选中时不存在）
@@ -1622,8 +1664,14 @@ def save_notifications_all():
             'to_users': request.form.get('to_users', '@all')
         }
 
+        # 通知汇总配置（旧版表单没有这些字段时保持原值）
+        digest_window = request.form.get('digest_window')
+        digest_window = int(digest_window or 0) if digest_window is not None else None
+        immediate_on_failure = request.form.get('immediate_on_failure') is not None if digest_window is not None else None
+
         # 保存到数据库
-        save_notification_config(enabled, on_success, on_failure, email_config, wechat_config)
+        save_notification_config(enabled, on_success, on_failure, email_config, wechat_config,
+                                 digest_window, immediate_on_failure)
 
         flash('通知配置已保存', 'success')
         return redirect(url_for('notifications'))
@@ -1642,11 +1690,6 @@ def test_notification():
     test_type = request.form.get('test_type')  # 'email' 或 'wechat'
 
     try:
-        import importlib.util
-        spec = importlib.util.spec_from_file_location("notifications", "/app/notifications.py")
-        notifications = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(notifications)
-
         if test_type == 'email':
             email_config = notifications_config.get('email', {})
 
@@ -1686,9 +1729,6 @@ def test_notification():
 
             app.logger.info("开始创建企业微信通知器...")
 
-            # 设置 notifications 模块的 logger 使用 Flask 的 logger
-            notifications.logger = app.logger
-
             notifier = notifications.WeChatNotifier(wechat_config)
 
             app.logger.info("开始发送测试消息...")
@@ -1723,7 +1763,6 @@ def api_backup_history():
         db_type = request.args.get('db_type')
         status = request.args.get('status')
 
-        sys.path.insert(0, BASE_DIR)
         from backup_logger import get_backup_history
 
         history = get_backup_history(
@@ -1738,6 +1777,38 @@ def api_backup_history():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/backup/history/search')
+@login_required
+def api_backup_history_search():
+    """全文检索备份历史（支持时间范围和相关度排序）"""
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'success': False, 'error': '请输入检索词'}), 400
+
+        limit = request.args.get('limit', 50, type=int)
+        status = request.args.get('status')
+        start_date = request.args.get('start')
+        end_date = request.args.get('end')
+        order = request.args.get('order', 'rank')
+
+        from backup_logger import search_backup_history
+
+        history = search_backup_history(
+            query,
+            limit=limit,
+            user_id=current_user.id,
+            status=status,
+            start_date=start_date,
+            end_date=end_date,
+            order=order
+        )
+
+        return jsonify({'success': True, 'data': history})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @app.route('/api/backup/statistics')
 @login_required
 def api_backup_statistics():
@@ -1745,7 +1816,6 @@ def api_backup_statistics():
     try:
         days = request.args.get('days', 7, type=int)
 
-        sys.path.insert(0, BASE_DIR)
         from backup_logger import get_backup_statistics
 
         stats = get_backup_statistics(days=days)
@@ -1755,6 +1825,248 @@ def api_backup_statistics():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/schedules/next_runs')
+@login_required
+def api_schedule_next_runs():
+    """获取当前用户各备份计划的下次执行时间"""
+    try:
+        count = min(request.args.get('count', 1, type=int), 50)
+
+        from config_manager import get_backup_schedules
+
+        schedules = get_backup_schedules(user_id=current_user.id)
+        expressions = {
+            info.get('db_type'): info.get('cron_expression') if info.get('enabled') else ''
+            for info in schedules.values()
+        }
+
+        runs = next_runs(expressions, count=max(count, 1))
+        data = {
+            db_type: {
+                'schedule': _humanize_cron(expressions[db_type]),
+                'next_runs': [run.strftime('%Y-%m-%d %H:%M') for run in db_runs]
+            }
+            for db_type, db_runs in runs.items()
+        }
+
+        return jsonify({'success': True, 'data': data})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+# --- 备份文件和恢复 API ---
+
+@app.route('/api/artifacts')
+@login_required
+def api_artifacts():
+    """列出当前用户可恢复的备份文件"""
+    try:
+        limit = min(request.args.get('limit', 50, type=int), 500)
+        artifacts = backup_artifacts.list_artifacts(
+            user_id=current_user.id,
+            db_type=request.args.get('db_type'),
+            limit=limit
+        )
+        return jsonify({'success': True, 'data': artifacts})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+def _get_user_artifact(artifact_id):
+    """获取当前用户的备份文件记录，不存在或文件已删除返回 None"""
+    artifact = backup_artifacts.get_artifact(artifact_id)
+    if not artifact or artifact['user_id'] != current_user.id or not artifact['exists']:
+        return None
+    return artifact
+
+
+@app.route('/api/artifacts/<int:artifact_id>/databases')
+@login_required
+def api_artifact_databases(artifact_id):
+    """列出"所有数据库"备份中的数据库和表（来自分段索引）"""
+    artifact = _get_user_artifact(artifact_id)
+    if not artifact:
+        return jsonify({'success': False, 'error': '备份文件不存在'}), 404
+    if not artifact['indexed']:
+        return jsonify({'success': False, 'error': '该备份没有分段索引'}), 400
+    return jsonify({'success': True, 'data': artifact_index.list_databases(artifact['path'])})
+
+
+@app.route('/api/artifacts/<int:artifact_id>/extract')
+@login_required
+def api_artifact_extract(artifact_id):
+    """从"所有数据库"备份中下载一个数据库（或一个表），按索引直接读取对应的 gzip 成员（或 zstd 帧）"""
+    artifact = _get_user_artifact(artifact_id)
+    if not artifact:
+        return jsonify({'success': False, 'error': '备份文件不存在'}), 404
+
+    database = request.args.get('database', '').strip()
+    table = request.args.get('table', '').strip() or None
+    if not database:
+        return jsonify({'success': False, 'error': '请指定数据库'}), 400
+    try:
+        ranges = artifact_index.database_ranges(artifact['path'], database, table)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    name = re.sub(r'[^\w.-]', '_', f"{database}_{table}" if table else database)
+    mimetype = COMPRESSION_MIMETYPES['.zst' if artifact['compression'] == 'zstd' else '.gz']
+    response = app.response_class(artifact_index.iter_compressed(artifact['path'], ranges), mimetype=mimetype)
+    response.headers['Content-Length'] = str(sum(length for offset, length in ranges))
+    response.headers['Content-Disposition'] = f'attachment; filename="{name}_{artifact["filename"]}"'
+    return response
+
+
+@app.route('/api/restores', methods=['GET', 'POST'])
+@login_required
+def api_restores():
+    """列出恢复任务（GET），或从备份文件发起恢复（POST，后台执行）"""
+    if request.method == 'GET':
+        limit = min(request.args.get('limit', 20, type=int), 200)
+        return jsonify({'success': True, 'data': restore_manager.list_restores(current_user.id, limit=limit)})
+
+    data = request.get_json(silent=True) or request.form
+    try:
+        restore_id = restore_manager.start_restore(
+            data.get('artifact_id'),
+            data.get('connection_id'),
+            target_db=data.get('target_db'),
+            user_id=current_user.id,
+            jobs=int(data.get('jobs') or 1),
+            max_rate=restore_manager.parse_rate(data.get('max_rate')),
+            create_db=str(data.get('create_db', '')).lower() in ('1', 'true', 'on', 'yes'),
+            source_db=data.get('source_db') or None
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+    return jsonify({'success': True, 'data': restore_manager.get_restore(restore_id)})
+
+
+@app.route('/api/restores/<int:restore_id>')
+@login_required
+def api_restore_status(restore_id):
+    """查看恢复任务的状态和进度"""
+    restore = restore_manager.get_restore(restore_id)
+    if not restore or restore['user_id'] != current_user.id:
+        return jsonify({'success': False, 'error': '恢复任务不存在'}), 404
+    return jsonify({'success': True, 'data': restore})
+
+
+@app.route('/api/verifications', methods=['GET', 'POST'])
+@login_required
+def api_verifications():
+    """列出恢复校验记录（GET），或在后台校验备份（POST，未指定 artifact_ids 时校验各连接最新的备份）"""
+    if request.method == 'GET':
+        limit = min(request.args.get('limit', 50, type=int), 500)
+        return jsonify({'success': True, 'data': restore_verify.list_verifications(current_user.id, limit=limit)})
+
+    data = request.get_json(silent=True) or {}
+    artifact_ids = []
+    for artifact_id in data.get('artifact_ids') or []:
+        artifact = backup_artifacts.get_artifact(artifact_id)
+        if not artifact or artifact['user_id'] != current_user.id:
+            return jsonify({'success': False, 'error': f'备份文件不存在: {artifact_id}'}), 400
+        artifact_ids.append(artifact['id'])
+
+    try:
+        restore_verify.start_verification(
+            artifact_ids or None,
+            user_id=current_user.id,
+            workers=min(int(data.get('workers') or 2), 8),
+            jobs=min(int(data.get('jobs') or 1), restore_manager.MAX_JOBS)
+        )
+    except (OSError, ValueError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+    return jsonify({'success': True, 'message': '恢复校验已在后台开始'})
+
+
+@app.route('/api/verifications/<int:verification_id>')
+@login_required
+def api_verification_detail(verification_id):
+    """查看恢复校验结果和各表统计"""
+    verification = restore_verify.get_verification(verification_id)
+    if not verification or verification['user_id'] != current_user.id:
+        return jsonify({'success': False, 'error': '校验记录不存在'}), 404
+    return jsonify({'success': True, 'data': verification})
+
+
+@app.route('/api/throttle', methods=['GET', 'POST'])
+@login_required
+def api_throttle():
+    """列出限速规则（GET，含全局规则），或为自己的数据库连接添加按时间窗口的限速规则（POST）"""
+    if request.method == 'GET':
+        return jsonify({'success': True, 'data': throttle.list_windows(current_user.id)})
+
+    data = request.get_json(silent=True) or request.form
+    try:
+        window_id = throttle.add_window(
+            data.get('start_time'),
+            data.get('end_time'),
+            read_rate=throttle.parse_rate(data.get('read_rate')),
+            write_rate=throttle.parse_rate(data.get('write_rate')),
+            connection_id=data.get('connection_id'),
+            user_id=current_user.id
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+    return jsonify({'success': True, 'data': {'id': window_id}})
+
+
+@app.route('/api/throttle/<int:window_id>/delete', methods=['POST'])
+@login_required
+def api_throttle_delete(window_id):
+    """删除自己添加的限速规则"""
+    if not throttle.delete_window(window_id, current_user.id):
+        return jsonify({'success': False, 'error': '限速规则不存在'}), 404
+    return jsonify({'success': True})
+
+
+def _metrics_token_valid():
+    """请求是否携带 METRICS_TOKEN 环境变量设置的 Bearer Token（未设置时一律无效）"""
+    token = os.environ.get('METRICS_TOKEN')
+    return bool(token) and secrets.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus 指标：需要携带 METRICS_TOKEN 环境变量设置的 Bearer Token（供抓取程序使用）
+
+    指标中含所有用户的 user_id、数据库名、备份大小和失败次数，已登录的普通用户也不能访问；
+    未设置 METRICS_TOKEN 时拒绝所有访问。
+    """
+    if not _metrics_token_valid():
+        return make_response('unauthorized\n', 401)
+
+    response = make_response(metrics.render())
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
+
+@app.route('/profiling/reports')
+def profiling_reports():
+    """列出慢请求的性能分析报告（报告中含所有用户的请求路径和耗时，与 /metrics 一样需要 METRICS_TOKEN）"""
+    if not _metrics_token_valid():
+        return jsonify({'success': False, 'error': 'unauthorized'}), 401
+    return jsonify({'success': True, 'enabled': profiling.PROFILING_ENABLED, 'data': profiling.list_reports()})
+
+
+@app.route('/profiling/reports/<filename>')
+def download_profiling_report(filename):
+    """下载性能分析报告（.txt 摘要或 .prof 原始数据），需要 METRICS_TOKEN"""
+    if not _metrics_token_valid():
+        return make_response('unauthorized\n', 401)
+    location = profiling.report_path(filename)
+    if not location:
+        return "File not found", 404
+    return send_from_directory(*location, as_attachment=True)
+
+
 @app.route('/api/system/logs')
 @login_required
 def api_system_logs():
@@ -1763,11 +2075,39 @@ def api_system_logs():
         limit = request.args.get('limit', 100, type=int)
         log_type = request.args.get('type', None)
         category = request.args.get('category', None)
+        start_date = request.args.get('start')
+        end_date = request.args.get('end')
 
-        sys.path.insert(0, BASE_DIR)
         from system_logger import get_logs
 
-        logs = get_logs(limit=limit, log_type=log_type, category=category)
+        logs = get_logs(limit=limit, log_type=log_type, category=category,
+                        start_date=start_date, end_date=end_date)
+
+        return jsonify({'success': True, 'data': logs})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/system/logs/search')
+@login_required
+def api_system_logs_search():
+    """全文检索系统日志（支持时间范围和相关度排序）"""
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'success': False, 'error': '请输入检索词'}), 400
+
+        limit = request.args.get('limit', 100, type=int)
+        log_type = request.args.get('type', None)
+        category = request.args.get('category', None)
+        start_date = request.args.get('start')
+        end_date = request.args.get('end')
+        order = request.args.get('order', 'rank')
+
+        from system_logger import search_logs
+
+        logs = search_logs(query, limit=limit, log_type=log_type, category=category,
+                           start_date=start_date, end_date=end_date, order=order)
 
         return jsonify({'success': True, 'data': logs})
     except Exception as e:
@@ -1792,7 +2132,7 @@ def test_connection():
         if db_type == 'postgresql':
             # 测试 PostgreSQL 连接
             try:
-                import psycopg2
+                psycopg2 = optional_deps.load('psycopg2')
                 conn_params = {
                     'host': host,
                     'port': port,
@@ -1815,7 +2155,7 @@ def test_connection():
         elif db_type == 'mysql':
             # 测试 MySQL 连接
             try:
-                import pymysql
+                pymysql = optional_deps.load('pymysql')
                 conn_params = {
                     'host': host,
                     'port': port,
@@ -1855,7 +2195,7 @@ def get_databases():
         if db_type == 'postgresql':
             # 获取 PostgreSQL 数据库列表
             try:
-                import psycopg2
+                psycopg2 = optional_deps.load('psycopg2')
                 conn = psycopg2.connect(
                     host=host,
                     port=port,
@@ -1891,7 +2231,7 @@ def get_databases():
         elif db_type == 'mysql':
             # 获取 MySQL 数据库列表
             try:
-                import pymysql
+                pymysql = optional_deps.load('pymysql')
                 conn = pymysql.connect(
                     host=host,
                     port=port,
@@ -1927,15 +2267,4 @@ def get_databases():
 
 
 if __name__ == '__main__':
-    # 启动时自动检查并确保数据库表完整性
-    print("\n" + "=" * 60)
-    print("应用启动 - 检查数据库完整性")
-    print("=" * 60)
-    try:
-        ensure_v22_tables()
-    except Exception as e:
-        print(f"⚠️  数据库完整性检查失败: {str(e)}")
-        print("继续启动应用...")
-    print("=" * 60 + "\n")
-
     app.run(host='0.0.0.0', port=5001, debug=True)
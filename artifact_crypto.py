@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+备份文件加密模块
+压缩后的备份数据在写入磁盘前按固定大小分块，用 AES-256-GCM 加密（每块独立认证），
+不需要先写明文文件再加密一遍。每个用户使用自己的数据密钥，数据密钥由主密钥加密后保存在
+encryption_keys 表中；备份文件头部记录所用密钥的 ID。
+
+文件格式（后缀 .enc，例如 pg_app_20250101_020000.sql.gz.enc）:
+    头部: MAGIC(8) | 版本(1) | 明文块大小(4, 大端) | nonce 前缀(8) | 密钥 ID 长度(1) | 密钥 ID
+    之后依次为各块: 密文(明文块大小，最后一块可以更短) | GCM 标签(16)
+    第 i 块的 nonce 为 nonce 前缀 + i（4 字节大端），附加认证数据为头部 + i + 是否最后一块，
+    块被调换、删除或文件在块边界处被截断都会导致认证失败。
+
+除最后一块外每块长度相同，明文偏移量可以直接换算为密文位置：随机读取（分段索引提取单个数据库、
+HTTP Range 下载）只需解密涉及的块。
+
+主密钥:
+    BACKUP_MASTER_KEY       base64 编码的 32 字节主密钥（推荐，通过 secret 注入）
+    BACKUP_MASTER_KEY_FILE  未设置 BACKUP_MASTER_KEY 时读取的主密钥文件，不存在时自动生成
+                            （默认 /backups/.master.key；丢失主密钥将无法解密任何备份）
+
+用法:
+    gzip < dump.sql | python3 artifact_crypto.py encrypt --user-id 1 > dump.sql.gz.enc
+    python3 artifact_crypto.py decrypt dump.sql.gz.enc | gzip -dc
+"""
+
+import os
+import sys
+import json
+import base64
+import struct
+import sqlite3
+import secrets
+import tempfile
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import TimedConnection
+import optional_deps
+
+# 数据库文件路径
+DB_FILE = os.environ.get('BACKUP_DB_FILE', "/backups/users.db")
+
+MASTER_KEY_FILE = os.environ.get('BACKUP_MASTER_KEY_FILE', "/backups/.master.key")
+
+# 加密文件后缀（追加在原备份文件名之后）
+ENCRYPTED_SUFFIX = '.enc'
+
+MAGIC = b'DBBKENC\x00'
+FORMAT_VERSION = 1
+
+# 明文块大小：随机读取时最多多解密一块
+CHUNK_SIZE = 1024 * 1024
+
+TAG_SIZE = 16
+NONCE_PREFIX_SIZE = 8
+KEY_SIZE = 32
+
+# 头部中密钥 ID 之前的固定部分
+_HEADER_FIXED = struct.Struct('>8sBI8sB')
+
+
+class DataKey:
+    """一个用户的数据密钥"""
+
+    def __init__(self, key_id, key):
+        self.key_id = key_id
+        self.key = key
+
+
+def get_db_connection():
+    """获取数据库连接"""
+    conn = sqlite3.connect(DB_FILE, factory=TimedConnection)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _aesgcm():
+    return optional_deps.load('cryptography').AESGCM
+
+
+def is_encrypted(path):
+    return path.endswith(ENCRYPTED_SUFFIX)
+
+
+# ===== 密钥管理 =====
+
+def _create_master_key_file():
+    """
+    生成主密钥文件：先完整写入临时文件，再以硬链接放到 MASTER_KEY_FILE
+
+    多个备份同时首次加密时只有一个链接成功，其余直接使用已有的文件；
+    读取方不会看到尚未写完的主密钥文件。
+    """
+    directory = os.path.dirname(os.path.abspath(MASTER_KEY_FILE))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix='.master.key.', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(base64.b64encode(secrets.token_bytes(KEY_SIZE)).decode() + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.link(temp_path, MASTER_KEY_FILE)
+        except FileExistsError:
+            return
+    finally:
+        os.remove(temp_path)
+    print(f"已生成主密钥文件 {MASTER_KEY_FILE}，请妥善备份，丢失后将无法解密备份", file=sys.stderr)
+
+
+def load_master_key():
+    """
+    读取主密钥，BACKUP_MASTER_KEY 和主密钥文件都没有时生成新的主密钥文件
+
+    Raises:
+        ValueError: 主密钥格式错误
+    """
+    encoded = os.environ.get('BACKUP_MASTER_KEY')
+    if not encoded:
+        if not os.path.exists(MASTER_KEY_FILE):
+            _create_master_key_file()
+        with open(MASTER_KEY_FILE) as f:
+            encoded = f.read().strip()
+    try:
+        key = base64.b64decode(encoded, validate=True)
+    except ValueError:
+        key = b''
+    if len(key) != KEY_SIZE:
+        raise ValueError("主密钥必须是 base64 编码的 32 字节")
+    return key
+
+
+def _wrap(master_key, key_id, key):
+    nonce = secrets.token_bytes(12)
+    return nonce + _aesgcm()(master_key).encrypt(nonce, key, key_id.encode())
+
+
+def _unwrap(master_key, key_id, wrapped):
+    return _aesgcm()(master_key).decrypt(wrapped[:12], wrapped[12:], key_id.encode())
+
+
+def create_key(user_id=None):
+    """
+    为用户生成新的数据密钥并设为当前密钥，之前的密钥保留用于解密旧备份
+
+    Returns:
+        DataKey: 新密钥
+    """
+    master_key = load_master_key()
+    key = secrets.token_bytes(KEY_SIZE)
+    key_id = f"u{user_id or 0}-{secrets.token_hex(6)}"
+    conn = get_db_connection()
+    try:
+        conn.execute('''
+            UPDATE encryption_keys SET status = 'retired', retired_at = CURRENT_TIMESTAMP
+            WHERE user_id IS ? AND status = 'active'
+        ''', (user_id,))
+        conn.execute('''
+            INSERT INTO encryption_keys (key_id, user_id, wrapped_key, status) VALUES (?, ?, ?, 'active')
+        ''', (key_id, user_id, _wrap(master_key, key_id, key)))
+        conn.commit()
+    finally:
+        conn.close()
+    return DataKey(key_id, key)
+
+
+def get_user_key(user_id=None):
+    """获取用户当前的数据密钥，没有时生成"""
+    conn = get_db_connection()
+    try:
+        row = conn.execute('''
+            SELECT key_id, wrapped_key FROM encryption_keys
+            WHERE user_id IS ? AND status = 'active' ORDER BY created_at DESC LIMIT 1
+        ''', (user_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return create_key(user_id)
+    return DataKey(row['key_id'], _unwrap(load_master_key(), row['key_id'], row['wrapped_key']))
+
+
+def get_key(key_id):
+    """
+    按 ID 获取数据密钥（解密时使用，已轮换的密钥也可以）
+
+    Raises:
+        ValueError: 密钥不存在
+    """
+    conn = get_db_connection()
+    try:
+        row = conn.execute('SELECT wrapped_key FROM encryption_keys WHERE key_id = ?', (key_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        raise ValueError(f"加密密钥不存在: {key_id}")
+    return DataKey(key_id, _unwrap(load_master_key(), key_id, row['wrapped_key']))
+
+
+def list_keys(user_id=None):
+    """列出密钥（不含密钥内容）"""
+    query = 'SELECT key_id, user_id, status, created_at, retired_at FROM encryption_keys'
+    params = []
+    if user_id is not None:
+        query += ' WHERE user_id = ?'
+        params.append(user_id)
+    query += ' ORDER BY created_at DESC'
+    try:
+        conn = get_db_connection()
+        try:
+            return [dict(row) for row in conn.execute(query, params).fetchall()]
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"获取加密密钥列表失败: {str(e)}", file=sys.stderr)
+        return []
+
+
+# ===== 文件格式 =====
+
+def _build_header(key_id, chunk_size, nonce_prefix):
+    key_id_bytes = key_id.encode()
+    return _HEADER_FIXED.pack(MAGIC, FORMAT_VERSION, chunk_size, nonce_prefix, len(key_id_bytes)) + key_id_bytes
+
+
+def read_header(f):
+    """
+    读取加密文件头部
+
+    Returns:
+        dict: {'key_id', 'chunk_size', 'nonce_prefix', 'header'}
+
+    Raises:
+        ValueError: 不是加密备份文件或版本不支持
+    """
+    fixed = f.read(_HEADER_FIXED.size)
+    if len(fixed) < _HEADER_FIXED.size:
+        raise ValueError("加密备份文件头部不完整")
+    magic, version, chunk_size, nonce_prefix, key_id_length = _HEADER_FIXED.unpack(fixed)
+    if magic != MAGIC:
+        raise ValueError("不是加密的备份文件")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"不支持的加密格式版本: {version}")
+    key_id = f.read(key_id_length)
+    return {'key_id': key_id.decode(), 'chunk_size': chunk_size, 'nonce_prefix': nonce_prefix,
+            'header': fixed + key_id}
+
+
+def read_key_id(path):
+    """加密备份文件使用的密钥 ID，不是加密文件或无法读取时返回 None"""
+    if not is_encrypted(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            return read_header(f)['key_id']
+    except (OSError, ValueError):
+        return None
+
+
+def _nonce(prefix, index):
+    return prefix + struct.pack('>I', index)
+
+
+def _aad(header, index, final):
+    return header + struct.pack('>Q?', index, final)
+
+
+# ===== 加密 =====
+
+def _default_workers():
+    from throttle import effective_cpus
+    return min(effective_cpus(), 8)
+
+
+class EncryptingWriter:
+    """
+    分块加密后写入 out
+
+    各块的加密在线程池中并行执行，按顺序写出；最多 workers * 2 块在途。
+    最后一块需要在附加认证数据中标记，因此总是保留一块到有后续数据或 finish() 时才加密。
+    """
+
+    def __init__(self, out, data_key, chunk_size=CHUNK_SIZE, workers=None):
+        self.out = out
+        self.cipher = _aesgcm()(data_key.key)
+        self.chunk_size = chunk_size
+        self.nonce_prefix = secrets.token_bytes(NONCE_PREFIX_SIZE)
+        self.header = _build_header(data_key.key_id, chunk_size, self.nonce_prefix)
+        self.position = 0
+        self.index = 0
+        self.workers = workers or _default_workers()
+        self.executor = ThreadPoolExecutor(self.workers) if self.workers > 1 else None
+        self.inflight = deque()
+        self.buffer = bytearray()
+        self.out.write(self.header)
+
+    def _encrypt(self, index, data, final):
+        return self.cipher.encrypt(_nonce(self.nonce_prefix, index), bytes(data), _aad(self.header, index, final))
+
+    def _submit(self, data, final):
+        if self.executor is None:
+            self.out.write(self._encrypt(self.index, data, final))
+        else:
+            self.inflight.append(self.executor.submit(self._encrypt, self.index, data, final))
+            while len(self.inflight) > self.workers * 2:
+                self.out.write(self.inflight.popleft().result())
+        self.index += 1
+
+    def write(self, data):
+        self.buffer += data
+        self.position += len(data)
+        while len(self.buffer) > self.chunk_size:
+            chunk = self.buffer[:self.chunk_size]
+            del self.buffer[:self.chunk_size]
+            self._submit(chunk, False)
+        return len(data)
+
+    def tell(self):
+        """已写入的明文字节数"""
+        return self.position
+
+    def finish(self):
+        """加密最后一块并写出所有在途的块（不关闭 out）"""
+        self._submit(self.buffer, True)
+        self.buffer = bytearray()
+        while self.inflight:
+            self.out.write(self.inflight.popleft().result())
+        if self.executor is not None:
+            self.executor.shutdown()
+        self.out.flush()
+
+
+# ===== 解密 =====
+
+class DecryptingReader:
+    """
+    加密备份文件的只读文件对象，read() / seek() 按明文偏移量工作，只解密涉及的块
+
+    source 为文件路径，或可 seek 的二进制文件对象（如远程存储的对象，见 storage.py）
+    """
+
+    def __init__(self, source, data_key=None):
+        self.f = open(source, 'rb') if isinstance(source, str) else source
+        try:
+            header = read_header(self.f)
+            self.key_id = header['key_id']
+            data_key = data_key or get_key(self.key_id)
+        except Exception:
+            self.f.close()
+            raise
+        self.header = header['header']
+        self.nonce_prefix = header['nonce_prefix']
+        self.chunk_size = header['chunk_size']
+        self.cipher = _aesgcm()(data_key.key)
+
+        encrypted_size = self.f.seek(0, os.SEEK_END) - len(self.header)
+        block = self.chunk_size + TAG_SIZE
+        full, rest = divmod(encrypted_size, block)
+        if (rest and rest < TAG_SIZE) or encrypted_size <= 0:
+            self.f.close()
+            raise ValueError("加密备份文件被截断")
+        self.chunks = full + (1 if rest else 0)
+        self.size = full * self.chunk_size + max(rest - TAG_SIZE, 0)
+        self.position = 0
+        self._cached_index = None
+        self._cached = b''
+
+    def _chunk(self, index):
+        if index != self._cached_index:
+            self.f.seek(len(self.header) + index * (self.chunk_size + TAG_SIZE))
+            data = self.f.read(self.chunk_size + TAG_SIZE)
+            try:
+                self._cached = self.cipher.decrypt(_nonce(self.nonce_prefix, index), data,
+                                                   _aad(self.header, index, index == self.chunks - 1))
+            except Exception:
+                raise ValueError(f"备份文件第 {index} 块解密失败（文件损坏或密钥不匹配）")
+            self._cached_index = index
+        return self._cached
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self.position
+        parts = []
+        while size > 0 and self.position < self.size:
+            index, offset = divmod(self.position, self.chunk_size)
+            data = self._chunk(index)[offset:offset + size]
+            parts.append(data)
+            self.position += len(data)
+            size -= len(data)
+        return b''.join(parts)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        self.position = max(0, offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_artifact(path):
+    """打开备份文件用于读取，加密文件透明解密"""
+    if is_encrypted(path):
+        return DecryptingReader(path)
+    return open(path, 'rb')
+
+
+def artifact_size(path):
+    """备份文件（解密后）的字节数"""
+    if is_encrypted(path):
+        with DecryptingReader(path) as reader:
+            return reader.size
+    return os.path.getsize(path)
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='备份文件加密工具')
+    subparsers = parser.add_subparsers(dest='command', help='可用命令')
+
+    encrypt_parser = subparsers.add_parser('encrypt', help='加密标准输入写入标准输出')
+    encrypt_parser.add_argument('--user-id', type=int, help='使用该用户的数据密钥')
+    encrypt_parser.add_argument('--workers', type=int, help='并行加密的线程数（默认按可用 CPU 数）')
+
+    decrypt_parser = subparsers.add_parser('decrypt', help='解密备份文件写入标准输出')
+    decrypt_parser.add_argument('path', help='加密的备份文件')
+
+    subparsers.add_parser('key-id', help='显示加密备份文件使用的密钥 ID').add_argument('path', help='加密的备份文件')
+
+    keys_parser = subparsers.add_parser('keys', help='列出数据密钥')
+    keys_parser.add_argument('--user-id', type=int, help='用户 ID')
+
+    rotate_parser = subparsers.add_parser('rotate', help='为用户生成新的数据密钥（旧密钥仍可解密旧备份）')
+    rotate_parser.add_argument('--user-id', type=int, help='用户 ID')
+
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'encrypt':
+            writer = EncryptingWriter(sys.stdout.buffer, get_user_key(args.user_id), workers=args.workers)
+            while True:
+                chunk = sys.stdin.buffer.read1(CHUNK_SIZE)
+                if not chunk:
+                    break
+                writer.write(chunk)
+            writer.finish()
+        elif args.command == 'decrypt':
+            with DecryptingReader(args.path) as reader:
+                while True:
+                    chunk = reader.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    sys.stdout.buffer.write(chunk)
+        elif args.command == 'key-id':
+            key_id = read_key_id(args.path)
+            if not key_id:
+                print(f"不是加密的备份文件: {args.path}", file=sys.stderr)
+                sys.exit(1)
+            print(key_id)
+        elif args.command == 'keys':
+            print(json.dumps(list_keys(args.user_id), indent=2, ensure_ascii=False, default=str))
+        elif args.command == 'rotate':
+            print(f"已生成新密钥: {create_key(args.user_id).key_id}")
+        else:
+            parser.print_help()
+            sys.exit(1)
+    except (ValueError, ImportError) as e:
+        print(f"错误: {str(e)}", file=sys.stderr)
+        sys.exit(1)
+    except BrokenPipeError:
+        sys.stderr.close()
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
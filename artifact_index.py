@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+备份文件分段索引模块
+"所有数据库"备份写成多个独立的 gzip 成员：每个数据库的建表部分、每个表的数据各为一个成员，
+成员在文件中的位置写入同名的 .idx 索引（每行一个 JSON）。提取单个数据库或单个表时按索引
+直接定位到对应成员读取，不必解压和扫描整个备份文件。多个 gzip 成员依次拼接仍是标准的
+gzip 文件，gzip -dc 可以照常解压整个备份。
+
+后台重新压缩为 zstd 的备份（.sql.zst，见 recompress.py）中每个成员对应一个独立的 zstd 帧，
+索引格式不变，多个帧依次拼接同样可以由 zstd -dc 整体解压。
+
+加密备份（.sql.gz.enc，见 artifact_crypto.py）的索引偏移量是解密后 gzip 数据中的位置，
+读取时只解密涉及的加密块；索引文件本身不加密，其中只有数据库名、表名和位置。
+配置了远程存储时（见 storage.py），备份文件在写入的同时上传，索引在备份写完后上传。
+
+索引行格式:
+    {"database": "app", "table": "public.users", "offset": 1024, "length": 2048, "raw": 8192}
+    database 为 null 表示 mysqldump 开头的全局设置，提取任何数据库时都会带上；
+    table 为 null 表示数据库中表数据以外的部分（建表、索引、视图等）
+
+用法（backup.sh 中替代 gzip）:
+    pg_dump -d app | python3 artifact_index.py gzip --output pg_all.sql.gz --database app --append
+    mysqldump --all-databases | python3 artifact_index.py gzip --output mysql_all.sql.gz --dialect mysql
+"""
+
+import os
+import sys
+import json
+import zlib
+import argparse
+import threading
+import contextlib
+import subprocess
+
+import artifact_crypto
+import storage
+
+# 索引文件后缀（追加在备份文件名之后）
+INDEX_SUFFIX = '.idx'
+
+# 与 gzip 默认相同的压缩级别
+COMPRESS_LEVEL = 6
+
+# 攒够这么多字节再交给压缩器，减少调用次数
+BUFFER_SIZE = 1024 * 1024
+
+# 读取压缩数据的块大小
+CHUNK_SIZE = 256 * 1024
+
+# gzip 格式的 wbits
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+# zstd 压缩的备份（成员为 zstd 帧）及其解压命令
+ZSTD_SUFFIXES = ('.sql.zst', '.sql.zst.enc')
+ZSTD_DECOMPRESS = ['zstd', '-dcq', '--long=27']
+
+# mysqldump --all-databases 输出中每个数据库和每个表的开始，以及表之后的视图、存储过程部分
+MYSQL_DATABASE_MARKER = b'-- Current Database: `'
+MYSQL_TABLE_MARKER = b'-- Table structure for table `'
+MYSQL_POST_MARKERS = (b'-- Final view structure for view ', b'-- Dumping routines', b'-- Dumping events')
+
+
+def index_path(path):
+    """备份文件对应的索引文件路径"""
+    return path + INDEX_SUFFIX
+
+
+# ===== 写入 =====
+
+class MemberWriter:
+    """把 SQL 文本写成多个独立的 gzip 成员，记录每个成员的位置和压缩前大小"""
+
+    def __init__(self, out, offset=0):
+        self.out = out
+        self.offset = offset
+        self.entries = []
+        self.raw_total = 0
+        self.current = {'database': None, 'table': None}
+        self._compressor = None
+        self._member_offset = offset
+        self._member_raw = 0
+        self._pending = []
+        self._pending_size = 0
+
+    def start(self, database, table=None):
+        """结束当前成员，之后写入的内容属于 database / table"""
+        self.finish_member()
+        self.current = {'database': database, 'table': table}
+
+    def write(self, data):
+        if self._compressor is None:
+            self._compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, GZIP_WBITS)
+            self._member_offset = self.offset
+            self._member_raw = 0
+        self._pending.append(data)
+        self._pending_size += len(data)
+        if self._pending_size >= BUFFER_SIZE:
+            self._flush_pending()
+
+    def finish_member(self):
+        """写出当前成员的剩余数据和 gzip 尾部（没有内容的成员不写出）"""
+        if self._compressor is None:
+            return
+        self._flush_pending()
+        self._emit(self._compressor.flush())
+        self._compressor = None
+        self.entries.append(dict(self.current, offset=self._member_offset,
+                                 length=self.offset - self._member_offset, raw=self._member_raw))
+        self.raw_total += self._member_raw
+
+    def _flush_pending(self):
+        if not self._pending:
+            return
+        data = b''.join(self._pending)
+        self._pending = []
+        self._pending_size = 0
+        self._member_raw += len(data)
+        self._emit(self._compressor.compress(data))
+
+    def _emit(self, data):
+        if data:
+            self.out.write(data)
+            self.offset += len(data)
+
+
+def _backtick_name(line, marker):
+    """从 mysqldump 注释中取出反引号内的名称"""
+    rest = line[len(marker):].rstrip(b'\r\n')
+    if rest.endswith(b'`'):
+        rest = rest[:-1]
+    return rest.replace(b'``', b'`').decode('utf-8', 'replace')
+
+
+def split_postgresql(lines, writer, database):
+    """pg_dump 输出：每个 COPY 数据块一个成员，其余部分按顺序各成一个成员"""
+    writer.start(database)
+    in_copy = False
+    for line in lines:
+        if in_copy:
+            writer.write(line)
+            if line == b'\\.\n':
+                in_copy = False
+                writer.start(database)
+        elif line.startswith(b'COPY ') and line.rstrip().endswith(b'FROM stdin;'):
+            table = line[5:].split(b' ', 1)[0].decode('utf-8', 'replace')
+            writer.start(database, table)
+            writer.write(line)
+            in_copy = True
+        else:
+            writer.write(line)
+
+
+def split_mysql(lines, writer, database=None):
+    """mysqldump 输出：按 Current Database 注释切换数据库，每个表（结构和数据）一个成员"""
+    writer.start(database)
+    current = database
+    for line in lines:
+        if line.startswith(MYSQL_DATABASE_MARKER):
+            current = _backtick_name(line, MYSQL_DATABASE_MARKER)
+            writer.start(current)
+        elif line.startswith(MYSQL_TABLE_MARKER):
+            writer.start(current, _backtick_name(line, MYSQL_TABLE_MARKER))
+        elif line.startswith(MYSQL_POST_MARKERS):
+            writer.start(current)
+        writer.write(line)
+
+
+def write_members(source, out, dialect='postgresql', database=None, offset=0):
+    """
+    压缩 source 写入文件对象 out（不写索引）
+
+    Args:
+        offset: out 当前的位置，成员的偏移量从此开始计算
+
+    Returns:
+        MemberWriter: 含各成员位置和压缩前总字节数
+    """
+    writer = MemberWriter(out, offset)
+    if dialect == 'mysql':
+        split_mysql(source, writer, database)
+    else:
+        split_postgresql(source, writer, database)
+    writer.finish_member()
+    return writer
+
+
+def write_indexed(source, output, dialect='postgresql', database=None, append=False, limiter=None, data_key=None,
+                  upload_as=None):
+    """
+    压缩 source 写入 output，并把各成员的位置追加到索引文件
+
+    Args:
+        source: 逐行读取的二进制输入
+        output: 备份文件路径
+        dialect: postgresql 或 mysql
+        database: 输入所属的数据库（pg_dump 的输出中不包含数据库名）
+        append: 追加到已有的备份文件（逐个数据库转储时使用）
+        limiter: throttle.Throttle，限制写入备份文件的速率
+        data_key: artifact_crypto.DataKey，指定时加密写入（不能与 append 同时使用）
+        upload_as: 配置了远程存储时边写入边上传，对象键按此路径计算（不能与 append 同时使用）
+
+    Returns:
+        MemberWriter: 含各成员位置和压缩前总字节数
+    """
+    if append and data_key is not None:
+        raise ValueError("加密备份不能追加写入")
+    if append and upload_as:
+        raise ValueError("上传远程存储的备份不能追加写入")
+    if not append:
+        for path in (output, index_path(output)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    upload = storage.open_upload(upload_as) if upload_as else None
+    # 正常结束时提交上传，出错时放弃已上传的部分
+    with open(output, 'ab') as out, (upload if upload is not None else contextlib.nullcontext()):
+        offset = out.tell()
+        if upload is not None:
+            out = storage.TeeWriter(out, upload)
+        if limiter is not None:
+            from throttle import ThrottledWriter
+            out = ThrottledWriter(out, limiter)
+        encrypter = None
+        if data_key is not None:
+            out = encrypter = artifact_crypto.EncryptingWriter(out, data_key)
+        writer = write_members(source, out, dialect, database, offset)
+        if encrypter is not None:
+            encrypter.finish()
+
+    with open(index_path(output), 'a', encoding='utf-8') as f:
+        for entry in writer.entries:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    if upload is not None:
+        storage.upload_file(index_path(output), index_path(upload_as))
+    return writer
+
+
+# ===== 读取 =====
+
+def read_index(path):
+    """
+    读取备份文件的索引
+
+    Returns:
+        list: 索引条目，没有索引返回空列表
+    """
+    try:
+        with open(index_path(path), encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except (OSError, ValueError) as e:
+        if os.path.exists(index_path(path)):
+            print(f"读取备份索引失败: {str(e)}", file=sys.stderr)
+        return []
+
+
+def has_index(path):
+    return os.path.exists(index_path(path))
+
+
+def list_databases(path):
+    """
+    列出索引中的数据库及其表
+
+    Returns:
+        list: [{'name', 'size', 'raw_size', 'tables'}]，按在文件中的顺序
+    """
+    databases = {}
+    for entry in read_index(path):
+        if entry['database'] is None:
+            continue
+        database = databases.setdefault(entry['database'], {
+            'name': entry['database'], 'size': 0, 'raw_size': 0, 'tables': []})
+        database['size'] += entry['length']
+        database['raw_size'] += entry['raw']
+        if entry['table'] and entry['table'] not in database['tables']:
+            database['tables'].append(entry['table'])
+    return list(databases.values())
+
+
+def database_ranges(path, database, table=None):
+    """
+    提取一个数据库（或其中一个表）需要读取的成员位置
+
+    Returns:
+        list: [(offset, length)]，按文件顺序
+
+    Raises:
+        ValueError: 备份没有索引，或索引中没有该数据库 / 表
+    """
+    entries = read_index(path)
+    if not entries:
+        raise ValueError(f"备份文件没有分段索引: {os.path.basename(path)}")
+
+    selected = [entry for entry in entries if entry['database'] == database
+                and (table is None or entry['table'] == table)]
+    if not selected:
+        target = f"{database}.{table}" if table else database
+        raise ValueError(f"备份中没有 {target}")
+
+    # mysqldump 开头的全局设置（字符集、外键检查等）
+    header = [entry for entry in entries if entry['database'] is None]
+    return [(entry['offset'], entry['length']) for entry in header + selected]
+
+
+def iter_compressed(path, ranges, chunk_size=CHUNK_SIZE):
+    """按位置读取成员的原始字节，依次拼接仍是合法的 gzip / zstd 数据（加密备份读取时解密）"""
+    with artifact_crypto.open_artifact(path) as f:
+        for offset, length in ranges:
+            f.seek(offset)
+            remaining = length
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    raise ValueError(f"备份文件在偏移 {offset} 处被截断")
+                remaining -= len(chunk)
+                yield chunk
+
+
+def pipe_through(command, chunks, chunk_size=CHUNK_SIZE):
+    """
+    把 chunks 送入外部命令的标准输入（后台线程），产出其标准输出
+
+    Raises:
+        OSError: 命令退出码不为 0
+    """
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    errors = []
+
+    def feed():
+        try:
+            for chunk in chunks:
+                process.stdin.write(chunk)
+        except BrokenPipeError:
+            pass
+        except Exception as e:
+            errors.append(e)
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    try:
+        while True:
+            data = process.stdout.read(chunk_size)
+            if not data:
+                break
+            yield data
+    finally:
+        process.stdout.close()
+        feeder.join()
+        returncode = process.wait()
+    if errors:
+        raise errors[0]
+    if returncode != 0:
+        raise OSError(f"{command[0]} 退出码 {returncode}")
+
+
+def iter_decompressed(path, ranges, chunk_size=CHUNK_SIZE):
+    """按位置读取并解压成员，产出 SQL 文本"""
+    if path.endswith(ZSTD_SUFFIXES):
+        yield from pipe_through(ZSTD_DECOMPRESS, iter_compressed(path, ranges, chunk_size), chunk_size)
+        return
+    for offset, length in ranges:
+        decompressor = zlib.decompressobj(GZIP_WBITS)
+        for chunk in iter_compressed(path, [(offset, length)], chunk_size):
+            data = decompressor.decompress(chunk)
+            if data:
+                yield data
+        data = decompressor.flush()
+        if data:
+            yield data
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='备份文件分段索引工具')
+    subparsers = parser.add_subparsers(dest='command', help='可用命令')
+
+    gzip_parser = subparsers.add_parser('gzip', help='压缩标准输入并写入分段索引')
+    gzip_parser.add_argument('--output', required=True, help='备份文件路径')
+    gzip_parser.add_argument('--dialect', choices=['postgresql', 'mysql'], default='postgresql', help='SQL 方言')
+    gzip_parser.add_argument('--database', help='输入所属的数据库')
+    gzip_parser.add_argument('--append', action='store_true', help='追加到已有的备份文件')
+    gzip_parser.add_argument('--raw-size-file', help='追加写入压缩前的字节数（供 backup.sh 统计）')
+    gzip_parser.add_argument('--throttle-connection', help='按该连接的限速规则限制写入速率（见 throttle.py）')
+    gzip_parser.add_argument('--encrypt', action='store_true', help='使用用户的数据密钥加密（见 artifact_crypto.py）')
+    gzip_parser.add_argument('--user-id', type=int, help='加密使用该用户的数据密钥')
+    gzip_parser.add_argument('--upload-as', help='配置了远程存储时边写入边上传，按该路径计算对象键（见 storage.py）')
+
+    list_parser = subparsers.add_parser('list', help='列出备份中的数据库和表')
+    list_parser.add_argument('path', help='备份文件路径')
+
+    extract_parser = subparsers.add_parser('extract', help='从备份中提取一个数据库或表')
+    extract_parser.add_argument('path', help='备份文件路径')
+    extract_parser.add_argument('--database', required=True, help='数据库名')
+    extract_parser.add_argument('--table', help='表名（PostgreSQL 为 schema.table）')
+    extract_parser.add_argument('--compressed', action='store_true', help='输出压缩的数据（与备份文件相同的 gzip 或 zstd 格式）')
+    extract_parser.add_argument('--output', '-o', help='输出文件（默认标准输出）')
+
+    args = parser.parse_args()
+
+    if args.command == 'gzip':
+        limiter = None
+        if args.throttle_connection:
+            import throttle
+            limiter = throttle.Throttle(args.throttle_connection, ['write'])
+        data_key = artifact_crypto.get_user_key(args.user_id) if args.encrypt else None
+        writer = write_indexed(sys.stdin.buffer, args.output, args.dialect, args.database, args.append, limiter,
+                               data_key, args.upload_as)
+        if args.raw_size_file:
+            with open(args.raw_size_file, 'a') as f:
+                f.write(f"{writer.raw_total}\n")
+    elif args.command == 'list':
+        if not has_index(args.path):
+            print(f"备份文件没有分段索引: {args.path}", file=sys.stderr)
+            sys.exit(1)
+        print(json.dumps(list_databases(args.path), indent=2, ensure_ascii=False))
+    elif args.command == 'extract':
+        try:
+            ranges = database_ranges(args.path, args.database, args.table)
+            reader = iter_compressed if args.compressed else iter_decompressed
+            out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+            try:
+                for chunk in reader(args.path, ranges):
+                    out.write(chunk)
+            finally:
+                if args.output:
+                    out.close()
+        except ValueError as e:
+            print(f"错误: {str(e)}", file=sys.stderr)
+            sys.exit(1)
+        except BrokenPipeError:
+            sys.stderr.close()
+            sys.exit(1)
+        except OSError as e:
+            print(f"错误: 解压失败: {str(e)}", file=sys.stderr)
+            sys.exit(1)
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+备份文件元数据模块
+记录每个成功备份文件的路径、格式、大小和来源连接（backup_artifacts 表），
+供恢复、校验等功能直接定位文件，不必从备份历史的消息中解析。
+
+配置了冷层（BACKUP_COLD_DIR，见 storage.py）时，migrate 命令把超过 BACKUP_COLD_AFTER_DAYS 天的备份
+连同分段索引限速复制到冷层，同步到磁盘并核对大小后更新记录中的路径，再删除热层的文件。
+文件原样移动（不重新压缩），分段索引、加密头和恢复方式都不受影响。
+"""
+
+import os
+import sys
+import json
+import time
+import fcntl
+import shutil
+import sqlite3
+import argparse
+import contextlib
+
+from metrics import TimedConnection
+import artifact_index
+import artifact_crypto
+import storage
+
+# 数据库文件路径
+DB_FILE = os.environ.get('BACKUP_DB_FILE', "/backups/users.db")
+
+# 备份根目录（各用户的备份在 user_<ID> 子目录下）
+BACKUP_BASE_DIR = os.environ.get('BACKUP_BASE_DIR', "/backups")
+
+# 移到冷层的复制速率上限（字节/秒），避免迁移占满磁盘带宽
+COLD_RATE = os.environ.get('BACKUP_COLD_RATE', '20M')
+
+# 迁移时每次复制的字节数，同时也是限速的粒度
+MIGRATE_CHUNK_SIZE = 1024 * 1024
+
+# 后台整理任务（移到冷层、重新压缩）共用的锁文件，同一时间只有一个任务移动或替换备份文件
+MAINTENANCE_LOCK = '.maintenance.lock'
+
+# 文件后缀 -> (格式, 压缩方式)
+# plain 为 SQL 文本，由 psql / mysql 执行；custom 为 pg_dump -Fc 输出，由 pg_restore 恢复
+# 加密备份在原后缀之后追加 .enc（见 artifact_crypto.py）
+ARTIFACT_FORMATS = (
+    ('.sql.gz.enc', 'plain', 'gzip'),
+    ('.sql.zst.enc', 'plain', 'zstd'),
+    ('.dump.enc', 'custom', None),
+    ('.sql.gz', 'plain', 'gzip'),
+    ('.sql.zst', 'plain', 'zstd'),
+    ('.sql', 'plain', None),
+    ('.dump', 'custom', None),
+)
+
+
+def get_db_connection():
+    """获取数据库连接"""
+    conn = sqlite3.connect(DB_FILE, factory=TimedConnection)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def detect_format(path):
+    """
+    根据文件名判断备份格式
+
+    Returns:
+        tuple: (格式, 压缩方式)，无法识别返回 (None, None)
+    """
+    for suffix, artifact_format, compression in ARTIFACT_FORMATS:
+        if path.endswith(suffix):
+            return artifact_format, compression
+    return None, None
+
+
+def normalize_db_type(db_type):
+    """备份历史中的 PostgreSQL/MySQL 统一为 postgresql/mysql"""
+    return (db_type or '').strip().lower()
+
+
+def record_artifact(path, db_type, db_name=None, user_id=None, connection_id=None,
+                    backup_history_id=None, size=None, raw_size=None):
+    """
+    记录一个备份文件（同一路径重复记录时更新）
+
+    Args:
+        path: 备份文件的绝对路径
+        db_type: 数据库类型
+        db_name: 数据库名称，为空表示备份了所有数据库
+        user_id: 用户 ID
+        connection_id: 来源数据库连接 ID
+        backup_history_id: 关联的备份记录 ID
+        size: 文件大小（字节）
+        raw_size: 压缩前的转储字节数
+
+    Returns:
+        int: 记录 ID，失败返回 None
+    """
+    artifact_format, compression = detect_format(path)
+    if artifact_format is None:
+        print(f"无法识别的备份文件格式: {path}", file=sys.stderr)
+        return None
+    if size is None and os.path.exists(path):
+        size = os.path.getsize(path)
+
+    try:
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO backup_artifacts
+                (backup_history_id, user_id, db_type, db_name, connection_id, path, format, compression, size, raw_size,
+                 key_id, tier)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(path) DO UPDATE SET
+                    backup_history_id = excluded.backup_history_id,
+                    user_id = excluded.user_id,
+                    connection_id = COALESCE(excluded.connection_id, connection_id),
+                    size = excluded.size,
+                    raw_size = COALESCE(excluded.raw_size, raw_size),
+                    key_id = excluded.key_id
+            ''', (backup_history_id, user_id, normalize_db_type(db_type), db_name or None, connection_id or None,
+                  os.path.abspath(path), artifact_format, compression, size, raw_size, artifact_crypto.read_key_id(path),
+                  storage.tier_of(path)))
+            conn.commit()
+            row = conn.execute('SELECT id FROM backup_artifacts WHERE path = ?', (os.path.abspath(path),)).fetchone()
+            return row['id'] if row else None
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"记录备份文件失败: {str(e)}", file=sys.stderr)
+        return None
+
+
+def _artifact_dict(row):
+    """数据库记录转换为字典，附带文件是否仍然存在"""
+    artifact = dict(row)
+    artifact['filename'] = os.path.basename(artifact['path'])
+    artifact['exists'] = os.path.exists(artifact['path'])
+    # "所有数据库"备份是否有分段索引（可单独提取或恢复其中一个数据库）
+    artifact['indexed'] = artifact_index.has_index(artifact['path'])
+    artifact['encrypted'] = artifact_crypto.is_encrypted(artifact['path'])
+    return artifact
+
+
+def get_artifact(artifact_id):
+    """获取单个备份文件记录，不存在返回 None"""
+    try:
+        conn = get_db_connection()
+        try:
+            row = conn.execute('SELECT * FROM backup_artifacts WHERE id = ?', (artifact_id,)).fetchone()
+        finally:
+            conn.close()
+        return _artifact_dict(row) if row else None
+    except sqlite3.Error as e:
+        print(f"获取备份文件记录失败: {str(e)}", file=sys.stderr)
+        return None
+
+
+def list_artifacts(user_id=None, db_type=None, limit=50):
+    """
+    列出备份文件，按时间倒序
+
+    Args:
+        user_id: 只列出该用户的备份
+        db_type: 只列出该类型的备份
+        limit: 返回记录数
+    """
+    query = 'SELECT * FROM backup_artifacts WHERE 1=1'
+    params = []
+    if user_id is not None:
+        query += ' AND user_id = ?'
+        params.append(user_id)
+    if db_type:
+        query += ' AND db_type = ?'
+        params.append(normalize_db_type(db_type))
+    query += ' ORDER BY created_at DESC, id DESC LIMIT ?'
+    params.append(limit)
+
+    try:
+        conn = get_db_connection()
+        try:
+            rows = conn.execute(query, params).fetchall()
+        finally:
+            conn.close()
+        return [_artifact_dict(row) for row in rows]
+    except sqlite3.Error as e:
+        print(f"获取备份文件列表失败: {str(e)}", file=sys.stderr)
+        return []
+
+
+def prune_missing():
+    """
+    删除文件已不存在的记录（备份被清理后调用）
+
+    Returns:
+        int: 删除的记录数
+    """
+    try:
+        conn = get_db_connection()
+        try:
+            rows = conn.execute('SELECT id, path FROM backup_artifacts').fetchall()
+            missing = [(row['id'], row['path']) for row in rows if not os.path.exists(row['path'])]
+            # 移到冷层、重新压缩时先更新记录中的路径再删除原文件，路径已变的记录不删除
+            deleted = 0
+            for params in missing:
+                deleted += conn.execute('DELETE FROM backup_artifacts WHERE id = ? AND path = ?', params).rowcount
+            conn.commit()
+            return deleted
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"清理备份文件记录失败: {str(e)}", file=sys.stderr)
+        return 0
+
+
+def backfill(base_dir=None):
+    """
+    为升级前的成功备份补充记录：按备份历史中的文件名在备份目录中查找
+
+    Returns:
+        int: 新增的记录数
+    """
+    base_dir = base_dir or BACKUP_BASE_DIR
+    try:
+        conn = get_db_connection()
+        try:
+            rows = conn.execute('''
+                SELECT h.id, h.user_id, h.db_type, h.db_name, h.backup_file, h.file_size, h.raw_size
+                FROM backup_history h
+                LEFT JOIN backup_artifacts a ON a.backup_history_id = h.id
+                WHERE h.status = '成功' AND h.backup_file IS NOT NULL AND h.backup_file != '' AND a.id IS NULL
+            ''').fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"读取备份历史失败: {str(e)}", file=sys.stderr)
+        return 0
+
+    added = 0
+    for row in rows:
+        candidates = [os.path.join(base_dir, row['backup_file'])]
+        if row['user_id']:
+            candidates.insert(0, os.path.join(base_dir, f"user_{row['user_id']}", row['backup_file']))
+        path = next((storage.locate(candidate) for candidate in candidates if storage.locate(candidate)), None)
+        if path and record_artifact(path, row['db_type'], row['db_name'], row['user_id'],
+                                    backup_history_id=row['id'], size=row['file_size'], raw_size=row['raw_size']):
+            added += 1
+    return added
+
+
+def query_artifacts(query, params=()):
+    """执行查询并返回 backup_artifacts 记录，失败返回空列表"""
+    try:
+        conn = get_db_connection()
+        try:
+            return conn.execute(query, params).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"读取备份文件记录失败: {str(e)}", file=sys.stderr)
+        return []
+
+
+@contextlib.contextmanager
+def maintenance_lock():
+    """后台整理任务的互斥锁（非阻塞），产出是否取得了锁"""
+    os.makedirs(BACKUP_BASE_DIR, exist_ok=True)
+    with open(os.path.join(BACKUP_BASE_DIR, MAINTENANCE_LOCK), 'w') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+
+
+def _copy_throttled(src, dst, bucket, rate):
+    """按 rate 限速复制 src 到 dst（写入临时文件并同步到磁盘后改名），保留修改时间"""
+    with open(src, 'rb') as f, storage.LocalWriter(dst) as writer:
+        while True:
+            chunk = f.read(MIGRATE_CHUNK_SIZE)
+            if not chunk:
+                break
+            wait = bucket.reserve(len(chunk), rate)
+            if wait > 0:
+                time.sleep(wait)
+            writer.write(chunk)
+    shutil.copystat(src, dst)
+    if os.path.getsize(dst) != os.path.getsize(src):
+        raise OSError(f"复制后大小不一致: {dst}")
+
+
+def migrate_artifact(artifact, bucket, rate):
+    """
+    把一个备份文件（连同分段索引）移到冷层并更新记录
+
+    Returns:
+        str: 冷层中的路径
+    """
+    src = artifact['path']
+    dst = storage.cold_path(src)
+    moved = [(src, dst)]
+    if artifact_index.has_index(src):
+        moved.append((artifact_index.index_path(src), artifact_index.index_path(dst)))
+    try:
+        for source, target in moved:
+            _copy_throttled(source, target, bucket, rate)
+        conn = get_db_connection()
+        try:
+            conn.execute('''
+                UPDATE backup_artifacts SET path = ?, tier = 'cold', migrated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (os.path.abspath(dst), artifact['id']))
+            conn.commit()
+        finally:
+            conn.close()
+    except (OSError, sqlite3.Error):
+        for source, target in moved:
+            if os.path.exists(target):
+                os.remove(target)
+        raise
+    # 记录已指向冷层，此后再删除热层的文件（正在读取的恢复任务持有打开的文件，不受影响）
+    for source, target in moved:
+        os.remove(source)
+    return dst
+
+
+def migrate_cold(days=None, rate=None, limit=None):
+    """
+    把热层中超过 days 天的备份文件移到冷层，同一时间只有一个迁移任务运行
+
+    Args:
+        days: 热层保留天数，默认 BACKUP_COLD_AFTER_DAYS
+        rate: 复制速率上限（字节/秒），默认 BACKUP_COLD_RATE，0 表示不限速
+        limit: 本次最多迁移的文件数
+
+    Returns:
+        int: 迁移的文件数
+    """
+    from throttle import TokenBucket, parse_rate
+
+    if not storage.COLD_DIR:
+        print("未配置冷层目录（BACKUP_COLD_DIR）", file=sys.stderr)
+        return 0
+    days = storage.COLD_AFTER_DAYS if days is None else days
+    rate = parse_rate(COLD_RATE) if rate is None else rate
+    cutoff = time.time() - days * 86400
+
+    with maintenance_lock() as locked:
+        if not locked:
+            print("已有整理任务在运行", file=sys.stderr)
+            return 0
+        # 取得锁之后再读取记录，其他整理任务可能刚刚改变了文件的位置
+        rows = query_artifacts("SELECT * FROM backup_artifacts WHERE tier = 'hot' ORDER BY created_at, id")
+
+        bucket = TokenBucket('cold-migration')
+        migrated = 0
+        for row in rows:
+            if limit is not None and migrated >= limit:
+                break
+            path = row['path']
+            try:
+                if not os.path.exists(path) or os.path.getmtime(path) >= cutoff:
+                    continue
+                migrate_artifact(dict(row), bucket, rate)
+                migrated += 1
+            except (OSError, sqlite3.Error) as e:
+                print(f"移到冷层失败 {os.path.basename(path)}: {str(e)}", file=sys.stderr)
+        return migrated
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='备份文件元数据工具')
+    subparsers = parser.add_subparsers(dest='command', help='可用命令')
+
+    list_parser = subparsers.add_parser('list', help='列出备份文件')
+    list_parser.add_argument('--user-id', type=int, help='用户 ID')
+    list_parser.add_argument('--db-type', help='数据库类型')
+    list_parser.add_argument('--limit', type=int, default=50, help='返回记录数')
+
+    show_parser = subparsers.add_parser('show', help='显示单个备份文件记录')
+    show_parser.add_argument('id', type=int, help='记录 ID')
+
+    subparsers.add_parser('prune', help='删除文件已不存在的记录')
+
+    backfill_parser = subparsers.add_parser('backfill', help='为升级前的备份补充记录')
+    backfill_parser.add_argument('--base-dir', help='备份根目录')
+
+    migrate_parser = subparsers.add_parser('migrate', help='把热层中较旧的备份移到冷层')
+    migrate_parser.add_argument('--days', type=int, help='热层保留天数（默认 BACKUP_COLD_AFTER_DAYS）')
+    migrate_parser.add_argument('--rate', help='复制速率上限，如 20M（默认 BACKUP_COLD_RATE，0 表示不限速）')
+    migrate_parser.add_argument('--limit', type=int, help='本次最多迁移的文件数')
+
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        print(json.dumps(list_artifacts(args.user_id, args.db_type, args.limit), indent=2, ensure_ascii=False))
+    elif args.command == 'show':
+        artifact = get_artifact(args.id)
+        if not artifact:
+            print(f"记录不存在: {args.id}", file=sys.stderr)
+            sys.exit(1)
+        print(json.dumps(artifact, indent=2, ensure_ascii=False))
+    elif args.command == 'prune':
+        print(f"已删除 {prune_missing()} 条记录")
+    elif args.command == 'backfill':
+        print(f"已补充 {backfill(args.base_dir)} 条记录")
+    elif args.command == 'migrate':
+        from throttle import parse_rate
+        rate = parse_rate(args.rate) if args.rate is not None else None
+        print(f"已移到冷层 {migrate_cold(args.days, rate, args.limit)} 个文件")
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
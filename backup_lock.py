@@ -8,10 +8,13 @@
 import os
 import sqlite3
 import threading
+import time
 from datetime import datetime, timedelta
 
+from metrics import TimedConnection, record_event
+
 # 数据库文件路径
-DB_FILE = "/backups/users.db"
+DB_FILE = os.environ.get('BACKUP_DB_FILE', "/backups/users.db")
 
 # 内存缓存，用于快速检查锁状态
 _lock_cache = {}
@@ -20,7 +23,7 @@ _lock_cache_lock = threading.Lock()
 
 def get_db_connection():
     """获取数据库连接"""
-    conn = sqlite3.connect(DB_FILE)
+    conn = sqlite3.connect(DB_FILE, factory=TimedConnection)
     conn.row_factory = sqlite3.Row
     return conn
 
@@ -59,6 +62,16 @@ def acquire_backup_lock(db_type, lock_id="manual"):
     Returns:
         bool: 成功获取锁返回 True，否则返回 False
     """
+    # 记录获取锁的耗时（含 SQLite 写锁等待），供 /metrics 统计
+    started = time.perf_counter()
+    acquired = _try_acquire_backup_lock(db_type, lock_id)
+    record_event('backup_lock_wait_seconds', time.perf_counter() - started,
+                 {'db_type': db_type, 'result': 'acquired' if acquired else 'busy'})
+    return acquired
+
+
+def _try_acquire_backup_lock(db_type, lock_id):
+    """检查并写入备份锁"""
     conn = get_db_connection()
     cursor = conn.cursor()
 
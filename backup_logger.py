@@ -14,7 +14,7 @@ from datetime import datetime
 from pathlib import Path
 
 # 数据库文件路径
-DB_FILE = "/backups/users.db"
+DB_FILE = os.environ.get('BACKUP_DB_FILE', "/backups/users.db")
 
 
 def get_db_connection():
@@ -25,7 +25,7 @@ def get_db_connection():
 
 
 def log_backup(user_id, db_type, db_name, trigger_type, status, message,
-               backup_file=None, file_size=None, duration=None, log_file=None):
+               backup_file=None, file_size=None, duration=None, log_file=None, raw_size=None, key_id=None):
     """
     记录备份历史
 
@@ -40,6 +40,8 @@ def log_backup(user_id, db_type, db_name, trigger_type, status, message,
         file_size: 文件大小（字节）
         duration: 耗时（秒）
         log_file: 详细日志文件路径
+        raw_size: 压缩前的转储字节数
+        key_id: 加密备份使用的密钥 ID
 
     Returns:
         int: 插入记录的 ID
@@ -50,9 +52,11 @@ def log_backup(user_id, db_type, db_name, trigger_type, status, message,
 
         cursor.execute('''
             INSERT INTO backup_history
-            (user_id, db_type, db_name, trigger_type, status, message, backup_file, file_size, duration, log_file)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, db_type, db_name, trigger_type, status, message, backup_file, file_size, duration, log_file))
+            (user_id, db_type, db_name, trigger_type, status, message, backup_file, file_size, duration, log_file,
+             raw_size, key_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, db_type, db_name, trigger_type, status, message, backup_file, file_size, duration, log_file,
+              raw_size, key_id))
 
         conn.commit()
         record_id = cursor.lastrowid
@@ -163,6 +167,90 @@ def get_backup_history(limit=100, offset=0, user_id=None, db_type=None, status=N
         return []
 
 
+def search_backup_history(query, limit=100, user_id=None, status=None,
+                          start_date=None, end_date=None, order='rank'):
+    """
+    全文检索备份历史消息
+
+    Args:
+        query: 检索词，多个词以空格分隔，需同时命中
+        limit: 返回记录数
+        user_id: 用户 ID（用于多用户隔离）
+        status: 过滤状态
+        start_date: 开始时间（含）
+        end_date: 结束时间（含）
+        order: 排序方式，rank 按相关度，time 按时间倒序
+
+    Returns:
+        list: 备份历史记录列表，FTS 检索时附带 rank 字段（越小越相关）
+    """
+    from system_logger import build_fts_query
+
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        filters = ""
+        params = []
+
+        if user_id is not None:
+            filters += " AND h.user_id = ?"
+            params.append(user_id)
+
+        if status:
+            filters += " AND h.status = ?"
+            params.append(status)
+
+        if start_date:
+            filters += " AND h.created_at >= ?"
+            params.append(start_date)
+
+        if end_date:
+            filters += " AND h.created_at <= ?"
+            params.append(end_date)
+
+        match_expr = build_fts_query(query)
+        rows = None
+
+        if match_expr:
+            order_by = "rank" if order == 'rank' else "h.created_at DESC"
+            try:
+                cursor.execute(f'''
+                    SELECT h.*, bm25(backup_history_fts) AS rank
+                    FROM backup_history_fts
+                    JOIN backup_history h ON h.id = backup_history_fts.rowid
+                    WHERE backup_history_fts MATCH ?{filters}
+                    ORDER BY {order_by}
+                    LIMIT ?
+                ''', [match_expr] + params + [limit])
+                rows = cursor.fetchall()
+            except sqlite3.OperationalError:
+                # 全文索引不存在，退回 LIKE 查询
+                rows = None
+
+        if rows is None:
+            like_filters = ""
+            like_params = []
+            for term in query.split():
+                like_filters += " AND h.message LIKE ?"
+                like_params.append(f'%{term}%')
+
+            cursor.execute(f'''
+                SELECT h.* FROM backup_history h
+                WHERE 1=1{like_filters}{filters}
+                ORDER BY h.created_at DESC
+                LIMIT ?
+            ''', like_params + params + [limit])
+            rows = cursor.fetchall()
+
+        conn.close()
+
+        return [dict(row) for row in rows]
+    except Exception as e:
+        print(f"检索备份历史失败: {str(e)}", file=sys.stderr)
+        return []
+
+
 def get_backup_statistics(days=7):
     """
     获取备份统计信息
@@ -237,27 +325,57 @@ def get_recent_backups(limit=10, user_id=None):
     return get_backup_history(limit=limit, user_id=user_id)
 
 
-def clear_old_history(days=30):
+def clear_old_history(days=30, batch_size=None, pause=None):
     """
-    清理旧的备份历史记录
+    分批清理旧的备份历史记录
+
+    与 system_logger.clear_old_logs 相同：按 id 分批删除并在批次间让出写锁，
+    清理完成后执行增量 VACUUM。
 
     Args:
         days: 保留最近多少天的记录
+        batch_size: 每批删除的行数（默认 system_logger.CLEAR_BATCH_SIZE）
+        pause: 批次间休眠秒数（默认 system_logger.CLEAR_BATCH_PAUSE）
 
     Returns:
         int: 删除的记录数
     """
+    import time
+    from system_logger import CLEAR_BATCH_SIZE, CLEAR_BATCH_PAUSE, incremental_vacuum
+
+    batch_size = batch_size or CLEAR_BATCH_SIZE
+    pause = CLEAR_BATCH_PAUSE if pause is None else pause
+
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
 
         cursor.execute('''
-            DELETE FROM backup_history
+            SELECT MAX(id) FROM backup_history
             WHERE created_at < datetime('now', '-' || ? || ' days')
         ''', (days,))
-
-        deleted_count = cursor.rowcount
-        conn.commit()
+        max_id = cursor.fetchone()[0]
+
+        deleted_count = 0
+        while max_id is not None:
+            cursor.execute('''
+                DELETE FROM backup_history WHERE id IN (
+                    SELECT id FROM backup_history
+                    WHERE id <= ? AND created_at < datetime('now', '-' || ? || ' days')
+                    ORDER BY id
+                    LIMIT ?
+                )
+            ''', (max_id, days, batch_size))
+            batch_count = cursor.rowcount
+            conn.commit()
+
+            deleted_count += batch_count
+            if batch_count < batch_size:
+                break
+            time.sleep(pause)
+
+        if deleted_count:
+            incremental_vacuum(conn, pause=pause)
         conn.close()
 
         return deleted_count
@@ -281,8 +399,13 @@ def main():
     log_parser.add_argument('--file', help='备份文件名')
     log_parser.add_argument('--size', type=int, help='文件大小（字节）')
     log_parser.add_argument('--duration', type=float, help='耗时（秒）')
+    log_parser.add_argument('--raw-size', type=int, help='压缩前的转储字节数')
     log_parser.add_argument('--log', help='详细日志文件路径')
     log_parser.add_argument('--user-id', type=int, help='用户 ID（用于多用户隔离）')
+    log_parser.add_argument('--notify', action='store_true', help='将备份结果写入通知发件箱')
+    log_parser.add_argument('--batch-key', help='备份任务 ID，同一任务的通知合并汇总')
+    log_parser.add_argument('--path', help='备份文件的完整路径（成功时记录到 backup_artifacts）')
+    log_parser.add_argument('--connection-id', help='来源数据库连接 ID')
 
     # 查询历史命令
     query_parser = subparsers.add_parser('query', help='查询备份历史')
@@ -291,6 +414,15 @@ def main():
     query_parser.add_argument('--status', help='过滤状态')
     query_parser.add_argument('--json', action='store_true', help='以 JSON 格式输出')
 
+    # 全文检索命令
+    search_parser = subparsers.add_parser('search', help='全文检索备份历史')
+    search_parser.add_argument('query', help='检索词（多个词以空格分隔）')
+    search_parser.add_argument('--limit', type=int, default=50, help='返回记录数')
+    search_parser.add_argument('--status', help='过滤状态')
+    search_parser.add_argument('--start', help='开始时间 (YYYY-MM-DD[ HH:MM:SS])')
+    search_parser.add_argument('--end', help='结束时间 (YYYY-MM-DD[ HH:MM:SS])')
+    search_parser.add_argument('--order', choices=['rank', 'time'], default='rank', help='排序方式')
+
     # 统计命令
     stats_parser = subparsers.add_parser('stats', help='获取统计信息')
     stats_parser.add_argument('--days', type=int, default=7, help='统计最近几天的数据')
@@ -298,10 +430,18 @@ def main():
     # 清理命令
     clear_parser = subparsers.add_parser('clear', help='清理旧记录')
     clear_parser.add_argument('--days', type=int, default=30, help='保留最近多少天的记录')
+    clear_parser.add_argument('--batch-size', type=int, help='每批删除的行数')
+    clear_parser.add_argument('--pause', type=float, help='批次间休眠秒数')
 
     args = parser.parse_args()
 
     if args.command == 'log':
+        # 加密备份的密钥 ID 从文件头部读取
+        key_id = None
+        if args.path and args.status == '成功':
+            from artifact_crypto import read_key_id
+            key_id = read_key_id(args.path)
+
         # 记录备份
         record_id = log_backup(
             user_id=getattr(args, 'user_id', None),
@@ -313,9 +453,33 @@ def main():
             backup_file=args.file,
             file_size=args.size,
             duration=args.duration,
-            log_file=args.log
+            log_file=args.log,
+            raw_size=args.raw_size,
+            key_id=key_id
         )
 
+        if record_id and args.path and args.status == '成功':
+            from backup_artifacts import record_artifact
+            record_artifact(args.path, args.type, args.name, getattr(args, 'user_id', None),
+                            connection_id=args.connection_id, backup_history_id=record_id,
+                            size=args.size, raw_size=args.raw_size)
+
+        if args.notify and args.status in ('成功', '失败'):
+            # 通知由 notification_dispatcher 异步发送，这里只写入发件箱
+            try:
+                from notifications import enqueue_backup_notification
+                enqueue_backup_notification(
+                    db_type=args.type,
+                    status=args.status,
+                    message=args.message,
+                    trigger_type=args.trigger,
+                    backup_file=args.file,
+                    backup_history_id=record_id,
+                    batch_key=args.batch_key
+                )
+            except Exception as e:
+                print(f"写入通知发件箱失败: {str(e)}", file=sys.stderr)
+
         if record_id:
             print(f"备份记录已保存，ID: {record_id}")
             sys.exit(0)
@@ -346,6 +510,18 @@ def main():
                         print(f"  文件: {record['backup_file']}")
                     print()
 
+    elif args.command == 'search':
+        # 全文检索
+        records = search_backup_history(
+            args.query,
+            limit=args.limit,
+            status=args.status,
+            start_date=args.start,
+            end_date=args.end,
+            order=args.order
+        )
+        print(json.dumps(records, indent=2, ensure_ascii=False))
+
     elif args.command == 'stats':
         # 统计信息
         stats = get_backup_statistics(days=args.days)
@@ -367,7 +543,7 @@ def main():
 
     elif args.command == 'clear':
         # 清理旧记录
-        deleted_count = clear_old_history(days=args.days)
+        deleted_count = clear_old_history(days=args.days, batch_size=args.batch_size, pause=args.pause)
         print(f"已清理 {deleted_count} 条旧备份记录（保留最近 {args.days} 天）")
 
     else:
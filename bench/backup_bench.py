@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+备份流程端到端性能测试
+在临时目录中初始化数据库、连接配置和通知配置，用 bench/bin 下的模拟转储程序代替
+pg_dump / mysqldump / psql，完整运行一次 scripts/backup.sh（读取配置、加锁、转储、压缩、
+记录历史、通知、清理），统计各阶段的进程数、累计耗时、CPU 时间和吞吐量。
+
+各外部命令通过临时生成的计时包装脚本调用，包装脚本用 bash 的 time 关键字把每次调用的
+耗时追加到计时文件，因此后台执行的日志和清理进程也会被统计。
+
+示例:
+    python3 bench/backup_bench.py --connections 4 --dump-size 32M
+    python3 bench/backup_bench.py --db-type all --all-databases 3 --runs 3 --output baseline.json
+    python3 bench/backup_bench.py --runs 3 --baseline baseline.json
+    python3 bench/backup_bench.py --agent --baseline baseline.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import tempfile
+import argparse
+import statistics
+import subprocess
+import contextlib
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_smtp import FakeSMTPServer
+from fake_dump import parse_size
+from notification_bench import setup_environment
+
+BACKUP_SCRIPT = os.path.join(REPO_DIR, 'scripts', 'backup.sh')
+
+# 需要计时的外部命令，值为真实程序路径（None 表示从 PATH 查找）
+TIMED_COMMANDS = {
+    'python3': sys.executable,
+    'pg_dump': os.path.join(BENCH_DIR, 'bin', 'pg_dump'),
+    'psql': os.path.join(BENCH_DIR, 'bin', 'psql'),
+    'mysqldump': os.path.join(BENCH_DIR, 'bin', 'mysqldump'),
+    'gzip': None,
+    'find': None,
+}
+
+# 使用 --agent 时额外计时的命令：辅助命令经 nc 发给备份代理执行
+AGENT_COMMANDS = {
+    'nc': None,
+}
+
+# 报告中各阶段的顺序
+STAGES = ['config', 'lock', 'dump', 'compress', 'log', 'notify', 'syslog', 'cleanup', 'agent', 'other']
+
+# Python 脚本和子命令对应的阶段，子命令为 None 表示该脚本的所有调用
+SCRIPT_STAGES = {
+    ('config_manager.py', None): 'config',
+    ('backup_lock.py', None): 'lock',
+    ('backup_logger.py', 'log'): 'log',
+    ('backup_logger.py', 'clear'): 'cleanup',
+    ('system_logger.py', 'log'): 'syslog',
+    ('system_logger.py', 'archive'): 'cleanup',
+    ('notification_outbox.py', None): 'notify',
+    ('notification_dispatcher.py', None): 'notify',
+    ('backup_artifacts.py', None): 'cleanup',
+    ('artifact_index.py', 'gzip'): 'compress',
+    ('throttle.py', 'pipe'): 'dump',
+    ('dump_scheduler.py', None): 'compress',
+    ('artifact_crypto.py', 'encrypt'): 'compress',
+    ('storage.py', 'store'): 'compress',
+    ('storage.py', None): 'cleanup',
+    ('recompress.py', None): 'cleanup',
+    ('throttle.py', 'enabled'): 'config',
+}
+
+# 等待后台进程结束的最长时间（秒）
+DRAIN_TIMEOUT = 120
+
+# 等待备份代理启动的最长时间（秒）
+AGENT_START_TIMEOUT = 10
+
+SHIM_TEMPLATE = '''#!/bin/bash
+# 由 backup_bench.py 生成：记录 {tool} 每次调用的耗时，格式为 "命令 脚本名 子命令 实际 用户态 内核态"
+script="$(basename -- "${{1:-_}}")"
+action="${{2:-_}}"
+script="${{script// /_}}"
+action="${{action// /_}}"
+TIMEFORMAT="{tool} ${{script//%/%%}} ${{action//%/%%}} %R %U %S"
+{{ time "{real}" "$@" 2>&3 3>&-; }} 3>&2 2>>"$BENCH_TIMING_FILE"
+'''
+
+
+def write_shims(shim_dir, commands=TIMED_COMMANDS):
+    """生成计时包装脚本"""
+    os.makedirs(shim_dir, exist_ok=True)
+    for tool, real in commands.items():
+        real = real or shutil.which(tool)
+        if not real:
+            raise RuntimeError(f"找不到命令: {tool}")
+        path = os.path.join(shim_dir, tool)
+        with open(path, 'w') as f:
+            f.write(SHIM_TEMPLATE.format(tool=tool, real=real))
+        os.chmod(path, 0o755)
+
+
+def classify(tool, script, action):
+    """根据命令、脚本名和子命令判断所属阶段"""
+    if tool in ('pg_dump', 'mysqldump', 'psql'):
+        return 'dump'
+    if tool == 'gzip':
+        return 'compress'
+    if tool == 'find':
+        return 'cleanup'
+    if tool == 'nc':
+        return 'agent'
+    return SCRIPT_STAGES.get((script, action)) or SCRIPT_STAGES.get((script, None)) or 'other'
+
+
+def parse_timings(timing_file):
+    """
+    解析计时文件
+
+    Returns:
+        dict: {阶段: {'procs', 'wall', 'cpu'}}
+    """
+    stages = {}
+    if not os.path.exists(timing_file):
+        return stages
+    with open(timing_file) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) != 6:
+                continue
+            tool, script, action = parts[:3]
+            try:
+                real, user, system = (float(value) for value in parts[3:])
+            except ValueError:
+                continue
+            entry = stages.setdefault(classify(tool, script, action), {'procs': 0, 'wall': 0.0, 'cpu': 0.0})
+            entry['procs'] += 1
+            entry['wall'] += real
+            entry['cpu'] += user + system
+    return stages
+
+
+def read_dump_bytes(stats_file):
+    """模拟转储程序输出的总字节数"""
+    total = 0
+    if os.path.exists(stats_file):
+        with open(stats_file) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 3:
+                    total += int(parts[2])
+    return total
+
+
+def backup_file_bytes(backup_dir):
+    """本次生成的压缩备份文件总大小"""
+    total = 0
+    for root, _, files in os.walk(backup_dir):
+        for name in files:
+            if name.endswith('.sql.gz') and not name.startswith('old_'):
+                total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def wait_for_group(pgid, timeout=DRAIN_TIMEOUT):
+    """等待进程组内的后台进程全部退出"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            os.killpg(pgid, 0)
+        except ProcessLookupError:
+            return True
+        time.sleep(0.05)
+    with contextlib.suppress(ProcessLookupError):
+        os.killpg(pgid, signal.SIGTERM)
+    return False
+
+
+def prepare_run(work_dir, smtp_port, args):
+    """
+    初始化一次测试使用的临时目录、数据库和环境变量
+
+    Returns:
+        dict: 运行 backup.sh 使用的环境变量
+    """
+    backup_dir = os.path.join(work_dir, 'backups')
+    os.makedirs(backup_dir)
+    shim_dir = os.path.join(work_dir, 'shims')
+    write_shims(shim_dir, dict(TIMED_COMMANDS, **AGENT_COMMANDS) if args.agent else TIMED_COMMANDS)
+
+    setup_environment(work_dir, smtp_port, 'http://127.0.0.1:9', {'email'})
+    import config_manager
+    import backup_lock
+
+    # 与 Web 应用启动时一样创建锁表
+    backup_lock.DB_FILE = config_manager.DB_FILE
+    backup_lock.init_backup_lock_table()
+
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        db_types = ['postgresql', 'mysql'] if args.db_type == 'all' else [args.db_type]
+        for db_type in db_types:
+            port = '5432' if db_type == 'postgresql' else '3306'
+            for index in range(args.connections):
+                config_manager.add_database_connection(
+                    args.user_id, db_type, '127.0.0.1', port, 'bench', 'bench', f'bench_{index}')
+            if args.all_databases:
+                config_manager.add_database_connection(
+                    args.user_id, db_type, '127.0.0.1', port, 'bench', 'bench', '')
+
+    # 超过保留期的旧备份，供清理阶段删除
+    user_dir = os.path.join(backup_dir, f'user_{args.user_id}')
+    os.makedirs(user_dir, exist_ok=True)
+    expired = time.time() - 30 * 86400
+    for index in range(args.old_files):
+        path = os.path.join(user_dir, f'old_{index}.sql.gz')
+        with open(path, 'wb') as f:
+            f.write(b'\x1f\x8b')
+        os.utime(path, (expired, expired))
+
+    env = dict(os.environ)
+    env.update({
+        'PATH': f"{shim_dir}:{env.get('PATH', '/usr/bin:/bin')}",
+        'BACKUP_DB_FILE': os.path.join(work_dir, 'users.db'),
+        'BACKUP_LOG_ARCHIVE_DIR': os.path.join(work_dir, 'archive'),
+        'BACKUP_BASE_DIR': backup_dir,
+        'CONFIG_MANAGER': os.path.join(REPO_DIR, 'config_manager.py'),
+        'SYSTEM_LOGGER': os.path.join(REPO_DIR, 'system_logger.py'),
+        'BACKUP_LOGGER': os.path.join(REPO_DIR, 'backup_logger.py'),
+        'BACKUP_LOCK': os.path.join(REPO_DIR, 'backup_lock.py'),
+        'NOTIFICATION_OUTBOX': os.path.join(REPO_DIR, 'notification_outbox.py'),
+        'BACKUP_ARTIFACTS': os.path.join(REPO_DIR, 'backup_artifacts.py'),
+        'ARTIFACT_INDEX': os.path.join(REPO_DIR, 'artifact_index.py'),
+        'THROTTLE': os.path.join(REPO_DIR, 'throttle.py'),
+        'DUMP_SCHEDULER': os.path.join(REPO_DIR, 'dump_scheduler.py'),
+        'ARTIFACT_CRYPTO': os.path.join(REPO_DIR, 'artifact_crypto.py'),
+        'STORAGE': os.path.join(REPO_DIR, 'storage.py'),
+        'RECOMPRESS': os.path.join(REPO_DIR, 'recompress.py'),
+        'BACKUP_MASTER_KEY_FILE': os.path.join(work_dir, 'master.key'),
+        'THROTTLE_STATE_DIR': os.path.join(work_dir, 'throttle'),
+        # 未使用 --agent 时套接字不存在，backup.sh 直接启动 Python 进程
+        'AGENT_SOCKET': os.path.join(work_dir, 'agent.sock'),
+        'WECHAT_TOKEN_CACHE_FILE': os.path.join(work_dir, 'wechat_token_cache.json'),
+        'BACKUP_METRICS_EVENTS': os.path.join(work_dir, 'metrics_events.log'),
+        'BENCH_TIMING_FILE': os.path.join(work_dir, 'timing.log'),
+        'BENCH_DUMP_STATS': os.path.join(work_dir, 'dump_stats.log'),
+        'BENCH_PYTHON': sys.executable,
+        'BENCH_DUMP_SIZE': str(parse_size(args.dump_size)),
+        'BENCH_DUMP_ENTROPY': str(args.entropy),
+        'BENCH_DUMP_RATE': str(parse_size(args.dump_rate)),
+        'BENCH_DUMP_SEED': str(args.seed),
+        'BENCH_PG_DATABASES': ','.join(f'db_{index}' for index in range(args.all_databases)),
+        'PYTHONDONTWRITEBYTECODE': '1',
+    })
+    return env
+
+
+def start_agent(env, log):
+    """启动备份代理并等待套接字就绪"""
+    agent = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, 'agent_daemon.py'), 'serve'],
+                             env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + AGENT_START_TIMEOUT
+    while not os.path.exists(env['AGENT_SOCKET']):
+        if agent.poll() is not None or time.monotonic() > deadline:
+            agent.kill()
+            raise RuntimeError("备份代理启动失败")
+        time.sleep(0.02)
+    return agent
+
+
+def run_once(smtp_port, args):
+    """运行一次完整备份流程并汇总各阶段指标"""
+    with tempfile.TemporaryDirectory(prefix='backup-bench-') as work_dir:
+        env = prepare_run(work_dir, smtp_port, args)
+        db_type = '' if args.db_type == 'all' else args.db_type
+        log_path = os.path.join(work_dir, 'backup.log')
+
+        agent = None
+        if args.agent:
+            with open(os.path.join(work_dir, 'agent.log'), 'w') as agent_log:
+                agent = start_agent(env, agent_log)
+
+        started = time.perf_counter()
+        with open(log_path, 'w') as log:
+            process = subprocess.Popen(
+                ['bash', BACKUP_SCRIPT, db_type, args.trigger, '', str(args.user_id)],
+                env=env, stdout=log, stderr=subprocess.STDOUT, start_new_session=True
+            )
+            exit_code = process.wait()
+            script_elapsed = time.perf_counter() - started
+            drained = wait_for_group(process.pid)
+
+            # 投递本次任务提交的汇总通知
+            subprocess.run(['python3', os.path.join(REPO_DIR, 'notification_dispatcher.py'), '--once'],
+                           env=env, stdout=log, stderr=subprocess.STDOUT)
+        total_elapsed = time.perf_counter() - started
+
+        if agent is not None:
+            agent.terminate()
+            agent.wait()
+
+        if exit_code != 0 or args.verbose:
+            with open(log_path) as f:
+                print(f.read(), file=sys.stderr)
+
+        stages = parse_timings(env['BENCH_TIMING_FILE'])
+        raw_bytes = read_dump_bytes(env['BENCH_DUMP_STATS'])
+        compressed_bytes = backup_file_bytes(env['BACKUP_BASE_DIR'])
+
+    for name in ('dump', 'compress'):
+        if name in stages:
+            stages[name]['bytes'] = raw_bytes
+
+    return {
+        'exit_code': exit_code,
+        'drained': drained,
+        'script_elapsed': script_elapsed,
+        'total_elapsed': total_elapsed,
+        'raw_bytes': raw_bytes,
+        'compressed_bytes': compressed_bytes,
+        'stages': stages,
+    }
+
+
+def merge_runs(runs):
+    """多次运行取各指标的中位数"""
+    def median(values):
+        return statistics.median(values) if values else 0
+
+    stages = {}
+    for name in STAGES:
+        entries = [run['stages'][name] for run in runs if name in run['stages']]
+        if not entries:
+            continue
+        wall = median([entry['wall'] for entry in entries])
+        stage = {
+            'procs': int(median([entry['procs'] for entry in entries])),
+            'wall': round(wall, 4),
+            'cpu': round(median([entry['cpu'] for entry in entries]), 4),
+        }
+        if 'bytes' in entries[0]:
+            stage['bytes'] = int(median([entry['bytes'] for entry in entries]))
+            stage['bytes_per_sec'] = round(stage['bytes'] / wall, 1) if wall > 0 else 0.0
+        stages[name] = stage
+
+    raw_bytes = int(median([run['raw_bytes'] for run in runs]))
+    compressed_bytes = int(median([run['compressed_bytes'] for run in runs]))
+    total_elapsed = median([run['total_elapsed'] for run in runs])
+    return {
+        'runs': len(runs),
+        'failed_runs': sum(1 for run in runs if run['exit_code'] != 0 or not run['drained']),
+        'script_elapsed': round(median([run['script_elapsed'] for run in runs]), 4),
+        'total_elapsed': round(total_elapsed, 4),
+        'total_cpu': round(sum(stage['cpu'] for stage in stages.values()), 4),
+        'total_procs': sum(stage['procs'] for stage in stages.values()),
+        'raw_bytes': raw_bytes,
+        'compressed_bytes': compressed_bytes,
+        'compression_ratio': round(raw_bytes / compressed_bytes, 2) if compressed_bytes else 0.0,
+        'bytes_per_sec': round(raw_bytes / total_elapsed, 1) if total_elapsed > 0 else 0.0,
+        'stages': stages,
+    }
+
+
+def _change(current, previous):
+    """相对基线的变化百分比"""
+    if not previous:
+        return ''
+    return f"{(current - previous) / previous * 100:+.1f}%"
+
+
+def print_report(result, baseline=None):
+    """输出文本报告"""
+    base_stages = (baseline or {}).get('stages', {})
+    print(f"运行次数: {result['runs']}（失败 {result['failed_runs']}）  "
+          f"脚本耗时: {result['script_elapsed']}s  总耗时（含后台进程和通知投递）: {result['total_elapsed']}s")
+    print(f"转储数据: {result['raw_bytes'] / 1048576:.1f} MiB  压缩后: {result['compressed_bytes'] / 1048576:.1f} MiB  "
+          f"压缩比: {result['compression_ratio']}  端到端吞吐: {result['bytes_per_sec'] / 1048576:.1f} MiB/s")
+    print()
+    header = f"{'阶段':<10}{'进程数':>8}{'累计耗时(s)':>14}{'CPU(s)':>10}{'MiB/s':>10}"
+    if baseline:
+        header += f"{'耗时变化':>12}{'CPU变化':>10}"
+    print(header)
+    for name in STAGES:
+        stage = result['stages'].get(name)
+        if not stage:
+            continue
+        rate = f"{stage['bytes_per_sec'] / 1048576:.1f}" if 'bytes_per_sec' in stage else '-'
+        line = f"{name:<10}{stage['procs']:>8}{stage['wall']:>14.3f}{stage['cpu']:>10.3f}{rate:>10}"
+        if baseline:
+            previous = base_stages.get(name, {})
+            line += f"{_change(stage['wall'], previous.get('wall')):>12}{_change(stage['cpu'], previous.get('cpu')):>10}"
+        print(line)
+    total = f"{'total':<10}{result['total_procs']:>8}{result['total_elapsed']:>14.3f}{result['total_cpu']:>10.3f}{'':>10}"
+    if baseline:
+        total += f"{_change(result['total_elapsed'], baseline.get('total_elapsed')):>12}"
+        total += f"{_change(result['total_cpu'], baseline.get('total_cpu')):>10}"
+    print(total)
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='备份流程端到端性能测试')
+    parser.add_argument('--db-type', choices=['postgresql', 'mysql', 'all'], default='postgresql', help='备份的数据库类型')
+    parser.add_argument('--connections', type=int, default=2, help='每种类型的单库连接数')
+    parser.add_argument('--all-databases', type=int, default=0,
+                        help='额外添加一个"备份所有数据库"的连接，并模拟该实例中的数据库数量（0 表示不添加）')
+    parser.add_argument('--dump-size', default='16M', help='每个数据库的转储大小，支持 K/M/G 后缀')
+    parser.add_argument('--entropy', type=float, default=0.3, help='转储内容中随机数据的比例 (0-1)')
+    parser.add_argument('--dump-rate', default='0', help='转储输出速率上限（字节/秒），0 表示不限速')
+    parser.add_argument('--seed', type=int, default=0, help='随机数种子')
+    parser.add_argument('--trigger', choices=['自动', '手动'], default='自动', help='触发方式（自动任务会执行清理）')
+    parser.add_argument('--old-files', type=int, default=20, help='预置的过期备份文件数量')
+    parser.add_argument('--user-id', type=int, default=1, help='备份所属用户 ID')
+    parser.add_argument('--runs', type=int, default=1, help='运行次数，结果取中位数')
+    parser.add_argument('--output', help='将结果保存为 JSON 基线文件')
+    parser.add_argument('--baseline', help='与之前保存的基线文件比较')
+    parser.add_argument('--json', action='store_true', help='以 JSON 格式输出')
+    parser.add_argument('--agent', action='store_true', help='启动备份代理，辅助命令经 nc 发给代理执行')
+    parser.add_argument('--verbose', action='store_true', help='输出 backup.sh 的日志')
+
+    args = parser.parse_args()
+
+    smtp = FakeSMTPServer()
+    smtp_port = smtp.start()
+    try:
+        runs = [run_once(smtp_port, args) for _ in range(max(args.runs, 1))]
+    finally:
+        smtp.stop()
+
+    result = merge_runs(runs)
+    result['config'] = {
+        'db_type': args.db_type,
+        'connections': args.connections,
+        'all_databases': args.all_databases,
+        'dump_size': parse_size(args.dump_size),
+        'entropy': args.entropy,
+        'dump_rate': parse_size(args.dump_rate),
+        'trigger': args.trigger,
+        'agent': args.agent,
+    }
+    result['smtp'] = smtp.stats
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    if args.json:
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+    else:
+        print_report(result, baseline)
+        print(f"\nSMTP 服务器: {smtp.stats}")
+
+    if result['failed_runs']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+模拟数据库转储程序
+代替 pg_dump / mysqldump / psql 输出确定性的 SQL 流，用于在没有真实数据库的环境下测试备份性能。
+同一数据库名和种子总是产生相同的内容，大小、熵和输出速率均可配置。
+
+bench/bin 下的同名脚本调用本模块，参数默认值从环境变量读取:
+    BENCH_DUMP_SIZE     每个数据库的转储大小，支持 K/M/G 后缀（默认 8M）
+    BENCH_DUMP_ENTROPY  行数据中随机内容的比例 0-1（默认 0.3）
+    BENCH_DUMP_RATE     输出速率上限，字节/秒，支持 K/M/G 后缀（默认不限速）
+    BENCH_DUMP_SEED     随机数种子（默认 0）
+    BENCH_DUMP_STATS    统计文件，每次转储追加一行 "程序 数据库 字节数 耗时"
+    BENCH_PG_DATABASES  psql 列出的数据库名，逗号或空格分隔（默认 app,analytics,audit）
+
+示例:
+    python3 bench/fake_dump.py generate --database demo --size 64M --entropy 0.5 | gzip > /dev/null
+"""
+
+import os
+import sys
+import time
+import zlib
+import random
+import argparse
+
+# 每次写出的块大小
+CHUNK_SIZE = 64 * 1024
+
+# 低熵部分使用的重复文本，模拟业务表中大量重复的枚举值和描述
+FILLER = ("status=active;region=cn-east;plan=standard;tags=backup,daily,retained;"
+          "description=the quick brown fox jumps over the lazy dog;") * 8
+
+DEFAULT_DATABASES = 'app,analytics,audit'
+
+# 通过 bench/bin 下的同名脚本调用时模拟的程序
+SIMULATED_TOOLS = ('pg_dump', 'mysqldump', 'psql')
+
+
+def parse_size(value):
+    """解析带 K/M/G 后缀的大小"""
+    if value is None or value == '':
+        return 0
+    value = str(value).strip().upper()
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    if value[-1:] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(float(value))
+
+
+def generate_rows(rng, row_size, entropy):
+    """
+    无限生成表数据行
+
+    每行由递增 id、随机十六进制串和重复文本组成，随机部分占 row_size * entropy 字节
+    """
+    random_len = int(row_size * entropy) // 2 * 2
+    filler_len = max(row_size - random_len, 0)
+    row_id = 0
+    while True:
+        row_id += 1
+        offset = row_id % 97
+        random_part = rng.randbytes(random_len // 2).hex() if random_len else ''
+        yield f"{row_id}\t{random_part}\t{FILLER[offset:offset + filler_len]}\n"
+
+
+def generate_dump(database, size, entropy=0.3, seed=0, dialect='postgresql', row_size=200):
+    """
+    生成一个数据库的 SQL 转储，按块产出 bytes
+
+    Args:
+        database: 数据库名，与 seed 一起决定内容
+        size: 转储总字节数（近似值，最后一行写完为止）
+        entropy: 行数据中随机内容的比例 (0-1)
+        seed: 随机数种子
+        dialect: postgresql（COPY 格式）或 mysql（INSERT 格式）
+        row_size: 每行的近似字节数
+    """
+    rng = random.Random(zlib.crc32(f"{seed}:{database}".encode()))
+    entropy = min(max(entropy, 0.0), 1.0)
+
+    if dialect == 'mysql':
+        header = (f"--\n-- Current Database: `{database}`\n--\n\n"
+                  f"CREATE DATABASE /*!32312 IF NOT EXISTS*/ `{database}`;\nUSE `{database}`;\n\n"
+                  "--\n-- Table structure for table `events`\n--\n\n"
+                  "CREATE TABLE `events` (`id` bigint NOT NULL, `token` text, `body` text, PRIMARY KEY (`id`));\n")
+        footer = "-- Dump completed\n"
+    else:
+        header = (f"--\n-- PostgreSQL database dump (bench)\n-- Database: {database}\n--\n\n"
+                  "CREATE TABLE public.events (id bigint NOT NULL, token text, body text);\n\n"
+                  "COPY public.events (id, token, body) FROM stdin;\n")
+        footer = "\\.\n\n--\n-- PostgreSQL database dump complete\n--\n"
+
+    written = len(header)
+    buffer = [header]
+    buffered = written
+    for row in generate_rows(rng, row_size, entropy):
+        if written >= size:
+            break
+        if dialect == 'mysql':
+            row_id, token, body = row.rstrip('\n').split('\t')
+            row = f"INSERT INTO `events` VALUES ({row_id},'{token}','{body}');\n"
+        buffer.append(row)
+        written += len(row)
+        buffered += len(row)
+        if buffered >= CHUNK_SIZE:
+            yield ''.join(buffer).encode()
+            buffer = []
+            buffered = 0
+    buffer.append(footer)
+    yield ''.join(buffer).encode()
+
+
+def write_dump(chunks, out, rate=0):
+    """
+    写出转储内容，rate 大于 0 时按字节/秒限速
+
+    Returns:
+        int: 写出的字节数
+    """
+    started = time.monotonic()
+    total = 0
+    for chunk in chunks:
+        out.write(chunk)
+        total += len(chunk)
+        if rate > 0:
+            ahead = total / rate - (time.monotonic() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+    out.flush()
+    return total
+
+
+def _option_value(argv, names):
+    """从模拟程序收到的参数中取出选项值，支持 -d db、--dbname=db 两种写法"""
+    for index, arg in enumerate(argv):
+        for name in names:
+            if arg == name and index + 1 < len(argv):
+                return argv[index + 1]
+            if name.startswith('--') and arg.startswith(name + '='):
+                return arg.split('=', 1)[1]
+    return None
+
+
+def _record_stats(tool, database, size, elapsed):
+    """追加一行转储统计"""
+    stats_file = os.environ.get('BENCH_DUMP_STATS')
+    if not stats_file:
+        return
+    with open(stats_file, 'a') as f:
+        f.write(f"{tool} {database} {size} {elapsed:.6f}\n")
+
+
+def list_databases():
+    """psql 列出的数据库"""
+    value = os.environ.get('BENCH_PG_DATABASES', DEFAULT_DATABASES)
+    return [name for name in value.replace(',', ' ').split() if name]
+
+
+def run_tool(tool, argv):
+    """
+    模拟 pg_dump / mysqldump / psql
+
+    这些程序的参数（如 -h 主机）与 argparse 冲突，只从中取出数据库名，其余配置读取环境变量
+    """
+    if tool == 'psql':
+        # backup.sh 只用 psql 查询数据库列表
+        print('\n'.join(list_databases()))
+        return
+
+    if tool == 'pg_dump':
+        dialect = 'postgresql'
+        databases = [_option_value(argv, ['-d', '--dbname']) or 'postgres']
+    else:
+        dialect = 'mysql'
+        if '--all-databases' in argv or '-A' in argv:
+            databases = list_databases()
+        else:
+            databases = [_option_value(argv, ['--databases', '-B']) or 'mysql']
+
+    size = parse_size(os.environ.get('BENCH_DUMP_SIZE', '8M'))
+    entropy = float(os.environ.get('BENCH_DUMP_ENTROPY', 0.3))
+    rate = parse_size(os.environ.get('BENCH_DUMP_RATE', '0'))
+    seed = int(os.environ.get('BENCH_DUMP_SEED', 0))
+    # pg_dump -Fc -f 直接写入文件（内容仍为 SQL 文本，只用于测试备份流程）
+    output_file = _option_value(argv, ['-f', '--file']) if tool == 'pg_dump' else None
+    if output_file:
+        with open(output_file, 'wb') as out:
+            dump_databases(tool, databases, size, entropy, rate, seed, dialect, out)
+    else:
+        dump_databases(tool, databases, size, entropy, rate, seed, dialect)
+
+
+def dump_databases(tool, databases, size, entropy, rate, seed, dialect, out=None):
+    """依次输出多个数据库的转储，默认写到标准输出"""
+    out = out or sys.stdout.buffer
+    try:
+        for database in databases:
+            started = time.monotonic()
+            written = write_dump(generate_dump(database, size, entropy, seed, dialect), out, rate)
+            _record_stats(tool, database, written, time.monotonic() - started)
+    except BrokenPipeError:
+        # 下游提前退出时与真实程序一样以非零状态结束
+        sys.stderr.close()
+        sys.exit(1)
+
+
+def main():
+    """命令行入口"""
+    if len(sys.argv) > 1 and sys.argv[1] in SIMULATED_TOOLS:
+        run_tool(sys.argv[1], sys.argv[2:])
+        return
+
+    parser = argparse.ArgumentParser(description='模拟数据库转储程序')
+    parser.add_argument('action', choices=['generate'], help='生成一个数据库的转储到标准输出')
+    parser.add_argument('--database', default='bench', help='数据库名')
+    parser.add_argument('--dialect', choices=['postgresql', 'mysql'], default='postgresql', help='SQL 方言')
+    parser.add_argument('--size', default='8M', help='转储大小，支持 K/M/G 后缀')
+    parser.add_argument('--entropy', type=float, default=0.3, help='随机内容比例 (0-1)')
+    parser.add_argument('--rate', default='0', help='输出速率上限（字节/秒），支持 K/M/G 后缀')
+    parser.add_argument('--seed', type=int, default=0, help='随机数种子')
+
+    args = parser.parse_args()
+    dump_databases('generate', [args.database], parse_size(args.size), args.entropy,
+                   parse_size(args.rate), args.seed, args.dialect)
+
+
+if __name__ == '__main__':
+    main()
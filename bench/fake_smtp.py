@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+模拟 SMTP 服务器
+用于在没有真实邮件服务器的环境下测试通知发送，支持配置延迟和错误率
+"""
+
+import sys
+import time
+import random
+import asyncio
+import argparse
+import threading
+
+
+class FakeSMTPServer:
+    """基于 asyncio 的最小 SMTP 服务器，接受任意账号和收件人，不投递邮件"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, connect_latency=0.0,
+                 error_rate=0.0, seed=None):
+        """
+        Args:
+            host: 监听地址
+            port: 监听端口，0 表示随机端口
+            latency: 每封邮件 DATA 结束后的响应延迟（秒）
+            connect_latency: 建立连接和 AUTH 的额外延迟（秒），模拟 TLS 握手和登录开销
+            error_rate: 返回 451 临时错误的概率 (0-1)
+            seed: 随机数种子
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.stats = {'connections': 0, 'logins': 0, 'messages': 0, 'errors': 0, 'bytes': 0}
+        self._loop = None
+        self._server = None
+        self._thread = None
+
+    async def _reply(self, writer, line):
+        writer.write(line.encode() + b'\r\n')
+        await writer.drain()
+
+    async def _handle(self, reader, writer):
+        """处理一个 SMTP 会话"""
+        self.stats['connections'] += 1
+        if self.connect_latency:
+            await asyncio.sleep(self.connect_latency)
+        await self._reply(writer, '220 fake-smtp ready')
+
+        in_data = False
+        size = 0
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                if in_data:
+                    if line.rstrip(b'\r\n') == b'.':
+                        in_data = False
+                        if self.latency:
+                            await asyncio.sleep(self.latency)
+                        if self.random.random() < self.error_rate:
+                            self.stats['errors'] += 1
+                            await self._reply(writer, '451 4.3.0 simulated temporary failure')
+                        else:
+                            self.stats['messages'] += 1
+                            self.stats['bytes'] += size
+                            await self._reply(writer, '250 2.0.0 queued')
+                    else:
+                        size += len(line)
+                    continue
+
+                command = line.decode(errors='replace').strip().split(' ', 1)[0].upper()
+                if command in ('EHLO', 'HELO'):
+                    writer.write(b'250-fake-smtp\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n')
+                    await writer.drain()
+                elif command == 'AUTH':
+                    if self.connect_latency:
+                        await asyncio.sleep(self.connect_latency)
+                    self.stats['logins'] += 1
+                    await self._reply(writer, '235 2.7.0 authentication successful')
+                elif command == 'DATA':
+                    in_data = True
+                    size = 0
+                    await self._reply(writer, '354 end data with <CR><LF>.<CR><LF>')
+                elif command == 'QUIT':
+                    await self._reply(writer, '221 2.0.0 bye')
+                    break
+                else:
+                    # MAIL/RCPT/RSET/NOOP 一律接受
+                    await self._reply(writer, '250 2.0.0 ok')
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        """在当前事件循环中启动服务"""
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self._server
+
+    def start(self):
+        """在后台线程中启动服务，返回监听端口"""
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.serve())
+            ready.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self.port
+
+    def stop(self):
+        """停止后台线程中的服务"""
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._server.close)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='模拟 SMTP 服务器')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址')
+    parser.add_argument('--port', type=int, default=2525, help='监听端口')
+    parser.add_argument('--latency', type=float, default=0.0, help='每封邮件的响应延迟（秒）')
+    parser.add_argument('--connect-latency', type=float, default=0.0, help='连接和登录的额外延迟（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回临时错误的概率 (0-1)')
+    parser.add_argument('--seed', type=int, help='随机数种子')
+
+    args = parser.parse_args()
+
+    server = FakeSMTPServer(args.host, args.port, args.latency, args.connect_latency, args.error_rate, args.seed)
+
+    async def run():
+        await server.serve()
+        print(f"模拟 SMTP 服务器已启动: {args.host}:{server.port}")
+        started = time.time()
+        try:
+            while True:
+                await asyncio.sleep(10)
+                print(f"[{int(time.time() - started)}s] {server.stats}")
+        finally:
+            print(f"统计: {server.stats}")
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+模拟企业微信 API 服务器
+实现 gettoken 和 message/send 两个接口，支持配置延迟、错误率和 token 失效率。
+通知模块通过环境变量 WECHAT_API_BASE=http://127.0.0.1:<端口> 指向本服务
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+class FakeWeChatServer:
+    """模拟企业微信 API 服务器"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, token_latency=0.0,
+                 error_rate=0.0, expire_rate=0.0, expires_in=7200, seed=None):
+        """
+        Args:
+            host: 监听地址
+            port: 监听端口，0 表示随机端口
+            latency: message/send 的响应延迟（秒）
+            token_latency: gettoken 的响应延迟（秒）
+            error_rate: message/send 返回 45009（频率超限）的概率 (0-1)
+            expire_rate: message/send 返回 42001（token 过期）的概率 (0-1)
+            expires_in: gettoken 返回的有效期（秒）
+            seed: 随机数种子
+        """
+        self.latency = latency
+        self.token_latency = token_latency
+        self.error_rate = error_rate
+        self.expire_rate = expire_rate
+        self.expires_in = expires_in
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.tokens = set()
+        self.stats = {'gettoken': 0, 'messages': 0, 'errors': 0, 'expired': 0, 'invalid_token': 0}
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, data):
+                body = json.dumps(data).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path != '/cgi-bin/gettoken':
+                    self.send_error(404)
+                    return
+                self._send_json(server.get_token(parse_qs(url.query)))
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                if url.path != '/cgi-bin/message/send':
+                    self.send_error(404)
+                    return
+                length = int(self.headers.get('Content-Length') or 0)
+                self.rfile.read(length)
+                token = parse_qs(url.query).get('access_token', [''])[0]
+                self._send_json(server.send_message(token))
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.host = host
+        self.port = self.httpd.server_address[1]
+        self._thread = None
+
+    def get_token(self, params):
+        """处理 gettoken 请求"""
+        if self.token_latency:
+            time.sleep(self.token_latency)
+        if not params.get('corpid') or not params.get('corpsecret'):
+            return {'errcode': 40013, 'errmsg': 'invalid corpid'}
+        with self.lock:
+            self.stats['gettoken'] += 1
+            token = f"fake-token-{self.stats['gettoken']}"
+            self.tokens.add(token)
+        return {'errcode': 0, 'errmsg': 'ok', 'access_token': token, 'expires_in': self.expires_in}
+
+    def send_message(self, token):
+        """处理 message/send 请求"""
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            if token not in self.tokens:
+                self.stats['invalid_token'] += 1
+                return {'errcode': 40014, 'errmsg': 'invalid access_token'}
+            roll = self.random.random()
+            if roll < self.expire_rate:
+                # 模拟 token 过期：作废该 token，调用方需要重新获取
+                self.tokens.discard(token)
+                self.stats['expired'] += 1
+                return {'errcode': 42001, 'errmsg': 'access_token expired'}
+            if roll < self.expire_rate + self.error_rate:
+                self.stats['errors'] += 1
+                return {'errcode': 45009, 'errmsg': 'api freq out of limit'}
+            self.stats['messages'] += 1
+        return {'errcode': 0, 'errmsg': 'ok'}
+
+    @property
+    def base_url(self):
+        """供 WECHAT_API_BASE 使用的地址"""
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        """在后台线程中启动服务，返回监听端口"""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self.port
+
+    def stop(self):
+        """停止服务"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='模拟企业微信 API 服务器')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址')
+    parser.add_argument('--port', type=int, default=8088, help='监听端口')
+    parser.add_argument('--latency', type=float, default=0.0, help='发送消息的响应延迟（秒）')
+    parser.add_argument('--token-latency', type=float, default=0.0, help='获取 token 的响应延迟（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回频率超限错误的概率 (0-1)')
+    parser.add_argument('--expire-rate', type=float, default=0.0, help='返回 token 过期的概率 (0-1)')
+    parser.add_argument('--expires-in', type=int, default=7200, help='token 有效期（秒）')
+    parser.add_argument('--seed', type=int, help='随机数种子')
+
+    args = parser.parse_args()
+
+    server = FakeWeChatServer(args.host, args.port, args.latency, args.token_latency,
+                              args.error_rate, args.expire_rate, args.expires_in, args.seed)
+    print(f"模拟企业微信 API 已启动: {server.base_url}")
+    print(f"使用方式: export WECHAT_API_BASE={server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        print(f"统计: {server.stats}")
+        sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
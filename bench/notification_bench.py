@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+通知吞吐量性能测试
+启动本地模拟 SMTP 和企业微信服务器，使用临时数据库中的通知配置，
+批量发送备份通知并统计每秒消息数和延迟分位数。
+
+示例:
+    python3 bench/notification_bench.py --messages 500 --concurrency 8
+    python3 bench/notification_bench.py --mode dispatcher --smtp-connect-latency 0.05 --json
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+import argparse
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_smtp import FakeSMTPServer
+from fake_wechat import FakeWeChatServer
+
+
+def percentile(values, pct):
+    """计算分位数（最近秩法）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(name, latencies, errors, elapsed, messages):
+    """汇总一组测试结果"""
+    return {
+        'name': name,
+        'messages': messages,
+        'errors': errors,
+        'elapsed': round(elapsed, 3),
+        'msgs_per_sec': round(messages / elapsed, 1) if elapsed > 0 else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'max_ms': round(max(latencies) * 1000, 2) if latencies else 0.0,
+    }
+
+
+def setup_environment(work_dir, smtp_port, wechat_base, channels):
+    """
+    在临时目录中初始化数据库和通知配置，并将各模块指向它
+
+    Returns:
+        module: notifications 模块
+    """
+    db_file = os.path.join(work_dir, 'users.db')
+
+    import migrate_db
+    import config_manager
+    import backup_logger
+    import notification_outbox
+    import notifications
+
+    for module in (migrate_db, config_manager, backup_logger, notification_outbox):
+        module.DB_FILE = db_file
+    notifications.WECHAT_API_BASE = wechat_base
+    notifications.TOKEN_CACHE_FILE = os.path.join(work_dir, 'wechat_token_cache.json')
+    notifications.TOKEN_LOCK_FILE = notifications.TOKEN_CACHE_FILE + '.lock'
+
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        migrate_db.ensure_v22_tables()
+        config_manager.init_config_tables()
+        config_manager.save_notification_config(
+            True, True, True,
+            {
+                'enabled': 'email' in channels,
+                'smtp_server': '127.0.0.1',
+                'smtp_port': smtp_port,
+                'use_tls': False,
+                'username': 'bench',
+                'password': 'bench',
+                'from_address': 'bench@example.com',
+                'recipients': ['ops@example.com']
+            },
+            {
+                'enabled': 'wechat' in channels,
+                'corp_id': 'bench-corp',
+                'corp_secret': 'bench-secret',
+                'agent_id': '1000001',
+                'to_users': '@all'
+            },
+            digest_window=0
+        )
+    return notifications
+
+
+def run_direct(notifications, messages, concurrency):
+    """直接调用 send_backup_notification，统计每次调用的延迟"""
+    latencies = []
+    errors = 0
+
+    def send(index):
+        status = '失败' if index % 10 == 0 else '成功'
+        started = time.perf_counter()
+        ok = notifications.send_backup_notification(
+            'PostgreSQL', status, f'数据库 bench_{index} 已备份到 bench_{index}.sql.gz', '自动', f'bench_{index}.sql.gz'
+        )
+        return time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for latency, ok in executor.map(send, range(messages)):
+                latencies.append(latency)
+                if not ok:
+                    errors += 1
+    elapsed = time.perf_counter() - started
+
+    return summarize('direct', latencies, errors, elapsed, messages)
+
+
+def run_dispatcher(notifications, messages, concurrency):
+    """写入发件箱后由 NotificationDispatcher 投递，统计每次投递的延迟"""
+    import notification_outbox
+    import notification_dispatcher
+
+    latencies = []
+    original_deliver = notification_dispatcher.deliver_group
+
+    def timed_deliver(records):
+        started = time.perf_counter()
+        result = original_deliver(records)
+        latencies.append(time.perf_counter() - started)
+        return result
+
+    notification_dispatcher.deliver_group = timed_deliver
+    # 测试只关心投递吞吐，失败不等待退避
+    notification_dispatcher.RETRY_BASE_DELAY = 0
+
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        for index in range(messages):
+            status = '失败' if index % 10 == 0 else '成功'
+            notifications.enqueue_backup_notification(
+                'PostgreSQL', status, f'数据库 bench_{index} 已备份到 bench_{index}.sql.gz', '自动',
+                f'bench_{index}.sql.gz', backup_history_id=index
+            )
+
+    dispatcher = notification_dispatcher.NotificationDispatcher(
+        {channel: concurrency for channel in notification_dispatcher.CHANNEL_CONCURRENCY}
+    )
+
+    async def drain():
+        while True:
+            stats = notification_outbox.get_outbox_stats()
+            if not any(count.get('pending') or count.get('sending') for count in stats.values()):
+                return stats
+            await dispatcher.drain_once()
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(open(os.devnull, 'w')), contextlib.redirect_stderr(open(os.devnull, 'w')):
+        stats = asyncio.run(drain())
+    elapsed = time.perf_counter() - started
+
+    notification_dispatcher.deliver_group = original_deliver
+    delivered = sum(count.get('sent', 0) for count in stats.values())
+    failed = sum(count.get('failed', 0) for count in stats.values())
+    return summarize('dispatcher', latencies, failed, elapsed, delivered)
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='通知吞吐量性能测试')
+    parser.add_argument('--mode', choices=['direct', 'dispatcher'], default='direct',
+                        help='direct: 直接调用 send_backup_notification；dispatcher: 经发件箱和分发器投递')
+    parser.add_argument('--messages', type=int, default=200, help='备份结果数量')
+    parser.add_argument('--concurrency', type=int, default=4, help='并发数')
+    parser.add_argument('--channels', default='email', help='启用的渠道，逗号分隔 (email,wechat)')
+    parser.add_argument('--smtp-latency', type=float, default=0.0, help='SMTP 每封邮件延迟（秒）')
+    parser.add_argument('--smtp-connect-latency', type=float, default=0.0, help='SMTP 连接和登录延迟（秒）')
+    parser.add_argument('--wechat-latency', type=float, default=0.0, help='企业微信发送延迟（秒）')
+    parser.add_argument('--wechat-token-latency', type=float, default=0.0, help='企业微信获取 token 延迟（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='模拟服务器错误率 (0-1)')
+    parser.add_argument('--seed', type=int, default=42, help='随机数种子')
+    parser.add_argument('--json', action='store_true', help='以 JSON 格式输出')
+
+    args = parser.parse_args()
+    channels = {channel.strip() for channel in args.channels.split(',') if channel.strip()}
+
+    smtp = FakeSMTPServer(latency=args.smtp_latency, connect_latency=args.smtp_connect_latency,
+                          error_rate=args.error_rate, seed=args.seed)
+    smtp_port = smtp.start()
+    wechat = FakeWeChatServer(latency=args.wechat_latency, token_latency=args.wechat_token_latency,
+                              error_rate=args.error_rate, seed=args.seed)
+    wechat.start()
+
+    try:
+        with tempfile.TemporaryDirectory(prefix='notification-bench-') as work_dir:
+            notifications = setup_environment(work_dir, smtp_port, wechat.base_url, channels)
+            if args.mode == 'direct':
+                result = run_direct(notifications, args.messages, args.concurrency)
+            else:
+                result = run_dispatcher(notifications, args.messages, args.concurrency)
+            notifications.close_smtp_sessions()
+    finally:
+        smtp.stop()
+        wechat.stop()
+
+    result['channels'] = sorted(channels)
+    result['concurrency'] = args.concurrency
+    result['smtp'] = smtp.stats
+    result['wechat'] = wechat.stats
+
+    if args.json:
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+        return
+
+    print(f"模式: {result['name']}  渠道: {', '.join(result['channels'])}  并发: {args.concurrency}")
+    print(f"消息数: {result['messages']}  失败: {result['errors']}  耗时: {result['elapsed']}s")
+    print(f"吞吐量: {result['msgs_per_sec']} 条/秒")
+    print(f"延迟: p50={result['p50_ms']}ms  p95={result['p95_ms']}ms  "
+          f"p99={result['p99_ms']}ms  max={result['max_ms']}ms")
+    print(f"SMTP 服务器: {smtp.stats}")
+    print(f"企业微信服务器: {wechat.stats}")
+
+
+if __name__ == '__main__':
+    main()
@@ -10,15 +10,23 @@ import sys
 import sqlite3
 import json
 import uuid
+import copy
+import threading
 from datetime import datetime
 
+from metrics import TimedConnection
+
 # 数据库文件路径
-DB_FILE = "/backups/users.db"
+DB_FILE = os.environ.get('BACKUP_DB_FILE', "/backups/users.db")
+
+# 进程内配置缓存: {缓存键: (配置代数, 配置)}
+_config_cache = {}
+_config_cache_lock = threading.Lock()
 
 
 def get_db_connection():
     """获取数据库连接"""
-    conn = sqlite3.connect(DB_FILE)
+    conn = sqlite3.connect(DB_FILE, factory=TimedConnection)
     conn.row_factory = sqlite3.Row
     return conn
 
@@ -63,6 +71,8 @@ def init_config_tables():
             enabled BOOLEAN DEFAULT 0,
             on_success BOOLEAN DEFAULT 1,
             on_failure BOOLEAN DEFAULT 1,
+            digest_window INTEGER DEFAULT 0,
+            immediate_on_failure BOOLEAN DEFAULT 1,
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
@@ -97,6 +107,15 @@ def init_config_tables():
     ''')
 
     # 插入默认通知配置（如果不存在）
+    # 配置代数表：每次通过本模块写入配置时递增，供各进程判断缓存是否失效
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS config_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO config_meta (key, value) VALUES ('generation', 0)")
+
     cursor.execute('SELECT COUNT(*) as count FROM notification_config')
     if cursor.fetchone()['count'] == 0:
         cursor.execute('INSERT INTO notification_config (enabled, on_success, on_failure) VALUES (0, 1, 1)')
@@ -117,11 +136,75 @@ def init_config_tables():
             VALUES (0, '@all')
         ''')
 
+    bump_config_generation(cursor)
     conn.commit()
     conn.close()
     print("配置表初始化完成")
 
 
+# ===== 配置缓存 =====
+
+def bump_config_generation(cursor):
+    """递增配置代数，在写配置的同一事务中调用，使所有进程的配置缓存失效"""
+    try:
+        cursor.execute('''
+            INSERT INTO config_meta (key, value) VALUES ('generation', 1)
+            ON CONFLICT(key) DO UPDATE SET value = value + 1
+        ''')
+    except sqlite3.OperationalError:
+        # 旧数据库尚未创建 config_meta 表，读取端此时也不会使用缓存
+        pass
+
+
+def get_config_generation():
+    """
+    获取当前配置代数
+
+    Returns:
+        int: 配置代数；config_meta 表不存在时返回 None（调用方不使用缓存）
+    """
+    conn = get_db_connection()
+    try:
+        row = conn.execute("SELECT value FROM config_meta WHERE key = 'generation'").fetchone()
+        return row['value'] if row else 0
+    except sqlite3.OperationalError:
+        return None
+    finally:
+        conn.close()
+
+
+def _get_cached_config(cache_key, loader):
+    """
+    按配置代数缓存配置读取结果
+
+    先读取代数再加载配置：若加载期间有写入，缓存的旧值会挂在旧代数下，
+    下一次读取看到新代数时自然重新加载。返回深拷贝，调用方可以放心修改。
+
+    Args:
+        cache_key: 缓存键
+        loader: 无参加载函数
+    """
+    generation = get_config_generation()
+    if generation is None:
+        return loader()
+
+    with _config_cache_lock:
+        cached = _config_cache.get(cache_key)
+    if cached and cached[0] == generation:
+        return copy.deepcopy(cached[1])
+
+    value = loader()
+    with _config_cache_lock:
+        _config_cache[cache_key] = (generation, value)
+    return copy.deepcopy(value)
+
+
+def clear_config_cache():
+    """清空本进程的配置缓存"""
+    with _config_cache_lock:
+        _config_cache.clear()
+
+
 # ===== 数据库连接管理 =====
 
 def add_database_connection(user_id, db_type, host, port, user, password, db_name):
@@ -145,6 +228,7 @@ def add_database_connection(user_id, db_type, host, port, user, password, db_nam
         VALUES (?, ?, ?, ?, ?, ?, ?, ?)
     ''', (conn_id, user_id, db_type, host, port, user, password, db_name))
 
+    bump_config_generation(cursor)
     conn.commit()
     conn.close()
     return conn_id
@@ -161,6 +245,7 @@ def update_database_connection(conn_id, db_type, host, port, user, password, db_
         WHERE id=?
     ''', (db_type, host, port, user, password, db_name, datetime.now(), conn_id))
 
+    bump_config_generation(cursor)
     conn.commit()
     conn.close()
 
@@ -172,6 +257,7 @@ def delete_database_connection(conn_id):
 
     cursor.execute('DELETE FROM database_connections WHERE id=?', (conn_id,))
 
+    bump_config_generation(cursor)
     conn.commit()
     conn.close()
 
@@ -249,6 +335,7 @@ def save_backup_schedule(user_id, db_type, schedule_type, cron_expression, reten
             VALUES (?, ?, ?, ?, ?, ?)
         ''', (user_id, db_type, schedule_type, cron_expression, retention_days, datetime.now()))
 
+    bump_config_generation(cursor)
     conn.commit()
     conn.close()
 
@@ -294,7 +381,12 @@ def get_backup_schedule(user_id, db_type):
 # ===== 通知配置管理 =====
 
 def get_notification_config():
-    """获取通知配置"""
+    """获取通知配置（按配置代数缓存）"""
+    return _get_cached_config('notifications', _load_notification_config)
+
+
+def _load_notification_config():
+    """从数据库读取通知配置"""
     conn = get_db_connection()
     cursor = conn.cursor()
 
@@ -319,6 +411,8 @@ def get_notification_config():
         'enabled': bool(main_config.get('enabled', 0)),
         'on_success': bool(main_config.get('on_success', 1)),
         'on_failure': bool(main_config.get('on_failure', 1)),
+        'digest_window': int(main_config.get('digest_window') or 0),
+        'immediate_on_failure': bool(main_config.get('immediate_on_failure', 1)),
         'email': {
             'enabled': bool(email_config.get('enabled', 0)),
             'smtp_server': email_config.get('smtp_server', ''),
@@ -339,7 +433,8 @@ def get_notification_config():
     }
 
 
-def save_notification_config(enabled, on_success, on_failure, email_config, wechat_config):
+def save_notification_config(enabled, on_success, on_failure, email_config, wechat_config,
+                             digest_window=None, immediate_on_failure=None):
     """保存通知配置"""
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -358,6 +453,8 @@ def save_notification_config(enabled, on_success, on_failure, email_config, wech
             WHERE id=1
         ''', (1 if enabled else 0, 1 if on_success else 0, 1 if on_failure else 0, datetime.now()))
 
+    _save_digest_config(cursor, digest_window, immediate_on_failure)
+
     # 更新或插入邮件配置
     cursor.execute('SELECT COUNT(*) as count FROM email_notification_config')
     if cursor.fetchone()['count'] == 0:
@@ -421,11 +518,21 @@ def save_notification_config(enabled, on_success, on_failure, email_config, wech
             datetime.now()
         ))
 
+    bump_config_generation(cursor)
     conn.commit()
     conn.close()
 
 
-def save_global_notification_config(enabled, on_success, on_failure):
+def _save_digest_config(cursor, digest_window, immediate_on_failure):
+    """保存通知汇总配置（参数为 None 时保持原值）"""
+    if digest_window is not None:
+        cursor.execute('UPDATE notification_config SET digest_window=?', (max(int(digest_window), 0),))
+    if immediate_on_failure is not None:
+        cursor.execute('UPDATE notification_config SET immediate_on_failure=?',
+                       (1 if immediate_on_failure else 0,))
+
+
+def save_global_notification_config(enabled, on_success, on_failure, digest_window=None, immediate_on_failure=None):
     """单独保存全局通知配置"""
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -446,6 +553,9 @@ def save_global_notification_config(enabled, on_success, on_failure):
             WHERE id=1
         ''', (1 if enabled else 0, 1 if on_success else 0, 1 if on_failure else 0, datetime.now()))
 
+    _save_digest_config(cursor, digest_window, immediate_on_failure)
+
+    bump_config_generation(cursor)
     conn.commit()
     conn.close()
 
@@ -492,6 +602,7 @@ def save_email_notification_config(email_config):
             datetime.now()
         ))
 
+    bump_config_generation(cursor)
     conn.commit()
     conn.close()
 
@@ -531,30 +642,42 @@ def save_wechat_notification_config(wechat_config):
             datetime.now()
         ))
 
+    bump_config_generation(cursor)
     conn.commit()
     conn.close()
 
 
 def get_all_config(user_id=None):
-    """获取所有配置（用于备份脚本）
+    """获取所有配置（用于备份脚本，按配置代数缓存）
 
     Args:
         user_id: 用户 ID（用于多用户隔离）
     """
+    return _get_cached_config(('all', user_id), lambda: _load_all_config(user_id))
+
+
+def _load_all_config(user_id):
+    """从数据库读取所有配置"""
+    schedules = get_backup_schedules(user_id)
     return {
         'postgresql': [dict(row) for row in get_database_connections(user_id, 'postgresql')],
         'mysql': [dict(row) for row in get_database_connections(user_id, 'mysql')],
-        'schedules': {k: v['cron_expression'] for k, v in get_backup_schedules(user_id).items() if v},
-        'retention_days': {k: v['retention_days'] for k, v in get_backup_schedules(user_id).items()},
-        'notifications': get_notification_config()
+        'schedules': {k: v['cron_expression'] for k, v in schedules.items() if v},
+        'retention_days': {k: v['retention_days'] for k, v in schedules.items()},
+        'notifications': _load_notification_config()
     }
 
 
 # ===== 命令行工具 =====
 
-def get_db_config_for_shell(db_type):
-    """为 Shell 脚本获取数据库连接配置"""
-    connections = get_database_connections(db_type)
+def get_db_config_for_shell(db_type, user_id=None):
+    """为 Shell 脚本获取数据库连接配置
+
+    Args:
+        db_type: 数据库类型
+        user_id: 用户 ID（可选，只返回该用户的连接）
+    """
+    connections = get_database_connections(user_id, db_type)
     output = []
     for conn in connections:
         # 输出格式: host;port;user;password;db_name;id
@@ -562,9 +685,9 @@ def get_db_config_for_shell(db_type):
     return '\n'.join(output)
 
 
-def get_retention_days_for_shell(db_type):
+def get_retention_days_for_shell(db_type, user_id=None):
     """为 Shell 脚本获取保留天数"""
-    schedule = get_backup_schedule(db_type)
+    schedule = get_backup_schedule(user_id, db_type)
     if schedule:
         return schedule.get('retention_days', 7)
     return 7
@@ -578,6 +701,7 @@ def main():
     parser.add_argument('action', choices=['init', 'get', 'export', 'get_dbs', 'get_retention'], help='操作类型')
     parser.add_argument('--format', choices=['json', 'env'], default='json', help='输出格式')
     parser.add_argument('--db_type', help='数据库类型 (postgresql/mysql)')
+    parser.add_argument('--user_id', help='用户 ID（用于多用户隔离）')
 
     args = parser.parse_args()
 
@@ -602,13 +726,13 @@ def main():
         if not args.db_type or args.db_type not in ['postgresql', 'mysql']:
             print("错误: 必须指定 --db_type (postgresql 或 mysql)", file=sys.stderr)
             sys.exit(1)
-        print(get_db_config_for_shell(args.db_type))
+        print(get_db_config_for_shell(args.db_type, args.user_id))
     elif args.action == 'get_retention':
         # 获取保留天数，用于 cleanup
         if not args.db_type or args.db_type not in ['postgresql', 'mysql']:
             print("错误: 必须指定 --db_type (postgresql 或 mysql)", file=sys.stderr)
             sys.exit(1)
-        print(get_retention_days_for_shell(args.db_type))
+        print(get_retention_days_for_shell(args.db_type, args.user_id))
 
 
 if __name__ == '__main__':
@@ -3,7 +3,7 @@ import hashlib
 import os
 
 # 将 users.db 放在 backups 文件夹下，确保数据持久化
-DB_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backups', 'users.db')
+DB_FILE = os.environ.get('BACKUP_DB_FILE') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backups', 'users.db')
 
 def init_db():
     """初始化数据库"""
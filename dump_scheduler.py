@@ -0,0 +1,583 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+自适应并发转储模块
+"所有数据库"备份中各数据库的 pg_dump 并行执行，并发数根据运行中观察到的信号自动调整：
+
+    - 转储吞吐量：所有 pg_dump 输出的未压缩字节数 / 秒
+    - 备份目录所在磁盘的写入延迟：/proc/diskstats 中该设备每次写入的平均耗时，
+      找不到块设备（overlay、网络文件系统）时改为测量一次小文件 fsync 的耗时
+    - 源数据库延迟（可选）：通过 psycopg2 定期执行 SELECT 1，与开始时的延迟比较
+
+控制方式为加性增、乘性减（AIMD）：从 1 个并发开始，每个控制周期加 1，只要吞吐量随之增长；
+增加并发后吞吐量没有明显提升就退回上一档并保持几个周期；磁盘写入延迟或源数据库延迟超过阈值时
+并发数减半。已经开始的转储不会被中断，并发数下降时只是暂缓启动新的转储。
+
+结果文件按数据库顺序写入分段压缩数据（见 artifact_index.py）：排在最前面、尚未写完的数据库直接写入，
+其余数据库先写入各自的 part 文件，轮到时把已写入的部分拼接过来后改为直接写入，索引中的偏移量相应调整，
+结果与逐个转储追加写入的文件相同。加密备份的 part 文件同样加密，拼接时解密后重新加密到结果文件中
+（见 artifact_crypto.py），磁盘上不出现明文。配置了远程存储时（见 storage.py），结果文件在写入的同时分片上传。
+
+用法（backup.sh 中）:
+    python3 dump_scheduler.py postgresql --host db1 --port 5432 --user postgres \\
+        --output pg_all.tmp.sql.gz --databases app analytics audit
+    标准输出为转储失败的数据库名（每行一个），有失败时退出码为 1
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import threading
+import subprocess
+import contextlib
+from datetime import datetime
+
+import artifact_index
+import artifact_crypto
+import optional_deps
+import throttle
+import storage
+
+# 控制周期（秒）
+CONTROL_INTERVAL = 5
+
+# 增加并发后吞吐量至少提升这么多才继续增加
+MIN_GAIN = 0.10
+
+# 增加并发没有收益、退回上一档后保持的控制周期数，之后再尝试增加
+HOLD_INTERVALS = 6
+
+# 备份磁盘平均写入延迟超过该值（毫秒）时并发减半
+DISK_LATENCY_LIMIT_MS = float(os.environ.get('DUMP_DISK_LATENCY_LIMIT_MS', 50))
+
+# 源数据库延迟超过开始时的这么多倍时并发减半
+SOURCE_LATENCY_FACTOR = float(os.environ.get('DUMP_SOURCE_LATENCY_FACTOR', 3))
+
+# 源数据库延迟的绝对下限（毫秒）：基线很小时的正常抖动不视为过载
+SOURCE_LATENCY_FLOOR_MS = 20
+
+# 源数据库探测连接的超时（秒）
+SOURCE_PROBE_TIMEOUT = 5
+
+# 把这么多字节攒在一起再交给限速器，避免每一行都加锁
+THROTTLE_BATCH = 64 * 1024
+
+
+def _log(message):
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message}", file=sys.stderr, flush=True)
+
+
+# ===== 信号采集 =====
+
+class DiskLatencyProbe:
+    """测量目录所在磁盘的平均写入延迟（毫秒）"""
+
+    def __init__(self, path):
+        self.path = path
+        self.device = self._find_device(path)
+        self.last = self._read_stats() if self.device else None
+
+    @staticmethod
+    def _find_device(path):
+        """目录所在块设备在 /proc/diskstats 中的名称，找不到返回 None"""
+        try:
+            st_dev = os.stat(path).st_dev
+            link = f"/sys/dev/block/{os.major(st_dev)}:{os.minor(st_dev)}"
+            if not os.path.exists(link):
+                return None
+            return os.path.basename(os.path.realpath(link))
+        except OSError:
+            return None
+
+    def _read_stats(self):
+        """返回 (完成的写入次数, 写入累计耗时毫秒)"""
+        try:
+            with open('/proc/diskstats') as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) > 10 and fields[2] == self.device:
+                        return int(fields[7]), int(fields[10])
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def _fsync_latency(self):
+        probe = os.path.join(self.path, '.latency_probe')
+        try:
+            started = time.perf_counter()
+            with open(probe, 'wb') as f:
+                f.write(b'\0' * 4096)
+                f.flush()
+                os.fsync(f.fileno())
+            return (time.perf_counter() - started) * 1000
+        except OSError:
+            return None
+        finally:
+            try:
+                os.remove(probe)
+            except OSError:
+                pass
+
+    def sample(self):
+        """自上次采样以来的平均写入延迟，没有写入时返回 0"""
+        if self.last is None:
+            return self._fsync_latency()
+        current = self._read_stats()
+        if current is None:
+            return None
+        writes = current[0] - self.last[0]
+        ticks = current[1] - self.last[1]
+        self.last = current
+        return ticks / writes if writes > 0 else 0.0
+
+
+class SourceLatencyProbe:
+    """定期在源数据库上执行 SELECT 1 测量往返延迟（毫秒），驱动未安装或连接失败时停用"""
+
+    def __init__(self, host, port, user, password, database):
+        self.conn = None
+        try:
+            psycopg2 = optional_deps.load('psycopg2')
+            self.conn = psycopg2.connect(host=host, port=port, user=user, password=password,
+                                         dbname=database, connect_timeout=SOURCE_PROBE_TIMEOUT)
+            self.conn.autocommit = True
+        except Exception as e:
+            _log(f"源数据库延迟探测未启用: {str(e)}")
+
+    def sample(self):
+        if self.conn is None:
+            return None
+        try:
+            started = time.perf_counter()
+            with self.conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+                cursor.fetchone()
+            return (time.perf_counter() - started) * 1000
+        except Exception as e:
+            _log(f"源数据库延迟探测失败，停止探测: {str(e)}")
+            self.close()
+            return None
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+            self.conn = None
+
+
+# ===== 并发控制 =====
+
+class ConcurrencyController:
+    """
+    AIMD 并发控制器
+
+    每个控制周期调用一次 update()，传入该周期的吞吐量和延迟，返回新的目标并发数
+    """
+
+    def __init__(self, max_jobs, min_jobs=1):
+        self.max_jobs = max(1, max_jobs)
+        self.min_jobs = max(1, min(min_jobs, self.max_jobs))
+        self.target = self.min_jobs
+        self.previous_throughput = None
+        self.increased = False
+        self.hold = 0
+        self.source_baseline = None
+        self.history = []
+
+    def _overloaded(self, disk_ms, source_ms):
+        if disk_ms is not None and disk_ms > DISK_LATENCY_LIMIT_MS:
+            return f"磁盘写入延迟 {disk_ms:.1f} ms"
+        if source_ms is not None:
+            if self.source_baseline is None or source_ms < self.source_baseline:
+                self.source_baseline = source_ms
+            limit = max(self.source_baseline * SOURCE_LATENCY_FACTOR, SOURCE_LATENCY_FLOOR_MS)
+            if source_ms > limit:
+                return f"源数据库延迟 {source_ms:.1f} ms（基线 {self.source_baseline:.1f} ms）"
+        return None
+
+    def update(self, throughput, disk_ms=None, source_ms=None):
+        """
+        Args:
+            throughput: 本周期的转储吞吐量（字节/秒）
+            disk_ms: 备份磁盘平均写入延迟
+            source_ms: 源数据库延迟
+
+        Returns:
+            int: 目标并发数
+        """
+        previous = self.target
+        overload = self._overloaded(disk_ms, source_ms)
+        if overload:
+            self.target = max(self.min_jobs, self.target // 2)
+            self.hold = HOLD_INTERVALS
+            reason = overload
+        elif self.increased and self.previous_throughput and \
+                throughput < self.previous_throughput * (1 + MIN_GAIN):
+            # 增加并发没有带来吞吐量提升：瓶颈不在并发数，退回上一档
+            self.target = max(self.min_jobs, self.target - 1)
+            self.hold = HOLD_INTERVALS
+            reason = "吞吐量未随并发增长"
+        elif self.hold > 0:
+            self.hold -= 1
+            reason = None
+        elif self.target < self.max_jobs:
+            self.target += 1
+            reason = "吞吐量随并发增长"
+        else:
+            reason = None
+
+        self.increased = self.target > previous
+        self.previous_throughput = throughput
+        if self.target != previous:
+            self.history.append({'from': previous, 'to': self.target, 'reason': reason,
+                                 'throughput': int(throughput), 'disk_ms': disk_ms, 'source_ms': source_ms})
+        return self.target
+
+
+# ===== 转储任务 =====
+
+class CountingReader:
+    """逐行读取转储输出，统计字节数，配置了限速时按读取速率限速"""
+
+    def __init__(self, stream, limiter=None):
+        self.stream = stream
+        self.limiter = limiter
+        self.bytes = 0
+        self._unthrottled = 0
+
+    def __iter__(self):
+        for line in self.stream:
+            self.bytes += len(line)
+            if self.limiter is not None:
+                self._unthrottled += len(line)
+                if self._unthrottled >= THROTTLE_BATCH:
+                    self.limiter.consume(self._unthrottled)
+                    self._unthrottled = 0
+            yield line
+
+
+class PartSink:
+    """
+    一个数据库转储的写入目标
+
+    轮到该数据库（前面的数据库都已写完）之前写入自己的 part 文件；轮到时把 part 文件中已有的内容
+    拼接到结果文件，之后的输出直接写入结果文件。排在最前面的数据库从一开始就直接写入，
+    不产生 part 文件。
+    """
+
+    def __init__(self, part, data_key=None):
+        self.part = part
+        self.data_key = data_key
+        self.lock = threading.Lock()
+        self.output = None
+        self.offset = 0
+        self._file = None
+        self._spool = None
+
+    def write(self, data):
+        with self.lock:
+            if self.output is not None:
+                self.output.write(data)
+            else:
+                if self._spool is None:
+                    self._file = open(self.part, 'wb')
+                    self._spool = self._file
+                    if self.data_key is not None:
+                        self._spool = artifact_crypto.EncryptingWriter(self._file, self.data_key)
+                self._spool.write(data)
+        return len(data)
+
+    def promote(self, output):
+        """轮到该数据库：拼接 part 文件中已有的内容，之后直接写入 output"""
+        with self.lock:
+            self.offset = output.tell()
+            if self._spool is not None:
+                self._close_spool()
+                with artifact_crypto.open_artifact(self.part) as part:
+                    shutil.copyfileobj(part, output, artifact_index.CHUNK_SIZE)
+                self.remove()
+            self.output = output
+
+    def _close_spool(self):
+        if self._spool is not self._file:
+            self._spool.finish()
+        self._file.close()
+        self._spool = None
+
+    def remove(self):
+        """删除 part 文件（转储失败、没有轮到时）"""
+        if self._spool is not None:
+            self._close_spool()
+        try:
+            os.remove(self.part)
+        except OSError:
+            pass
+
+
+class DumpJob:
+    """一个数据库的转储：pg_dump 的输出在本进程的线程中分段压缩，写入 PartSink"""
+
+    def __init__(self, database, part, argv, dialect='postgresql', connection_id=None, data_key=None):
+        self.database = database
+        self.sink = PartSink(part, data_key)
+        self.argv = argv
+        self.dialect = dialect
+        self.connection_id = connection_id
+        self.reader = None
+        self.writer = None
+        self.error = None
+        self.thread = None
+
+    @property
+    def bytes(self):
+        return self.reader.bytes if self.reader else 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def done(self):
+        return self.thread is not None and not self.thread.is_alive()
+
+    def _run(self):
+        read_limiter = write_limiter = None
+        if self.connection_id:
+            read_limiter = throttle.Throttle(self.connection_id, ['read'])
+            write_limiter = throttle.Throttle(self.connection_id, ['write'])
+        try:
+            process = subprocess.Popen(self.argv, stdout=subprocess.PIPE)
+        except OSError as e:
+            self.error = str(e)
+            return
+        try:
+            self.reader = CountingReader(process.stdout, read_limiter)
+            out = throttle.ThrottledWriter(self.sink, write_limiter) if write_limiter is not None else self.sink
+            self.writer = artifact_index.write_members(self.reader, out, self.dialect, self.database)
+        except Exception as e:
+            self.error = str(e)
+            process.kill()
+        finally:
+            process.stdout.close()
+            code = process.wait()
+        if code != 0 and not self.error:
+            self.error = f"退出码 {code}"
+
+
+def postgresql_argv(host, port, user):
+    """返回生成某个数据库 pg_dump 命令的函数（密码通过 PGPASSWORD 传递）"""
+    def build(database):
+        return ['pg_dump', '-h', host, '-p', str(port), '-U', user, '-d', database]
+    return build
+
+
+class OrderedOutput:
+    """
+    按数据库顺序把各转储写入结果文件
+
+    任一时刻只有排在最前面、尚未写完的数据库（队首）写入结果文件，队首写完后下一个数据库接替，
+    把它在 part 文件中已写入的部分拼接过来后继续直接写入。结果与逐个转储追加写入的文件相同，
+    每个数据库的数据最多经过一次 part 文件，不再在全部结束后重新拼接整个文件。
+    """
+
+    def __init__(self, jobs, out):
+        self.jobs = jobs
+        self.out = out
+        self.head = 0
+
+    def advance(self):
+        """队首写完时依次交给后面已开始的数据库；有数据库失败时停止，结果文件作废"""
+        while self.head < len(self.jobs):
+            job = self.jobs[self.head]
+            if job.error or job.thread is None:
+                return
+            if job.sink.output is None:
+                job.sink.promote(self.out)
+            if not job.done():
+                return
+            self.head += 1
+
+    def complete(self):
+        return self.head == len(self.jobs)
+
+    def write_index(self, path):
+        """写出合并后的索引（各成员偏移量加上该数据库在结果文件中的起始位置）"""
+        with open(path, 'w', encoding='utf-8') as index:
+            for job in self.jobs:
+                for entry in job.writer.entries:
+                    entry = dict(entry, offset=entry['offset'] + job.sink.offset)
+                    index.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    @property
+    def raw_total(self):
+        return sum(job.writer.raw_total for job in self.jobs)
+
+
+class DumpFailed(Exception):
+    """有数据库转储失败，放弃结果文件（及其上传）"""
+
+
+def remove_parts(jobs):
+    for job in jobs:
+        job.sink.remove()
+
+
+def dump_all(databases, output, build_argv, dialect='postgresql', connection_id=None, max_jobs=0,
+             source_probe=None, interval=CONTROL_INTERVAL, data_key=None, upload_as=None):
+    """
+    自适应并发转储多个数据库到一个分段压缩文件
+
+    Args:
+        databases: 数据库名列表，结果文件中按此顺序排列
+        output: 输出文件路径（同时生成 output.idx）
+        build_argv: 数据库名 -> 转储命令
+        dialect: SQL 方言
+        connection_id: 连接 ID，用于限速（见 throttle.py）
+        max_jobs: 并发上限，0 表示按可用 CPU 数
+        source_probe: SourceLatencyProbe，None 表示不探测源数据库
+        interval: 控制周期（秒）
+        data_key: artifact_crypto.DataKey，指定时加密写入
+        upload_as: 配置了远程存储时合并结果边写入边上传，对象键按此路径计算（见 storage.py）
+
+    Returns:
+        dict: {'failed': [失败的数据库], 'raw_size', 'max_concurrency', 'adjustments'}
+    """
+    if max_jobs <= 0:
+        max_jobs = throttle.effective_cpus()
+    max_jobs = min(max_jobs, len(databases)) or 1
+    controller = ConcurrencyController(max_jobs)
+    disk_probe = DiskLatencyProbe(os.path.dirname(os.path.abspath(output)))
+
+    # 加密的 part 文件带 .enc 后缀，拼接时由 open_artifact 识别并解密
+    suffix = artifact_crypto.ENCRYPTED_SUFFIX if data_key is not None else ''
+    jobs = [DumpJob(database, f"{output}.part{index}{suffix}", build_argv(database), dialect, connection_id, data_key)
+            for index, database in enumerate(databases)]
+    pending = list(jobs)
+    running = []
+    peak = 0
+    last_bytes = 0
+    last_tick = time.monotonic()
+    raw_size = 0
+    merged = False
+
+    upload = storage.open_upload(upload_as) if upload_as else None
+    try:
+        # 正常结束时提交上传，出错或有数据库失败时放弃已上传的部分
+        with open(output, 'wb') as f, (upload if upload is not None else contextlib.nullcontext()):
+            out = storage.TeeWriter(f, upload) if upload is not None else f
+            if data_key is not None:
+                out = artifact_crypto.EncryptingWriter(out, data_key)
+            ordered = OrderedOutput(jobs, out)
+
+            while pending or running:
+                while pending and len(running) < controller.target:
+                    job = pending.pop(0)
+                    _log(f"开始转储数据库 {job.database}（并发 {len(running) + 1}/{controller.target}）")
+                    job.start()
+                    running.append(job)
+                    ordered.advance()
+                peak = max(peak, len(running))
+
+                time.sleep(min(0.2, interval))
+                for job in [job for job in running if job.done()]:
+                    running.remove(job)
+                    if job.error:
+                        _log(f"数据库 {job.database} 转储失败: {job.error}")
+                ordered.advance()
+
+                now = time.monotonic()
+                if now - last_tick < interval:
+                    continue
+                total = sum(job.bytes for job in jobs)
+                throughput = (total - last_bytes) / (now - last_tick)
+                last_bytes, last_tick = total, now
+                # 剩余任务少于目标并发时吞吐量自然下降，不据此调整
+                if not pending:
+                    continue
+                previous = controller.target
+                target = controller.update(throughput, disk_probe.sample(),
+                                           source_probe.sample() if source_probe else None)
+                if target != previous:
+                    _log(f"并发 {previous} -> {target}: {controller.history[-1]['reason']}，"
+                         f"吞吐量 {throttle.format_rate(int(throughput))}")
+
+            ordered.advance()
+            if not ordered.complete():
+                raise DumpFailed()
+            if data_key is not None:
+                out.finish()
+        ordered.write_index(artifact_index.index_path(output))
+        if upload is not None:
+            storage.upload_file(artifact_index.index_path(output), artifact_index.index_path(upload_as))
+        raw_size = ordered.raw_total
+        merged = True
+    except DumpFailed:
+        pass
+    except (OSError, ValueError, ImportError) as e:
+        _log(f"合并转储文件失败: {str(e)}")
+        # 写入结果文件出错时转储线程可能仍在写，等它们结束后再清理
+        for job in running:
+            job.thread.join()
+    finally:
+        if source_probe:
+            source_probe.close()
+        remove_parts(jobs)
+
+    failed = [job.database for job in jobs if job.error]
+    if not merged and not failed:
+        failed = list(databases)
+    return {'failed': failed, 'raw_size': raw_size, 'max_concurrency': peak,
+            'adjustments': controller.history}
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='自适应并发转储工具')
+    subparsers = parser.add_subparsers(dest='command', help='可用命令')
+
+    pg_parser = subparsers.add_parser('postgresql', help='并发转储 PostgreSQL 实例中的多个数据库')
+    pg_parser.add_argument('--host', required=True, help='主机')
+    pg_parser.add_argument('--port', default='5432', help='端口')
+    pg_parser.add_argument('--user', required=True, help='用户名（密码通过 PGPASSWORD 传递）')
+    pg_parser.add_argument('--output', required=True, help='输出文件路径')
+    pg_parser.add_argument('--databases', nargs='+', required=True, help='要转储的数据库')
+    pg_parser.add_argument('--connection', help='连接 ID（用于限速）')
+    pg_parser.add_argument('--max-jobs', type=int, default=0, help='并发上限，0 表示按可用 CPU 数')
+    pg_parser.add_argument('--interval', type=float, default=CONTROL_INTERVAL, help='控制周期（秒）')
+    pg_parser.add_argument('--probe-source', action='store_true', help='探测源数据库延迟（需要 psycopg2）')
+    pg_parser.add_argument('--raw-size-file', help='追加写入压缩前的字节数（供 backup.sh 统计）')
+    pg_parser.add_argument('--encrypt', action='store_true', help='使用用户的数据密钥加密（见 artifact_crypto.py）')
+    pg_parser.add_argument('--user-id', type=int, help='加密使用该用户的数据密钥')
+    pg_parser.add_argument('--upload-as', help='配置了远程存储时边写入边上传，按该路径计算对象键（见 storage.py）')
+
+    args = parser.parse_args()
+
+    if args.command == 'postgresql':
+        source_probe = None
+        if args.probe_source:
+            source_probe = SourceLatencyProbe(args.host, args.port, args.user,
+                                              os.environ.get('PGPASSWORD'), 'postgres')
+        data_key = artifact_crypto.get_user_key(args.user_id) if args.encrypt else None
+        result = dump_all(args.databases, args.output, postgresql_argv(args.host, args.port, args.user),
+                          connection_id=args.connection, max_jobs=args.max_jobs,
+                          source_probe=source_probe, interval=args.interval, data_key=data_key,
+                          upload_as=args.upload_as)
+        _log(f"转储完成：{len(args.databases)} 个数据库，最大并发 {result['max_concurrency']}，"
+             f"调整 {len(result['adjustments'])} 次")
+        if args.raw_size_file:
+            with open(args.raw_size_file, 'a') as f:
+                f.write(f"{result['raw_size']}\n")
+        for database in result['failed']:
+            print(database)
+        sys.exit(1 if result['failed'] else 0)
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
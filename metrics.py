@@ -0,0 +1,549 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+运行指标模块
+在 Web 进程内维护 Prometheus 文本格式的计数器、仪表和直方图，供 /metrics 接口输出。
+
+指标来源:
+- HTTP 请求耗时：Flask 请求钩子按路由记录
+- SQLite 查询耗时：各模块 get_db_connection 使用 TimedConnection，按调用函数记录
+- 备份耗时、字节数、压缩比：抓取时从 backup_history 增量读取（按上次读到的 ID）
+- 通知延迟和失败：抓取时从 notification_history 增量读取
+- 发件箱积压和备份锁：抓取时查询当前状态
+- 其他进程（如 backup.sh 调用的 backup_lock.py）的观测值：追加到事件文件，抓取时读取
+"""
+
+import os
+import sys
+import json
+import time
+import fcntl
+import sqlite3
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+
+# 数据库文件路径
+DB_FILE = os.environ.get('BACKUP_DB_FILE', "/backups/users.db")
+
+# 其他进程写入的指标事件文件，每行一个 JSON 对象
+EVENTS_FILE = os.environ.get('BACKUP_METRICS_EVENTS', "/backups/metrics_events.log")
+
+# 事件文件读取后超过该大小则清空
+EVENTS_FILE_MAX_BYTES = 1024 * 1024
+
+# Web 进程启动后首次抓取时回溯的历史记录时长（小时）
+BACKFILL_HOURS = 24
+
+# 直方图分桶
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+BACKUP_DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+BYTES_BUCKETS = tuple(1024 ** 2 * 4 ** n for n in range(9))
+RATIO_BUCKETS = (1, 1.5, 2, 3, 4, 6, 8, 12, 16, 32)
+NOTIFY_LATENCY_BUCKETS = (0.5, 1, 5, 15, 30, 60, 300, 900, 3600)
+
+
+def _format_labels(labelnames, values, extra=None):
+    """生成 {name="value",...}，按 Prometheus 规则转义"""
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        escaped.append(f'{name}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    """格式化数值"""
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """指标基类，按标签值保存样本"""
+
+    type_name = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        """标签字典转为按 labelnames 排列的元组"""
+        if not self.labelnames:
+            return ()
+        labels = labels or {}
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def samples(self):
+        """
+        Returns:
+            list: [(后缀, 标签值元组, 额外标签, 数值)]
+        """
+        raise NotImplementedError
+
+    def render(self):
+        """输出该指标的文本格式"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for suffix, values, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, values, extra)} {_format_value(value)}")
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """只增不减的计数器"""
+
+    type_name = 'counter'
+
+    def inc(self, amount=1, labels=None):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [('', key, None, value) for key, value in sorted(self._values.items())]
+
+
+class Gauge(Metric):
+    """可任意设置的仪表"""
+
+    type_name = 'gauge'
+
+    def set(self, value, labels=None):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def replace(self, values):
+        """
+        整体替换所有样本（抓取时重新统计的状态类指标使用）
+
+        Args:
+            values: [(labels, value)]
+        """
+        with self._lock:
+            self._values = {self._key(labels): value for labels, value in values}
+
+    def samples(self):
+        with self._lock:
+            return [('', key, None, value) for key, value in sorted(self._values.items())]
+
+
+class Histogram(Metric):
+    """累积分桶直方图"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=None):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['counts'][index] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+
+    def samples(self):
+        result = []
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, state['counts']):
+                    cumulative += count
+                    result.append(('_bucket', key, ('le', _format_value(float(bound))), cumulative))
+                result.append(('_bucket', key, ('le', '+Inf'), state['count']))
+                result.append(('_sum', key, None, state['sum']))
+                result.append(('_count', key, None, state['count']))
+        return result
+
+
+class MetricsRegistry:
+    """指标注册表，同名指标只创建一次"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        """输出所有指标的文本格式"""
+        with self._lock:
+            metrics = [self._metrics[name] for name in sorted(self._metrics)]
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    'http_requests_total', 'HTTP 请求数', ('method', 'route', 'status'))
+HTTP_DURATION = REGISTRY.histogram(
+    'http_request_duration_seconds', 'HTTP 请求耗时（秒）', ('method', 'route'))
+SQLITE_DURATION = REGISTRY.histogram(
+    'sqlite_query_duration_seconds', 'SQLite 语句执行耗时（秒），按调用函数统计', ('function',), QUERY_BUCKETS)
+SQLITE_ERRORS = REGISTRY.counter(
+    'sqlite_query_errors_total', 'SQLite 语句执行失败次数', ('function',))
+
+BACKUP_RUNS = REGISTRY.counter(
+    'backup_runs_total', '备份次数', ('user_id', 'db_type', 'db_name', 'status'))
+BACKUP_DURATION = REGISTRY.histogram(
+    'backup_duration_seconds', '单个数据库备份耗时（秒）', ('user_id', 'db_type', 'db_name'), BACKUP_DURATION_BUCKETS)
+BACKUP_BYTES = REGISTRY.counter(
+    'backup_bytes_total', '备份文件（压缩后）字节数', ('user_id', 'db_type', 'db_name'))
+BACKUP_RAW_BYTES = REGISTRY.counter(
+    'backup_raw_bytes_total', '转储原始（压缩前）字节数', ('user_id', 'db_type', 'db_name'))
+BACKUP_SIZE = REGISTRY.histogram(
+    'backup_size_bytes', '单个备份文件大小（字节）', ('db_type',), BYTES_BUCKETS)
+BACKUP_COMPRESSION = REGISTRY.histogram(
+    'backup_compression_ratio', '备份压缩比（原始字节数 / 压缩后字节数）', ('db_type',), RATIO_BUCKETS)
+BACKUP_LOCK_WAIT = REGISTRY.histogram(
+    'backup_lock_wait_seconds', '获取备份锁耗时（秒）', ('db_type', 'result'), QUERY_BUCKETS)
+BACKUP_LOCKS_HELD = REGISTRY.gauge(
+    'backup_locks_held', '当前持有的备份锁', ('db_type', 'locked_by'))
+RESTORE_VERIFY_DURATION = REGISTRY.histogram(
+    'restore_verify_duration_seconds', '恢复校验中恢复备份的耗时（秒）', ('db_type', 'status'), BACKUP_DURATION_BUCKETS)
+
+NOTIFICATIONS = REGISTRY.counter(
+    'notifications_total', '通知发送尝试次数', ('channel', 'status'))
+NOTIFICATION_LATENCY = REGISTRY.histogram(
+    'notification_latency_seconds', '备份完成到通知发送成功的延迟（秒）', ('channel',), NOTIFY_LATENCY_BUCKETS)
+OUTBOX_DEPTH = REGISTRY.gauge(
+    'notification_outbox_messages', '通知发件箱中的消息数', ('channel', 'status'))
+OUTBOX_OLDEST = REGISTRY.gauge(
+    'notification_outbox_oldest_pending_seconds', '最早一条待发送通知已等待的时间（秒）', ('channel',))
+
+# 事件文件中允许的直方图，防止任意写入产生新指标
+EVENT_HISTOGRAMS = {
+    BACKUP_LOCK_WAIT.name: BACKUP_LOCK_WAIT,
+    RESTORE_VERIFY_DURATION.name: RESTORE_VERIFY_DURATION,
+}
+
+# 增量读取状态
+_ingest_state = {'backup_history': None, 'notification_history': None, 'events_offset': 0}
+_ingest_lock = threading.Lock()
+
+
+# ===== SQLite 查询耗时 =====
+
+# 每条语句执行后调用的监听函数 fn(function, elapsed)，供请求级性能分析使用
+_query_listeners = []
+
+
+def add_query_listener(listener):
+    """注册 SQLite 语句耗时监听函数"""
+    if listener not in _query_listeners:
+        _query_listeners.append(listener)
+
+
+def _caller_name(depth):
+    """调用方的 模块.函数 名"""
+    frame = sys._getframe(depth)
+    module = frame.f_globals.get('__name__', '?')
+    if module == '__main__':
+        module = os.path.splitext(os.path.basename(frame.f_code.co_filename))[0]
+    return f"{module}.{frame.f_code.co_name}"
+
+
+class TimedCursor(sqlite3.Cursor):
+    """记录每条语句执行耗时的游标"""
+
+    def _timed(self, method, depth, *args):
+        function = _caller_name(depth)
+        started = time.perf_counter()
+        try:
+            return method(self, *args)
+        except sqlite3.Error:
+            SQLITE_ERRORS.inc(labels={'function': function})
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            SQLITE_DURATION.observe(elapsed, {'function': function})
+            for listener in _query_listeners:
+                listener(function, elapsed)
+
+    def execute(self, sql, parameters=(), _depth=3):
+        return self._timed(sqlite3.Cursor.execute, _depth, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters, _depth=3):
+        return self._timed(sqlite3.Cursor.executemany, _depth, sql, seq_of_parameters)
+
+    def executescript(self, sql_script, _depth=3):
+        return self._timed(sqlite3.Cursor.executescript, _depth, sql_script)
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    记录语句执行耗时的连接
+
+    用法: sqlite3.connect(DB_FILE, factory=TimedConnection)
+    """
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters, _depth=4)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters, _depth=4)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script, _depth=4)
+
+
+# ===== 其他进程的指标事件 =====
+
+def record_event(name, value, labels=None):
+    """
+    追加一条直方图观测值到事件文件，由 Web 进程抓取时读取
+
+    在 backup.sh 调用的命令行工具中使用，失败时只打印警告
+    """
+    line = json.dumps({'name': name, 'labels': labels or {}, 'value': value}, ensure_ascii=False) + '\n'
+    try:
+        with open(EVENTS_FILE, 'a', encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(line)
+    except OSError as e:
+        print(f"写入指标事件失败: {str(e)}", file=sys.stderr)
+
+
+def _ingest_events():
+    """读取事件文件中新增的观测值"""
+    if not os.path.exists(EVENTS_FILE):
+        return
+    with open(EVENTS_FILE, 'r+', encoding='utf-8') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        size = os.fstat(f.fileno()).st_size
+        offset = _ingest_state['events_offset']
+        if size < offset:
+            offset = 0
+        f.seek(offset)
+        data = f.read()
+        offset = f.tell()
+        if offset >= EVENTS_FILE_MAX_BYTES:
+            # 已全部读取，持锁清空，写入方不会丢数据
+            f.truncate(0)
+            offset = 0
+        _ingest_state['events_offset'] = offset
+
+    for line in data.splitlines():
+        try:
+            event = json.loads(line)
+            metric = EVENT_HISTOGRAMS.get(event['name'])
+            if metric:
+                metric.observe(float(event['value']), event.get('labels'))
+        except (ValueError, KeyError, TypeError):
+            continue
+
+
+# ===== 备份和通知历史 =====
+
+def get_db_connection():
+    """获取数据库连接"""
+    conn = sqlite3.connect(DB_FILE, factory=TimedConnection)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _parse_timestamp(value):
+    """解析 SQLite 的 CURRENT_TIMESTAMP（UTC）"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
+def _utcnow():
+    """当前 UTC 时间（不带时区，与 SQLite CURRENT_TIMESTAMP 一致）"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _start_id(cursor, table, time_column):
+    """首次抓取时从最近 BACKFILL_HOURS 小时的记录开始读取"""
+    since = (_utcnow() - timedelta(hours=BACKFILL_HOURS)).strftime('%Y-%m-%d %H:%M:%S')
+    cursor.execute(f'SELECT MIN(id) FROM {table} WHERE {time_column} >= ?', (since,))
+    first = cursor.fetchone()[0]
+    if first is not None:
+        return first - 1
+    cursor.execute(f'SELECT MAX(id) FROM {table}')
+    return cursor.fetchone()[0] or 0
+
+
+def _ingest_backups(cursor):
+    """读取新增的备份记录"""
+    if _ingest_state['backup_history'] is None:
+        _ingest_state['backup_history'] = _start_id(cursor, 'backup_history', 'created_at')
+
+    cursor.execute('''
+        SELECT id, user_id, db_type, db_name, status, file_size, raw_size, duration
+        FROM backup_history WHERE id > ? ORDER BY id
+    ''', (_ingest_state['backup_history'],))
+    for row in cursor.fetchall():
+        _ingest_state['backup_history'] = row['id']
+        db_type = (row['db_type'] or '').lower()
+        labels = {'user_id': row['user_id'] or '', 'db_type': db_type, 'db_name': row['db_name'] or 'all'}
+        BACKUP_RUNS.inc(labels=dict(labels, status=row['status']))
+        if row['status'] != '成功':
+            continue
+        if row['duration']:
+            BACKUP_DURATION.observe(row['duration'], labels)
+        if row['file_size']:
+            BACKUP_BYTES.inc(row['file_size'], labels)
+            BACKUP_SIZE.observe(row['file_size'], {'db_type': db_type})
+        if row['raw_size']:
+            BACKUP_RAW_BYTES.inc(row['raw_size'], labels)
+            if row['file_size']:
+                BACKUP_COMPRESSION.observe(row['raw_size'] / row['file_size'], {'db_type': db_type})
+
+
+def _ingest_notifications(cursor):
+    """读取新增的通知记录，延迟从备份记录写入时间算起"""
+    if _ingest_state['notification_history'] is None:
+        _ingest_state['notification_history'] = _start_id(cursor, 'notification_history', 'sent_at')
+
+    cursor.execute('''
+        SELECT n.id, n.notification_type, n.status, n.sent_at, b.created_at AS backup_at
+        FROM notification_history n
+        LEFT JOIN backup_history b ON b.id = n.backup_history_id
+        WHERE n.id > ? ORDER BY n.id
+    ''', (_ingest_state['notification_history'],))
+    for row in cursor.fetchall():
+        _ingest_state['notification_history'] = row['id']
+        channel = row['notification_type']
+        NOTIFICATIONS.inc(labels={'channel': channel, 'status': row['status']})
+        if row['status'] == '成功':
+            sent_at, backup_at = _parse_timestamp(row['sent_at']), _parse_timestamp(row['backup_at'])
+            if sent_at and backup_at:
+                NOTIFICATION_LATENCY.observe(max((sent_at - backup_at).total_seconds(), 0.0), {'channel': channel})
+
+
+def _collect_state(cursor):
+    """统计发件箱积压和备份锁等当前状态"""
+    cursor.execute('''
+        SELECT channel, status, COUNT(*) AS count FROM notification_outbox GROUP BY channel, status
+    ''')
+    OUTBOX_DEPTH.replace([({'channel': row['channel'], 'status': row['status']}, row['count'])
+                          for row in cursor.fetchall()])
+
+    cursor.execute('''
+        SELECT channel, MIN(created_at) AS oldest FROM notification_outbox
+        WHERE status IN ('pending', 'sending') GROUP BY channel
+    ''')
+    now = _utcnow()
+    oldest = []
+    for row in cursor.fetchall():
+        created_at = _parse_timestamp(row['oldest'])
+        if created_at:
+            oldest.append(({'channel': row['channel']}, max((now - created_at).total_seconds(), 0.0)))
+    OUTBOX_OLDEST.replace(oldest)
+
+    cursor.execute('SELECT db_type, locked_by FROM backup_locks WHERE is_locked = 1')
+    BACKUP_LOCKS_HELD.replace([({'db_type': row['db_type'], 'locked_by': row['locked_by'] or ''}, 1)
+                               for row in cursor.fetchall()])
+
+
+def collect():
+    """抓取前更新从数据库和事件文件读取的指标，各部分失败互不影响"""
+    with _ingest_lock:
+        try:
+            _ingest_events()
+        except OSError as e:
+            print(f"读取指标事件失败: {str(e)}", file=sys.stderr)
+
+        try:
+            conn = get_db_connection()
+        except sqlite3.Error as e:
+            print(f"连接数据库失败: {str(e)}", file=sys.stderr)
+            return
+        try:
+            cursor = conn.cursor()
+            for step in (_ingest_backups, _ingest_notifications, _collect_state):
+                try:
+                    step(cursor)
+                except sqlite3.Error as e:
+                    print(f"收集指标失败 ({step.__name__}): {str(e)}", file=sys.stderr)
+        finally:
+            conn.close()
+
+
+def render():
+    """收集并输出所有指标"""
+    collect()
+    return REGISTRY.render()
+
+
+# ===== Flask 集成 =====
+
+def init_app(app):
+    """为 Flask 应用注册请求耗时统计钩子"""
+    from flask import g, request
+
+    @app.before_request
+    def _metrics_start_timer():
+        g._metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _metrics_record_request(response):
+        started = getattr(g, '_metrics_started', None)
+        if started is not None:
+            # 按路由模板统计，避免文件名等路径参数产生大量标签
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            HTTP_DURATION.observe(time.perf_counter() - started, {'method': request.method, 'route': route})
+            HTTP_REQUESTS.inc(labels={'method': request.method, 'route': route, 'status': response.status_code})
+        return response
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='运行指标工具')
+    subparsers = parser.add_subparsers(dest='command', help='可用命令')
+
+    subparsers.add_parser('dump', help='输出从数据库和事件文件收集的指标')
+
+    args = parser.parse_args()
+
+    if args.command == 'dump':
+        sys.stdout.write(render())
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -7,11 +7,17 @@
 import sqlite3
 import os
 import sys
+import fcntl
 import hashlib
+import argparse
 from datetime import datetime
 
 # 数据库文件路径（可通过环境变量或命令行参数覆盖）
-DB_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backups', 'users.db')
+DB_FILE = os.environ.get('BACKUP_DB_FILE') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backups', 'users.db')
+
+# 当前代码期望的数据库结构版本，完整检查和迁移成功后写入 PRAGMA user_version。
+# 修改任何表、列、索引或 ensure_* 步骤时加 1，下次启动会重新执行一次完整检查
+SCHEMA_VERSION = 8
 
 
 def check_table_exists(conn, table_name):
@@ -65,6 +71,562 @@ def check_index_exists(conn, index_name):
     return cursor.fetchone() is not None
 
 
+def check_trigger_exists(conn, trigger_name):
+    """检查触发器是否存在"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT name FROM sqlite_master
+        WHERE type='trigger' AND name=?
+    """, (trigger_name,))
+    return cursor.fetchone() is not None
+
+
+def ensure_columns(conn, table_name, columns):
+    """为已有表补充缺失的列（ALTER TABLE ADD COLUMN，不重建表、不丢数据）
+
+    Args:
+        conn: 数据库连接
+        table_name: 表名
+        columns: {列名: 列定义}
+
+    Returns:
+        list: 新增的列名
+    """
+    if not check_table_exists(conn, table_name):
+        return []
+
+    existing = get_table_columns(conn, table_name)
+    added = []
+    for column_name, column_def in columns.items():
+        if column_name not in existing:
+            conn.execute(f'ALTER TABLE {table_name} ADD COLUMN {column_name} {column_def}')
+            added.append(column_name)
+    return added
+
+
+# 全文检索索引定义: (源表, FTS 表, 被索引的列)
+LOG_SEARCH_INDEXES = [
+    ('system_logs', 'system_logs_fts', ['message', 'details']),
+    ('backup_history', 'backup_history_fts', ['message']),
+]
+
+
+def ensure_log_search_tables():
+    """确保日志全文检索（FTS5）索引及同步触发器存在
+
+    FTS 表使用外部内容模式（content=源表），不重复存储日志正文，
+    由 INSERT/UPDATE/DELETE 触发器保持与源表同步。
+    使用 trigram 分词器，以支持中文和主机名等任意子串检索。
+    """
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+
+    try:
+        for table_name, fts_name, columns in LOG_SEARCH_INDEXES:
+            if not check_table_exists(conn, table_name):
+                continue
+
+            triggers = [f'{fts_name}_ai', f'{fts_name}_ad', f'{fts_name}_au']
+            if check_table_exists(conn, fts_name) and all(check_trigger_exists(conn, t) for t in triggers):
+                continue
+
+            print(f"  创建全文检索索引: {fts_name}")
+            col_list = ', '.join(columns)
+            new_values = ', '.join(f'new.{col}' for col in columns)
+            old_values = ', '.join(f'old.{col}' for col in columns)
+
+            if not check_table_exists(conn, fts_name):
+                try:
+                    cursor.execute(f"""
+                        CREATE VIRTUAL TABLE {fts_name} USING fts5(
+                            {col_list}, content='{table_name}', content_rowid='id', tokenize='trigram'
+                        )
+                    """)
+                except sqlite3.OperationalError:
+                    # SQLite < 3.34 不支持 trigram 分词器，退回默认分词器
+                    cursor.execute(f"""
+                        CREATE VIRTUAL TABLE {fts_name} USING fts5(
+                            {col_list}, content='{table_name}', content_rowid='id'
+                        )
+                    """)
+
+            # 源表重建时触发器会随旧表一起删除，这里统一重新创建
+            for trigger_name in triggers:
+                cursor.execute(f'DROP TRIGGER IF EXISTS {trigger_name}')
+            cursor.execute(f"""
+                CREATE TRIGGER {fts_name}_ai AFTER INSERT ON {table_name} BEGIN
+                    INSERT INTO {fts_name}(rowid, {col_list}) VALUES (new.id, {new_values});
+                END
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER {fts_name}_ad AFTER DELETE ON {table_name} BEGIN
+                    INSERT INTO {fts_name}({fts_name}, rowid, {col_list}) VALUES ('delete', old.id, {old_values});
+                END
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER {fts_name}_au AFTER UPDATE ON {table_name} BEGIN
+                    INSERT INTO {fts_name}({fts_name}, rowid, {col_list}) VALUES ('delete', old.id, {old_values});
+                    INSERT INTO {fts_name}(rowid, {col_list}) VALUES (new.id, {new_values});
+                END
+            """)
+
+            # 为已有数据建立索引
+            cursor.execute(f"INSERT INTO {fts_name}({fts_name}) VALUES ('rebuild')")
+            print(f"  ✅ 全文检索索引 {fts_name} 创建完成")
+
+        conn.commit()
+        return True
+
+    except sqlite3.OperationalError as e:
+        # SQLite 编译时未启用 FTS5，检索接口会自动退回 LIKE 查询
+        print(f"  ⚠️  无法创建全文检索索引: {str(e)}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+
+# 备份指标所需的列：压缩前的转储字节数，用于统计压缩比
+BACKUP_METRICS_COLUMNS = {
+    'raw_size': 'INTEGER',
+}
+
+
+def ensure_backup_metrics_columns():
+    """确保 backup_history 包含 /metrics 统计所需的列"""
+    conn = sqlite3.connect(DB_FILE)
+
+    try:
+        added = ensure_columns(conn, 'backup_history', BACKUP_METRICS_COLUMNS)
+        if added:
+            print(f"  ✅ backup_history 新增列: {', '.join(added)}")
+        conn.commit()
+        return True
+    except sqlite3.Error as e:
+        print(f"  ⚠️  补充 backup_history 列失败: {str(e)}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+
+# 通知汇总配置列：digest_window 为汇总窗口（秒，0 表示逐条发送），
+# immediate_on_failure 为失败结果是否跳过汇总立即发送
+NOTIFICATION_DIGEST_COLUMNS = {
+    'digest_window': 'INTEGER DEFAULT 0',
+    'immediate_on_failure': 'BOOLEAN DEFAULT 1',
+}
+
+
+def ensure_notification_outbox():
+    """确保通知发件箱表及汇总配置列存在
+
+    备份结果先写入发件箱，由常驻的 notification_dispatcher 统一投递和重试，
+    投递成功或超过重试次数前消息不会丢失。
+    同一任务（batch_key）的结果可在汇总窗口内合并为一条通知。
+    """
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+
+    try:
+        if not check_table_exists(conn, 'notification_outbox'):
+            print("  创建 notification_outbox 表...")
+            cursor.execute('''
+                CREATE TABLE notification_outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    backup_history_id INTEGER,
+                    channel TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL DEFAULT 6,
+                    next_attempt_at REAL NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    batch_key TEXT,
+                    payload TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            print("  ✅ notification_outbox 表创建成功")
+
+        # 汇总通知所需的列：batch_key 为空表示立即发送，payload 为结构化的备份结果
+        ensure_columns(conn, 'notification_outbox', {
+            'batch_key': 'TEXT',
+            'payload': 'TEXT',
+        })
+        added = ensure_columns(conn, 'notification_config', NOTIFICATION_DIGEST_COLUMNS)
+        if added:
+            print(f"  ✅ notification_config 新增列: {', '.join(added)}")
+
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_notification_outbox_due
+            ON notification_outbox(status, next_attempt_at)
+        ''')
+        conn.commit()
+        return True
+    except sqlite3.Error as e:
+        print(f"  ⚠️  创建 notification_outbox 表失败: {str(e)}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+
+def ensure_restore_tables():
+    """确保备份文件元数据表和恢复任务表存在
+
+    backup_artifacts 记录每个成功备份文件的路径、格式和来源连接，恢复时据此选择恢复方式；
+    restores 记录恢复任务的目标和进度。
+    """
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+
+    try:
+        if not check_table_exists(conn, 'backup_artifacts'):
+            print("  创建 backup_artifacts 表...")
+            cursor.execute('''
+                CREATE TABLE backup_artifacts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    backup_history_id INTEGER,
+                    user_id INTEGER,
+                    db_type TEXT NOT NULL,
+                    db_name TEXT,
+                    connection_id TEXT,
+                    path TEXT NOT NULL UNIQUE,
+                    format TEXT NOT NULL,
+                    compression TEXT,
+                    size INTEGER,
+                    raw_size INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            print("  ✅ backup_artifacts 表创建成功")
+
+        if not check_table_exists(conn, 'restores'):
+            print("  创建 restores 表...")
+            cursor.execute('''
+                CREATE TABLE restores (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    artifact_id INTEGER NOT NULL,
+                    user_id INTEGER,
+                    connection_id TEXT,
+                    target_db TEXT,
+                    jobs INTEGER NOT NULL DEFAULT 1,
+                    max_rate INTEGER NOT NULL DEFAULT 0,
+                    create_db BOOLEAN NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    bytes_total INTEGER NOT NULL DEFAULT 0,
+                    bytes_done INTEGER NOT NULL DEFAULT 0,
+                    tables_total INTEGER,
+                    tables_done INTEGER NOT NULL DEFAULT 0,
+                    message TEXT,
+                    pid INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    started_at TIMESTAMP,
+                    finished_at TIMESTAMP
+                )
+            ''')
+            print("  ✅ restores 表创建成功")
+
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_backup_artifacts_user
+            ON backup_artifacts(user_id, created_at)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_backup_artifacts_history
+            ON backup_artifacts(backup_history_id)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_restores_user
+            ON restores(user_id, created_at)
+        ''')
+        conn.commit()
+        return True
+    except sqlite3.Error as e:
+        print(f"  ⚠️  创建恢复相关表失败: {str(e)}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+
+# restores 表后来补充的列
+RESTORE_EXTRA_COLUMNS = {
+    'source_db': 'TEXT',
+}
+
+
+def ensure_restore_columns():
+    """确保 restores 包含从"所有数据库"备份中恢复单个数据库所需的列"""
+    conn = sqlite3.connect(DB_FILE)
+
+    try:
+        added = ensure_columns(conn, 'restores', RESTORE_EXTRA_COLUMNS)
+        if added:
+            print(f"  ✅ restores 新增列: {', '.join(added)}")
+        conn.commit()
+        return True
+    except sqlite3.Error as e:
+        print(f"  ⚠️  补充 restores 列失败: {str(e)}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+
+def ensure_verification_table():
+    """确保恢复校验结果表存在
+
+    backup_verifications 记录每次把备份恢复到临时数据库实例后的结果、
+    恢复耗时以及各表的行数和校验和。
+    """
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+
+    try:
+        if not check_table_exists(conn, 'backup_verifications'):
+            print("  创建 backup_verifications 表...")
+            cursor.execute('''
+                CREATE TABLE backup_verifications (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    artifact_id INTEGER NOT NULL,
+                    user_id INTEGER,
+                    connection_id TEXT,
+                    db_type TEXT,
+                    db_name TEXT,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    restore_seconds REAL,
+                    check_seconds REAL,
+                    tables_count INTEGER,
+                    rows_count INTEGER,
+                    checksum TEXT,
+                    details TEXT,
+                    message TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    finished_at TIMESTAMP
+                )
+            ''')
+            print("  ✅ backup_verifications 表创建成功")
+
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_backup_verifications_artifact
+            ON backup_verifications(artifact_id)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_backup_verifications_user
+            ON backup_verifications(user_id, created_at)
+        ''')
+        conn.commit()
+        return True
+    except sqlite3.Error as e:
+        print(f"  ⚠️  创建 backup_verifications 表失败: {str(e)}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+
+def ensure_throttle_table():
+    """确保备份限速规则表存在
+
+    throttle_windows 记录各时间段内备份的读取和写入速率上限，
+    connection_id 为空的规则是全局限速（见 throttle.py）。
+    """
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+
+    try:
+        if not check_table_exists(conn, 'throttle_windows'):
+            print("  创建 throttle_windows 表...")
+            cursor.execute('''
+                CREATE TABLE throttle_windows (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    connection_id TEXT,
+                    start_time TEXT NOT NULL,
+                    end_time TEXT NOT NULL,
+                    read_rate INTEGER NOT NULL DEFAULT 0,
+                    write_rate INTEGER NOT NULL DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            print("  ✅ throttle_windows 表创建成功")
+
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_throttle_windows_connection
+            ON throttle_windows(connection_id)
+        ''')
+        conn.commit()
+        return True
+    except sqlite3.Error as e:
+        print(f"  ⚠️  创建 throttle_windows 表失败: {str(e)}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+
+# 加密备份使用的密钥 ID，同时记录在备份历史和备份文件元数据中
+ENCRYPTION_KEY_COLUMNS = {
+    'key_id': 'TEXT',
+}
+
+
+def ensure_encryption_tables():
+    """确保备份加密所需的表和列存在
+
+    encryption_keys 保存各用户经主密钥加密的数据密钥（见 artifact_crypto.py），
+    backup_history 和 backup_artifacts 记录加密备份所用的密钥 ID。
+    """
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+
+    try:
+        if not check_table_exists(conn, 'encryption_keys'):
+            print("  创建 encryption_keys 表...")
+            cursor.execute('''
+                CREATE TABLE encryption_keys (
+                    key_id TEXT PRIMARY KEY,
+                    user_id INTEGER,
+                    wrapped_key BLOB NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'active',
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    retired_at TIMESTAMP
+                )
+            ''')
+            print("  ✅ encryption_keys 表创建成功")
+
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_encryption_keys_user
+            ON encryption_keys(user_id, status)
+        ''')
+        for table in ('backup_history', 'backup_artifacts'):
+            added = ensure_columns(conn, table, ENCRYPTION_KEY_COLUMNS)
+            if added:
+                print(f"  ✅ {table} 新增列: {', '.join(added)}")
+        conn.commit()
+        return True
+    except sqlite3.Error as e:
+        print(f"  ⚠️  创建加密相关表失败: {str(e)}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+
+# 备份文件所在的存储层（hot / cold，见 storage.py）和移到冷层的时间
+ARTIFACT_TIER_COLUMNS = {
+    'tier': "TEXT NOT NULL DEFAULT 'hot'",
+    'migrated_at': 'TIMESTAMP',
+}
+
+
+def ensure_artifact_tier_columns():
+    """确保备份文件元数据中有存储层相关的列
+
+    backup_artifacts.path 始终是文件的当前位置，移到冷层后随之更新；
+    tier 和 migrated_at 记录所在的层和迁移时间，迁移任务按 tier 查找待迁移的文件。
+    """
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+
+    try:
+        added = ensure_columns(conn, 'backup_artifacts', ARTIFACT_TIER_COLUMNS)
+        if added:
+            print(f"  ✅ backup_artifacts 新增列: {', '.join(added)}")
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_backup_artifacts_tier
+            ON backup_artifacts(tier, created_at)
+        ''')
+        conn.commit()
+        return True
+    except sqlite3.Error as e:
+        print(f"  ⚠️  添加存储层列失败: {str(e)}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+
+# 后台重新压缩（见 recompress.py）记录的列：完成时间、原文件大小和解压后数据的 SHA-256
+ARTIFACT_RECOMPRESS_COLUMNS = {
+    'recompressed_at': 'TIMESTAMP',
+    'original_size': 'INTEGER',
+    'raw_sha256': 'TEXT',
+}
+
+
+def ensure_artifact_recompress_columns():
+    """确保备份文件元数据中有重新压缩相关的列
+
+    重新压缩后 path、compression、size 随之更新，original_size 保留原文件大小用于统计节省的空间。
+    """
+    conn = sqlite3.connect(DB_FILE)
+
+    try:
+        added = ensure_columns(conn, 'backup_artifacts', ARTIFACT_RECOMPRESS_COLUMNS)
+        if added:
+            print(f"  ✅ backup_artifacts 新增列: {', '.join(added)}")
+        conn.commit()
+        return True
+    except sqlite3.Error as e:
+        print(f"  ⚠️  添加重新压缩列失败: {str(e)}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+
+def ensure_incremental_vacuum():
+    """确保数据库处于 auto_vacuum=INCREMENTAL 模式
+
+    日志和历史清理后通过 PRAGMA incremental_vacuum 分段回收空间。
+    已有数据库切换模式需要执行一次完整 VACUUM，只在首次切换时发生。
+    """
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute('PRAGMA auto_vacuum')
+        if cursor.fetchone()[0] == 2:
+            return True
+
+        print("  启用增量 VACUUM 模式（首次需要整理数据库文件）...")
+        cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        cursor.execute('VACUUM')
+        print("  ✅ 增量 VACUUM 模式已启用")
+        return True
+    except sqlite3.Error as e:
+        print(f"  ⚠️  启用增量 VACUUM 模式失败: {str(e)}")
+        return False
+    finally:
+        conn.close()
+
+
+# v2.2.0 之后新增的结构检查，按顺序执行（全文检索索引依赖源表，放在最前）
+SCHEMA_EXTENSION_STEPS = (
+    ensure_log_search_tables,
+    ensure_notification_outbox,
+    ensure_backup_metrics_columns,
+    ensure_restore_tables,
+    ensure_restore_columns,
+    ensure_verification_table,
+    ensure_throttle_table,
+    ensure_encryption_tables,
+    ensure_artifact_tier_columns,
+    ensure_artifact_recompress_columns,
+    ensure_incremental_vacuum,
+)
+
+
+def ensure_schema_extensions():
+    """依次执行 v2.2.0 之后新增的结构检查，全部成功返回 True"""
+    results = [step() for step in SCHEMA_EXTENSION_STEPS]
+    return all(results)
+
+
 def migrate_to_v2_1():
     """迁移到 v2.1.0 - 添加通知和历史记录表"""
     print(f"正在迁移数据库到 v2.1.0: {DB_FILE}")
@@ -275,6 +837,8 @@ def ensure_v22_tables():
                     enabled BOOLEAN DEFAULT 0,
                     on_success BOOLEAN DEFAULT 1,
                     on_failure BOOLEAN DEFAULT 1,
+                    digest_window INTEGER DEFAULT 0,
+                    immediate_on_failure BOOLEAN DEFAULT 1,
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             '''
@@ -486,7 +1050,8 @@ def ensure_v22_tables():
         if not created_tables and not rebuilt_tables and not created_indexes:
             print(f"  所有表和索引都已存在且结构正确，无需修改")
 
-        return True
+        # 全文检索索引依赖上面的源表，最后创建
+        return ensure_schema_extensions()
 
     except Exception as e:
         print(f"\n❌ 数据库完整性检查失败: {str(e)}")
@@ -611,6 +1176,8 @@ def migrate_to_v2_2():
                     enabled BOOLEAN DEFAULT 0,
                     on_success BOOLEAN DEFAULT 1,
                     on_failure BOOLEAN DEFAULT 1,
+                    digest_window INTEGER DEFAULT 0,
+                    immediate_on_failure BOOLEAN DEFAULT 1,
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             ''')
@@ -773,32 +1340,42 @@ def init_v20_database():
         conn.close()
 
 
-def main(use_auto_ensure=False):
-    """主函数
+def get_schema_version():
+    """读取数据库记录的结构版本（PRAGMA user_version），数据库不存在或读取失败返回 None"""
+    if not os.path.exists(DB_FILE):
+        return None
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        try:
+            return conn.execute('PRAGMA user_version').fetchone()[0]
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"读取数据库结构版本失败: {str(e)}", file=sys.stderr)
+        return None
 
-    Args:
-        use_auto_ensure: 是否使用自动完整性检查模式（启动时调用）
-    """
-    print("=" * 60)
-    print("数据库备份管理器 - 数据库迁移工具")
-    print("=" * 60)
-    print(f"\n数据库文件: {DB_FILE}")
 
+def set_schema_version(version):
+    """写入数据库结构版本"""
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        # PRAGMA 不支持参数绑定
+        conn.execute(f'PRAGMA user_version = {int(version)}')
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def run_migrations():
+    """完整检查并迁移数据库结构，全部成功返回 True"""
     # 如果数据库文件不存在，先创建基础结构
     if not os.path.exists(DB_FILE):
         print("\n数据库文件不存在，创建新数据库...")
         if not init_v20_database():
             print("\n❌ 数据库初始化失败")
-            return
+            return False
         print("✅ 数据库初始化完成")
 
-    # 如果是自动模式，直接确保所有表存在
-    if use_auto_ensure:
-        print("\n" + "=" * 60)
-        ensure_v22_tables()
-        print("=" * 60)
-        return
-
     # 获取当前版本
     current_version = get_current_version()
     print(f"当前版本: {current_version}")
@@ -821,10 +1398,6 @@ def main(use_auto_ensure=False):
     elif current_version == "2.2.0":
         migrations.append(("2.2.0", migrate_to_v2_2))
 
-    if not migrations:
-        print("\n✅ 数据库已是最新版本，无需迁移")
-        return
-
     # 执行迁移
     print(f"\n需要执行 {len(migrations)} 个迁移:")
     for version, _ in migrations:
@@ -843,7 +1416,85 @@ def main(use_auto_ensure=False):
 
     print(f"\n{'=' * 60}")
     print(f"\n迁移完成! 成功: {success_count}/{len(migrations)}")
+    if success_count != len(migrations):
+        return False
+
+    # 补齐缺失的表和索引，以及配置、备份锁模块使用的表
+    print(f"\n{'=' * 60}")
+    if not ensure_v22_tables():
+        return False
+
+    import config_manager
+    import backup_lock
+    config_manager.init_config_tables()
+    backup_lock.init_backup_lock_table()
+
     print(f"最新版本: {get_current_version()}")
+    return True
+
+
+def ensure_schema(force=False):
+    """确保数据库结构为最新版本（Web 应用启动和 entrypoint 调用）
+
+    user_version 已等于 SCHEMA_VERSION 时只读取一次版本号，不做任何表结构检查；
+    否则执行完整的检查和迁移，成功后写入版本号。
+    多个进程同时启动时由迁移锁保证只有一个执行迁移，其余等待后直接返回。
+
+    Args:
+        force: 忽略已记录的版本，强制执行完整检查
+
+    Returns:
+        bool: 数据库结构是否为最新版本
+    """
+    if not force and (get_schema_version() or 0) >= SCHEMA_VERSION:
+        return True
+
+    os.makedirs(os.path.dirname(os.path.abspath(DB_FILE)), exist_ok=True)
+    with open(DB_FILE + '.migrate.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        # 等待期间其他进程可能已完成迁移
+        if not force and (get_schema_version() or 0) >= SCHEMA_VERSION:
+            return True
+
+        try:
+            if not run_migrations():
+                print("数据库结构检查未全部完成，下次启动时重试", file=sys.stderr)
+                return False
+            set_schema_version(SCHEMA_VERSION)
+        except Exception as e:
+            print(f"数据库迁移失败: {str(e)}", file=sys.stderr)
+            return False
+
+    print(f"✅ 数据库结构版本: {SCHEMA_VERSION}")
+    return True
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='数据库备份管理器 - 数据库迁移工具')
+    parser.add_argument('--force', action='store_true', help='忽略已记录的结构版本，强制执行完整检查')
+    parser.add_argument('--status', action='store_true', help='只显示结构版本，不执行迁移')
+
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("数据库备份管理器 - 数据库迁移工具")
+    print("=" * 60)
+    print(f"\n数据库文件: {DB_FILE}")
+
+    recorded = get_schema_version()
+    print(f"结构版本: {recorded if recorded is not None else '无'}（当前代码: {SCHEMA_VERSION}）")
+
+    if args.status:
+        return
+
+    if not args.force and (recorded or 0) >= SCHEMA_VERSION:
+        print("\n✅ 数据库已是最新版本，无需迁移")
+        return
+
+    if not ensure_schema(force=args.force):
+        sys.exit(1)
 
 
 if __name__ == '__main__':
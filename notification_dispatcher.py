@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+通知分发器
+常驻进程，从 notification_outbox 领取待发送通知并异步投递，
+失败时按指数退避重试，每次尝试都记录到 notification_history。
+同一批次的汇总通知合并为一条消息发送
+"""
+
+import sys
+import time
+import json
+import random
+import signal
+import asyncio
+import argparse
+
+import notification_outbox
+from notifications import load_config, create_notifier, format_backup_digest, prune_idle_smtp_sessions
+from backup_logger import log_notification
+
+# 每个渠道同时发送的最大数量
+CHANNEL_CONCURRENCY = {
+    'email': 2,
+    'wechat': 4,
+}
+
+# 汇总消息最多列出的条目数（企业微信文本消息上限 2048 字节）
+DIGEST_MAX_ITEMS = {
+    'email': None,
+    'wechat': 12,
+}
+
+# 重试退避：第 n 次失败后等待 RETRY_BASE_DELAY * 2^(n-1) 秒，最长 RETRY_MAX_DELAY 秒
+RETRY_BASE_DELAY = 30
+RETRY_MAX_DELAY = 3600
+
+# 没有待发送通知时的轮询间隔（秒）
+POLL_INTERVAL = 2.0
+
+# 已发送记录的清理周期（秒）和保留天数
+PRUNE_INTERVAL = 3600
+PRUNE_KEEP_DAYS = 7
+
+
+def retry_delay(attempts):
+    """计算第 attempts 次失败后的重试等待时间（带随机抖动，避免同时重试）"""
+    delay = min(RETRY_BASE_DELAY * (2 ** max(attempts - 1, 0)), RETRY_MAX_DELAY)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def build_message(records):
+    """
+    生成一组发件箱记录对应的消息
+
+    单条记录直接使用原消息，多条记录根据 payload 生成汇总消息。
+
+    Returns:
+        tuple: (title, content)
+    """
+    if len(records) == 1:
+        return records[0]['title'], records[0]['content']
+
+    items = []
+    for record in records:
+        try:
+            items.append(json.loads(record['payload']))
+        except (TypeError, ValueError):
+            items.append({'status': '成功' if record['title'].startswith('[成功]') else '失败',
+                          'message': record['title']})
+    channel = records[0]['channel']
+    return format_backup_digest(items, DIGEST_MAX_ITEMS.get(channel))
+
+
+def deliver_group(records):
+    """
+    同步发送一组通知（在线程池中执行）
+
+    Returns:
+        tuple: (是否成功, 错误信息, 是否可重试)
+    """
+    channel = records[0]['channel']
+    notifications_config = load_config().get('notifications', {})
+    try:
+        notifier = create_notifier(channel, notifications_config)
+    except Exception as e:
+        return False, f"通知配置无效: {str(e)}", False
+
+    if notifier is None:
+        return False, "通知渠道未启用", False
+
+    title, content = build_message(records)
+    try:
+        if channel == 'email':
+            notifier.deliver(title, content, is_html=False)
+        else:
+            notifier.deliver(title, content)
+        return True, None, False
+    except Exception as e:
+        return False, str(e), True
+
+
+def group_records(records):
+    """按渠道和批次分组，batch_key 为空的记录各自单独发送"""
+    groups = {}
+    for record in records:
+        if record.get('batch_key') is None:
+            key = ('single', record['id'])
+        else:
+            key = (record['channel'], record['batch_key'])
+        groups.setdefault(key, []).append(record)
+    return list(groups.values())
+
+
+class NotificationDispatcher:
+    """发件箱分发器"""
+
+    def __init__(self, concurrency=None):
+        self.concurrency = dict(CHANNEL_CONCURRENCY)
+        if concurrency:
+            self.concurrency.update(concurrency)
+        self.semaphores = {}
+        self.in_flight = set()
+        self.stopping = False
+        self.wakeup = None
+        self.last_prune = 0.0
+
+    def _semaphore(self, channel):
+        """获取渠道的并发信号量"""
+        if channel not in self.semaphores:
+            self.semaphores[channel] = asyncio.Semaphore(self.concurrency.get(channel, 1))
+        return self.semaphores[channel]
+
+    def _capacity(self):
+        """当前还能领取的通知数量（最多积压一轮并发量，其余留在发件箱）"""
+        return sum(self.concurrency.values()) * 2 - len(self.in_flight)
+
+    async def _deliver(self, records):
+        """发送一组通知并记录每条的结果"""
+        channel = records[0]['channel']
+        attempts = max(record['attempts'] for record in records)
+        max_attempts = min(record['max_attempts'] for record in records)
+        ids = ', '.join(f"#{record['id']}" for record in records)
+        label = f"通知 {ids} ({channel})" if len(records) == 1 else f"汇总通知 {len(records)} 条 ({channel})"
+
+        async with self._semaphore(channel):
+            success, error, retryable = await asyncio.to_thread(deliver_group, records)
+
+        if success:
+            for record in records:
+                await asyncio.to_thread(notification_outbox.mark_sent, record['id'])
+                await asyncio.to_thread(log_notification, record['backup_history_id'], channel, '成功')
+            print(f"[分发器] {label} 发送成功，第 {attempts} 次尝试")
+            return
+
+        if retryable and attempts < max_attempts:
+            delay = retry_delay(attempts)
+            message = f"第 {attempts} 次尝试失败，{int(delay)} 秒后重试: {error}"
+            for record in records:
+                await asyncio.to_thread(notification_outbox.mark_retry, record['id'], error, delay)
+        else:
+            message = f"第 {attempts} 次尝试失败，不再重试: {error}"
+            for record in records:
+                await asyncio.to_thread(notification_outbox.mark_failed, record['id'], error)
+
+        for record in records:
+            await asyncio.to_thread(log_notification, record['backup_history_id'], channel, '失败', message)
+        print(f"[分发器] {label} {message}", file=sys.stderr)
+
+    def _spawn(self, records):
+        """为领取的一组通知创建发送任务"""
+        task = asyncio.create_task(self._deliver(records))
+        self.in_flight.add(task)
+        task.add_done_callback(self._task_done)
+
+    def _task_done(self, task):
+        """发送任务结束，唤醒主循环继续领取"""
+        self.in_flight.discard(task)
+        if not task.cancelled() and task.exception():
+            print(f"[分发器] 发送任务异常: {task.exception()}", file=sys.stderr)
+        if self.wakeup:
+            self.wakeup.set()
+
+    async def _prune(self):
+        """定期清理已发送的发件箱记录"""
+        if time.time() - self.last_prune < PRUNE_INTERVAL:
+            return
+        self.last_prune = time.time()
+        count = await asyncio.to_thread(notification_outbox.prune_sent, PRUNE_KEEP_DAYS)
+        if count:
+            print(f"[分发器] 已清理 {count} 条已发送记录")
+
+    async def drain_once(self):
+        """
+        领取一批到期通知并等待发送完成
+
+        Returns:
+            int: 处理的通知数
+        """
+        records = await asyncio.to_thread(notification_outbox.claim_due, self._capacity())
+        for group in group_records(records):
+            self._spawn(group)
+        if self.in_flight:
+            await asyncio.gather(*self.in_flight, return_exceptions=True)
+        return len(records)
+
+    async def run(self):
+        """主循环：领取到期通知，等待到下一条到期或有发送任务结束"""
+        self.wakeup = asyncio.Event()
+
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.stop)
+
+        reset = await asyncio.to_thread(notification_outbox.reset_stuck)
+        if reset:
+            print(f"[分发器] 已恢复 {reset} 条未完成的通知")
+        print("[分发器] 通知分发器已启动")
+
+        while not self.stopping:
+            try:
+                await self._prune()
+                await asyncio.to_thread(prune_idle_smtp_sessions)
+
+                capacity = self._capacity()
+                if capacity > 0:
+                    records = await asyncio.to_thread(notification_outbox.claim_due, capacity)
+                    for group in group_records(records):
+                        self._spawn(group)
+
+                wait = await asyncio.to_thread(notification_outbox.next_due_in, POLL_INTERVAL)
+                wait = min(wait, POLL_INTERVAL)
+            except Exception as e:
+                # 数据库暂时锁定等错误不退出，下一轮再试
+                print(f"[分发器] 领取通知失败: {str(e)}", file=sys.stderr)
+                wait = POLL_INTERVAL
+
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=max(wait, 0.05))
+            except asyncio.TimeoutError:
+                pass
+
+        # 等待发送中的通知完成，未完成的记录在下次启动时恢复
+        if self.in_flight:
+            print(f"[分发器] 等待 {len(self.in_flight)} 条发送中的通知完成...")
+            await asyncio.gather(*self.in_flight, return_exceptions=True)
+        print("[分发器] 通知分发器已停止")
+
+    def stop(self):
+        """请求停止主循环"""
+        self.stopping = True
+        if self.wakeup:
+            self.wakeup.set()
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='通知分发器')
+    parser.add_argument('--once', action='store_true', help='只处理当前到期的通知后退出')
+    parser.add_argument('--email-concurrency', type=int, help='邮件并发数')
+    parser.add_argument('--wechat-concurrency', type=int, help='企业微信并发数')
+
+    args = parser.parse_args()
+
+    concurrency = {}
+    if args.email_concurrency:
+        concurrency['email'] = args.email_concurrency
+    if args.wechat_concurrency:
+        concurrency['wechat'] = args.wechat_concurrency
+
+    dispatcher = NotificationDispatcher(concurrency)
+
+    if args.once:
+        count = asyncio.run(dispatcher.drain_once())
+        print(f"已处理 {count} 条通知")
+    else:
+        asyncio.run(dispatcher.run())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+通知发件箱模块
+备份结果先写入 notification_outbox 表，由 notification_dispatcher 异步投递
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import json
+
+# 数据库文件路径
+DB_FILE = os.environ.get('BACKUP_DB_FILE', "/backups/users.db")
+
+# 默认最大尝试次数
+DEFAULT_MAX_ATTEMPTS = 6
+
+# 汇总通知最长等待时间（秒）：同一批次持续有新结果时，窗口最多顺延到此上限
+DIGEST_MAX_HOLD = 6 * 3600
+
+# 未指定批次的汇总通知共用的批次键（按时间窗口合并）
+DEFAULT_BATCH_KEY = 'window'
+
+# 发件箱状态
+STATUS_PENDING = 'pending'
+STATUS_SENDING = 'sending'
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+
+
+def get_db_connection():
+    """获取数据库连接"""
+    conn = sqlite3.connect(DB_FILE, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def enqueue(backup_history_id, channel, title, content, max_attempts=DEFAULT_MAX_ATTEMPTS,
+            batch_key=None, payload=None, delay=0, cursor=None):
+    """
+    将一条通知写入发件箱
+
+    batch_key 不为空时作为汇总通知：同渠道同批次的待发送记录共用一个到期时间，
+    每写入一条就把整组顺延到 delay 秒之后（最长不超过 DIGEST_MAX_HOLD），
+    到期后由分发器合并为一条消息发送。
+
+    Args:
+        backup_history_id: 关联的备份记录 ID
+        channel: 通知渠道 (email/wechat)
+        title: 消息标题
+        content: 消息内容
+        max_attempts: 最大尝试次数
+        batch_key: 汇总批次键，为空表示立即发送
+        payload: 结构化的通知数据（dict），用于生成汇总消息
+        delay: 汇总窗口（秒）
+        cursor: 可选，复用调用方的事务
+
+    Returns:
+        int: 发件箱记录 ID，失败返回 None
+    """
+    if cursor is not None:
+        return _enqueue(cursor, backup_history_id, channel, title, content, max_attempts,
+                        batch_key, payload, delay)
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        conn.isolation_level = None
+        cursor = conn.cursor()
+        # 顺延整组到期时间和插入新记录需要在同一个写事务中完成，避免与分发器领取交错
+        cursor.execute('BEGIN IMMEDIATE')
+        record_id = _enqueue(cursor, backup_history_id, channel, title, content, max_attempts,
+                             batch_key, payload, delay)
+        cursor.execute('COMMIT')
+        return record_id
+    except Exception as e:
+        if conn is not None and conn.in_transaction:
+            conn.execute('ROLLBACK')
+        print(f"写入通知发件箱失败: {str(e)}", file=sys.stderr)
+        return None
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+def _enqueue(cursor, backup_history_id, channel, title, content, max_attempts, batch_key, payload, delay):
+    """在给定游标上写入发件箱记录，并顺延同批次的到期时间"""
+    now = time.time()
+    due = now + max(delay or 0, 0)
+
+    if batch_key is not None:
+        cursor.execute('''
+            SELECT MIN(CAST(strftime('%s', created_at) AS REAL))
+            FROM notification_outbox
+            WHERE status = ? AND channel = ? AND batch_key = ?
+        ''', (STATUS_PENDING, channel, batch_key))
+        first_created = cursor.fetchone()[0]
+        if first_created is not None:
+            due = max(min(due, first_created + DIGEST_MAX_HOLD), now)
+            cursor.execute('''
+                UPDATE notification_outbox
+                SET next_attempt_at = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE status = ? AND channel = ? AND batch_key = ?
+            ''', (due, STATUS_PENDING, channel, batch_key))
+
+    cursor.execute('''
+        INSERT INTO notification_outbox
+        (backup_history_id, channel, title, content, max_attempts, next_attempt_at, batch_key, payload)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (backup_history_id, channel, title, content, max_attempts, due, batch_key,
+          json.dumps(payload, ensure_ascii=False) if payload is not None else None))
+    return cursor.lastrowid
+
+
+def flush(batch_key):
+    """
+    让指定批次的汇总通知立即到期（备份任务结束时调用）
+
+    Returns:
+        int: 受影响的记录数
+    """
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE notification_outbox
+            SET next_attempt_at = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE status = ? AND batch_key = ?
+        ''', (time.time(), STATUS_PENDING, batch_key))
+        conn.commit()
+        count = cursor.rowcount
+        conn.close()
+        return count
+    except Exception as e:
+        print(f"提交汇总通知失败: {str(e)}", file=sys.stderr)
+        return 0
+
+
+def claim_due(limit=10, channel=None):
+    """
+    领取到期的待发送通知，并标记为 sending
+
+    使用 BEGIN IMMEDIATE 保证多个进程不会领取到同一条记录。
+    汇总通知会连同同组的其它待发送记录一起领取，实际条数可能超过 limit。
+
+    Args:
+        limit: 最多领取条数
+        channel: 只领取指定渠道
+
+    Returns:
+        list: 通知记录列表
+    """
+    if limit <= 0:
+        return []
+
+    conn = get_db_connection()
+    try:
+        conn.isolation_level = None
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+
+        where = "status = ? AND next_attempt_at <= ?"
+        params = [STATUS_PENDING, time.time()]
+        if channel:
+            where += " AND channel = ?"
+            params.append(channel)
+
+        cursor.execute(f'''
+            SELECT * FROM notification_outbox
+            WHERE {where}
+            ORDER BY next_attempt_at, id
+            LIMIT ?
+        ''', params + [limit])
+        rows = [dict(row) for row in cursor.fetchall()]
+
+        # 汇总通知按组领取：同渠道同批次的待发送记录一起发出
+        claimed_ids = {row['id'] for row in rows}
+        groups = {(row['channel'], row['batch_key']) for row in rows if row['batch_key'] is not None}
+        for group_channel, group_key in groups:
+            cursor.execute('''
+                SELECT * FROM notification_outbox
+                WHERE status = ? AND channel = ? AND batch_key = ?
+                ORDER BY id
+            ''', (STATUS_PENDING, group_channel, group_key))
+            for row in cursor.fetchall():
+                if row['id'] not in claimed_ids:
+                    rows.append(dict(row))
+                    claimed_ids.add(row['id'])
+
+        if rows:
+            placeholders = ', '.join('?' for _ in rows)
+            cursor.execute(f'''
+                UPDATE notification_outbox
+                SET status = ?, attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP
+                WHERE id IN ({placeholders})
+            ''', [STATUS_SENDING] + [row['id'] for row in rows])
+            for row in rows:
+                row['attempts'] += 1
+
+        cursor.execute('COMMIT')
+        return rows
+    except Exception:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+
+def next_due_in(default=None):
+    """
+    返回距离下一条待发送通知到期的秒数
+
+    Returns:
+        float: 秒数（已到期为 0），没有待发送通知时返回 default
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT MIN(next_attempt_at) FROM notification_outbox WHERE status = ?
+        ''', (STATUS_PENDING,))
+        next_at = cursor.fetchone()[0]
+    finally:
+        conn.close()
+
+    if next_at is None:
+        return default
+    return max(0.0, next_at - time.time())
+
+
+def mark_sent(outbox_id):
+    """标记通知发送成功"""
+    _update(outbox_id, STATUS_SENT, None)
+
+
+def mark_retry(outbox_id, error_message, delay):
+    """标记通知发送失败，delay 秒后重试"""
+    _update(outbox_id, STATUS_PENDING, error_message, time.time() + delay)
+
+
+def mark_failed(outbox_id, error_message):
+    """标记通知最终失败，不再重试"""
+    _update(outbox_id, STATUS_FAILED, error_message)
+
+
+def _update(outbox_id, status, error_message, next_attempt_at=None):
+    """更新发件箱记录状态"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        if next_attempt_at is None:
+            cursor.execute('''
+                UPDATE notification_outbox
+                SET status = ?, last_error = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (status, error_message, outbox_id))
+        else:
+            cursor.execute('''
+                UPDATE notification_outbox
+                SET status = ?, last_error = ?, next_attempt_at = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (status, error_message, next_attempt_at, outbox_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def reset_stuck():
+    """
+    将 sending 状态的记录恢复为 pending
+
+    发送进程异常退出时记录会停留在 sending，分发器启动时调用。
+
+    Returns:
+        int: 恢复的记录数
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE notification_outbox
+            SET status = ?, next_attempt_at = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE status = ?
+        ''', (STATUS_PENDING, time.time(), STATUS_SENDING))
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        conn.close()
+
+
+def retry_failed(outbox_id=None):
+    """
+    将最终失败的通知重新放回队列
+
+    Args:
+        outbox_id: 指定记录 ID，为空时重试全部失败记录
+
+    Returns:
+        int: 重新入队的记录数
+    """
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        sql = '''
+            UPDATE notification_outbox
+            SET status = ?, attempts = 0, next_attempt_at = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE status = ?
+        '''
+        params = [STATUS_PENDING, time.time(), STATUS_FAILED]
+        if outbox_id is not None:
+            sql += " AND id = ?"
+            params.append(outbox_id)
+        cursor.execute(sql, params)
+        conn.commit()
+        count = cursor.rowcount
+        conn.close()
+        return count
+    except Exception as e:
+        print(f"重试失败通知出错: {str(e)}", file=sys.stderr)
+        return 0
+
+
+def prune_sent(days=7):
+    """
+    删除已发送超过指定天数的发件箱记录（投递结果已记录在 notification_history）
+
+    Returns:
+        int: 删除的记录数
+    """
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            DELETE FROM notification_outbox
+            WHERE status = ? AND updated_at < datetime('now', ?)
+        ''', (STATUS_SENT, f'-{int(days)} days'))
+        conn.commit()
+        count = cursor.rowcount
+        conn.close()
+        return count
+    except Exception as e:
+        print(f"清理通知发件箱失败: {str(e)}", file=sys.stderr)
+        return 0
+
+
+def get_outbox_stats():
+    """
+    获取发件箱统计
+
+    Returns:
+        dict: {渠道: {状态: 数量}}
+    """
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT channel, status, COUNT(*) as count
+            FROM notification_outbox
+            GROUP BY channel, status
+        ''')
+        stats = {}
+        for row in cursor.fetchall():
+            stats.setdefault(row['channel'], {})[row['status']] = row['count']
+        conn.close()
+        return stats
+    except Exception as e:
+        print(f"获取发件箱统计失败: {str(e)}", file=sys.stderr)
+        return {}
+
+
+def list_outbox(status=None, limit=50):
+    """
+    查询发件箱记录
+
+    Args:
+        status: 过滤状态
+        limit: 返回记录数
+
+    Returns:
+        list: 发件箱记录列表
+    """
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        if status:
+            cursor.execute('''
+                SELECT * FROM notification_outbox WHERE status = ? ORDER BY id DESC LIMIT ?
+            ''', (status, limit))
+        else:
+            cursor.execute('SELECT * FROM notification_outbox ORDER BY id DESC LIMIT ?', (limit,))
+        records = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return records
+    except Exception as e:
+        print(f"查询发件箱失败: {str(e)}", file=sys.stderr)
+        return []
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='通知发件箱工具')
+    subparsers = parser.add_subparsers(dest='command', help='可用命令')
+
+    # 统计命令
+    subparsers.add_parser('stats', help='按渠道和状态统计')
+
+    # 查询命令
+    list_parser = subparsers.add_parser('list', help='查询发件箱记录')
+    list_parser.add_argument('--status', choices=[STATUS_PENDING, STATUS_SENDING, STATUS_SENT, STATUS_FAILED],
+                             help='过滤状态')
+    list_parser.add_argument('--limit', type=int, default=50, help='返回记录数')
+
+    # 重试命令
+    retry_parser = subparsers.add_parser('retry', help='重新投递失败的通知')
+    retry_parser.add_argument('--id', type=int, help='发件箱记录 ID（默认全部）')
+
+    # 提交汇总命令
+    flush_parser = subparsers.add_parser('flush', help='立即发送指定批次的汇总通知')
+    flush_parser.add_argument('--batch-key', required=True, help='批次键（备份任务 ID）')
+
+    # 清理命令
+    prune_parser = subparsers.add_parser('prune', help='清理已发送的记录')
+    prune_parser.add_argument('--days', type=int, default=7, help='保留最近多少天的记录')
+
+    args = parser.parse_args()
+
+    if args.command == 'stats':
+        print(json.dumps(get_outbox_stats(), indent=2, ensure_ascii=False))
+    elif args.command == 'list':
+        print(json.dumps(list_outbox(args.status, args.limit), indent=2, ensure_ascii=False))
+    elif args.command == 'retry':
+        print(f"已重新入队 {retry_failed(args.id)} 条通知")
+    elif args.command == 'flush':
+        print(f"已提交 {flush(args.batch_key)} 条汇总通知")
+    elif args.command == 'prune':
+        print(f"已清理 {prune_sent(args.days)} 条已发送记录")
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
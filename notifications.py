@@ -13,27 +13,177 @@ import argparse
 import logging
 import hashlib
 import time
+import fcntl
+import atexit
+import threading
 from datetime import datetime
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.utils import formataddr
 from urllib.parse import urlencode
 
+import config_manager
+import optional_deps
+
 # 配置日志
 logger = logging.getLogger(__name__)
 
-# 尝试导入 requests，如果失败则提示安装
-try:
-    import requests
-except ImportError:
-    print("错误: 需要安装 requests 库")
-    print("请运行: pip3 install requests")
-    sys.exit(1)
+# requests 只在发送企业微信消息时需要，首次使用时再导入，
+# 以免写入发件箱的备份进程也要承担导入开销
+def _import_requests():
+    """导入 requests（每个进程只做一次）"""
+    return optional_deps.load('requests')
+
+
+# 企业微信 API 地址（可通过环境变量指向本地模拟服务，见 bench/fake_wechat.py）
+WECHAT_API_BASE = os.environ.get('WECHAT_API_BASE', 'https://qyapi.weixin.qq.com').rstrip('/')
+
+# 企业微信 access_token 缓存文件，所有进程共用，写入前需持有 TOKEN_LOCK_FILE 上的排他锁
+TOKEN_CACHE_FILE = os.environ.get('WECHAT_TOKEN_CACHE_FILE', "/tmp/wechat_token_cache.json")
+TOKEN_LOCK_FILE = TOKEN_CACHE_FILE + ".lock"
+TOKEN_CACHE_DURATION = 7200  # 接口未返回 expires_in 时的默认有效期（秒）
+TOKEN_REFRESH_MARGIN = 300   # 距离过期不足该时间时提前刷新（秒）
+
+# 进程内 token 缓存: {config_key: {'access_token': ..., 'expires_at': ...}}
+_token_memory = {}
+_token_memory_lock = threading.Lock()
+
+
+def _read_token_cache():
+    """读取 token 缓存文件（文件通过原子替换写入，读取无需加锁）"""
+    try:
+        with open(TOKEN_CACHE_FILE, 'r') as f:
+            data = json.load(f)
+        tokens = data.get('tokens')
+        return tokens if isinstance(tokens, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_token_cache(tokens):
+    """原子写入 token 缓存文件（调用方需持有排他锁）"""
+    tmp_file = f"{TOKEN_CACHE_FILE}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_file, 'w') as f:
+            json.dump({'tokens': tokens}, f)
+        os.chmod(tmp_file, 0o600)
+        os.replace(tmp_file, TOKEN_CACHE_FILE)
+    except OSError as e:
+        logger.warning(f"[企业微信] 写入 token 缓存失败: {str(e)}")
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+
+
+class _TokenLock:
+    """token 缓存的跨进程排他锁（flock）"""
+
+    def __enter__(self):
+        self.file = open(TOKEN_LOCK_FILE, 'a')
+        fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        self.file.close()
+        return False
+
+
+def _token_is_fresh(entry, margin=TOKEN_REFRESH_MARGIN):
+    """判断缓存的 token 是否在刷新余量之外仍然有效"""
+    return bool(entry and entry.get('access_token') and entry.get('expires_at', 0) - time.time() > margin)
+
 
+# SMTP 会话池：按服务器配置复用已登录的会话，省去每封邮件的 TLS 握手和 AUTH
+SMTP_TIMEOUT = 30            # 连接和命令超时（秒）
+SMTP_IDLE_TIMEOUT = 60       # 空闲超过该时间的会话直接关闭（秒）
+SMTP_HEALTHCHECK_AFTER = 5   # 空闲超过该时间再次使用前先发送 NOOP 检查（秒）
+SMTP_POOL_SIZE = 4           # 每个服务器配置最多保留的空闲会话数
 
-# 配置文件路径（已废弃，保留用于向后兼容）
-TOKEN_CACHE_FILE = "/tmp/wechat_token_cache.json"
-TOKEN_CACHE_DURATION = 7200  # token 缓存2小时（企业微信 token 有效期）
+_smtp_pool = {}
+_smtp_pool_lock = threading.Lock()
+
+
+def _close_smtp_session(server):
+    """关闭 SMTP 会话，忽略连接已断开等错误"""
+    try:
+        server.quit()
+    except Exception:
+        try:
+            server.close()
+        except Exception:
+            pass
+
+
+def _acquire_smtp_session(key):
+    """
+    从会话池取出一个可用会话
+
+    Returns:
+        smtplib.SMTP: 会话；没有可用会话时返回 None
+    """
+    while True:
+        with _smtp_pool_lock:
+            idle = _smtp_pool.get(key)
+            if not idle:
+                return None
+            server, last_used = idle.pop()
+
+        idle_seconds = time.monotonic() - last_used
+        if idle_seconds > SMTP_IDLE_TIMEOUT:
+            _close_smtp_session(server)
+            continue
+
+        if idle_seconds > SMTP_HEALTHCHECK_AFTER:
+            try:
+                if server.noop()[0] != 250:
+                    raise smtplib.SMTPException("NOOP 检查失败")
+            except Exception:
+                _close_smtp_session(server)
+                continue
+
+        return server
+
+
+def _release_smtp_session(key, server):
+    """将会话放回会话池，池已满时关闭"""
+    with _smtp_pool_lock:
+        idle = _smtp_pool.setdefault(key, [])
+        if len(idle) < SMTP_POOL_SIZE:
+            idle.append((server, time.monotonic()))
+            return
+    _close_smtp_session(server)
+
+
+def prune_idle_smtp_sessions():
+    """关闭空闲超时的会话（常驻进程定期调用）"""
+    expired = []
+    now = time.monotonic()
+    with _smtp_pool_lock:
+        for key, idle in _smtp_pool.items():
+            keep = []
+            for server, last_used in idle:
+                if now - last_used > SMTP_IDLE_TIMEOUT:
+                    expired.append(server)
+                else:
+                    keep.append((server, last_used))
+            _smtp_pool[key] = keep
+    for server in expired:
+        _close_smtp_session(server)
+    return len(expired)
+
+
+def close_smtp_sessions():
+    """关闭会话池中的所有会话（进程退出时调用）"""
+    with _smtp_pool_lock:
+        sessions = [server for idle in _smtp_pool.values() for server, _ in idle]
+        _smtp_pool.clear()
+    for server in sessions:
+        _close_smtp_session(server)
+
+
+atexit.register(close_smtp_sessions)
 
 
 class EmailNotifier:
@@ -58,6 +208,90 @@ class EmailNotifier:
         if not self.recipients:
             raise ValueError("未配置邮件收件人")
 
+        # 会话池键：服务器配置相同的通知器共用会话
+        self.pool_key = (
+            self.smtp_server, self.smtp_port, bool(self.use_tls), self.username,
+            hashlib.sha256(str(self.password).encode()).hexdigest()
+        )
+
+    def _connect(self):
+        """建立并登录新的 SMTP 会话"""
+        if self.use_tls:
+            # 使用 TLS (通常是 587 端口)
+            server = smtplib.SMTP(self.smtp_server, self.smtp_port, timeout=SMTP_TIMEOUT)
+            server.starttls()
+        else:
+            # 使用 SSL (通常是 465 端口) 或无加密
+            if self.smtp_port == 465:
+                server = smtplib.SMTP_SSL(self.smtp_server, self.smtp_port, timeout=SMTP_TIMEOUT)
+            else:
+                server = smtplib.SMTP(self.smtp_server, self.smtp_port, timeout=SMTP_TIMEOUT)
+
+        try:
+            # 登录
+            if self.username and self.password:
+                server.login(self.username, self.password)
+        except Exception:
+            _close_smtp_session(server)
+            raise
+
+        return server
+
+    def _build_message(self, subject, content, is_html=False):
+        """构建邮件消息"""
+        msg = MIMEMultipart('alternative')
+        msg['Subject'] = subject
+        msg['From'] = formataddr(('数据库备份系统', self.from_address))
+        msg['To'] = ', '.join(self.recipients)
+
+        # 添加邮件内容
+        if is_html:
+            msg.attach(MIMEText(content, 'html', 'utf-8'))
+        else:
+            msg.attach(MIMEText(content, 'plain', 'utf-8'))
+        return msg.as_string()
+
+    def deliver(self, subject, content, is_html=False):
+        """
+        发送邮件，失败时抛出异常
+
+        优先复用会话池中的会话；复用的会话已被服务器断开时，
+        换用新会话重试一次。
+
+        Args:
+            subject: 邮件主题
+            content: 邮件内容
+            is_html: 是否为HTML格式
+        """
+        message = self._build_message(subject, content, is_html)
+        server = _acquire_smtp_session(self.pool_key)
+        reused = server is not None
+        if server is None:
+            server = self._connect()
+
+        try:
+            try:
+                server.sendmail(self.from_address, self.recipients, message)
+            except (smtplib.SMTPServerDisconnected, smtplib.SMTPResponseException, ConnectionError) as e:
+                # 池中会话可能已被服务器超时关闭（断开连接或 421），重新连接后重试一次
+                stale = not isinstance(e, smtplib.SMTPResponseException) or e.smtp_code == 421
+                if not reused or not stale:
+                    raise
+                logger.info(f"[邮件] 复用的 SMTP 会话已失效，重新连接: {str(e)}")
+                _close_smtp_session(server)
+                server = None
+                server = self._connect()
+                server.sendmail(self.from_address, self.recipients, message)
+        except Exception:
+            if server is not None:
+                _close_smtp_session(server)
+            raise
+
+        _release_smtp_session(self.pool_key, server)
+
+        print(f"邮件通知已发送到 {', '.join(self.recipients)}")
+        return True
+
     def send(self, subject, content, is_html=False):
         """
         发送邮件
@@ -75,41 +309,7 @@ class EmailNotifier:
             return False
 
         try:
-            # 创建邮件消息
-            msg = MIMEMultipart('alternative')
-            msg['Subject'] = subject
-            msg['From'] = formataddr(('数据库备份系统', self.from_address))
-            msg['To'] = ', '.join(self.recipients)
-
-            # 添加邮件内容
-            if is_html:
-                msg.attach(MIMEText(content, 'html', 'utf-8'))
-            else:
-                msg.attach(MIMEText(content, 'plain', 'utf-8'))
-
-            # 连接 SMTP 服务器
-            if self.use_tls:
-                # 使用 TLS (通常是 587 端口)
-                server = smtplib.SMTP(self.smtp_server, self.smtp_port)
-                server.starttls()
-            else:
-                # 使用 SSL (通常是 465 端口) 或无加密
-                if self.smtp_port == 465:
-                    server = smtplib.SMTP_SSL(self.smtp_server, self.smtp_port)
-                else:
-                    server = smtplib.SMTP(self.smtp_server, self.smtp_port)
-
-            # 登录
-            if self.username and self.password:
-                server.login(self.username, self.password)
-
-            # 发送邮件
-            server.sendmail(self.from_address, self.recipients, msg.as_string())
-            server.quit()
-
-            print(f"邮件通知已发送到 {', '.join(self.recipients)}")
-            return True
-
+            return self.deliver(subject, content, is_html)
         except Exception as e:
             print(f"发送邮件失败: {str(e)}")
             return False
@@ -141,66 +341,100 @@ class WeChatNotifier:
         """
         获取企业微信 access_token
 
+        依次查找进程内缓存和共享缓存文件；需要刷新时先获取跨进程排他锁，
+        拿到锁后再检查一次缓存，保证同一时刻只有一个调用方请求 gettoken，
+        其余调用方等待并直接使用其结果。距离过期不足 TOKEN_REFRESH_MARGIN
+        时提前刷新。
+
         Returns:
             str: access_token
         """
-        # 检查缓存
-        if os.path.exists(TOKEN_CACHE_FILE):
+        with _token_memory_lock:
+            entry = _token_memory.get(self.config_key)
+        if _token_is_fresh(entry):
+            return entry['access_token']
+
+        entry = _read_token_cache().get(self.config_key)
+        if _token_is_fresh(entry):
+            with _token_memory_lock:
+                _token_memory[self.config_key] = entry
+            return entry['access_token']
+
+        with _TokenLock():
+            # 等待锁期间其它进程可能已经刷新过
+            tokens = _read_token_cache()
+            entry = tokens.get(self.config_key)
+            if _token_is_fresh(entry):
+                with _token_memory_lock:
+                    _token_memory[self.config_key] = entry
+                return entry['access_token']
+
             try:
-                with open(TOKEN_CACHE_FILE, 'r') as f:
-                    cache_data = json.load(f)
-                    cache_time = cache_data.get('time', 0)
-                    cache_key = cache_data.get('config_key', '')
-
-                    # 检查配置是否变化
-                    if cache_key != self.config_key:
-                        logger.info("[企业微信] 配置已变化，清除旧缓存")
-                        self._clear_token_cache()
-                    elif time.time() - cache_time < TOKEN_CACHE_DURATION:
-                        return cache_data.get('access_token', '')
-            except (json.JSONDecodeError, IOError):
-                pass
-
-        # 从 API 获取新 token
-        url = "https://qyapi.weixin.qq.com/cgi-bin/gettoken"
+                entry = self._fetch_access_token()
+            except Exception as e:
+                # 提前刷新失败时，旧 token 只要还没过期就继续使用
+                if _token_is_fresh(tokens.get(self.config_key), margin=0):
+                    logger.warning(f"[企业微信] 刷新 access_token 失败，继续使用未过期的旧 token: {str(e)}")
+                    return tokens[self.config_key]['access_token']
+                print(f"获取企业微信 access_token 失败: {str(e)}")
+                raise
+
+            # 顺便清理已过期的其它配置的 token
+            tokens = {key: value for key, value in tokens.items() if _token_is_fresh(value, margin=0)}
+            tokens[self.config_key] = entry
+            _write_token_cache(tokens)
+
+        with _token_memory_lock:
+            _token_memory[self.config_key] = entry
+        return entry['access_token']
+
+    def _fetch_access_token(self):
+        """
+        从 API 获取新 token
+
+        Returns:
+            dict: {'access_token': ..., 'expires_at': ...}
+        """
+        url = f"{WECHAT_API_BASE}/cgi-bin/gettoken"
         params = {
             'corpid': self.corp_id,
             'corpsecret': self.corp_secret
         }
 
-        try:
-            response = requests.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            data = response.json()
+        response = _import_requests().get(url, params=params, timeout=10)
+        response.raise_for_status()
+        data = response.json()
 
-            if data.get('errcode', -1) != 0:
-                raise Exception(f"获取 access_token 失败: {data.get('errmsg', '未知错误')}")
+        if data.get('errcode', -1) != 0:
+            raise Exception(f"获取 access_token 失败: {data.get('errmsg', '未知错误')}")
 
-            access_token = data.get('access_token', '')
-
-            # 缓存 token，同时保存配置 key
-            try:
-                with open(TOKEN_CACHE_FILE, 'w') as f:
-                    json.dump({
-                        'access_token': access_token,
-                        'time': time.time(),
-                        'config_key': self.config_key
-                    }, f)
-            except IOError:
-                pass  # 缓存失败不影响继续
+        expires_in = int(data.get('expires_in') or TOKEN_CACHE_DURATION)
+        logger.info(f"[企业微信] 已获取新的 access_token，有效期 {expires_in} 秒")
+        return {
+            'access_token': data.get('access_token', ''),
+            'expires_at': time.time() + expires_in
+        }
 
-            return access_token
+    def _clear_token_cache(self, access_token=None):
+        """
+        使缓存的 token 失效
 
-        except Exception as e:
-            print(f"获取企业微信 access_token 失败: {str(e)}")
-            raise
+        Args:
+            access_token: 已确认失效的 token；缓存中已是其它进程刷新后的新 token 时保留
+        """
+        with _token_memory_lock:
+            entry = _token_memory.get(self.config_key)
+            if entry and (access_token is None or entry.get('access_token') == access_token):
+                _token_memory.pop(self.config_key, None)
 
-    def _clear_token_cache(self):
-        """清除 token 缓存"""
         try:
-            if os.path.exists(TOKEN_CACHE_FILE):
-                os.remove(TOKEN_CACHE_FILE)
-                logger.info("[企业微信] 已清除 token 缓存")
+            with _TokenLock():
+                tokens = _read_token_cache()
+                entry = tokens.get(self.config_key)
+                if entry and (access_token is None or entry.get('access_token') == access_token):
+                    del tokens[self.config_key]
+                    _write_token_cache(tokens)
+                    logger.info("[企业微信] 已清除 token 缓存")
         except Exception as e:
             logger.warning(f"[企业微信] 清除缓存失败: {str(e)}")
 
@@ -223,6 +457,65 @@ class WeChatNotifier:
         text = text.replace('`', '')         # 移除行内代码
         return text
 
+    def deliver(self, title, content):
+        """
+        发送企业微信消息，失败时抛出异常
+
+        Args:
+            title: 消息标题
+            content: 消息内容
+        """
+        requests = _import_requests()
+
+        # 尝试发送，如果 token 失效则重试一次
+        for attempt in range(2):
+            logger.info("[企业微信] 开始获取 access_token...")
+            access_token = self._get_access_token()
+            logger.info(f"[企业微信] 获取到 token: {access_token[:10] if access_token else 'None'}...")
+
+            url = f"{WECHAT_API_BASE}/cgi-bin/message/send?access_token={access_token}"
+
+            # 将 markdown 格式转换为纯文本
+            title_clean = self._clean_markdown(title)
+            content_clean = self._clean_markdown(content)
+            message_content = f"{title_clean}\n\n{content_clean}"
+
+            data = {
+                "touser": self.to_users,
+                "msgtype": "text",
+                "agentid": self.agent_id,
+                "text": {
+                    "content": message_content
+                },
+                "safe": 0
+            }
+
+            logger.info(f"[企业微信] 发送消息到 {self.to_users}, agentid={self.agent_id}")
+            logger.debug(f"[企业微信] 消息内容: {message_content}")
+            response = requests.post(url, json=data, timeout=10)
+            logger.info(f"[企业微信] 响应状态码: {response.status_code}")
+            logger.info(f"[企业微信] 响应内容: {response.text}")
+
+            response.raise_for_status()
+            result = response.json()
+
+            if result.get('errcode', -1) != 0:
+                errcode = result.get('errcode')
+                errmsg = result.get('errmsg', '未知错误')
+
+                # token 相关的错误码，清除缓存并重试
+                if errcode in [40014, 42001, 42007, 42009] and attempt == 0:
+                    logger.warning(f"[企业微信] Token 失效 (errcode={errcode})，清除缓存并重试...")
+                    self._clear_token_cache(access_token)
+                    continue
+
+                raise Exception(f"消息发送失败: errcode={errcode}, errmsg={errmsg}")
+
+            logger.info(f"[企业微信] 通知已成功发送到 {self.to_users}")
+            return True
+
+        raise Exception("access_token 多次失效，消息未发送")
+
     def send(self, title, content):
         """
         发送企业微信消息
@@ -234,62 +527,13 @@ class WeChatNotifier:
         Returns:
             bool: 发送成功返回 True，否则返回 False
         """
-        # 尝试发送，如果 token 失效则重试一次
-        for attempt in range(2):
-            try:
-                logger.info("[企业微信] 开始获取 access_token...")
-                access_token = self._get_access_token()
-                logger.info(f"[企业微信] 获取到 token: {access_token[:10] if access_token else 'None'}...")
-
-                url = f"https://qyapi.weixin.qq.com/cgi-bin/message/send?access_token={access_token}"
-
-                # 将 markdown 格式转换为纯文本
-                title_clean = self._clean_markdown(title)
-                content_clean = self._clean_markdown(content)
-                message_content = f"{title_clean}\n\n{content_clean}"
-
-                data = {
-                    "touser": self.to_users,
-                    "msgtype": "text",
-                    "agentid": self.agent_id,
-                    "text": {
-                        "content": message_content
-                    },
-                    "safe": 0
-                }
-
-                logger.info(f"[企业微信] 发送消息到 {self.to_users}, agentid={self.agent_id}")
-                logger.debug(f"[企业微信] 消息内容: {message_content}")
-                response = requests.post(url, json=data, timeout=10)
-                logger.info(f"[企业微信] 响应状态码: {response.status_code}")
-                logger.info(f"[企业微信] 响应内容: {response.text}")
-
-                response.raise_for_status()
-                result = response.json()
-
-                if result.get('errcode', -1) != 0:
-                    errcode = result.get('errcode')
-                    errmsg = result.get('errmsg', '未知错误')
-
-                    # token 相关的错误码，清除缓存并重试
-                    if errcode in [40014, 42001, 42007, 42009] and attempt == 0:
-                        logger.warning(f"[企业微信] Token 失效 (errcode={errcode})，清除缓存并重试...")
-                        self._clear_token_cache()
-                        continue
-
-                    logger.error(f"[企业微信] 消息发送失败: errcode={errcode}, errmsg={errmsg}")
-                    return False
-
-                logger.info(f"[企业微信] 通知已成功发送到 {self.to_users}")
-                return True
-
-            except Exception as e:
-                logger.error(f"[企业微信] 发送通知失败: {str(e)}")
-                import traceback
-                logger.error(traceback.format_exc())
-                return False
-
-        return False
+        try:
+            return self.deliver(title, content)
+        except Exception as e:
+            logger.error(f"[企业微信] 发送通知失败: {str(e)}")
+            import traceback
+            logger.error(traceback.format_exc())
+            return False
 
 
 def format_backup_message(db_type, status, message, trigger_type="自动", backup_file=None):
@@ -333,18 +577,55 @@ def format_backup_message(db_type, status, message, trigger_type="自动", backu
     return title, content
 
 
+def format_backup_digest(items, max_items=None):
+    """
+    将多条备份结果格式化为一条汇总通知
+
+    Args:
+        items: 备份结果列表，每项包含 db_type/status/message/trigger_type/backup_file/time
+        max_items: 最多列出的条目数（企业微信消息有长度限制），失败优先列出
+
+    Returns:
+        tuple: (title, content)
+    """
+    failed = [item for item in items if item.get('status') != "成功"]
+    succeeded = [item for item in items if item.get('status') == "成功"]
+    db_types = sorted({item.get('db_type', '') for item in items if item.get('db_type')})
+    db_label = '/'.join(db_types) or '数据库'
+
+    if failed:
+        title = f"[失败] 数据库备份汇总 - {db_label}（成功 {len(succeeded)}，失败 {len(failed)}）"
+    else:
+        title = f"[成功] 数据库备份汇总 - {db_label}（共 {len(succeeded)} 项）"
+
+    lines = [
+        f"时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+        f"成功: {len(succeeded)}  失败: {len(failed)}",
+        ""
+    ]
+
+    listed = failed + succeeded
+    if max_items is not None and len(listed) > max_items:
+        hidden = len(listed) - max_items
+        listed = listed[:max_items]
+    else:
+        hidden = 0
+
+    for item in listed:
+        mark = "✔" if item.get('status') == "成功" else "✘"
+        lines.append(f"{mark} [{item.get('time', '')}] {item.get('db_type', '')} {item.get('message', '')}")
+
+    if hidden:
+        lines.append(f"... 另有 {hidden} 项未列出，请在备份历史中查看")
+
+    return title, '\n'.join(lines)
+
+
 def load_config():
-    """从数据库加载配置"""
+    """从数据库加载配置（由 config_manager 按配置代数缓存）"""
     try:
-        # 尝试多个可能的路径
-        possible_paths = ['/', '/root/db-backup-agent', '/app']
-        for path in possible_paths:
-            if os.path.exists(os.path.join(path, 'config_manager.py')):
-                sys.path.insert(0, path)
-                from config_manager import get_notification_config
-                config = get_notification_config()
-                return {'notifications': config}
-        raise Exception("找不到 config_manager.py")
+        config = config_manager.get_notification_config()
+        return {'notifications': config}
     except Exception as e:
         print(f"从数据库加载通知配置失败: {str(e)}")
         return {}
@@ -415,6 +696,91 @@ def send_backup_notification(db_type, status, message, trigger_type="自动", ba
     return success_count > 0
 
 
+# 支持的通知渠道
+NOTIFICATION_CHANNELS = ('email', 'wechat')
+
+
+def create_notifier(channel, notifications_config):
+    """
+    根据渠道创建通知器
+
+    Args:
+        channel: 通知渠道 (email/wechat)
+        notifications_config: 通知配置
+
+    Returns:
+        EmailNotifier/WeChatNotifier: 通知器；渠道未启用时返回 None
+    """
+    channel_config = notifications_config.get(channel, {})
+    if not notifications_config.get('enabled', False) or not channel_config.get('enabled', False):
+        return None
+    if channel == 'email':
+        return EmailNotifier(channel_config)
+    if channel == 'wechat':
+        return WeChatNotifier(channel_config)
+    raise ValueError(f"未知的通知渠道: {channel}")
+
+
+def enqueue_backup_notification(db_type, status, message, trigger_type="自动", backup_file=None,
+                                backup_history_id=None, batch_key=None):
+    """
+    将备份通知写入发件箱，由 notification_dispatcher 异步投递
+
+    每个已启用的渠道写入一条记录，发送和重试都不在备份进程中进行。
+    配置了汇总窗口时，同一任务（batch_key）或窗口内的结果会合并为一条通知；
+    开启“失败立即通知”时失败结果不参与汇总。
+
+    Args:
+        db_type: 数据库类型 (PostgreSQL/MySQL)
+        status: 备份状态 (成功/失败)
+        message: 备份消息
+        trigger_type: 触发类型 (自动/手动)
+        backup_file: 备份文件名（可选）
+        backup_history_id: 关联的备份记录 ID（可选）
+        batch_key: 备份任务 ID（可选），同一任务的结果合并汇总
+
+    Returns:
+        int: 写入发件箱的记录数
+    """
+    import notification_outbox
+
+    notifications_config = load_config().get('notifications', {})
+
+    if not notifications_config.get('enabled', False):
+        return 0
+    if status == "成功" and not notifications_config.get('on_success', True):
+        return 0
+    if status == "失败" and not notifications_config.get('on_failure', True):
+        return 0
+
+    title, content = format_backup_message(db_type, status, message, trigger_type, backup_file)
+    payload = {
+        'db_type': db_type,
+        'status': status,
+        'message': message,
+        'trigger_type': trigger_type,
+        'backup_file': backup_file,
+        'time': datetime.now().strftime('%H:%M:%S')
+    }
+
+    digest_window = int(notifications_config.get('digest_window', 0) or 0)
+    immediate = digest_window <= 0 or (status == "失败" and notifications_config.get('immediate_on_failure', True))
+
+    count = 0
+    for channel in NOTIFICATION_CHANNELS:
+        if not notifications_config.get(channel, {}).get('enabled', False):
+            continue
+        record_id = notification_outbox.enqueue(
+            backup_history_id, channel, title, content,
+            batch_key=None if immediate else (batch_key or notification_outbox.DEFAULT_BATCH_KEY),
+            payload=payload,
+            delay=0 if immediate else digest_window
+        )
+        if record_id:
+            count += 1
+    return count
+
+
 def main():
     """命令行入口"""
     parser = argparse.ArgumentParser(description='数据库备份通知工具')
@@ -423,9 +789,25 @@ def main():
     parser.add_argument('--message', required=True, help='备份消息')
     parser.add_argument('--trigger', default='自动', help='触发类型 (自动/手动)')
     parser.add_argument('--file', help='备份文件名（可选）')
+    parser.add_argument('--enqueue', action='store_true', help='写入发件箱，由分发器异步发送')
+    parser.add_argument('--history-id', type=int, help='关联的备份记录 ID（与 --enqueue 一起使用）')
+    parser.add_argument('--batch-key', help='备份任务 ID，同一任务的结果合并汇总（与 --enqueue 一起使用）')
 
     args = parser.parse_args()
 
+    if args.enqueue:
+        count = enqueue_backup_notification(
+            db_type=args.type,
+            status=args.status,
+            message=args.message,
+            trigger_type=args.trigger,
+            backup_file=args.file,
+            backup_history_id=args.history_id,
+            batch_key=args.batch_key
+        )
+        print(f"已写入发件箱 {count} 条通知")
+        sys.exit(0)
+
     # 发送通知
     success = send_backup_notification(
         db_type=args.type,
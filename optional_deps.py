@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+可选依赖的延迟导入
+psycopg2、pymysql、qrcode、Pillow、requests、cryptography、boto3 只在少数功能中用到
+（测试连接、绑定 OTP、发送企业微信消息、加密备份、上传 S3），
+在首次使用时才导入，每个进程只导入一次，避免 Web 应用启动和备份脚本调用的 Python 进程承担导入开销。
+
+用法:
+    psycopg2 = optional_deps.load('psycopg2')
+"""
+
+import sys
+import argparse
+import importlib
+import importlib.util
+import threading
+
+# 名称 -> (导入的模块, pip 包名)
+OPTIONAL_DEPENDENCIES = {
+    'psycopg2': ('psycopg2', 'psycopg2-binary'),
+    'pymysql': ('pymysql', 'pymysql'),
+    'qrcode': ('qrcode', 'qrcode'),
+    'PIL': ('PIL.Image', 'Pillow'),
+    'requests': ('requests', 'requests'),
+    'cryptography': ('cryptography.hazmat.primitives.ciphers.aead', 'cryptography'),
+    'boto3': ('boto3', 'boto3'),
+}
+
+# 已导入的模块
+_modules = {}
+_modules_lock = threading.Lock()
+
+
+def load(name):
+    """
+    导入可选依赖（每个进程只做一次）
+
+    Args:
+        name: OPTIONAL_DEPENDENCIES 中的名称
+
+    Returns:
+        module: 导入的模块
+
+    Raises:
+        ImportError: 依赖未安装
+    """
+    module = _modules.get(name)
+    if module is not None:
+        return module
+
+    module_name, package = OPTIONAL_DEPENDENCIES[name]
+    with _modules_lock:
+        module = _modules.get(name)
+        if module is None:
+            try:
+                module = importlib.import_module(module_name)
+            except ImportError:
+                raise ImportError(f"需要安装 {package} 库，请运行: pip3 install {package}")
+            _modules[name] = module
+    return module
+
+
+def is_available(name):
+    """检查可选依赖是否已安装（不导入）"""
+    module_name = OPTIONAL_DEPENDENCIES[name][0]
+    try:
+        return importlib.util.find_spec(module_name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='可选依赖检查工具')
+    parser.add_argument('action', choices=['check'], help='检查可选依赖是否已安装')
+
+    parser.parse_args()
+
+    missing = 0
+    for name, (module_name, package) in OPTIONAL_DEPENDENCIES.items():
+        if is_available(name):
+            print(f"{name:<10} 已安装")
+        else:
+            missing += 1
+            print(f"{name:<10} 未安装 (pip3 install {package})")
+    sys.exit(1 if missing else 0)
+
+
+if __name__ == '__main__':
+    main()
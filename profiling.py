@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+请求性能分析模块（默认关闭，设置 PROFILING_ENABLED=1 开启）
+
+开启后:
+- 请求处理中用 span() 标记的步骤和每条 SQLite 语句都会计时，
+  汇总结果通过 Server-Timing 响应头返回，并记入 /metrics 的 request_span_duration_seconds
+- 按 PROFILING_SAMPLE_RATE 抽样用 cProfile 分析整个请求，耗时超过 PROFILING_SLOW_MS 的
+  请求把分析结果保存到 PROFILING_DIR，可在 /profiling/reports 下载（与 /metrics 一样需要 METRICS_TOKEN）
+
+环境变量:
+    PROFILING_ENABLED      1 开启
+    PROFILING_SAMPLE_RATE  cProfile 抽样比例 0-1（默认 0.05）
+    PROFILING_SLOW_MS      保存报告的耗时阈值，毫秒（默认 500）
+    PROFILING_DIR          报告目录（默认 /backups/profiles）
+    PROFILING_KEEP         最多保留的报告数（默认 50）
+"""
+
+import os
+import re
+import io
+import sys
+import time
+import pstats
+import random
+import cProfile
+import argparse
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+
+import metrics
+
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '0').lower() in ('1', 'true', 'yes', 'on')
+SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0.05))
+SLOW_MS = float(os.environ.get('PROFILING_SLOW_MS', 500))
+PROFILE_DIR = os.environ.get('PROFILING_DIR', "/backups/profiles")
+PROFILE_KEEP = int(os.environ.get('PROFILING_KEEP', 50))
+
+# Server-Timing 中最多列出的 SQLite 调用函数数量
+MAX_SQL_ENTRIES = 10
+
+# 报告中 pstats 输出的行数
+REPORT_STATS_LINES = 60
+
+REPORT_NAME_PATTERN = re.compile(r'^[\w.-]+\.(txt|prof)$')
+
+SPAN_DURATION = metrics.REGISTRY.histogram(
+    'request_span_duration_seconds', '请求内各步骤耗时（秒），PROFILING_ENABLED=1 时记录', ('route', 'span'))
+
+# 当前请求的计时记录
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+
+# cProfile 同一时间只能有一个实例运行
+_profiler_lock = threading.Lock()
+
+
+class Trace:
+    """一次请求的计时记录"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+        self.queries = {}
+
+    def add_span(self, name, elapsed):
+        self.spans.append((name, elapsed))
+
+    def add_query(self, function, elapsed):
+        count, total = self.queries.get(function, (0, 0.0))
+        self.queries[function] = (count + 1, total + elapsed)
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        """生成 Server-Timing 响应头"""
+        entries = []
+        totals = {}
+        for name, elapsed in self.spans:
+            totals[name] = totals.get(name, 0.0) + elapsed
+        for name, elapsed in totals.items():
+            entries.append(f"{_token(name)};dur={elapsed * 1000:.2f}")
+
+        if self.queries:
+            count = sum(item[0] for item in self.queries.values())
+            total = sum(item[1] for item in self.queries.values())
+            entries.append(f'sql;dur={total * 1000:.2f};desc="{count} queries"')
+            slowest = sorted(self.queries.items(), key=lambda item: item[1][1], reverse=True)[:MAX_SQL_ENTRIES]
+            for function, (calls, elapsed) in slowest:
+                entries.append(f'sql.{_token(function)};dur={elapsed * 1000:.2f};desc="{calls}x"')
+
+        entries.append(f"total;dur={self.elapsed() * 1000:.2f}")
+        return ', '.join(entries)
+
+    def summary(self):
+        """文本格式的计时汇总（写入报告）"""
+        lines = [f"{name:<40} {elapsed * 1000:>10.2f} ms" for name, elapsed in self.spans]
+        for function, (calls, elapsed) in sorted(self.queries.items(), key=lambda item: item[1][1], reverse=True):
+            lines.append(f"{'sql ' + function:<40} {elapsed * 1000:>10.2f} ms  ({calls} 次)")
+        return '\n'.join(lines)
+
+
+def _token(name):
+    """Server-Timing 的指标名只能包含 token 字符"""
+    return re.sub(r'[^\w.-]', '_', name)
+
+
+def _record_query(function, elapsed):
+    """SQLite 语句耗时监听：记入当前请求"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_query(function, elapsed)
+
+
+@contextmanager
+def span(name):
+    """
+    标记请求中的一个步骤并计时，未开启或不在请求中时不做任何事
+
+    用法:
+        with span('load_config'):
+            config = load_config()
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_span(name, time.perf_counter() - started)
+
+
+# ===== 报告 =====
+
+def _report_name(route, elapsed_ms):
+    """生成报告文件名（不含扩展名）"""
+    route = re.sub(r'[^\w-]+', '_', route).strip('_') or 'root'
+    return f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{route}_{int(elapsed_ms)}ms"
+
+
+def save_report(profiler, trace, method, path, route, elapsed_ms):
+    """
+    保存慢请求的分析报告：.prof 为 pstats 原始数据，.txt 为可读摘要
+
+    Returns:
+        str: 报告名（不含扩展名），失败返回 None
+    """
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        name = _report_name(route, elapsed_ms)
+        base = os.path.join(PROFILE_DIR, name)
+        profiler.dump_stats(base + '.prof')
+
+        stream = io.StringIO()
+        stats = pstats.Stats(profiler, stream=stream)
+        stats.sort_stats('cumulative').print_stats(REPORT_STATS_LINES)
+        with open(base + '.txt', 'w', encoding='utf-8') as f:
+            f.write(f"{method} {path}  路由: {route}  耗时: {elapsed_ms:.1f} ms\n\n")
+            f.write("== 步骤耗时 ==\n")
+            f.write(trace.summary() + "\n\n")
+            f.write("== cProfile（按累计耗时排序） ==\n")
+            f.write(stream.getvalue())
+
+        prune_reports()
+        return name
+    except OSError as e:
+        print(f"保存性能分析报告失败: {str(e)}", file=sys.stderr)
+        return None
+
+
+def list_reports():
+    """
+    列出已保存的报告
+
+    Returns:
+        list: [{'name', 'created_at', 'size', 'files'}]，按时间倒序
+    """
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    reports = {}
+    for filename in os.listdir(PROFILE_DIR):
+        if not REPORT_NAME_PATTERN.match(filename):
+            continue
+        name, ext = os.path.splitext(filename)
+        path = os.path.join(PROFILE_DIR, filename)
+        report = reports.setdefault(name, {'name': name, 'files': [], 'size': 0, 'created_at': None})
+        report['files'].append(filename)
+        report['size'] += os.path.getsize(path)
+        report['created_at'] = datetime.fromtimestamp(os.path.getmtime(path)).strftime('%Y-%m-%d %H:%M:%S')
+    return sorted(reports.values(), key=lambda report: report['name'], reverse=True)
+
+
+def prune_reports(keep=None):
+    """只保留最近 keep 份报告"""
+    keep = PROFILE_KEEP if keep is None else keep
+    removed = 0
+    for report in list_reports()[keep:]:
+        for filename in report['files']:
+            try:
+                os.remove(os.path.join(PROFILE_DIR, filename))
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def report_path(filename):
+    """校验报告文件名，返回 (目录, 文件名)，非法或不存在返回 None"""
+    if not REPORT_NAME_PATTERN.match(filename or ''):
+        return None
+    if not os.path.exists(os.path.join(PROFILE_DIR, filename)):
+        return None
+    return PROFILE_DIR, filename
+
+
+# ===== Flask 集成 =====
+
+def init_app(app):
+    """为 Flask 应用注册计时和抽样分析钩子（未开启时不注册）"""
+    if not PROFILING_ENABLED:
+        return
+
+    from flask import g, request
+
+    metrics.add_query_listener(_record_query)
+
+    @app.before_request
+    def _profiling_start():
+        g._profiling_trace = Trace()
+        g._profiling_token = _current_trace.set(g._profiling_trace)
+        g._profiler = None
+        if random.random() < SAMPLE_RATE and _profiler_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                g._profiler = profiler
+            except ValueError:
+                # 其他分析工具正在运行
+                _profiler_lock.release()
+
+    @app.after_request
+    def _profiling_finish(response):
+        trace = getattr(g, '_profiling_trace', None)
+        if trace is None:
+            return response
+
+        profiler = getattr(g, '_profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            g._profiler = None
+            _profiler_lock.release()
+
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        for name, elapsed in trace.spans:
+            SPAN_DURATION.observe(elapsed, {'route': route, 'span': name})
+
+        elapsed_ms = trace.elapsed() * 1000
+        if profiler is not None and elapsed_ms >= SLOW_MS:
+            name = save_report(profiler, trace, request.method, request.path, route, elapsed_ms)
+            if name:
+                response.headers['X-Profile-Report'] = name
+
+        response.headers['Server-Timing'] = trace.server_timing()
+        return response
+
+    @app.teardown_request
+    def _profiling_teardown(exc):
+        profiler = g.pop('_profiler', None)
+        if profiler is not None:
+            # 请求异常结束，after_request 未执行
+            profiler.disable()
+            _profiler_lock.release()
+        token = g.pop('_profiling_token', None)
+        if token is not None:
+            _current_trace.reset(token)
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='性能分析报告工具')
+    subparsers = parser.add_subparsers(dest='command', help='可用命令')
+
+    subparsers.add_parser('list', help='列出已保存的报告')
+    show_parser = subparsers.add_parser('show', help='显示报告摘要')
+    show_parser.add_argument('name', help='报告名')
+    prune_parser = subparsers.add_parser('prune', help='清理旧报告')
+    prune_parser.add_argument('--keep', type=int, default=PROFILE_KEEP, help='保留的报告数')
+
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        for report in list_reports():
+            print(f"{report['created_at']}  {report['name']}  ({report['size']} 字节)")
+    elif args.command == 'show':
+        location = report_path(os.path.basename(args.name) + '.txt')
+        if not location:
+            print(f"报告不存在: {args.name}", file=sys.stderr)
+            sys.exit(1)
+        with open(os.path.join(*location), encoding='utf-8') as f:
+            print(f.read())
+    elif args.command == 'prune':
+        print(f"已删除 {prune_reports(args.keep)} 个文件")
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
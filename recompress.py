@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+备份文件后台重新压缩模块
+备份窗口内用 gzip 快速压缩，备份在保留期内大部分时间只是占用空间。超过 BACKUP_RECOMPRESS_AFTER_DAYS 天的
+gzip 备份（plain 格式，.sql.gz / .sql.gz.enc）由后台任务流式重新压缩为高级别 zstd（--long 长距离匹配），
+文件名改为 .sql.zst / .sql.zst.enc:
+
+    - 有分段索引的"所有数据库"备份逐个成员转换，每个 gzip 成员对应一个独立的 zstd 帧，
+      索引中的偏移量随之重写，提取和恢复单个数据库的方式不变（见 artifact_index.py）
+    - 加密备份解密后重新压缩，再用原来的数据密钥加密，磁盘上不出现明文（见 artifact_crypto.py）
+    - 转换时计算解压后数据的 SHA-256，新文件写完并同步到磁盘后完整解压一遍核对，
+      一致后在同一个事务中更新 backup_artifacts 和 backup_history 的文件名、大小，再删除原文件
+      （热层、冷层和远程存储中的旧副本都删除，新文件重新上传，见 storage.py）
+    - 新文件保留原文件的修改时间，保留策略和移到冷层的时间仍从备份完成时算起
+
+CPU 预算：zstd 使用 BACKUP_RECOMPRESS_THREADS 个线程（不超过容器实际可用的 CPU 数），
+backup.sh 以转储相同的 nice / ionice 优先级启动。任务只在备份窗口之外运行：开始前等待正在运行的备份结束，
+每个文件开始前检查，有备份开始或离开 BACKUP_RECOMPRESS_WINDOW 时停止，剩余文件下次处理。
+与移到冷层的任务共用一把锁（见 backup_artifacts.py），同一时间只有一个任务移动或替换备份文件。
+
+用法（backup.sh 清理旧备份后在后台执行）:
+    python3 recompress.py run
+    python3 recompress.py convert /backups/user_2/pg_all_20240101_020000.sql.gz
+
+环境变量:
+    BACKUP_RECOMPRESS_AFTER_DAYS  超过这么多天的备份重新压缩，为空表示 backup.sh 不启动该任务（默认）
+    BACKUP_RECOMPRESS_LEVEL       zstd 压缩级别（默认 19，20 以上自动加 --ultra）
+    BACKUP_RECOMPRESS_THREADS     zstd 线程数（默认 1）
+    BACKUP_RECOMPRESS_WINDOW      允许运行的时间段 HH:MM-HH:MM（开始晚于结束表示跨午夜），为空表示不限
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import shutil
+import sqlite3
+import hashlib
+import argparse
+from datetime import datetime
+
+import artifact_index
+import artifact_crypto
+import backup_artifacts
+import storage
+
+# 未指定天数时重新压缩超过这么多天的备份
+RECOMPRESS_AFTER_DAYS = os.environ.get('BACKUP_RECOMPRESS_AFTER_DAYS', '')
+DEFAULT_AFTER_DAYS = 1
+
+ZSTD_LEVEL = int(os.environ.get('BACKUP_RECOMPRESS_LEVEL', '19'))
+RECOMPRESS_THREADS = int(os.environ.get('BACKUP_RECOMPRESS_THREADS', '1'))
+RECOMPRESS_WINDOW = os.environ.get('BACKUP_RECOMPRESS_WINDOW', '').strip()
+
+# 长距离匹配的窗口（2^27 = 128 MiB）；不超过 zstd 解压的默认内存上限，恢复时不需要额外参数
+WINDOW_LOG = 27
+
+# 原后缀 -> 重新压缩后的后缀
+SUFFIXES = (
+    ('.sql.gz.enc', '.sql.zst.enc'),
+    ('.sql.gz', '.sql.zst'),
+)
+
+# 读取原文件的块大小
+CHUNK_SIZE = 1024 * 1024
+
+# 开始前等待正在运行的备份结束的最长时间（秒），与备份锁的过期时间相同
+IDLE_WAIT = 2 * 3600
+IDLE_POLL_INTERVAL = 30
+
+
+def _log(message):
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message}", file=sys.stderr, flush=True)
+
+
+def _format_size(size):
+    return f"{size / 1048576:.1f} MiB"
+
+
+def target_path(path):
+    """
+    重新压缩后的文件路径
+
+    Raises:
+        ValueError: 不是 gzip 压缩的 SQL 备份
+    """
+    for old, new in SUFFIXES:
+        if path.endswith(old):
+            return path[:-len(old)] + new
+    raise ValueError(f"不是 gzip 压缩的 SQL 备份: {os.path.basename(path)}")
+
+
+def zstd_command(level=None, threads=None):
+    """压缩命令：线程数不超过当前进程实际可用的 CPU 数"""
+    from throttle import effective_cpus
+    level = ZSTD_LEVEL if level is None else level
+    threads = max(1, min(threads or RECOMPRESS_THREADS, effective_cpus()))
+    command = ['zstd', f'-{level}', f'--long={WINDOW_LOG}', f'-T{threads}', '-cq']
+    if level > 19:
+        command.insert(1, '--ultra')
+    return command
+
+
+# ===== 运行时机 =====
+
+def parse_window(value):
+    """
+    解析 HH:MM-HH:MM
+
+    Returns:
+        tuple: (开始, 结束)
+
+    Raises:
+        ValueError: 格式错误
+    """
+    from throttle import window_active
+    parts = value.split('-')
+    if len(parts) != 2:
+        raise ValueError(f"时间段格式应为 HH:MM-HH:MM: {value}")
+    start, end = (part.strip() for part in parts)
+    window_active(start, end)
+    return start, end
+
+
+def backup_running():
+    """是否有备份任务持有备份锁（过期的锁不算）"""
+    import backup_lock
+    return any(info['is_locked'] for info in backup_lock.get_all_backup_locks().values())
+
+
+def blocked_reason(window=None):
+    """
+    当前不能开始转换下一个文件的原因
+
+    Returns:
+        str: 原因，可以继续返回 None
+    """
+    from throttle import window_active
+    if window and not window_active(*window):
+        return f"不在允许运行的时间段 {window[0]}-{window[1]} 内"
+    if backup_running():
+        return "有备份任务正在运行"
+    return None
+
+
+def wait_for_backups(timeout=IDLE_WAIT):
+    """等待正在运行的备份结束（backup.sh 在释放备份锁之前启动本任务），超时返回 False"""
+    deadline = time.monotonic() + timeout
+    while backup_running():
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(IDLE_POLL_INTERVAL)
+    return True
+
+
+# ===== 转换 =====
+
+def _read_range(reader, offset=0, length=None):
+    """从 offset 开始读取 length 字节（None 表示读到结尾）"""
+    reader.seek(offset)
+    while length is None or length > 0:
+        chunk = reader.read(CHUNK_SIZE if length is None else min(CHUNK_SIZE, length))
+        if not chunk:
+            if length is not None:
+                raise ValueError(f"备份文件在偏移 {offset} 处被截断")
+            return
+        if length is not None:
+            length -= len(chunk)
+        yield chunk
+
+
+def _gunzip(chunks):
+    """解压 gzip 数据，支持多个成员依次拼接（gzip 命令追加写入的文件）"""
+    decompressor = zlib.decompressobj(artifact_index.GZIP_WBITS)
+    pending = False
+    for chunk in chunks:
+        while chunk:
+            try:
+                data = decompressor.decompress(chunk)
+            except zlib.error as e:
+                raise ValueError(f"gzip 数据损坏: {str(e)}")
+            pending = True
+            if data:
+                yield data
+            if not decompressor.eof:
+                break
+            chunk = decompressor.unused_data
+            decompressor = zlib.decompressobj(artifact_index.GZIP_WBITS)
+            pending = False
+    if pending:
+        raise ValueError("gzip 数据不完整")
+
+
+def _segments(path, size):
+    """
+    需要逐个转换的成员：有索引时为索引条目，否则整个文件为一段
+
+    Raises:
+        ValueError: 索引中的成员没有连续覆盖整个文件
+    """
+    if not artifact_index.has_index(path):
+        return [{'offset': 0, 'length': size}], False
+    entries = sorted(artifact_index.read_index(path), key=lambda entry: entry['offset'])
+    position = 0
+    for entry in entries:
+        if entry['offset'] != position:
+            raise ValueError(f"分段索引在偏移 {position} 处不连续")
+        position += entry['length']
+    if not entries or position != size:
+        raise ValueError("分段索引与备份文件大小不一致")
+    return entries, True
+
+
+def decompressed_digest(path):
+    """
+    完整解压 zstd 备份，返回解压后数据的 SHA-256 和字节数
+
+    Raises:
+        OSError: zstd 解压失败
+    """
+    digest = hashlib.sha256()
+    total = 0
+    with artifact_crypto.open_artifact(path) as reader:
+        for data in artifact_index.pipe_through(artifact_index.ZSTD_DECOMPRESS, _read_range(reader)):
+            digest.update(data)
+            total += len(data)
+    return digest.hexdigest(), total
+
+
+def _remove(*paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def convert(src, dst, level=None, threads=None):
+    """
+    把 gzip 备份 src 流式转换为 zstd 备份 dst（含分段索引），写完后完整解压核对
+
+    Returns:
+        dict: {'raw_size', 'raw_sha256'}
+
+    Raises:
+        ValueError: 原文件损坏或核对不一致
+        OSError: 读写失败或 zstd 执行失败
+    """
+    command = zstd_command(level, threads)
+    data_key = None
+    if artifact_crypto.is_encrypted(src):
+        data_key = artifact_crypto.get_key(artifact_crypto.read_key_id(src))
+    segments, indexed = _segments(src, artifact_crypto.artifact_size(src))
+    outputs = [dst] + ([artifact_index.index_path(dst)] if indexed else [])
+    digest = hashlib.sha256()
+    raw_total = 0
+
+    def tap(chunks):
+        nonlocal raw_total
+        for data in chunks:
+            digest.update(data)
+            raw_total += len(data)
+            yield data
+
+    try:
+        entries = []
+        with artifact_crypto.open_artifact(src) as reader, storage.LocalWriter(dst) as out_file:
+            out = out_file
+            if data_key is not None:
+                out = artifact_crypto.EncryptingWriter(out_file, data_key)
+            position = 0
+            for segment in segments:
+                raw_before = raw_total
+                length = 0
+                chunks = tap(_gunzip(_read_range(reader, segment['offset'], segment['length'])))
+                for data in artifact_index.pipe_through(command, chunks):
+                    out.write(data)
+                    length += len(data)
+                entries.append(dict(segment, offset=position, length=length, raw=raw_total - raw_before))
+                position += length
+            if data_key is not None:
+                out.finish()
+        if indexed:
+            with storage.LocalWriter(artifact_index.index_path(dst)) as f:
+                for entry in entries:
+                    f.write((json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8'))
+            shutil.copystat(artifact_index.index_path(src), artifact_index.index_path(dst))
+        shutil.copystat(src, dst)
+
+        expected = digest.hexdigest()
+        if decompressed_digest(dst) != (expected, raw_total):
+            raise ValueError("重新压缩后的文件解压结果与原文件不一致")
+    except BaseException:
+        _remove(*outputs)
+        raise
+    return {'raw_size': raw_total, 'raw_sha256': expected}
+
+
+def recompress_artifact(artifact, level=None, threads=None):
+    """
+    重新压缩一个备份文件并替换原文件，更新备份文件记录和备份历史
+
+    Returns:
+        dict: {'path', 'size', 'original_size'}
+    """
+    src = artifact['path']
+    dst = target_path(src)
+    if os.path.exists(dst):
+        raise ValueError(f"目标文件已存在: {os.path.basename(dst)}")
+    original_size = os.path.getsize(src)
+    result = convert(src, dst, level, threads)
+    size = os.path.getsize(dst)
+
+    try:
+        conn = backup_artifacts.get_db_connection()
+        try:
+            with conn:
+                conn.execute('''
+                    UPDATE backup_artifacts
+                    SET path = ?, compression = 'zstd', size = ?, raw_size = ?, original_size = ?, raw_sha256 = ?,
+                        recompressed_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                ''', (os.path.abspath(dst), size, result['raw_size'], original_size, result['raw_sha256'],
+                      artifact['id']))
+                if artifact.get('backup_history_id'):
+                    conn.execute('UPDATE backup_history SET backup_file = ?, file_size = ? WHERE id = ?',
+                                 (os.path.basename(dst), size, artifact['backup_history_id']))
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        _remove(dst, artifact_index.index_path(dst))
+        raise
+
+    # 记录已指向新文件，此后再删除原文件（正在读取的恢复任务持有打开的文件，不受影响）
+    _remove(src, artifact_index.index_path(src))
+    try:
+        if storage.upload_artifact(dst):
+            storage.delete_artifact(src)
+    except (OSError, ValueError, ImportError) as e:
+        print(f"更新远程副本失败 {os.path.basename(dst)}: {str(e)}", file=sys.stderr)
+    return {'path': dst, 'size': size, 'original_size': original_size}
+
+
+def recompress_aged(days=None, limit=None, level=None, threads=None, wait=True):
+    """
+    重新压缩超过 days 天的 gzip 备份，只在没有备份运行、且处于允许的时间段内时进行
+
+    Args:
+        days: 默认 BACKUP_RECOMPRESS_AFTER_DAYS（未设置时 1 天）
+        limit: 本次最多处理的文件数
+        wait: 开始前等待正在运行的备份结束
+
+    Returns:
+        int: 重新压缩的文件数
+    """
+    if shutil.which('zstd') is None:
+        print("未安装 zstd，跳过重新压缩", file=sys.stderr)
+        return 0
+    if days is None:
+        days = int(RECOMPRESS_AFTER_DAYS or DEFAULT_AFTER_DAYS)
+    window = parse_window(RECOMPRESS_WINDOW) if RECOMPRESS_WINDOW else None
+    cutoff = time.time() - days * 86400
+
+    if wait and not wait_for_backups():
+        print("备份任务长时间未结束，跳过重新压缩", file=sys.stderr)
+        return 0
+
+    with backup_artifacts.maintenance_lock() as locked:
+        if not locked:
+            print("已有整理任务在运行", file=sys.stderr)
+            return 0
+        rows = backup_artifacts.query_artifacts('''
+            SELECT * FROM backup_artifacts WHERE format = 'plain' AND compression = 'gzip' ORDER BY created_at, id
+        ''')
+
+        done = 0
+        for row in rows:
+            if limit is not None and done >= limit:
+                break
+            path = row['path']
+            try:
+                if not os.path.exists(path) or os.path.getmtime(path) >= cutoff:
+                    continue
+            except OSError:
+                continue
+            reason = blocked_reason(window)
+            if reason:
+                _log(f"{reason}，停止重新压缩（剩余的文件下次处理）")
+                break
+            started = time.monotonic()
+            try:
+                result = recompress_artifact(dict(row), level, threads)
+            except (OSError, ValueError, sqlite3.Error) as e:
+                print(f"重新压缩失败 {os.path.basename(path)}: {str(e)}", file=sys.stderr)
+                continue
+            done += 1
+            _log(f"{os.path.basename(path)} -> {os.path.basename(result['path'])}: "
+                 f"{_format_size(result['original_size'])} -> {_format_size(result['size'])}，"
+                 f"耗时 {time.monotonic() - started:.1f} 秒")
+        return done
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='备份文件重新压缩工具')
+    subparsers = parser.add_subparsers(dest='command', help='可用命令')
+
+    run_parser = subparsers.add_parser('run', help='重新压缩较旧的 gzip 备份')
+    run_parser.add_argument('--days', type=int, help='超过这么多天的备份（默认 BACKUP_RECOMPRESS_AFTER_DAYS）')
+    run_parser.add_argument('--limit', type=int, help='本次最多处理的文件数')
+    run_parser.add_argument('--level', type=int, help='zstd 压缩级别（默认 BACKUP_RECOMPRESS_LEVEL）')
+    run_parser.add_argument('--threads', type=int, help='zstd 线程数（默认 BACKUP_RECOMPRESS_THREADS）')
+    run_parser.add_argument('--no-wait', action='store_true', help='有备份正在运行时直接退出，不等待')
+
+    convert_parser = subparsers.add_parser('convert', help='立即重新压缩一个备份文件（需要已有备份文件记录）')
+    convert_parser.add_argument('path', help='备份文件路径')
+    convert_parser.add_argument('--level', type=int, help='zstd 压缩级别')
+    convert_parser.add_argument('--threads', type=int, help='zstd 线程数')
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        try:
+            done = recompress_aged(args.days, args.limit, args.level, args.threads, wait=not args.no_wait)
+        except ValueError as e:
+            print(f"错误: {str(e)}", file=sys.stderr)
+            sys.exit(1)
+        print(f"已重新压缩 {done} 个文件")
+    elif args.command == 'convert':
+        rows = backup_artifacts.query_artifacts('SELECT * FROM backup_artifacts WHERE path = ?',
+                                                (os.path.abspath(args.path),))
+        if not rows:
+            print(f"没有该备份文件的记录: {args.path}", file=sys.stderr)
+            sys.exit(1)
+        with backup_artifacts.maintenance_lock() as locked:
+            if not locked:
+                print("已有整理任务在运行", file=sys.stderr)
+                sys.exit(1)
+            try:
+                result = recompress_artifact(dict(rows[0]), args.level, args.threads)
+            except (OSError, ValueError, sqlite3.Error) as e:
+                print(f"错误: {str(e)}", file=sys.stderr)
+                sys.exit(1)
+        print(f"{result['path']}: {_format_size(result['original_size'])} -> {_format_size(result['size'])}")
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,885 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+备份恢复模块
+将 backup_artifacts 中记录的备份文件流式恢复到指定的数据库:
+
+- gzip 压缩的 SQL: 由 gzip -dc 解压后直接送入 psql / mysql，解压与导入在不同进程中同时进行。
+  后台重新压缩为 zstd 的备份（见 recompress.py）由 zstd -dc 解压，其余流程相同。
+  jobs > 1 且备份只包含一个数据库时按表拆分：建表等前置语句先执行，各表数据分段写入临时文件后
+  由多个连接并行导入，索引、约束等后置语句最后执行
+- PostgreSQL custom 格式（.dump）: pg_restore -j N 并行恢复
+- "所有数据库"备份可以只恢复其中一个数据库（source_db）：按 artifact_index 的分段索引
+  只读取该数据库的 gzip 成员（或 zstd 帧）
+
+恢复进度（已读取的字节数、已完成的表数）写入 restores 表，可通过 /api/restores 或 status 命令查看。
+max_rate 限制读取备份文件的速率（字节/秒），避免恢复占满磁盘带宽影响线上业务。
+
+环境变量:
+    RESTORE_SPOOL_DIR  并行恢复时表数据分段的临时目录（默认 /backups/.restore_spool）
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from metrics import TimedConnection
+import artifact_index
+import artifact_crypto
+import backup_artifacts
+import config_manager
+from throttle import parse_rate
+
+# 数据库文件路径
+DB_FILE = os.environ.get('BACKUP_DB_FILE', "/backups/users.db")
+
+# 并行恢复的临时目录，需要能容纳若干个表的未压缩数据
+SPOOL_DIR = os.environ.get('RESTORE_SPOOL_DIR', "/backups/.restore_spool")
+
+# 读取备份文件的块大小
+CHUNK_SIZE = 256 * 1024
+
+# 进度写入数据库的最短间隔（秒）
+PROGRESS_INTERVAL = 1.0
+
+# 并行连接数上限
+MAX_JOBS = 16
+
+# 并行恢复时每个连接最多积压的待导入分段数，限制临时文件占用的磁盘空间
+SPOOL_BACKLOG = 2
+
+# 失败时保留在 message 中的错误输出行数
+ERROR_LINES = 5
+
+# 解压命令，未压缩的文件用 cat 读取，流程与压缩文件相同
+DECOMPRESSORS = {
+    'gzip': ['gzip', '-dc'],
+    'zstd': ['zstd', '-dcq', '--long=27'],
+    None: ['cat'],
+}
+
+# 恢复任务状态
+STATUS_PENDING = 'pending'
+STATUS_RUNNING = 'running'
+STATUS_SUCCESS = 'success'
+STATUS_FAILED = 'failed'
+
+# update_restore 允许更新的列
+RESTORE_FIELDS = ('status', 'bytes_total', 'bytes_done', 'tables_total', 'tables_done', 'message', 'pid',
+                  'started_at', 'finished_at')
+
+# mysqldump --databases 输出中指定数据库的语句，恢复到其他数据库时去掉
+MYSQL_DATABASE_STATEMENT = re.compile(rb'^(CREATE DATABASE|USE) ')
+
+# mysqldump 中每个表（或视图占位表）的开始，以及依赖所有表的视图、存储过程部分的开始
+MYSQL_SECTION_MARKERS = (b'-- Table structure for table ', b'-- Temporary view structure for view ')
+MYSQL_POST_MARKERS = (b'-- Final view structure for view ', b'-- Dumping routines', b'-- Dumping events')
+
+# pg_dump 输出中的属主和权限语句（均为单行）
+POSTGRESQL_OWNERSHIP_STATEMENT = re.compile(
+    rb'^(ALTER .+ OWNER TO |ALTER DEFAULT PRIVILEGES |GRANT |REVOKE |SET SESSION AUTHORIZATION )')
+
+
+class RestoreFailed(Exception):
+    """恢复过程中客户端程序执行失败"""
+
+
+def get_db_connection():
+    """获取数据库连接"""
+    conn = sqlite3.connect(DB_FILE, factory=TimedConnection)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+# ===== 恢复任务记录 =====
+
+def create_restore(artifact_id, connection_id, target_db=None, user_id=None, jobs=1, max_rate=0, create_db=False,
+                   source_db=None):
+    """
+    创建恢复任务
+
+    Args:
+        artifact_id: 备份文件记录 ID
+        connection_id: 目标数据库连接 ID（类型需与备份一致）
+        target_db: 恢复到的数据库名；恢复整个"所有 MySQL 数据库"备份时忽略
+        user_id: 发起恢复的用户 ID，指定时只能恢复属于该用户的备份到该用户的连接
+                 （未指定用户的定时任务生成的备份不属于任何用户，只能在命令行中恢复）
+        jobs: 并行连接数
+        max_rate: 读取备份文件的速率上限（字节/秒），0 表示不限速
+        create_db: 目标数据库不存在时创建
+        source_db: 只恢复"所有数据库"备份中的这个数据库（需要分段索引），target_db 默认与其同名；
+                   PostgreSQL 所有数据库备份必须指定
+
+    Returns:
+        int: 恢复任务 ID
+
+    Raises:
+        ValueError: 备份文件、连接或目标数据库无效
+    """
+    artifact = backup_artifacts.get_artifact(artifact_id)
+    if not artifact or (user_id is not None and artifact['user_id'] != user_id):
+        raise ValueError(f"备份文件不存在: {artifact_id}")
+    if not artifact['exists']:
+        raise ValueError(f"备份文件已被删除: {artifact['filename']}")
+
+    connection = config_manager.get_database_connection(connection_id)
+    if not connection or (user_id is not None and connection.get('user_id') != user_id):
+        raise ValueError(f"数据库连接不存在: {connection_id}")
+    if connection['db_type'] != artifact['db_type']:
+        raise ValueError(f"连接类型 {connection['db_type']} 与备份类型 {artifact['db_type']} 不一致")
+
+    bytes_total = artifact_crypto.artifact_size(artifact['path'])
+    if source_db:
+        if artifact['db_name']:
+            raise ValueError("只能从备份了所有数据库的文件中选择单个数据库")
+        ranges = artifact_index.database_ranges(artifact['path'], source_db)
+        bytes_total = sum(length for offset, length in ranges)
+        target_db = target_db or source_db
+
+    if artifact['db_type'] == 'postgresql' and not artifact['db_name'] and not source_db:
+        # pg_dump -d 逐库转储后拼接，文件中没有 \connect，整体恢复会把所有数据库写进同一个目标库
+        raise ValueError("PostgreSQL 所有数据库备份只能逐个数据库恢复，请指定要恢复的数据库")
+
+    all_databases = artifact['db_type'] == 'mysql' and not artifact['db_name'] and not source_db
+    if all_databases:
+        target_db = None
+    elif not target_db:
+        raise ValueError("必须指定目标数据库")
+
+    jobs = max(1, min(int(jobs or 1), MAX_JOBS))
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO restores
+            (artifact_id, user_id, connection_id, source_db, target_db, jobs, max_rate, create_db, status, bytes_total)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (artifact_id, user_id, connection_id, source_db or None, target_db, jobs, int(max_rate or 0),
+              bool(create_db), STATUS_PENDING, bytes_total))
+        conn.commit()
+        return cursor.lastrowid
+    finally:
+        conn.close()
+
+
+def get_restore(restore_id):
+    """获取恢复任务，附带备份文件名和进度百分比"""
+    try:
+        conn = get_db_connection()
+        try:
+            row = conn.execute('''
+                SELECT r.*, a.path AS artifact_path, a.format AS artifact_format, a.db_type AS db_type
+                FROM restores r LEFT JOIN backup_artifacts a ON a.id = r.artifact_id
+                WHERE r.id = ?
+            ''', (restore_id,)).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"获取恢复任务失败: {str(e)}", file=sys.stderr)
+        return None
+    return _restore_dict(row) if row else None
+
+
+def list_restores(user_id=None, limit=20):
+    """列出恢复任务，按时间倒序"""
+    query = '''
+        SELECT r.*, a.path AS artifact_path, a.format AS artifact_format, a.db_type AS db_type
+        FROM restores r LEFT JOIN backup_artifacts a ON a.id = r.artifact_id
+    '''
+    params = []
+    if user_id is not None:
+        query += ' WHERE r.user_id = ?'
+        params.append(user_id)
+    query += ' ORDER BY r.id DESC LIMIT ?'
+    params.append(limit)
+    try:
+        conn = get_db_connection()
+        try:
+            rows = conn.execute(query, params).fetchall()
+        finally:
+            conn.close()
+        return [_restore_dict(row) for row in rows]
+    except sqlite3.Error as e:
+        print(f"获取恢复任务列表失败: {str(e)}", file=sys.stderr)
+        return []
+
+
+def _restore_dict(row):
+    restore = dict(row)
+    path = restore.pop('artifact_path', None)
+    restore['artifact_file'] = os.path.basename(path) if path else None
+    total = restore.get('bytes_total') or 0
+    restore['percent'] = round(min(restore.get('bytes_done') or 0, total) * 100.0 / total, 1) if total else None
+    return restore
+
+
+def update_restore(restore_id, **fields):
+    """更新恢复任务的状态和进度"""
+    fields = {key: value for key, value in fields.items() if key in RESTORE_FIELDS}
+    if not fields:
+        return
+    try:
+        conn = get_db_connection()
+        try:
+            assignments = ', '.join(f"{key} = ?" for key in fields)
+            conn.execute(f'UPDATE restores SET {assignments} WHERE id = ?', list(fields.values()) + [restore_id])
+            conn.commit()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"更新恢复任务失败: {str(e)}", file=sys.stderr)
+
+
+class RestoreProgress:
+    """汇总各线程的进度，按 PROGRESS_INTERVAL 写入 restores 表"""
+
+    def __init__(self, restore_id, bytes_total, echo=False):
+        self.restore_id = restore_id
+        self.bytes_total = bytes_total
+        self.bytes_done = 0
+        self.tables_done = 0
+        self.tables_total = None
+        self.echo = echo
+        self._lock = threading.Lock()
+        self._saved_at = 0.0
+
+    def add_bytes(self, count):
+        with self._lock:
+            self.bytes_done += count
+        self.maybe_save()
+
+    def table_done(self):
+        with self._lock:
+            self.tables_done += 1
+        self.maybe_save()
+
+    def set_tables_total(self, total):
+        self.tables_total = total
+        self.save()
+
+    def maybe_save(self):
+        if time.monotonic() - self._saved_at >= PROGRESS_INTERVAL:
+            self.save()
+
+    def save(self):
+        with self._lock:
+            self._saved_at = time.monotonic()
+            fields = {'bytes_done': self.bytes_done, 'tables_done': self.tables_done}
+            if self.tables_total is not None:
+                fields['tables_total'] = self.tables_total
+        if self.restore_id:
+            update_restore(self.restore_id, **fields)
+        if self.echo:
+            percent = fields['bytes_done'] * 100.0 / self.bytes_total if self.bytes_total else 0
+            tables = f"{fields['tables_done']}/{self.tables_total}" if self.tables_total else fields['tables_done']
+            print(f"\r已读取 {fields['bytes_done'] / 1048576:.1f} MiB ({percent:.1f}%)  已完成表: {tables}",
+                  end='', file=sys.stderr, flush=True)
+
+
+# ===== 数据库客户端 =====
+
+class RestoreClient:
+    """目标数据库的命令行客户端（psql / mysql / pg_restore）"""
+
+    def __init__(self, connection, database):
+        self.db_type = connection['db_type']
+        self.host = connection['host']
+        self.port = str(connection['port'])
+        self.user = connection['user']
+        self.database = database
+        self.env = dict(os.environ)
+        if self.db_type == 'postgresql':
+            self.env['PGPASSWORD'] = connection['password']
+        else:
+            # 通过环境变量传递密码，不出现在进程参数中
+            self.env['MYSQL_PWD'] = connection['password']
+
+    def command(self, database=None):
+        """执行 SQL 的客户端命令，出错时立即停止"""
+        database = database or self.database
+        if self.db_type == 'postgresql':
+            return ['psql', '-h', self.host, '-p', self.port, '-U', self.user, '-d', database or 'postgres',
+                    '-X', '-q', '-v', 'ON_ERROR_STOP=1']
+        command = ['mysql', '-h', self.host, '-P', self.port, '-u', self.user]
+        if database:
+            command.append(database)
+        return command
+
+    def popen(self, stdin):
+        """启动客户端从 stdin 读取 SQL"""
+        return subprocess.Popen(self.command(), stdin=stdin, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE, env=self.env)
+
+    def run_file(self, path):
+        """
+        执行一个 SQL 文件
+
+        Returns:
+            tuple: (退出码, 标准错误)
+        """
+        with open(path, 'rb') as f:
+            result = subprocess.run(self.command(), stdin=f, stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.PIPE, env=self.env)
+        return result.returncode, result.stderr.decode('utf-8', 'replace')
+
+    def query(self, sql, database=None):
+        """
+        执行查询并返回结果行（每行为字符串元组）
+
+        Raises:
+            RestoreFailed: 查询失败
+        """
+        if self.db_type == 'postgresql':
+            command = self.command(database) + ['-A', '-t', '-F', '\t', '-c', sql]
+        else:
+            command = self.command(database) + ['-N', '-B', '-e', sql]
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=self.env)
+        if result.returncode != 0:
+            raise RestoreFailed(result.stderr.decode('utf-8', 'replace').strip() or f"查询失败，退出码 {result.returncode}")
+        lines = result.stdout.decode('utf-8', 'replace').splitlines()
+        return [tuple(line.split('\t')) for line in lines if line]
+
+    def create_database(self):
+        """目标数据库不存在时创建"""
+        if self.db_type == 'postgresql':
+            sql = ("SELECT format('CREATE DATABASE %I', :'target') "
+                   "WHERE NOT EXISTS (SELECT 1 FROM pg_database WHERE datname = :'target') \\gexec\n")
+            command = self.command('postgres') + ['-v', f'target={self.database}']
+        else:
+            sql = f"CREATE DATABASE IF NOT EXISTS `{self.database.replace('`', '``')}`;\n"
+            command = ['mysql', '-h', self.host, '-P', self.port, '-u', self.user]
+        result = subprocess.run(command, input=sql.encode(), stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE, env=self.env)
+        if result.returncode != 0:
+            raise RestoreFailed(f"创建数据库失败: {result.stderr.decode('utf-8', 'replace').strip()}")
+
+
+def _collect_stderr(stream, lines):
+    """后台读取子进程的标准错误，保留最后若干行"""
+    for line in stream:
+        text = line.decode('utf-8', 'replace').rstrip()
+        if text:
+            lines.append(text)
+    stream.close()
+
+
+def _error_summary(lines):
+    return '\n'.join(list(lines)[-ERROR_LINES:])
+
+
+# ===== 读取备份文件 =====
+
+def _read_chunks(path):
+    with artifact_crypto.open_artifact(path) as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+def feed_file(path, out, progress, max_rate=0, ranges=None):
+    """
+    按块把备份文件写入 out（解压进程的标准输入），统计进度并按 max_rate 限速
+
+    指定 ranges（[(偏移, 长度)]，来自 artifact_index）时只读取这些 gzip 成员。
+    下游进程提前退出时停止写入，由调用方根据下游的退出码判断结果
+    """
+    started = time.monotonic()
+    total = 0
+    chunks = artifact_index.iter_compressed(path, ranges, CHUNK_SIZE) if ranges else _read_chunks(path)
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+            total += len(chunk)
+            progress.add_bytes(len(chunk))
+            if max_rate > 0:
+                ahead = total / max_rate - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+    except (BrokenPipeError, ValueError):
+        pass
+    finally:
+        try:
+            out.close()
+        except BrokenPipeError:
+            pass
+
+
+class DecompressedStream:
+    """后台线程读取备份文件送入解压进程，调用方从 stdout 读取解压后的 SQL"""
+
+    def __init__(self, artifact, progress, max_rate=0, ranges=None):
+        self.process = subprocess.Popen(DECOMPRESSORS[artifact['compression']],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.stdout = self.process.stdout
+        self.feeder = threading.Thread(target=feed_file, daemon=True,
+                                       args=(artifact['path'], self.process.stdin, progress, max_rate, ranges))
+        self.feeder.start()
+
+    def close(self):
+        """关闭读取端并等待解压进程退出，返回是否正常结束"""
+        if self.stdout and not self.stdout.closed:
+            self.stdout.close()
+        self.feeder.join()
+        return self.process.wait() == 0
+
+
+# ===== 恢复方式 =====
+
+def strip_mysql_database(lines):
+    """去掉 mysqldump --databases 输出中的 CREATE DATABASE / USE 语句，使数据恢复到客户端指定的数据库"""
+    for line in lines:
+        if not MYSQL_DATABASE_STATEMENT.match(line):
+            yield line
+
+
+def strip_postgresql_ownership(lines):
+    """
+    去掉 pg_dump 输出中的属主和权限语句（与 pg_restore --no-owner --no-privileges 相同），
+    恢复到没有源库角色的实例时使用；COPY 数据块中的内容原样保留
+    """
+    in_copy = False
+    for line in lines:
+        if in_copy:
+            if line == b'\\.\n':
+                in_copy = False
+        elif line.startswith(b'COPY ') and line.rstrip().endswith(b'FROM stdin;'):
+            in_copy = True
+        elif POSTGRESQL_OWNERSHIP_STATEMENT.match(line):
+            continue
+        yield line
+
+
+def restore_stream(client, artifact, progress, max_rate=0, filters=(), ranges=None):
+    """
+    顺序恢复 SQL 文本：解压进程的输出直接作为客户端的标准输入
+
+    指定 filters（逐行处理 SQL 的生成器函数）时由本进程转发 SQL
+    """
+    stream = DecompressedStream(artifact, progress, max_rate, ranges)
+    errors = deque(maxlen=50)
+
+    if filters:
+        process = client.popen(subprocess.PIPE)
+    else:
+        process = client.popen(stream.stdout)
+        # 解压输出已交给客户端进程，本进程不再持有
+        stream.stdout.close()
+
+    collector = threading.Thread(target=_collect_stderr, args=(process.stderr, errors), daemon=True)
+    collector.start()
+
+    if filters:
+        lines = stream.stdout
+        for line_filter in filters:
+            lines = line_filter(lines)
+        try:
+            for line in lines:
+                process.stdin.write(line)
+        except BrokenPipeError:
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    code = process.wait()
+    collector.join()
+    decompressed = stream.close()
+    if code != 0:
+        raise RestoreFailed(_error_summary(errors) or f"客户端退出码 {code}")
+    if not decompressed:
+        raise RestoreFailed("解压备份文件失败")
+
+
+class ParallelLoader:
+    """
+    分段并行导入
+
+    前置部分（建表等）在第一个表数据分段开始前顺序执行；每个表的数据写入临时文件，
+    加上会话设置（preamble）后由线程池并行导入；后置部分（索引、约束、视图等）最后执行。
+    """
+
+    def __init__(self, client, jobs, progress):
+        self.client = client
+        self.progress = progress
+        os.makedirs(SPOOL_DIR, exist_ok=True)
+        self.spool = tempfile.mkdtemp(prefix='restore_', dir=SPOOL_DIR)
+        self.executor = ThreadPoolExecutor(max_workers=jobs)
+        self.backlog = threading.BoundedSemaphore(jobs * SPOOL_BACKLOG)
+        self.futures = []
+        self.errors = deque(maxlen=50)
+        self.failed = threading.Event()
+        self.preamble = []
+        self.sections = 0
+        self.pre = open(os.path.join(self.spool, 'pre.sql'), 'wb')
+        self.pre_done = False
+        self.post = None
+        self.current = None
+
+    def add_preamble(self, line):
+        """会话设置语句：前置部分执行一次，并加到每个分段开头"""
+        self.preamble.append(line)
+        self.add_pre(line)
+
+    def add_pre(self, line):
+        self.pre.write(line)
+
+    def start_section(self):
+        self.end_section()
+        self._run_pre()
+        # 积压的分段过多时等待，限制临时文件占用的磁盘空间
+        while not self.backlog.acquire(timeout=1):
+            self._check_failed()
+        self._check_failed()
+        self.sections += 1
+        self.current = open(os.path.join(self.spool, f'section_{self.sections:06d}.sql'), 'wb')
+        self.current.writelines(self.preamble)
+
+    def add_section(self, line):
+        self.current.write(line)
+
+    def end_section(self):
+        if self.current is None:
+            return
+        self.current.close()
+        self.futures.append(self.executor.submit(self._run_section, self.current.name))
+        self.current = None
+
+    def add_post(self, line):
+        if self.post is None:
+            self.post = open(os.path.join(self.spool, 'post.sql'), 'wb')
+            self.post.writelines(self.preamble)
+        self.post.write(line)
+
+    def finish(self):
+        """等待所有分段导入完成后执行后置部分"""
+        self.end_section()
+        self._run_pre()
+        for future in self.futures:
+            future.result()
+        self._check_failed()
+        if self.post is not None:
+            self.post.close()
+            self._run(self.post.name)
+
+    def close(self):
+        """清理临时文件（正常结束或失败都需要调用）"""
+        self.failed.set()
+        self.executor.shutdown(wait=True)
+        for handle in (self.pre, self.post, self.current):
+            if handle is not None and not handle.closed:
+                handle.close()
+        shutil.rmtree(self.spool, ignore_errors=True)
+
+    def _run_pre(self):
+        if self.pre_done:
+            return
+        self.pre.close()
+        self._run(self.pre.name)
+        self.pre_done = True
+
+    def _run(self, path):
+        code, stderr = self.client.run_file(path)
+        if code != 0:
+            self.errors.extend(line for line in stderr.splitlines() if line.strip())
+            self.failed.set()
+            raise RestoreFailed(_error_summary(self.errors) or f"客户端退出码 {code}")
+
+    def _run_section(self, path):
+        try:
+            if self.failed.is_set():
+                return
+            self._run(path)
+            self.progress.table_done()
+        except RestoreFailed:
+            pass
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.backlog.release()
+
+    def _check_failed(self):
+        if self.failed.is_set():
+            raise RestoreFailed(_error_summary(self.errors) or "表数据导入失败")
+
+
+def split_postgresql(lines, loader):
+    """按 COPY 块拆分 pg_dump 的 SQL 文本"""
+    in_copy = False
+    seen_data = False
+    for line in lines:
+        if in_copy:
+            loader.add_section(line)
+            if line == b'\\.\n':
+                loader.end_section()
+                in_copy = False
+        elif line.startswith(b'COPY ') and line.rstrip().endswith(b'FROM stdin;'):
+            loader.start_section()
+            loader.add_section(line)
+            in_copy = True
+            seen_data = True
+        elif seen_data:
+            loader.add_post(line)
+        elif line.startswith(b'SET ') or line.startswith(b'SELECT pg_catalog.set_config('):
+            loader.add_preamble(line)
+        else:
+            loader.add_pre(line)
+
+
+def split_mysql(lines, loader):
+    """按表拆分 mysqldump 的 SQL 文本（依赖 mysqldump 默认输出的注释）"""
+    state = 'pre'
+    for line in lines:
+        if line.startswith(MYSQL_SECTION_MARKERS):
+            loader.start_section()
+            state = 'section'
+        elif line.startswith(MYSQL_POST_MARKERS):
+            loader.end_section()
+            state = 'post'
+
+        if state == 'section':
+            loader.add_section(line)
+        elif state == 'post':
+            loader.add_post(line)
+        elif MYSQL_DATABASE_STATEMENT.match(line):
+            continue
+        elif line.startswith(b'/*!') or line.startswith(b'SET '):
+            loader.add_preamble(line)
+        else:
+            loader.add_pre(line)
+
+
+def restore_parallel(client, artifact, jobs, progress, max_rate=0, filters=(), ranges=None):
+    """按表拆分 SQL 文本，多个连接并行导入"""
+    stream = DecompressedStream(artifact, progress, max_rate, ranges)
+    loader = ParallelLoader(client, jobs, progress)
+    try:
+        lines = stream.stdout
+        for line_filter in filters:
+            lines = line_filter(lines)
+        if artifact['db_type'] == 'postgresql':
+            split_postgresql(lines, loader)
+        else:
+            split_mysql(lines, loader)
+        if not stream.close():
+            raise RestoreFailed("解压备份文件失败")
+        progress.set_tables_total(loader.sections)
+        loader.finish()
+    finally:
+        stream.close()
+        loader.close()
+
+
+def restore_custom(client, artifact, jobs, progress, no_owner=False):
+    """
+    pg_restore -j 并行恢复 custom 格式的备份
+
+    加密的备份解密后经标准输入交给 pg_restore，pg_restore 从标准输入读取时不支持 -j，只能单连接恢复
+    """
+    encrypted = artifact_crypto.is_encrypted(artifact['path'])
+    if not encrypted:
+        listing = subprocess.run(['pg_restore', '-l', artifact['path']], stdout=subprocess.PIPE,
+                                 stderr=subprocess.DEVNULL, env=client.env)
+        if listing.returncode == 0:
+            progress.set_tables_total(sum(1 for line in listing.stdout.splitlines() if b' TABLE DATA ' in line))
+
+    command = ['pg_restore', '-h', client.host, '-p', client.port, '-U', client.user, '-d', client.database,
+               '--exit-on-error', '--verbose']
+    if not encrypted:
+        command += ['-j', str(jobs)]
+    if no_owner:
+        command += ['--no-owner', '--no-privileges']
+    if encrypted:
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.PIPE, env=client.env)
+        threading.Thread(target=feed_file, args=(artifact['path'], process.stdin, progress), daemon=True).start()
+    else:
+        command.append(artifact['path'])
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=client.env)
+    errors = deque(maxlen=50)
+    for line in process.stderr:
+        text = line.decode('utf-8', 'replace').rstrip()
+        if 'processing data for table' in text:
+            progress.table_done()
+        elif text:
+            errors.append(text)
+    code = process.wait()
+    progress.add_bytes(progress.bytes_total - progress.bytes_done)
+    if code != 0:
+        raise RestoreFailed(_error_summary(line for line in errors if 'error' in line.lower()) or
+                            f"pg_restore 退出码 {code}")
+
+
+def restore_artifact(client, artifact, progress, jobs=1, max_rate=0, no_owner=False, source_db=None):
+    """
+    按备份格式选择恢复方式，把备份文件恢复到 client 指定的数据库
+
+    Args:
+        no_owner: 不恢复属主和权限（PostgreSQL），目标实例中没有源库的角色时使用
+        source_db: 只恢复"所有数据库"备份中的这个数据库（按分段索引直接读取，不解压其他数据库）
+
+    Raises:
+        RestoreFailed: 恢复失败
+    """
+    if artifact['format'] == 'custom':
+        restore_custom(client, artifact, jobs, progress, no_owner)
+        return
+
+    ranges = None
+    if source_db:
+        try:
+            ranges = artifact_index.database_ranges(artifact['path'], source_db)
+        except ValueError as e:
+            raise RestoreFailed(str(e))
+    single_database = bool(artifact['db_name'] or source_db)
+
+    filters = []
+    if artifact['db_type'] == 'mysql' and single_database:
+        filters.append(strip_mysql_database)
+    if artifact['db_type'] == 'postgresql' and no_owner:
+        filters.append(strip_postgresql_ownership)
+
+    if jobs > 1 and single_database:
+        restore_parallel(client, artifact, jobs, progress, max_rate, filters, ranges)
+    else:
+        restore_stream(client, artifact, progress, max_rate, filters, ranges)
+
+
+def run_restore(restore_id, echo=False):
+    """
+    执行恢复任务
+
+    Returns:
+        bool: 是否成功
+    """
+    restore = get_restore(restore_id)
+    if not restore:
+        print(f"恢复任务不存在: {restore_id}", file=sys.stderr)
+        return False
+
+    update_restore(restore_id, status=STATUS_RUNNING, pid=os.getpid(), started_at=_now())
+    progress = RestoreProgress(restore_id, restore['bytes_total'], echo=echo)
+    started = time.monotonic()
+    try:
+        artifact = backup_artifacts.get_artifact(restore['artifact_id'])
+        if not artifact or not artifact['exists']:
+            raise RestoreFailed("备份文件不存在")
+        connection = config_manager.get_database_connection(restore['connection_id'])
+        if not connection:
+            raise RestoreFailed("目标数据库连接不存在")
+
+        client = RestoreClient(connection, restore['target_db'])
+        if restore['create_db'] and restore['target_db']:
+            client.create_database()
+
+        restore_artifact(client, artifact, progress, restore['jobs'] or 1, restore['max_rate'] or 0,
+                         source_db=restore['source_db'])
+        progress.save()
+        elapsed = time.monotonic() - started
+        update_restore(restore_id, status=STATUS_SUCCESS, finished_at=_now(),
+                       message=f"恢复完成，耗时 {elapsed:.1f} 秒")
+        return True
+    except (RestoreFailed, OSError) as e:
+        progress.save()
+        update_restore(restore_id, status=STATUS_FAILED, finished_at=_now(), message=str(e))
+        print(f"恢复失败: {str(e)}", file=sys.stderr)
+        return False
+    finally:
+        if echo:
+            print(file=sys.stderr)
+
+
+def start_restore(artifact_id, connection_id, target_db=None, user_id=None, jobs=1, max_rate=0, create_db=False,
+                  source_db=None):
+    """
+    创建恢复任务并在后台进程中执行
+
+    Returns:
+        int: 恢复任务 ID
+
+    Raises:
+        ValueError: 参数无效
+    """
+    restore_id = create_restore(artifact_id, connection_id, target_db, user_id, jobs, max_rate, create_db, source_db)
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), 'run', str(restore_id)],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    update_restore(restore_id, pid=process.pid)
+    return restore_id
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='备份恢复工具')
+    subparsers = parser.add_subparsers(dest='command', help='可用命令')
+
+    restore_parser = subparsers.add_parser('restore', help='恢复一个备份文件（前台执行并显示进度）')
+    restore_parser.add_argument('--artifact', type=int, required=True, help='备份文件记录 ID（见 backup_artifacts.py list）')
+    restore_parser.add_argument('--connection', required=True, help='目标数据库连接 ID')
+    restore_parser.add_argument('--target-db', help='恢复到的数据库名')
+    restore_parser.add_argument('--source-db', help='只恢复"所有数据库"备份中的这个数据库（PostgreSQL 所有数据库备份必须指定）')
+    restore_parser.add_argument('--jobs', type=int, default=1, help='并行连接数')
+    restore_parser.add_argument('--max-rate', default='0', help='读取速率上限（字节/秒），支持 K/M/G 后缀')
+    restore_parser.add_argument('--create-db', action='store_true', help='目标数据库不存在时创建')
+    restore_parser.add_argument('--background', action='store_true', help='在后台执行，立即返回任务 ID')
+
+    run_parser = subparsers.add_parser('run', help='执行已创建的恢复任务')
+    run_parser.add_argument('id', type=int, help='恢复任务 ID')
+
+    status_parser = subparsers.add_parser('status', help='查看恢复任务')
+    status_parser.add_argument('id', type=int, nargs='?', help='恢复任务 ID，省略时列出最近的任务')
+    status_parser.add_argument('--limit', type=int, default=20, help='列出的任务数')
+
+    args = parser.parse_args()
+
+    if args.command == 'restore':
+        try:
+            if args.background:
+                restore_id = start_restore(args.artifact, args.connection, args.target_db, jobs=args.jobs,
+                                           max_rate=parse_rate(args.max_rate), create_db=args.create_db,
+                                           source_db=args.source_db)
+                print(f"恢复任务已启动，ID: {restore_id}")
+                return
+            restore_id = create_restore(args.artifact, args.connection, args.target_db, jobs=args.jobs,
+                                        max_rate=parse_rate(args.max_rate), create_db=args.create_db,
+                                        source_db=args.source_db)
+        except ValueError as e:
+            print(f"错误: {str(e)}", file=sys.stderr)
+            sys.exit(1)
+        ok = run_restore(restore_id, echo=True)
+        print(json.dumps(get_restore(restore_id), indent=2, ensure_ascii=False))
+        sys.exit(0 if ok else 1)
+    elif args.command == 'run':
+        sys.exit(0 if run_restore(args.id) else 1)
+    elif args.command == 'status':
+        result = get_restore(args.id) if args.id else list_restores(limit=args.limit)
+        if args.id and not result:
+            print(f"恢复任务不存在: {args.id}", file=sys.stderr)
+            sys.exit(1)
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
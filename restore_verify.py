@@ -0,0 +1,685 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+备份恢复校验模块
+把备份文件恢复到本机临时启动的 PostgreSQL / MySQL 实例中，确认备份确实可以恢复，并记录:
+
+- 恢复耗时
+- 每个表的行数和校验和（PostgreSQL 为各行 md5 之和，MySQL 为 CHECKSUM TABLE），以及汇总校验和
+
+结果写入 backup_verifications 表。每个校验任务使用独立的数据目录和端口，多个任务可并行执行，
+结束后停止实例并删除数据目录，不会连接或修改任何线上数据库。
+
+需要镜像中安装数据库服务端（构建时指定 --build-arg INSTALL_VERIFY_SERVERS=true），
+未安装对应服务端的备份会被跳过。
+
+环境变量:
+    RESTORE_VERIFY_DIR       临时实例的数据目录（默认 /backups/.verify）
+    PG_BIN_DIR               initdb / pg_ctl 所在目录（默认在 PATH 和 /usr/lib/postgresql/*/bin 中查找）
+    RESTORE_VERIFY_SCHEDULE  由 entrypoint.sh 读取，设置后按该 cron 表达式定时校验各连接的最新备份
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import socket
+import sqlite3
+import hashlib
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from metrics import TimedConnection, record_event
+import artifact_index
+import backup_artifacts
+import restore_manager
+from restore_manager import RestoreClient, RestoreFailed, RestoreProgress
+
+# 数据库文件路径
+DB_FILE = os.environ.get('BACKUP_DB_FILE', "/backups/users.db")
+
+# 临时实例的数据目录，需要能容纳恢复后的数据库
+VERIFY_DIR = os.environ.get('RESTORE_VERIFY_DIR', "/backups/.verify")
+
+# 等待临时实例启动的最长时间（秒）
+STARTUP_TIMEOUT = 120
+
+# 每条统计查询包含的表数
+TABLES_PER_QUERY = 50
+
+# 不参与统计的 MySQL 系统库
+MYSQL_SYSTEM_SCHEMAS = ('mysql', 'information_schema', 'performance_schema', 'sys')
+
+# 备份了所有 PostgreSQL 数据库时，各数据库分别恢复到 verify_<序号>（不同数据库中的同名表互不冲突）
+POSTGRESQL_DATABASE_PREFIX = 'verify_'
+
+# 校验状态
+STATUS_RUNNING = 'running'
+STATUS_PASSED = 'passed'
+STATUS_FAILED = 'failed'
+
+
+class VerificationError(Exception):
+    """临时实例启动或统计查询失败"""
+
+
+def get_db_connection():
+    """获取数据库连接"""
+    conn = sqlite3.connect(DB_FILE, factory=TimedConnection)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _free_port():
+    """取一个当前空闲的本机端口"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _run(command, description):
+    """执行服务端管理命令，失败时抛出 VerificationError"""
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    if result.returncode != 0:
+        output = result.stdout.decode('utf-8', 'replace').strip().splitlines()
+        raise VerificationError(f"{description}失败: {' '.join(output[-3:]) or result.returncode}")
+
+
+# ===== 临时数据库实例 =====
+
+class DisposableInstance:
+    """
+    本机临时数据库实例，只监听 127.0.0.1 的随机端口
+
+    用法:
+        with PostgresInstance() as instance:
+            client = RestoreClient(instance.connection(), 'demo')
+    """
+    db_type = None
+    service_user = None
+    admin_user = None
+
+    def __init__(self, work_dir=None):
+        self.work_dir = work_dir or VERIFY_DIR
+        self.dir = None
+        self.port = None
+
+    def __enter__(self):
+        os.makedirs(self.work_dir, exist_ok=True)
+        self.dir = tempfile.mkdtemp(prefix=f'{self.db_type}_', dir=self.work_dir)
+        self.port = _free_port()
+        try:
+            if os.geteuid() == 0:
+                # 数据库服务端拒绝以 root 运行，数据目录交给服务账户
+                try:
+                    shutil.chown(self.dir, self.service_user, self.service_user)
+                except LookupError:
+                    raise VerificationError(f"服务账户 {self.service_user} 不存在，请确认已安装 {self.db_type} 服务端")
+            self.start()
+        except Exception:
+            self.cleanup()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        try:
+            self.stop()
+        finally:
+            self.cleanup()
+
+    def cleanup(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def as_service_user(self, command):
+        """以 root 运行时切换到服务账户执行"""
+        if os.geteuid() == 0:
+            return ['runuser', '-u', self.service_user, '--'] + command
+        return command
+
+    def connection(self):
+        """连接参数，格式与 database_connections 表一致"""
+        return {'db_type': self.db_type, 'host': '127.0.0.1', 'port': self.port,
+                'user': self.admin_user, 'password': ''}
+
+    @classmethod
+    def available(cls):
+        raise NotImplementedError
+
+    def start(self):
+        raise NotImplementedError
+
+    def stop(self):
+        raise NotImplementedError
+
+
+def find_pg_bin_dir():
+    """查找 initdb / pg_ctl 所在目录，未安装返回 None"""
+    configured = os.environ.get('PG_BIN_DIR')
+    if configured:
+        return configured if os.path.exists(os.path.join(configured, 'initdb')) else None
+    initdb = shutil.which('initdb')
+    if initdb:
+        return os.path.dirname(initdb)
+    # Debian 的 postgresql 包不把服务端程序放入 PATH，取最高版本
+    candidates = glob.glob('/usr/lib/postgresql/*/bin/initdb')
+    candidates.sort(key=lambda path: int(path.split('/')[4]) if path.split('/')[4].isdigit() else 0)
+    return os.path.dirname(candidates[-1]) if candidates else None
+
+
+class PostgresInstance(DisposableInstance):
+    """临时 PostgreSQL 实例（trust 认证，关闭 fsync 以加快导入）"""
+    db_type = 'postgresql'
+    service_user = 'postgres'
+    admin_user = 'postgres'
+
+    @classmethod
+    def available(cls):
+        return find_pg_bin_dir() is not None
+
+    def start(self):
+        bin_dir = find_pg_bin_dir()
+        if not bin_dir:
+            raise VerificationError("未安装 PostgreSQL 服务端")
+        self.pg_ctl = os.path.join(bin_dir, 'pg_ctl')
+        self.data_dir = os.path.join(self.dir, 'data')
+        _run(self.as_service_user([os.path.join(bin_dir, 'initdb'), '-D', self.data_dir, '-U', self.admin_user,
+                                   '-A', 'trust', '-E', 'UTF8', '--no-sync']), "初始化 PostgreSQL 实例")
+        options = (f"-p {self.port} -k {self.dir} -c listen_addresses=127.0.0.1 "
+                   "-c fsync=off -c synchronous_commit=off -c full_page_writes=off")
+        _run(self.as_service_user([self.pg_ctl, '-D', self.data_dir, '-l', os.path.join(self.dir, 'server.log'),
+                                   '-o', options, '-w', '-t', str(STARTUP_TIMEOUT), 'start']),
+             "启动 PostgreSQL 实例")
+
+    def stop(self):
+        subprocess.run(self.as_service_user([self.pg_ctl, '-D', self.data_dir, '-m', 'immediate', '-w', 'stop']),
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+class MysqlInstance(DisposableInstance):
+    """临时 MySQL / MariaDB 实例（root 无密码，只监听本机）"""
+    db_type = 'mysql'
+    service_user = 'mysql'
+    admin_user = 'root'
+
+    @staticmethod
+    def find_server():
+        return shutil.which('mariadbd') or shutil.which('mysqld')
+
+    @classmethod
+    def available(cls):
+        return cls.find_server() is not None
+
+    def start(self):
+        server = self.find_server()
+        if not server:
+            raise VerificationError("未安装 MySQL 服务端")
+        data_dir = os.path.join(self.dir, 'data')
+        user_args = [f'--user={self.service_user}'] if os.geteuid() == 0 else []
+        mariadb = os.path.basename(server) == 'mariadbd' or shutil.which('mariadb-install-db')
+
+        if mariadb:
+            install = shutil.which('mariadb-install-db') or shutil.which('mysql_install_db')
+            _run([install, '--no-defaults', f'--datadir={data_dir}', '--auth-root-authentication-method=normal',
+                  '--skip-test-db'] + user_args, "初始化 MySQL 实例")
+            extra_args = []
+        else:
+            _run([server, '--no-defaults', '--initialize-insecure', f'--datadir={data_dir}'] + user_args,
+                 "初始化 MySQL 实例")
+            extra_args = ['--disable-log-bin']
+
+        self.process = subprocess.Popen(
+            [server, '--no-defaults', f'--datadir={data_dir}', f'--socket={self.dir}/mysqld.sock',
+             f'--port={self.port}', '--bind-address=127.0.0.1', f'--pid-file={self.dir}/mysqld.pid',
+             f'--log-error={self.dir}/error.log', '--innodb-flush-log-at-trx-commit=0'] + extra_args + user_args,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        client = RestoreClient(self.connection(), None)
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while True:
+            try:
+                client.query('SELECT 1')
+                return
+            except RestoreFailed:
+                if self.process.poll() is not None:
+                    raise VerificationError(f"启动 MySQL 实例失败，详见 {self.dir}/error.log")
+                if time.monotonic() > deadline:
+                    raise VerificationError("等待 MySQL 实例启动超时")
+                time.sleep(0.5)
+
+    def stop(self):
+        process = getattr(self, 'process', None)
+        if process is None or process.poll() is not None:
+            return
+        process.terminate()
+        try:
+            process.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+INSTANCE_TYPES = {
+    'postgresql': PostgresInstance,
+    'mysql': MysqlInstance,
+}
+
+
+# ===== 恢复后的统计 =====
+
+def _pg_ident(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _pg_literal(value):
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _mysql_ident(name):
+    return '`' + name.replace('`', '``') + '`'
+
+
+def _mysql_literal(value):
+    return "'" + value.replace('\\', '\\\\').replace("'", "''") + "'"
+
+
+def _batches(items, size):
+    for index in range(0, len(items), size):
+        yield items[index:index + size]
+
+
+def collect_postgresql_stats(client, database):
+    """
+    统计每个用户表的行数和校验和
+
+    校验和为各行文本 md5 前 60 位之和，与行的物理顺序无关，逐行累加不占用额外内存
+
+    Returns:
+        list: [{'table', 'rows', 'checksum'}]
+    """
+    tables = client.query(
+        "SELECT schemaname, tablename FROM pg_tables "
+        "WHERE schemaname NOT IN ('pg_catalog', 'information_schema') ORDER BY 1, 2", database)
+    stats = []
+    for batch in _batches(tables, TABLES_PER_QUERY):
+        sql = ' UNION ALL '.join(
+            f"SELECT {_pg_literal(f'{schema}.{table}')}, count(*), "
+            f"coalesce(sum(('x' || substr(md5(t::text), 1, 15))::bit(60)::bigint), 0) "
+            f"FROM {_pg_ident(schema)}.{_pg_ident(table)} t"
+            for schema, table in batch)
+        for name, rows, checksum in client.query(sql, database):
+            stats.append({'table': name, 'rows': int(rows), 'checksum': checksum})
+    return stats
+
+
+def collect_mysql_stats(client, database=None):
+    """
+    统计每个表的行数和 CHECKSUM TABLE 结果，database 为空时统计所有非系统库
+
+    Returns:
+        list: [{'table', 'rows', 'checksum'}]
+    """
+    if database:
+        condition = f"table_schema = {_mysql_literal(database)}"
+    else:
+        condition = f"table_schema NOT IN ({', '.join(_mysql_literal(name) for name in MYSQL_SYSTEM_SCHEMAS)})"
+    tables = client.query(
+        "SELECT table_schema, table_name FROM information_schema.tables "
+        f"WHERE table_type = 'BASE TABLE' AND {condition} ORDER BY table_schema, table_name")
+    stats = []
+    for batch in _batches(tables, TABLES_PER_QUERY):
+        idents = [f"{_mysql_ident(schema)}.{_mysql_ident(table)}" for schema, table in batch]
+        counts = client.query(' UNION ALL '.join(
+            f"SELECT {_mysql_literal(f'{schema}.{table}')}, COUNT(*) FROM {ident}"
+            for (schema, table), ident in zip(batch, idents)))
+        checksums = dict(client.query(f"CHECKSUM TABLE {', '.join(idents)}"))
+        for name, rows in counts:
+            stats.append({'table': name, 'rows': int(rows), 'checksum': checksums.get(name)})
+    return stats
+
+
+def summarize_stats(stats):
+    """汇总校验和：按表名排序后的 "表名:行数:校验和" 的 md5"""
+    digest = hashlib.md5()
+    for item in sorted(stats, key=lambda item: item['table']):
+        digest.update(f"{item['table']}:{item['rows']}:{item['checksum']}\n".encode())
+    return digest.hexdigest()
+
+
+# ===== 校验记录 =====
+
+def _create_verification(artifact):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO backup_verifications (artifact_id, user_id, connection_id, db_type, db_name, status)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (artifact['id'], artifact['user_id'], artifact['connection_id'], artifact['db_type'],
+              artifact['db_name'], STATUS_RUNNING))
+        conn.commit()
+        return cursor.lastrowid
+    finally:
+        conn.close()
+
+
+def _finish_verification(verification_id, status, message, restore_seconds=None, check_seconds=None,
+                         stats=None):
+    fields = {
+        'status': status,
+        'message': message,
+        'restore_seconds': restore_seconds,
+        'check_seconds': check_seconds,
+        'finished_at': _now(),
+    }
+    if stats is not None:
+        fields.update({
+            'tables_count': len(stats),
+            'rows_count': sum(item['rows'] for item in stats),
+            'checksum': summarize_stats(stats),
+            'details': json.dumps(stats, ensure_ascii=False),
+        })
+    try:
+        conn = get_db_connection()
+        try:
+            assignments = ', '.join(f"{key} = ?" for key in fields)
+            conn.execute(f'UPDATE backup_verifications SET {assignments} WHERE id = ?',
+                         list(fields.values()) + [verification_id])
+            conn.commit()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"更新校验记录失败: {str(e)}", file=sys.stderr)
+
+
+def _previous_verification(artifact):
+    """同一连接、同一数据库上一次通过的校验"""
+    try:
+        conn = get_db_connection()
+        try:
+            return conn.execute('''
+                SELECT * FROM backup_verifications
+                WHERE status = ? AND db_type = ? AND COALESCE(connection_id, '') = COALESCE(?, '')
+                  AND COALESCE(db_name, '') = COALESCE(?, '') AND artifact_id != ?
+                ORDER BY id DESC LIMIT 1
+            ''', (STATUS_PASSED, artifact['db_type'], artifact['connection_id'], artifact['db_name'],
+                  artifact['id'])).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+
+
+def get_verification(verification_id):
+    """获取单条校验记录（details 解析为列表）"""
+    try:
+        conn = get_db_connection()
+        try:
+            row = conn.execute('SELECT * FROM backup_verifications WHERE id = ?', (verification_id,)).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"获取校验记录失败: {str(e)}", file=sys.stderr)
+        return None
+    if not row:
+        return None
+    verification = dict(row)
+    verification['details'] = json.loads(verification['details']) if verification['details'] else []
+    return verification
+
+
+def list_verifications(user_id=None, limit=50):
+    """列出校验记录（不含每个表的明细），按时间倒序"""
+    query = '''
+        SELECT v.id, v.artifact_id, v.user_id, v.connection_id, v.db_type, v.db_name, v.status,
+               v.restore_seconds, v.check_seconds, v.tables_count, v.rows_count, v.checksum, v.message,
+               v.created_at, v.finished_at, a.path AS artifact_path
+        FROM backup_verifications v LEFT JOIN backup_artifacts a ON a.id = v.artifact_id
+    '''
+    params = []
+    if user_id is not None:
+        query += ' WHERE v.user_id = ?'
+        params.append(user_id)
+    query += ' ORDER BY v.id DESC LIMIT ?'
+    params.append(limit)
+    try:
+        conn = get_db_connection()
+        try:
+            rows = conn.execute(query, params).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"获取校验记录失败: {str(e)}", file=sys.stderr)
+        return []
+    verifications = []
+    for row in rows:
+        verification = dict(row)
+        path = verification.pop('artifact_path')
+        verification['artifact_file'] = os.path.basename(path) if path else None
+        verifications.append(verification)
+    return verifications
+
+
+def select_latest_artifacts(user_id=None, include_verified=False):
+    """
+    选出每个连接、每个数据库最新的备份文件（默认只选尚未校验过的）
+
+    Returns:
+        list: 备份文件记录
+    """
+    query = '''
+        SELECT a.id FROM backup_artifacts a
+        WHERE a.id = (
+            SELECT MAX(b.id) FROM backup_artifacts b
+            WHERE b.db_type = a.db_type
+              AND COALESCE(b.connection_id, '') = COALESCE(a.connection_id, '')
+              AND COALESCE(b.db_name, '') = COALESCE(a.db_name, '')
+        )
+    '''
+    params = []
+    if not include_verified:
+        query += ' AND NOT EXISTS (SELECT 1 FROM backup_verifications v WHERE v.artifact_id = a.id)'
+    if user_id is not None:
+        query += ' AND a.user_id = ?'
+        params.append(user_id)
+    query += ' ORDER BY a.id'
+    try:
+        conn = get_db_connection()
+        try:
+            ids = [row['id'] for row in conn.execute(query, params).fetchall()]
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"选择待校验的备份失败: {str(e)}", file=sys.stderr)
+        return []
+    artifacts = (backup_artifacts.get_artifact(artifact_id) for artifact_id in ids)
+    return [artifact for artifact in artifacts if artifact and artifact['exists']]
+
+
+# ===== 执行校验 =====
+
+def _restore_targets(artifact):
+    """
+    需要依次执行的恢复：[(源数据库, 临时实例中的数据库)]
+
+    源数据库为 None 表示恢复整个备份；临时实例中的数据库为 None 表示由备份自行创建（所有 MySQL 数据库）。
+    PostgreSQL "所有数据库"备份按分段索引逐个数据库恢复到各自的数据库，没有索引时返回 None（无法校验）
+    """
+    if artifact['db_name']:
+        return [(None, artifact['db_name'])]
+    if artifact['db_type'] != 'postgresql':
+        return [(None, None)]
+    databases = artifact_index.list_databases(artifact['path']) if artifact['indexed'] else []
+    if not databases:
+        return None
+    return [(database['name'], f"{POSTGRESQL_DATABASE_PREFIX}{index}") for index, database in enumerate(databases)]
+
+
+def verify_artifact(artifact_id, jobs=1, work_dir=None):
+    """
+    把一个备份文件恢复到临时实例并统计各表
+
+    Returns:
+        dict: 校验记录，备份文件不存在或无法校验时返回 None
+    """
+    artifact = backup_artifacts.get_artifact(artifact_id)
+    if not artifact or not artifact['exists']:
+        print(f"备份文件不存在: {artifact_id}", file=sys.stderr)
+        return None
+    instance_type = INSTANCE_TYPES.get(artifact['db_type'])
+    if instance_type is None or not instance_type.available():
+        print(f"未安装 {artifact['db_type']} 服务端，跳过 {artifact['filename']}", file=sys.stderr)
+        return None
+
+    targets = _restore_targets(artifact)
+    if targets is None:
+        print(f"PostgreSQL \"所有数据库\"备份没有分段索引，无法逐个数据库校验，跳过 {artifact['filename']}",
+              file=sys.stderr)
+        return None
+
+    verification_id = _create_verification(artifact)
+    restore_seconds = None
+    try:
+        with instance_type(work_dir) as instance:
+            started = time.monotonic()
+            progress = RestoreProgress(None, artifact['size'] or 0)
+            clients = []
+            for source_db, database in targets:
+                client = RestoreClient(instance.connection(), database)
+                if database:
+                    client.create_database()
+                restore_manager.restore_artifact(client, artifact, progress, jobs=jobs, no_owner=True,
+                                                 source_db=source_db)
+                clients.append((source_db, client))
+            restore_seconds = time.monotonic() - started
+
+            started = time.monotonic()
+            stats = []
+            for source_db, client in clients:
+                if artifact['db_type'] == 'postgresql':
+                    database_stats = collect_postgresql_stats(client, client.database)
+                else:
+                    database_stats = collect_mysql_stats(client, client.database)
+                # 逐个数据库恢复时表名前加上源数据库名（db.schema.table）
+                if source_db:
+                    for item in database_stats:
+                        item['table'] = f"{source_db}.{item['table']}"
+                stats.extend(database_stats)
+            check_seconds = time.monotonic() - started
+    except (VerificationError, RestoreFailed, OSError) as e:
+        failed_stage = "恢复" if restore_seconds is None else "统计"
+        _finish_verification(verification_id, STATUS_FAILED, f"{failed_stage}失败: {str(e)}", restore_seconds)
+        record_event('restore_verify_duration_seconds', restore_seconds or 0,
+                     {'db_type': artifact['db_type'], 'status': STATUS_FAILED})
+        return get_verification(verification_id)
+
+    rows = sum(item['rows'] for item in stats)
+    if not stats:
+        status = STATUS_FAILED
+        message = "恢复成功，但没有任何表"
+    else:
+        status = STATUS_PASSED
+        message = f"恢复耗时 {restore_seconds:.1f} 秒，{len(stats)} 个表，{rows} 行"
+        previous = _previous_verification(artifact)
+        if previous is not None and previous['rows_count'] is not None:
+            message += f"（较上次校验 {rows - previous['rows_count']:+d} 行）"
+
+    _finish_verification(verification_id, status, message, restore_seconds, check_seconds, stats)
+    record_event('restore_verify_duration_seconds', restore_seconds,
+                 {'db_type': artifact['db_type'], 'status': status})
+    return get_verification(verification_id)
+
+
+def verify_artifacts(artifact_ids, workers=2, jobs=1, work_dir=None):
+    """
+    并行校验多个备份文件，每个备份使用独立的临时实例
+
+    Returns:
+        list: 校验记录（跳过的备份不在其中）
+    """
+    if not artifact_ids:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = executor.map(lambda artifact_id: verify_artifact(artifact_id, jobs, work_dir), artifact_ids)
+        return [result for result in results if result]
+
+
+def start_verification(artifact_ids=None, user_id=None, workers=2, jobs=1):
+    """在后台进程中校验指定的备份（未指定时校验各连接最新的未校验备份）"""
+    command = [sys.executable, os.path.abspath(__file__), 'run', '--workers', str(workers), '--jobs', str(jobs)]
+    if artifact_ids:
+        command += ['--artifact'] + [str(artifact_id) for artifact_id in artifact_ids]
+    elif user_id is not None:
+        command += ['--user-id', str(user_id)]
+    return subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            start_new_session=True).pid
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='备份恢复校验工具')
+    subparsers = parser.add_subparsers(dest='command', help='可用命令')
+
+    run_parser = subparsers.add_parser('run', help='恢复到临时实例并校验（默认校验各连接最新的未校验备份）')
+    run_parser.add_argument('--artifact', type=int, nargs='+', help='备份文件记录 ID')
+    run_parser.add_argument('--user-id', type=int, help='只校验该用户的备份')
+    run_parser.add_argument('--all', action='store_true', help='已校验过的最新备份也重新校验')
+    run_parser.add_argument('--workers', type=int, default=2, help='同时运行的临时实例数')
+    run_parser.add_argument('--jobs', type=int, default=1, help='每个恢复的并行连接数')
+
+    list_parser = subparsers.add_parser('list', help='列出校验记录')
+    list_parser.add_argument('--user-id', type=int, help='用户 ID')
+    list_parser.add_argument('--limit', type=int, default=50, help='返回记录数')
+
+    show_parser = subparsers.add_parser('show', help='显示校验记录和各表统计')
+    show_parser.add_argument('id', type=int, help='校验记录 ID')
+
+    subparsers.add_parser('check', help='检查本机是否安装了临时实例所需的服务端')
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        if args.artifact:
+            artifact_ids = args.artifact
+        else:
+            artifact_ids = [artifact['id'] for artifact in select_latest_artifacts(args.user_id, args.all)]
+        if not artifact_ids:
+            print("没有需要校验的备份")
+            return
+        results = verify_artifacts(artifact_ids, args.workers, args.jobs)
+        for result in results:
+            print(f"#{result['artifact_id']} {result['db_type']} {result['db_name'] or '所有数据库'}: "
+                  f"{result['status']}  {result['message']}")
+        sys.exit(0 if results and all(result['status'] == STATUS_PASSED for result in results) else 1)
+    elif args.command == 'list':
+        print(json.dumps(list_verifications(args.user_id, args.limit), indent=2, ensure_ascii=False))
+    elif args.command == 'show':
+        verification = get_verification(args.id)
+        if not verification:
+            print(f"校验记录不存在: {args.id}", file=sys.stderr)
+            sys.exit(1)
+        print(json.dumps(verification, indent=2, ensure_ascii=False))
+    elif args.command == 'check':
+        missing = 0
+        for db_type, instance_type in INSTANCE_TYPES.items():
+            if instance_type.available():
+                print(f"{db_type:<12} 可用")
+            else:
+                missing += 1
+                print(f"{db_type:<12} 未安装服务端")
+        sys.exit(1 if missing else 0)
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+备份计划模型
+将 cron 表达式解析为预编译的计划对象，供 Web 界面展示和调度计算共用
+"""
+
+import sys
+import bisect
+import argparse
+import functools
+from datetime import datetime, timedelta
+
+# 各字段取值范围: (最小值, 最大值)
+FIELD_RANGES = [
+    (0, 59),   # 分钟
+    (0, 23),   # 小时
+    (1, 31),   # 日
+    (1, 12),   # 月
+    (0, 7),    # 星期（0 和 7 都表示周日）
+]
+
+WEEKDAY_NAMES = {0: '周日', 1: '周一', 2: '周二', 3: '周三', 4: '周四', 5: '周五', 6: '周六'}
+
+# 查找下次执行时间时最多向后搜索的天数（覆盖闰年 2 月 29 日这类稀有计划）
+MAX_SEARCH_DAYS = 366 * 8
+
+
+def _parse_field(field, low, high):
+    """
+    解析 cron 的单个字段
+
+    支持 *、数字、范围 a-b、步长 */n 和 a-b/n，以及逗号分隔的组合
+
+    Returns:
+        tuple: 升序排列的取值
+    """
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step_str = part.split('/', 1)
+            if not step_str.isdigit() or int(step_str) == 0:
+                raise ValueError(f"无效的步长: {field}")
+            step = int(step_str)
+
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start_str, end_str = part.split('-', 1)
+            if not start_str.isdigit() or not end_str.isdigit():
+                raise ValueError(f"无效的范围: {field}")
+            start, end = int(start_str), int(end_str)
+        elif part.isdigit():
+            start = end = int(part)
+            if step != 1:
+                end = high
+        else:
+            raise ValueError(f"无效的字段: {field}")
+
+        if start < low or end > high or start > end:
+            raise ValueError(f"字段超出范围 {low}-{high}: {field}")
+
+        values.update(range(start, end + 1, step))
+
+    return tuple(sorted(values))
+
+
+class CronSchedule:
+    """预编译的 5 段 cron 计划"""
+
+    def __init__(self, expression):
+        """
+        解析 cron 表达式
+
+        Args:
+            expression: 5 段 cron 表达式，如 "0 2 * * *"
+
+        Raises:
+            ValueError: 表达式格式不正确
+        """
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError(f"cron 表达式必须为 5 段: {expression}")
+
+        self.expression = ' '.join(parts)
+        self.minute_field, self.hour_field, self.day_field, self.month_field, self.weekday_field = parts
+
+        fields = [_parse_field(part, low, high) for part, (low, high) in zip(parts, FIELD_RANGES)]
+        self.minutes, self.hours, self.days, self.months = fields[:4]
+        self.weekdays = frozenset(day % 7 for day in fields[4])
+
+        # 按 cron 语义：日和星期都被限定时，满足任意一个即可；否则两者都须满足
+        self.day_restricted = self.day_field != '*'
+        self.weekday_restricted = self.weekday_field != '*'
+        self._day_set = frozenset(self.days)
+        self._month_set = frozenset(self.months)
+
+    @classmethod
+    def from_ui(cls, frequency, time_str='02:00', weekday='0', day_of_month='1'):
+        """
+        根据界面表单构建计划
+
+        Args:
+            frequency: disabled/daily/weekly/monthly
+            time_str: 执行时间 HH:MM
+            weekday: 星期几 (0-6，0 为周日)
+            day_of_month: 每月几号 (1-31)
+
+        Returns:
+            CronSchedule: 计划对象；frequency 为 disabled 时返回 None
+
+        Raises:
+            ValueError: 表单取值无效
+        """
+        if frequency == 'disabled':
+            return None
+
+        try:
+            hour, minute = (int(value) for value in (time_str or '').split(':'))
+        except ValueError:
+            raise ValueError(f"无效的时间: {time_str}")
+        if not (0 <= hour <= 23 and 0 <= minute <= 59):
+            raise ValueError(f"无效的时间: {time_str}")
+
+        if frequency == 'daily':
+            return parse_cron(f"{minute} {hour} * * *")
+        if frequency == 'weekly':
+            if not str(weekday).isdigit() or not 0 <= int(weekday) <= 6:
+                raise ValueError(f"无效的星期: {weekday}")
+            return parse_cron(f"{minute} {hour} * * {int(weekday)}")
+        if frequency == 'monthly':
+            if not str(day_of_month).isdigit() or not 1 <= int(day_of_month) <= 31:
+                raise ValueError(f"无效的日期: {day_of_month}")
+            return parse_cron(f"{minute} {hour} {int(day_of_month)} * *")
+
+        raise ValueError(f"未知的计划频率: {frequency}")
+
+    @property
+    def schedule_type(self):
+        """界面使用的计划频率: daily/weekly/monthly，其它形式为 custom"""
+        if len(self.minutes) != 1 or len(self.hours) != 1 or self.month_field != '*':
+            return 'custom'
+        if not self.day_restricted and self.weekday_restricted and len(self.weekdays) == 1:
+            return 'weekly'
+        if self.day_restricted and not self.weekday_restricted and len(self.days) == 1:
+            return 'monthly'
+        if not self.day_restricted and not self.weekday_restricted:
+            return 'daily'
+        return 'custom'
+
+    def to_ui(self):
+        """返回适合界面表单填充的字典"""
+        schedule_type = self.schedule_type
+        if schedule_type == 'custom':
+            return {'frequency': 'disabled'}  # 界面无法表示的格式
+
+        result = {
+            'frequency': schedule_type,
+            'time': f"{self.hours[0]:02d}:{self.minutes[0]:02d}"
+        }
+        if schedule_type == 'weekly':
+            result['weekday'] = str(next(iter(self.weekdays)))
+        elif schedule_type == 'monthly':
+            result['day_of_month'] = str(self.days[0])
+        return result
+
+    def humanize(self):
+        """返回人类可读的计划描述"""
+        schedule_type = self.schedule_type
+        if schedule_type == 'custom':
+            return "自定义计划"
+
+        time_str = f"{self.hours[0]:02d}:{self.minutes[0]:02d}"
+        if schedule_type == 'weekly':
+            return f"每周{WEEKDAY_NAMES.get(next(iter(self.weekdays)), '')} {time_str}"
+        if schedule_type == 'monthly':
+            return f"每月{self.days[0]}号 {time_str}"
+        return f"每天 {time_str}"
+
+    def matches_day(self, day):
+        """判断某一天是否需要执行"""
+        if day.month not in self._month_set:
+            return False
+
+        day_match = day.day in self._day_set
+        # date.weekday() 周一为 0，cron 周日为 0
+        weekday_match = (day.weekday() + 1) % 7 in self.weekdays
+
+        if self.day_restricted and self.weekday_restricted:
+            return day_match or weekday_match
+        return day_match and weekday_match
+
+    def next_fire_times(self, start=None, count=1):
+        """
+        计算 start 之后（不含）的下 count 次执行时间
+
+        按天跳过不匹配的日期，匹配日内用二分查找定位小时和分钟，
+        不会逐分钟枚举。
+
+        Args:
+            start: 起始时间，默认为当前时间
+            count: 需要的次数
+
+        Returns:
+            list: datetime 列表，按时间升序
+        """
+        start = (start or datetime.now()).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        results = []
+        day = start.date()
+
+        for _ in range(MAX_SEARCH_DAYS):
+            if self.matches_day(day):
+                same_day = day == start.date()
+                hour_index = bisect.bisect_left(self.hours, start.hour) if same_day else 0
+                for hour in self.hours[hour_index:]:
+                    minute_index = 0
+                    if same_day and hour == start.hour:
+                        minute_index = bisect.bisect_left(self.minutes, start.minute)
+                    for minute in self.minutes[minute_index:]:
+                        results.append(datetime(day.year, day.month, day.day, hour, minute))
+                        if len(results) >= count:
+                            return results
+            day += timedelta(days=1)
+
+        return results
+
+    def next_fire_time(self, start=None):
+        """计算下一次执行时间，没有则返回 None"""
+        times = self.next_fire_times(start, 1)
+        return times[0] if times else None
+
+    def __eq__(self, other):
+        return isinstance(other, CronSchedule) and self.expression == other.expression
+
+    def __hash__(self):
+        return hash(self.expression)
+
+    def __repr__(self):
+        return f"CronSchedule({self.expression!r})"
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_cron(expression):
+    """
+    解析 cron 表达式并缓存结果（同一表达式只解析一次）
+
+    Args:
+        expression: cron 表达式；空字符串或 'disabled' 表示不调度
+
+    Returns:
+        CronSchedule: 计划对象；不调度时返回 None
+
+    Raises:
+        ValueError: 表达式格式不正确
+    """
+    if not expression or expression == 'disabled':
+        return None
+    return CronSchedule(expression)
+
+
+def next_runs(schedules, start=None, count=1):
+    """
+    批量计算多个计划的下次执行时间
+
+    Args:
+        schedules: {计划键: cron 表达式}
+        start: 起始时间，默认为当前时间
+        count: 每个计划需要的次数
+
+    Returns:
+        dict: {计划键: [datetime, ...]}，未启用或无效的计划返回空列表
+    """
+    start = start or datetime.now()
+    result = {}
+    for key, expression in schedules.items():
+        try:
+            schedule = parse_cron(expression)
+        except ValueError:
+            schedule = None
+        result[key] = schedule.next_fire_times(start, count) if schedule else []
+    return result
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='备份计划工具')
+    subparsers = parser.add_subparsers(dest='command', help='子命令')
+
+    # next 命令
+    next_parser = subparsers.add_parser('next', help='计算下次执行时间')
+    next_parser.add_argument('expression', help='cron 表达式')
+    next_parser.add_argument('--count', type=int, default=5, help='计算次数')
+
+    # validate 命令
+    validate_parser = subparsers.add_parser('validate', help='校验 cron 表达式')
+    validate_parser.add_argument('expression', help='cron 表达式')
+
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'next':
+            schedule = parse_cron(args.expression)
+            if not schedule:
+                print("计划未启用")
+                return
+            print(schedule.humanize())
+            for fire_time in schedule.next_fire_times(count=args.count):
+                print(fire_time.strftime('%Y-%m-%d %H:%M'))
+        elif args.command == 'validate':
+            parse_cron(args.expression)
+            print("cron 表达式有效")
+        else:
+            parser.print_help()
+            sys.exit(1)
+    except ValueError as e:
+        print(f"错误: {str(e)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,42 @@
 #!/bin/bash
 
-# 脚本出错时立即退出（但管道命令中的部分失败不会导致退出）
+# 脚本出错时立即退出；管道中任一命令失败即视为整个管道失败（pg_dump 出错不会被 gzip 的成功掩盖）
 set -e
+set -o pipefail
 
 # --- 配置 ---
-CONFIG_MANAGER="/config_manager.py"
-SYSTEM_LOGGER="/app/system_logger.py"
-BACKUP_BASE_DIR="/backups"
+# 各路径可通过同名环境变量覆盖（性能测试时指向临时目录）
+CONFIG_MANAGER="${CONFIG_MANAGER:-/app/config_manager.py}"
+SYSTEM_LOGGER="${SYSTEM_LOGGER:-/app/system_logger.py}"
+BACKUP_LOGGER="${BACKUP_LOGGER:-/app/backup_logger.py}"
+BACKUP_LOCK="${BACKUP_LOCK:-/app/backup_lock.py}"
+NOTIFICATION_OUTBOX="${NOTIFICATION_OUTBOX:-/app/notification_outbox.py}"
+BACKUP_ARTIFACTS="${BACKUP_ARTIFACTS:-/app/backup_artifacts.py}"
+ARTIFACT_INDEX="${ARTIFACT_INDEX:-/app/artifact_index.py}"
+THROTTLE="${THROTTLE:-/app/throttle.py}"
+DUMP_SCHEDULER="${DUMP_SCHEDULER:-/app/dump_scheduler.py}"
+ARTIFACT_CRYPTO="${ARTIFACT_CRYPTO:-/app/artifact_crypto.py}"
+STORAGE="${STORAGE:-/app/storage.py}"
+RECOMPRESS="${RECOMPRESS:-/app/recompress.py}"
+BACKUP_BASE_DIR="${BACKUP_BASE_DIR:-/backups}"
+# 常驻备份代理的套接字（见 agent_daemon.py），代理未运行时直接启动 Python 进程
+AGENT_SOCKET="${AGENT_SOCKET:-/run/backup-agent.sock}"
 RETENTION_DAYS=7 # 默认备份保留天数
+# PostgreSQL 单库备份格式：plain 为 gzip 压缩的 SQL；custom 为 pg_dump -Fc，可用 pg_restore -j 并行恢复
+PG_DUMP_FORMAT="${PG_DUMP_FORMAT:-plain}"
+# 转储和压缩进程的 CPU / IO 优先级，减少与本机其他负载的争用（DUMP_NICE=0 且 DUMP_IONICE_CLASS=0 时不调整）
+# ionice 只在 BFQ 等支持 IO 优先级的调度器下生效；源数据库服务端的负载由 throttle.py 的读取限速控制
+DUMP_NICE="${DUMP_NICE:-10}"
+DUMP_IONICE_CLASS="${DUMP_IONICE_CLASS:-2}"  # 1 实时 / 2 尽力而为 / 3 空闲
+DUMP_IONICE_LEVEL="${DUMP_IONICE_LEVEL:-7}"  # 尽力而为级别内的优先级，0 最高 7 最低
+# "所有数据库"备份的最大并发转储数（0 表示按容器可用的 CPU 数），实际并发在此范围内自动调整
+DUMP_MAX_JOBS="${DUMP_MAX_JOBS:-0}"
+# 调整并发时是否参考源数据库的查询延迟（需要 psycopg2，未安装时自动忽略）
+DUMP_PROBE_SOURCE="${DUMP_PROBE_SOURCE:-true}"
+# 备份文件加密：true 时压缩后的数据在写入磁盘前用用户的数据密钥分块加密，文件名追加 .enc（见 artifact_crypto.py）
+BACKUP_ENCRYPTION="${BACKUP_ENCRYPTION:-false}"
+# 远程存储（local / s3，见 storage.py）：配置后备份在写入本地文件的同时并发分片上传异地副本，为空时只保存在本地
+BACKUP_STORAGE="${BACKUP_STORAGE:-}"
 DATE=$(date +%Y%m%d_%H%M%S)
 
 # 从第一个命令行参数读取要备份的数据库类型
@@ -30,6 +59,87 @@ fi
 # 确保用户备份目录存在
 mkdir -p "$BACKUP_DIR"
 
+# 读取配置时只取当前用户的数据库连接和备份计划
+USER_FILTER_ARGS=()
+if [[ -n "$USER_ID" ]]; then
+    USER_FILTER_ARGS=(--user_id "$USER_ID")
+fi
+
+# 转储和压缩命令的前缀（nice / ionice），不可用或无权限时跳过对应的调整
+LOW_PRIORITY=()
+if [[ "$DUMP_NICE" != "0" ]] && nice -n "$DUMP_NICE" true 2>/dev/null; then
+    LOW_PRIORITY+=(nice -n "$DUMP_NICE")
+fi
+if [[ "$DUMP_IONICE_CLASS" != "0" ]] && command -v ionice > /dev/null 2>&1; then
+    IONICE_ARGS=(-c "$DUMP_IONICE_CLASS")
+    if [[ "$DUMP_IONICE_CLASS" != "3" ]]; then
+        IONICE_ARGS+=(-n "$DUMP_IONICE_LEVEL")
+    fi
+    if ionice "${IONICE_ARGS[@]}" true 2>/dev/null; then
+        LOW_PRIORITY+=(ionice "${IONICE_ARGS[@]}")
+    fi
+fi
+
+# 加密备份的文件名后缀、选择数据密钥的参数（未指定用户时使用共享密钥），以及传给 artifact_index.py / dump_scheduler.py 的加密参数
+ENCRYPT_SUFFIX=""
+ENCRYPT_KEY_ARGS=()
+ENCRYPT_ARGS=()
+if [[ "$BACKUP_ENCRYPTION" == "true" ]]; then
+    ENCRYPT_SUFFIX=".enc"
+    if [[ -n "$USER_ID" ]]; then
+        ENCRYPT_KEY_ARGS=(--user-id "$USER_ID")
+    fi
+    ENCRYPT_ARGS=(--encrypt "${ENCRYPT_KEY_ARGS[@]}")
+fi
+
+# 当前连接配置了限速规则时为连接 ID（见 throttle_for_connection），转储和写入经过 throttle.py 限速
+THROTTLE_CONN=""
+
+# 本次任务的通知批次 ID：同一任务的结果在通知中合并汇总
+NOTIFY_BATCH_KEY="${1:-all}_${DATE}_$$"
+# 后台写入备份历史的进程，退出前等待它们完成后再提交汇总通知
+HISTORY_PIDS=()
+
+# --- 辅助命令 ---
+# 执行 Python 辅助模块的命令: agent_call <模块名> [参数...]
+# 优先通过常驻代理执行（省去每次启动 Python 进程的开销），代理不可用时直接运行模块脚本
+agent_call() {
+    local module="$1"
+    shift
+
+    if [[ -S "$AGENT_SOCKET" ]] && command -v nc > /dev/null 2>&1; then
+        local response
+        response=$(printf '%s\0' "$module" "$@" | nc -NU "$AGENT_SOCKET" 2>/dev/null) || response=""
+        local status="${response%%$'\n'*}"
+        # 只有未收到响应时才回退，避免同一命令执行两次
+        if [[ "$status" =~ ^[0-9]+$ ]]; then
+            if [[ "$response" == *$'\n'* && -n "${response#*$'\n'}" ]]; then
+                printf '%s\n' "${response#*$'\n'}"
+            fi
+            return "$status"
+        elif [[ -n "$response" ]]; then
+            echo "[$(date)] 备份代理响应异常: $module $1" >&2
+            return 1
+        fi
+    fi
+
+    local script
+    case "$module" in
+        config_manager) script="$CONFIG_MANAGER" ;;
+        system_logger) script="$SYSTEM_LOGGER" ;;
+        backup_logger) script="$BACKUP_LOGGER" ;;
+        backup_lock) script="$BACKUP_LOCK" ;;
+        notification_outbox) script="$NOTIFICATION_OUTBOX" ;;
+        backup_artifacts) script="$BACKUP_ARTIFACTS" ;;
+        throttle) script="$THROTTLE" ;;
+        *)
+            echo "[$(date)] 未知的辅助模块: $module" >&2
+            return 2
+            ;;
+    esac
+    python3 "$script" "$@"
+}
+
 # --- 系统日志函数 ---
 log_system() {
     local log_type="$1"  # info/warning/error/debug
@@ -38,13 +148,123 @@ log_system() {
     local details="$4"
 
     # 记录到数据库（后台执行，输出到 /dev/null）
-    python3 "$SYSTEM_LOGGER" log \
+    agent_call system_logger log \
         --type "$log_type" \
         --category "$category" \
         --message "$message" \
         --details "$details" > /dev/null 2>&1 &
 }
 
+# --- 计时与字节统计 ---
+# 从 $1（微秒时间戳，取自 ${EPOCHREALTIME/[.,]/}）到现在经过的秒数
+elapsed_since() {
+    local us=$(( ${EPOCHREALTIME/[.,]/} - $1 ))
+    printf '%d.%06d' $((us / 1000000)) $((us % 1000000))
+}
+
+# --- 限速与优先级 ---
+# 连接 $1 配置了限速规则时设置 THROTTLE_CONN，否则清空（不在时间窗口内的规则由 throttle.py 按时放行）
+throttle_for_connection() {
+    THROTTLE_CONN=""
+    if [[ -n "$1" ]] && agent_call throttle enabled --connection "$1" > /dev/null 2>&1; then
+        THROTTLE_CONN="$1"
+        echo "[$(date)] 连接 $1 已配置限速规则"
+    fi
+}
+
+# 以较低优先级执行转储命令，配置了限速时输出按读取速率限速
+run_dump() {
+    if [[ -n "$THROTTLE_CONN" ]]; then
+        "${LOW_PRIORITY[@]}" "$@" | python3 "$THROTTLE" pipe --connection "$THROTTLE_CONN" --scope read
+    else
+        "${LOW_PRIORITY[@]}" "$@"
+    fi
+}
+
+# 写入备份文件前的处理：启用加密时先分块加密，配置了限速时按写入速率限速，都没有时原样输出
+encode_artifact() {
+    if [[ "$BACKUP_ENCRYPTION" == "true" && -n "$THROTTLE_CONN" ]]; then
+        "${LOW_PRIORITY[@]}" python3 "$ARTIFACT_CRYPTO" encrypt "${ENCRYPT_KEY_ARGS[@]}" \
+            | python3 "$THROTTLE" pipe --connection "$THROTTLE_CONN" --scope write
+    elif [[ "$BACKUP_ENCRYPTION" == "true" ]]; then
+        "${LOW_PRIORITY[@]}" python3 "$ARTIFACT_CRYPTO" encrypt "${ENCRYPT_KEY_ARGS[@]}"
+    elif [[ -n "$THROTTLE_CONN" ]]; then
+        python3 "$THROTTLE" pipe --connection "$THROTTLE_CONN" --scope write
+    else
+        cat
+    fi
+}
+
+# 把标准输入经 encode_artifact 处理后追加写入备份文件 $1，配置了远程存储时同时上传
+store_artifact() {
+    local target="$1"
+    if [[ -n "$BACKUP_STORAGE" ]]; then
+        encode_artifact | python3 "$STORAGE" store "$target"
+    else
+        encode_artifact >> "$target"
+    fi
+}
+
+# 删除失败的备份文件（含分段索引和字节计数），配置了远程存储时同时删除已上传的副本
+discard_artifact() {
+    local target="$1"
+    rm -f "$target" "${target}.idx" "${target}.rawsize"
+    if [[ -n "$BACKUP_STORAGE" ]]; then
+        python3 "$STORAGE" delete "$target" > /dev/null 2>&1 || true
+    fi
+}
+
+# 压缩标准输入写入 $1（$2 为 append 时追加，加密备份不能追加），压缩前的字节数追加到 $1.rawsize
+gzip_counted() {
+    local target="$1"
+    local mode="${2:-}"
+    if [[ "$mode" != "append" ]]; then
+        rm -f "$target" "${target}.rawsize"
+    fi
+    if [[ -n "$THROTTLE_CONN" || "$BACKUP_ENCRYPTION" == "true" || -n "$BACKUP_STORAGE" ]]; then
+        tee >(wc -c >> "${target}.rawsize") | "${LOW_PRIORITY[@]}" gzip | store_artifact "$target"
+    else
+        tee >(wc -c >> "${target}.rawsize") | "${LOW_PRIORITY[@]}" gzip >> "$target"
+    fi
+}
+
+# 压缩标准输入写入 $2 并为每个数据库、每个表生成分段索引 $2.idx（见 artifact_index.py），
+# 用于"所有数据库"备份，恢复或下载单个数据库时不必解压整个文件。$1 为 SQL 方言，其余参数传给 artifact_index.py
+gzip_indexed() {
+    local dialect="$1" target="$2"
+    shift 2
+    local extra_args=()
+    if [[ -n "$THROTTLE_CONN" ]]; then
+        extra_args+=(--throttle-connection "$THROTTLE_CONN")
+    fi
+    if [[ -n "$BACKUP_STORAGE" ]]; then
+        extra_args+=(--upload-as "$target")
+    fi
+    "${LOW_PRIORITY[@]}" python3 "$ARTIFACT_INDEX" gzip --dialect "$dialect" --output "$target" \
+        --raw-size-file "${target}.rawsize" "${extra_args[@]}" "${ENCRYPT_ARGS[@]}" "$@"
+}
+
+# 读取并删除 gzip_counted 记录的压缩前字节数，$2 为写入次数（字节计数进程可能稍晚于管道结束）
+read_raw_size() {
+    local counter="$1.rawsize"
+    local expected="${2:-1}"
+    local waited=0
+    local total=0
+    local counts=()
+    while [[ $waited -lt 100 ]]; do
+        counts=()
+        [[ -f "$counter" ]] && mapfile -t counts < "$counter"
+        [[ ${#counts[@]} -ge $expected ]] && break
+        sleep 0.05
+        waited=$((waited + 1))
+    done
+    for size in "${counts[@]}"; do
+        total=$((total + size))
+    done
+    rm -f "$counter"
+    echo "$total"
+}
+
 # --- 日志记录函数 ---
 log_history() {
     local db_type="$1"
@@ -53,6 +273,9 @@ log_history() {
     local message="$4"
     local log_file="$5"
     local backup_file="$6"
+    local duration="${7:-}"
+    local raw_size="${8:-}"
+    local connection_id="${9:-}"
 
     # 如果提供了日志文件路径，只取文件名部分
     if [[ -n "$log_file" ]]; then
@@ -89,7 +312,25 @@ log_history() {
         user_id_arg="--user-id $USER_ID"
     fi
 
-    python3 /app/backup_logger.py log \
+    # 耗时和压缩前字节数用于 /metrics 统计
+    local metric_args=()
+    if [[ -n "$duration" ]]; then
+        metric_args+=(--duration "$duration")
+    fi
+    if [[ -n "$raw_size" && "$raw_size" != "0" ]]; then
+        metric_args+=(--raw-size "$raw_size")
+    fi
+
+    # 成功的备份文件记录到 backup_artifacts，供恢复时定位
+    local artifact_args=()
+    if [[ -n "$backup_file" ]]; then
+        artifact_args+=(--path "$BACKUP_DIR/$backup_file")
+    fi
+    if [[ -n "$connection_id" ]]; then
+        artifact_args+=(--connection-id "$connection_id")
+    fi
+
+    agent_call backup_logger log \
         --type "$db_type" \
         --name "$db_name" \
         --trigger "$trigger_type" \
@@ -98,37 +339,30 @@ log_history() {
         --file "$backup_file" \
         --size "$file_size" \
         --log "$log_file" \
+        --notify \
+        --batch-key "$NOTIFY_BATCH_KEY" \
+        "${metric_args[@]}" \
+        "${artifact_args[@]}" \
         $user_id_arg > /dev/null 2>&1 &
-
-
-    # 发送通知
-    send_backup_notification "$db_type" "$status" "$message" "$trigger_type" "$backup_file"
+    HISTORY_PIDS+=($!)
 }
 
-# --- 通知函数 ---
-send_backup_notification() {
-    local db_type="$1"
-    local status="$2"
-    local message="$3"
-    local trigger_type="$4"
-    local backup_file="$5"
-
-    # 检查通知模块是否存在
-    if [[ ! -f "/app/notifications.py" ]]; then
-        return 0
-    fi
-
-    # 调用通知模块（后台执行，不阻塞备份流程）
-    local notify_args="--type \"$db_type\" --status \"$status\" --message \"$message\" --trigger \"$trigger_type\""
-    if [[ -n "$backup_file" ]]; then
-        notify_args="$notify_args --file \"$backup_file\""
+# --- 备份函数 ---
+# 转储单个 PostgreSQL 数据库到 $5
+# custom 格式由 pg_dump 自行压缩，不经过 gzip，也不统计压缩前的字节数
+dump_postgresql_database() {
+    local host="$1" port="$2" user="$3" dbname="$4" target="$5"
+    if [[ "$target" == *.dump* ]] && [[ -n "$THROTTLE_CONN" || "$BACKUP_ENCRYPTION" == "true" || -n "$BACKUP_STORAGE" ]]; then
+        # custom 格式的输出已压缩，读取和写入速率都按输出字节计算
+        rm -f "$target"
+        run_dump pg_dump -h "$host" -p "$port" -U "$user" -d "$dbname" -Fc | store_artifact "$target"
+    elif [[ "$target" == *.dump ]]; then
+        "${LOW_PRIORITY[@]}" pg_dump -h "$host" -p "$port" -U "$user" -d "$dbname" -Fc -f "$target"
+    else
+        run_dump pg_dump -h "$host" -p "$port" -U "$user" -d "$dbname" | gzip_counted "$target"
     fi
-
-    # 在后台执行通知发送，忽略错误以免影响备份任务（输出到 /dev/null）
-    eval "python3 /app/notifications.py $notify_args" > /dev/null 2>&1 &
 }
 
-# --- 备份函数 ---
 backup_postgresql() {
     local trigger_type=$1
     local specific_db_id=$2  # 可选：只备份指定的数据库
@@ -141,7 +375,7 @@ backup_postgresql() {
         log_system "info" "backup" "开始 PostgreSQL 备份任务" "触发方式: $trigger_type"
     fi
 
-    pg_dbs=$(python3 "$CONFIG_MANAGER" get_dbs --db_type postgresql 2>/dev/null)
+    pg_dbs=$(agent_call config_manager get_dbs --db_type postgresql "${USER_FILTER_ARGS[@]}" 2>/dev/null)
 
     if [[ -z "$pg_dbs" ]]; then
         echo "[$(date)] 未配置PostgreSQL数据库，跳过备份。"
@@ -157,45 +391,68 @@ backup_postgresql() {
         if [[ -n "$specific_db_id" && "$conn_id" != "$specific_db_id" ]]; then
             continue
         fi
+        throttle_for_connection "$conn_id"
 
         if [ -z "$dbname" ]; then # 备份所有数据库
-            backup_file="${BACKUP_DIR}/pg_all_${DATE}.sql.gz"
+            backup_file="${BACKUP_DIR}/pg_all_${DATE}.sql.gz${ENCRYPT_SUFFIX}"
             echo "[$(date)] > 正在备份所有 PostgreSQL 数据库到 ${backup_file}..."
             log_system "info" "backup" "开始备份所有 PostgreSQL 数据库" "目标文件: ${backup_file##*/}"
 
             export PGPASSWORD=$password
+            local started_us=${EPOCHREALTIME/[.,]/}
 
             # 逐个备份所有用户数据库（排除系统模板数据库）
-            databases=$(psql -h "$host" -p "$port" -U "$user" -d "postgres" -tAc "SELECT datname FROM pg_database WHERE datistemplate = false ORDER BY datname" 2>/dev/null)
+            databases=$(psql -h "$host" -p "$port" -U "$user" -d "postgres" -tAc "SELECT datname FROM pg_database WHERE datistemplate = false ORDER BY datname" 2>/dev/null) || databases=""
 
             if [[ -n "$databases" ]]; then
                 # 创建临时文件
-                local temp_file="${BACKUP_DIR}/pg_all_${DATE}.tmp.sql.gz"
-
-                # 逐个转储数据库并合并
-                first=true
-                for db in $databases; do
-                    echo "[$(date)] >> 备份数据库: $db"
-                    if $first; then
-                        # 第一个数据库，直接创建文件
-                        pg_dump -h "$host" -p "$port" -U "$user" -d "$db" 2>/dev/null | gzip > "$temp_file"
-                        first=false
-                    else
-                        # 后续数据库，追加到文件
-                        pg_dump -h "$host" -p "$port" -U "$user" -d "$db" 2>/dev/null | gzip >> "$temp_file"
+                local temp_file="${BACKUP_DIR}/pg_all_${DATE}.tmp.sql.gz${ENCRYPT_SUFFIX}"
+
+                # 各数据库并发转储后按顺序合并为一个文件，任一数据库转储失败则整个备份记为失败
+                # 并发数由 dump_scheduler.py 根据转储吞吐量、磁盘写入延迟和源数据库延迟自动调整
+                rm -f "$temp_file" "${temp_file}.idx" "${temp_file}.rawsize"
+                local failed_dbs=()
+                local scheduler_args=(--max-jobs "$DUMP_MAX_JOBS" --raw-size-file "${temp_file}.rawsize" "${ENCRYPT_ARGS[@]}")
+                if [[ -n "$THROTTLE_CONN" ]]; then
+                    scheduler_args+=(--connection "$THROTTLE_CONN")
+                fi
+                if [[ "$DUMP_PROBE_SOURCE" == "true" ]]; then
+                    scheduler_args+=(--probe-source)
+                fi
+                if [[ -n "$BACKUP_STORAGE" ]]; then
+                    # 临时文件改名前就开始上传，对象键按最终文件名计算
+                    scheduler_args+=(--upload-as "$backup_file")
+                fi
+                local scheduler_output
+                if ! scheduler_output=$("${LOW_PRIORITY[@]}" python3 "$DUMP_SCHEDULER" postgresql \
+                        --host "$host" --port "$port" --user "$user" --output "$temp_file" \
+                        "${scheduler_args[@]}" --databases $databases); then
+                    mapfile -t failed_dbs < <(printf '%s' "$scheduler_output" | grep -v '^$' || true)
+                    if [[ ${#failed_dbs[@]} -eq 0 ]]; then
+                        failed_dbs=("（转储调度失败）")
                     fi
-                done
+                fi
+                local raw_size=$(read_raw_size "$temp_file")
+
+                if [[ ${#failed_dbs[@]} -gt 0 ]]; then
+                    log_history "PostgreSQL" "$trigger_type" "失败" "所有数据库备份失败，转储出错的数据库: ${failed_dbs[*]}" "" "" "$(elapsed_since "$started_us")"
+                    log_system "error" "backup" "PostgreSQL 所有数据库备份失败" "主机: ${host}, 转储出错的数据库: ${failed_dbs[*]}"
+                    rm -f "$temp_file" "${temp_file}.idx"
+                    unset PGPASSWORD
+                    continue
+                fi
 
                 # 重命名为最终文件
                 mv "$temp_file" "$backup_file"
+                mv "${temp_file}.idx" "${backup_file}.idx" 2>/dev/null || true
 
                 if [[ -f "$backup_file" && -s "$backup_file" ]]; then
-                    log_history "PostgreSQL" "$trigger_type" "成功" "所有数据库已备份到 ${backup_file##*/}" "" "${backup_file##*/}"
+                    log_history "PostgreSQL" "$trigger_type" "成功" "所有数据库已备份到 ${backup_file##*/}" "" "${backup_file##*/}" "$(elapsed_since "$started_us")" "$raw_size" "$conn_id"
                     log_system "info" "backup" "PostgreSQL 所有数据库备份成功" "文件: ${backup_file##*/}"
                 else
-                    log_history "PostgreSQL" "$trigger_type" "失败" "所有数据库备份失败" "" ""
+                    log_history "PostgreSQL" "$trigger_type" "失败" "所有数据库备份失败" "" "" "$(elapsed_since "$started_us")"
                     log_system "error" "backup" "PostgreSQL 所有数据库备份失败" "主机: ${host}"
-                    rm -f "$backup_file"
+                    discard_artifact "$backup_file"
                 fi
             else
                 log_history "PostgreSQL" "$trigger_type" "失败" "无法获取数据库列表" "" ""
@@ -203,19 +460,28 @@ backup_postgresql() {
             fi
             unset PGPASSWORD
         else # 备份单个数据库
-            backup_file="${BACKUP_DIR}/pg_${dbname}_${DATE}.sql.gz"
+            if [[ "$PG_DUMP_FORMAT" == "custom" ]]; then
+                backup_file="${BACKUP_DIR}/pg_${dbname}_${DATE}.dump${ENCRYPT_SUFFIX}"
+            else
+                backup_file="${BACKUP_DIR}/pg_${dbname}_${DATE}.sql.gz${ENCRYPT_SUFFIX}"
+            fi
 
             echo "[$(date)] > 正在备份 ${dbname} 到 ${backup_file}..."
             log_system "info" "backup" "开始备份数据库: $dbname" "目标文件: ${backup_file##*/}"
 
             export PGPASSWORD=$password
-            if pg_dump -h "$host" -p "$port" -U "$user" -d "$dbname" | gzip > "$backup_file"; then
-                log_history "PostgreSQL" "$trigger_type" "成功" "数据库 ${dbname} 已备份到 ${backup_file##*/}" "" "${backup_file##*/}"
+            local started_us=${EPOCHREALTIME/[.,]/}
+            if dump_postgresql_database "$host" "$port" "$user" "$dbname" "$backup_file"; then
+                local raw_size=""
+                if [[ "$backup_file" != *.dump* ]]; then
+                    raw_size=$(read_raw_size "$backup_file")
+                fi
+                log_history "PostgreSQL" "$trigger_type" "成功" "数据库 ${dbname} 已备份到 ${backup_file##*/}" "" "${backup_file##*/}" "$(elapsed_since "$started_us")" "$raw_size" "$conn_id"
                 log_system "info" "backup" "PostgreSQL 数据库备份成功" "数据库: ${dbname}, 文件: ${backup_file##*/}"
             else
-                log_history "PostgreSQL" "$trigger_type" "失败" "数据库 ${dbname} 备份失败" "" ""
+                log_history "PostgreSQL" "$trigger_type" "失败" "数据库 ${dbname} 备份失败" "" "" "$(elapsed_since "$started_us")"
                 log_system "error" "backup" "PostgreSQL 数据库备份失败" "数据库: ${dbname}, 主机: ${host}"
-                rm -f "$backup_file" # 删除失败的备份文件
+                discard_artifact "$backup_file" # 删除失败的备份文件
             fi
             unset PGPASSWORD
         fi
@@ -234,7 +500,7 @@ backup_mysql() {
         log_system "info" "backup" "开始 MySQL 备份任务" "触发方式: $trigger_type"
     fi
 
-    mysql_dbs=$(python3 "$CONFIG_MANAGER" get_dbs --db_type mysql 2>/dev/null)
+    mysql_dbs=$(agent_call config_manager get_dbs --db_type mysql "${USER_FILTER_ARGS[@]}" 2>/dev/null)
 
     if [[ -z "$mysql_dbs" ]]; then
         echo "[$(date)] 未配置MySQL数据库，跳过备份。"
@@ -250,30 +516,33 @@ backup_mysql() {
         if [[ -n "$specific_db_id" && "$conn_id" != "$specific_db_id" ]]; then
             continue
         fi
+        throttle_for_connection "$conn_id"
 
         if [ -z "$dbname" ]; then # 备份所有数据库
-            backup_file="${BACKUP_DIR}/mysql_all_${DATE}.sql.gz"
+            backup_file="${BACKUP_DIR}/mysql_all_${DATE}.sql.gz${ENCRYPT_SUFFIX}"
             echo "[$(date)] > 正在备份所有 MySQL 数据库到 ${backup_file}..."
             log_system "info" "backup" "开始备份所有 MySQL 数据库" "目标文件: ${backup_file##*/}"
-            if mysqldump -h "$host" -P "$port" -u "$user" --password="$password" --all-databases | gzip > "$backup_file"; then
-                log_history "MySQL" "$trigger_type" "成功" "所有数据库已备份到 ${backup_file##*/}" "" "${backup_file##*/}"
+            local started_us=${EPOCHREALTIME/[.,]/}
+            if run_dump mysqldump -h "$host" -P "$port" -u "$user" --password="$password" --all-databases | gzip_indexed mysql "$backup_file"; then
+                log_history "MySQL" "$trigger_type" "成功" "所有数据库已备份到 ${backup_file##*/}" "" "${backup_file##*/}" "$(elapsed_since "$started_us")" "$(read_raw_size "$backup_file")" "$conn_id"
                 log_system "info" "backup" "MySQL 所有数据库备份成功" "文件: ${backup_file##*/}"
             else
-                log_history "MySQL" "$trigger_type" "失败" "所有数据库备份失败" "" ""
+                log_history "MySQL" "$trigger_type" "失败" "所有数据库备份失败" "" "" "$(elapsed_since "$started_us")"
                 log_system "error" "backup" "MySQL 所有数据库备份失败" "主机: ${host}"
-                rm -f "$backup_file"
+                discard_artifact "$backup_file"
             fi
         else # 备份单个数据库
-            backup_file="${BACKUP_DIR}/mysql_${dbname}_${DATE}.sql.gz"
+            backup_file="${BACKUP_DIR}/mysql_${dbname}_${DATE}.sql.gz${ENCRYPT_SUFFIX}"
             echo "[$(date)] > 正在备份数据库 ${dbname} 到 ${backup_file}..."
             log_system "info" "backup" "开始备份 MySQL 数据库: $dbname" "目标文件: ${backup_file##*/}"
-            if mysqldump -h "$host" -P "$port" -u "$user" --password="$password" --databases "$dbname" | gzip > "$backup_file"; then
-                log_history "MySQL" "$trigger_type" "成功" "数据库 ${dbname} 已备份到 ${backup_file##*/}" "" "${backup_file##*/}"
+            local started_us=${EPOCHREALTIME/[.,]/}
+            if run_dump mysqldump -h "$host" -P "$port" -u "$user" --password="$password" --databases "$dbname" | gzip_counted "$backup_file"; then
+                log_history "MySQL" "$trigger_type" "成功" "数据库 ${dbname} 已备份到 ${backup_file##*/}" "" "${backup_file##*/}" "$(elapsed_since "$started_us")" "$(read_raw_size "$backup_file")" "$conn_id"
                 log_system "info" "backup" "MySQL 数据库备份成功" "数据库: ${dbname}, 文件: ${backup_file##*/}"
             else
-                log_history "MySQL" "$trigger_type" "失败" "数据库 ${dbname} 备份失败" "" ""
+                log_history "MySQL" "$trigger_type" "失败" "数据库 ${dbname} 备份失败" "" "" "$(elapsed_since "$started_us")"
                 log_system "error" "backup" "MySQL 数据库备份失败" "数据库: ${dbname}, 主机: ${host}"
-                rm -f "$backup_file"
+                discard_artifact "$backup_file"
             fi
         fi
     done
@@ -284,27 +553,50 @@ cleanup_old_backups() {
     echo "[$(date)] 正在清理旧备份..."
 
     # 获取 PostgreSQL 的保留天数作为默认值
-    local retention_days=$(python3 "$CONFIG_MANAGER" get_retention --db_type postgresql 2>/dev/null || echo 7)
+    local retention_days=$(agent_call config_manager get_retention --db_type postgresql "${USER_FILTER_ARGS[@]}" 2>/dev/null || echo 7)
 
     echo "保留最近 ${retention_days} 天的备份。"
     log_system "info" "cleanup" "开始清理旧备份" "保留天数: ${retention_days}"
 
-    local deleted_count=$(find "$BACKUP_DIR" -name "*.sql.gz" -o -name "*.tar.gz" -mtime +$((retention_days - 1)) -print | wc -l)
-    find "$BACKUP_DIR" -name "*.sql.gz" -o -name "*.tar.gz" -mtime +$((retention_days - 1)) -exec rm -f {} \;
+    # 本地和远程存储的旧备份都由 storage.py 按保留天数清理（远程保留天数见 BACKUP_REMOTE_RETENTION_DAYS）
+    local deleted
+    deleted=$(python3 "$STORAGE" prune --dir "$BACKUP_DIR" --days "$retention_days" 2>&1) || true
 
-    log_system "info" "cleanup" "清理旧备份完成" "删除了 ${deleted_count} 个文件"
+    log_system "info" "cleanup" "清理旧备份完成" "${deleted}"
 
-    # 清理数据库中的旧系统日志（保留30天）
-    echo "[$(date)] 正在清理数据库旧系统日志..."
-    local log_retention_days=30
-    local deleted_logs=$(python3 "$SYSTEM_LOGGER" clear --days $log_retention_days 2>/dev/null || echo 0)
-    log_system "info" "cleanup" "清理系统日志完成" "删除了 ${deleted_logs} 条系统日志，保留最近 ${log_retention_days} 天"
+    # 后台整理备份文件，两个任务依次执行（共用一把锁，见 backup_artifacts.py）:
+    # 较旧的 gzip 备份重新压缩为 zstd（等本次备份释放备份锁后才开始，见 recompress.py）；
+    # 配置了冷层时，把热层中较旧的备份限速移到冷层
+    if [ -n "${BACKUP_RECOMPRESS_AFTER_DAYS:-}" ] || [ -n "${BACKUP_COLD_DIR:-}" ]; then
+        (
+            if [ -n "${BACKUP_RECOMPRESS_AFTER_DAYS:-}" ]; then
+                recompressed=$("${LOW_PRIORITY[@]}" python3 "$RECOMPRESS" run 2>/dev/null || echo 0)
+                log_system "info" "cleanup" "重新压缩旧备份完成" "${recompressed}"
+            fi
+            if [ -n "${BACKUP_COLD_DIR:-}" ]; then
+                migrated=$("${LOW_PRIORITY[@]}" python3 "$BACKUP_ARTIFACTS" migrate 2>/dev/null || echo 0)
+                log_system "info" "cleanup" "移到冷层完成" "${migrated}"
+            fi
+        ) > /dev/null 2>&1 &
+    fi
 
-    # 清理数据库中的旧备份历史记录（保留30天）
-    echo "[$(date)] 正在清理数据库旧备份历史记录..."
+    # 系统日志超过30天的移入按月归档分区（保留12个月），备份历史记录保留30天，
+    # 并删除文件已被上面清理掉的备份文件记录
+    # 分批处理并在批次间让出写锁，放到后台慢慢执行，不阻塞本次备份任务退出
+    # 这些命令耗时较长，直接启动 Python 进程，不占用备份代理（代理中的命令依次执行）
+    echo "[$(date)] 正在后台归档旧系统日志并清理旧备份历史记录..."
+    local log_hot_days=30
+    local log_archive_months=12
     local backup_history_retention_days=30
-    local deleted_backup_history=$(python3 /app/backup_logger.py clear --days $backup_history_retention_days 2>/dev/null || echo 0)
-    log_system "info" "cleanup" "清理备份历史完成" "删除了 ${deleted_backup_history} 条备份历史记录，保留最近 ${backup_history_retention_days} 天"
+    (
+        archived_logs=$(python3 "$SYSTEM_LOGGER" archive --hot-days $log_hot_days --keep-months $log_archive_months 2>/dev/null || echo 0)
+        log_system "info" "cleanup" "归档系统日志完成" "${archived_logs}，热库保留最近 ${log_hot_days} 天，归档保留 ${log_archive_months} 个月"
+
+        deleted_backup_history=$(python3 "$BACKUP_LOGGER" clear --days $backup_history_retention_days 2>/dev/null || echo 0)
+        log_system "info" "cleanup" "清理备份历史完成" "${deleted_backup_history}"
+
+        python3 "$BACKUP_ARTIFACTS" prune 2>/dev/null || true
+    ) > /dev/null 2>&1 &
 }
 
 # --- 主逻辑 ---
@@ -324,7 +616,7 @@ main() {
     fi
 
     # 尝试获取备份锁
-    if ! python3 /backup_lock.py acquire --db_type "$DB_TYPE_TO_BACKUP" --lock_id "$lock_id" 2>/dev/null; then
+    if ! agent_call backup_lock acquire --db_type "$DB_TYPE_TO_BACKUP" --lock_id "$lock_id" 2>/dev/null; then
         echo "[$(date)] 无法获取 $DB_TYPE_TO_BACKUP 备份锁，可能已有备份任务在运行中"
         log_system "warning" "backup" "$DB_TYPE_TO_BACKUP 备份任务被跳过（已有任务运行中）" "触发方式: $trigger_type"
         exit 1
@@ -357,12 +649,18 @@ release_backup_lock_and_exit() {
     local exit_code=$?
 
     # 释放备份锁
-    if python3 /backup_lock.py release --db_type "$DB_TYPE_TO_BACKUP" 2>/dev/null; then
+    if agent_call backup_lock release --db_type "$DB_TYPE_TO_BACKUP" 2>/dev/null; then
         echo "[$(date)] 已释放 $DB_TYPE_TO_BACKUP 备份锁"
     else
         echo "[$(date)] 释放 $DB_TYPE_TO_BACKUP 备份锁失败"
     fi
 
+    # 等待备份历史写入完成，然后让本次任务的汇总通知立即发送
+    if [[ ${#HISTORY_PIDS[@]} -gt 0 ]]; then
+        wait "${HISTORY_PIDS[@]}" 2>/dev/null || true
+        agent_call notification_outbox flush --batch-key "$NOTIFY_BATCH_KEY" > /dev/null 2>&1 || true
+    fi
+
     # 恢复默认的退出行为
     trap - EXIT INT TERM
 
@@ -1,6 +1,6 @@
 #!/bin/bash
 
-CONFIG_MANAGER="/config_manager.py"
+CONFIG_MANAGER="/app/config_manager.py"
 
 # 函数：从数据库更新 crontab
 update_cron_from_config() {
@@ -11,8 +11,12 @@ update_cron_from_config() {
     echo "SHELL=/bin/bash" > "$CRON_FILE"
     echo "PATH=/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin" >> "$CRON_FILE"
 
+    # 导出一次配置，两种数据库的计划都从中读取
+    local config_json
+    config_json=$(python3 "$CONFIG_MANAGER" export 2>/dev/null)
+
     # 2. 为 PostgreSQL 设置 cron 任务
-    pg_schedule=$(python3 "$CONFIG_MANAGER" export 2>/dev/null | jq -r '.schedules.postgresql // "disabled"')
+    pg_schedule=$(jq -r '.schedules.postgresql // "disabled"' <<< "$config_json")
     if [ "$pg_schedule" != "disabled" ] && [ -n "$pg_schedule" ]; then
         echo "为 PostgreSQL 设置备份计划: $pg_schedule"
         echo "$pg_schedule root /usr/local/bin/backup.sh postgresql 自动 >> /var/log/cron.log 2>&1" >> "$CRON_FILE"
@@ -21,7 +25,7 @@ update_cron_from_config() {
     fi
 
     # 3. 为 MySQL 设置 cron 任务
-    mysql_schedule=$(python3 "$CONFIG_MANAGER" export 2>/dev/null | jq -r '.schedules.mysql // "disabled"')
+    mysql_schedule=$(jq -r '.schedules.mysql // "disabled"' <<< "$config_json")
     if [ "$mysql_schedule" != "disabled" ] && [ -n "$mysql_schedule" ]; then
         echo "为 MySQL 设置备份计划: $mysql_schedule"
         echo "$mysql_schedule root /usr/local/bin/backup.sh mysql 自动 >> /var/log/cron.log 2>&1" >> "$CRON_FILE"
@@ -29,7 +33,13 @@ update_cron_from_config() {
         echo "MySQL 的自动备份已禁用。"
     fi
 
-    # 4. 设置正确的文件权限并应用 crontab
+    # 4. 恢复校验：按 RESTORE_VERIFY_SCHEDULE 把各连接的最新备份恢复到临时实例中校验
+    if [ -n "${RESTORE_VERIFY_SCHEDULE:-}" ]; then
+        echo "设置恢复校验计划: $RESTORE_VERIFY_SCHEDULE"
+        echo "$RESTORE_VERIFY_SCHEDULE root . /etc/environment; python3 /app/restore_verify.py run --workers ${RESTORE_VERIFY_WORKERS:-2} >> /var/log/cron.log 2>&1" >> "$CRON_FILE"
+    fi
+
+    # 5. 设置正确的文件权限并应用 crontab
     chmod 0644 "$CRON_FILE"
     crontab "$CRON_FILE"
     echo "Cron 计划更新完成。"
@@ -42,24 +52,44 @@ printenv | grep -v "no_proxy" > /etc/environment
 
 # 2. 检查并执行数据库迁移
 echo "检查数据库迁移..."
-if [ -f "/migrate_db.py" ]; then
-    python3 /migrate_db.py
+if [ -f "/app/migrate_db.py" ]; then
+    python3 /app/migrate_db.py
 else
     echo "未找到迁移脚本，跳过迁移"
 fi
 
-# 3. 从配置文件设置初始的 cron 计划
+# 3. 启动备份代理 (在后台运行，异常退出后自动重启)，backup.sh 通过它执行辅助命令
+echo "启动备份代理..."
+(
+    while true; do
+        python3 /app/agent_daemon.py serve >> /var/log/backup_agent.log 2>&1
+        echo "备份代理已退出，5 秒后重启..." >> /var/log/backup_agent.log
+        sleep 5
+    done
+) &
+
+# 4. 从配置文件设置初始的 cron 计划
 update_cron_from_config
 
-# 4. 创建并设置 cron 日志文件
+# 5. 创建并设置 cron 日志文件
 echo "确保 cron 日志文件存在..."
 touch /var/log/cron.log
 chmod 0644 /var/log/cron.log
 
-# 5. 启动 cron 服务 (在后台运行)
+# 6. 启动 cron 服务 (在后台运行)
 echo "启动 cron 服务..."
 cron
 
-# 6. 启动 Flask 应用 (在前台运行，以便 Docker 日志可以捕获输出)
+# 7. 启动通知分发器 (在后台运行，异常退出后自动重启)
+echo "启动通知分发器..."
+(
+    while true; do
+        python3 /app/notification_dispatcher.py >> /var/log/notification_dispatcher.log 2>&1
+        echo "通知分发器已退出，5 秒后重启..." >> /var/log/notification_dispatcher.log
+        sleep 5
+    done
+) &
+
+# 8. 启动 Flask 应用 (在前台运行，以便 Docker 日志可以捕获输出)
 echo "启动 Flask Web 服务器..."
-exec python3 /app.py
+exec python3 /app/app.py
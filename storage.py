@@ -0,0 +1,767 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+备份存储后端模块
+本地目录（local，也可以是挂载的 NFS 等网络文件系统）和 S3 兼容的对象存储（s3，包括 MinIO 等
+本地部署的服务）实现相同的接口:
+
+    open_writer(key)  流式写入，close() 提交、abort() 放弃（S3 为并发分片上传）
+    open(key)         可 seek 的只读文件对象（S3 按需发起范围请求）
+    stat(key) / list(prefix) / delete(key)
+
+备份仍先写到本地 /backups（恢复、校验、提取直接读本地文件）。配置了远程存储（BACKUP_STORAGE）时，
+备份在写入本地文件的同时上传异地副本：压缩或加密后的数据攒够一个分片就交给线程池上传，
+多个分片同时在途，不必等整个文件写完再上传。下载时本地文件已被清理则从远程读取；
+保留策略对本地和远程分别执行（prune）。对象键为备份文件相对 BACKUP_BASE_DIR 的路径，
+如 user_2/pg_all_20240101_020000.sql.gz。
+
+本地分为热层和冷层：新备份写入热层（BACKUP_BASE_DIR，一般为 SSD），超过 BACKUP_COLD_AFTER_DAYS 天的
+由 backup_artifacts.py migrate 限速移到冷层（BACKUP_COLD_DIR，大容量盘），目录结构相同。
+查找、下载、删除和保留策略依次检查热层、冷层和远程存储，备份文件的当前位置记录在 backup_artifacts 表中。
+
+用法（backup.sh 中替代 >> 写入备份文件）:
+    pg_dump -d app | gzip | python3 storage.py store /backups/user_2/pg_app.sql.gz
+
+环境变量:
+    BACKUP_STORAGE                远程存储类型：local 或 s3，为空表示只保存在本地（默认）
+    BACKUP_STORAGE_DIR            local 远程存储的目录
+    BACKUP_S3_BUCKET              s3 存储桶
+    BACKUP_S3_PREFIX              对象键前缀
+    BACKUP_S3_ENDPOINT            S3 兼容服务的地址（MinIO 如 http://minio:9000），为空使用 AWS
+    BACKUP_S3_REGION              区域
+    BACKUP_S3_PART_SIZE           分片大小（默认 16M，最小 5M）
+    BACKUP_S3_CONCURRENCY         同时上传的分片数（默认 8）
+    BACKUP_REMOTE_RETENTION_DAYS  远程副本保留天数（默认与本地相同）
+    BACKUP_REMOTE_LIST_TTL        页面显示的远程备份列表缓存的秒数（默认 60，0 表示不缓存）
+    BACKUP_COLD_DIR               冷层目录，为空表示不分层（默认）
+    BACKUP_COLD_AFTER_DAYS        备份在热层保留的天数，之后移到冷层（默认 3）
+    BACKUP_COLD_RATE              移到冷层的复制速率上限（默认 20M，即 20 MiB/s，0 表示不限速）
+    访问密钥使用 boto3 的标准配置（AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY 等）
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import optional_deps
+from throttle import parse_rate
+
+# 备份根目录（对象键相对于此目录）
+BACKUP_BASE_DIR = os.environ.get('BACKUP_BASE_DIR', "/backups")
+
+STORAGE_BACKEND = os.environ.get('BACKUP_STORAGE', '').strip().lower()
+STORAGE_DIR = os.environ.get('BACKUP_STORAGE_DIR', '')
+S3_BUCKET = os.environ.get('BACKUP_S3_BUCKET', '')
+S3_PREFIX = os.environ.get('BACKUP_S3_PREFIX', '')
+S3_ENDPOINT = os.environ.get('BACKUP_S3_ENDPOINT', '')
+S3_REGION = os.environ.get('BACKUP_S3_REGION', '')
+
+# 冷层目录和热层保留天数（见 backup_artifacts.migrate_cold）
+COLD_DIR = os.environ.get('BACKUP_COLD_DIR', '')
+COLD_AFTER_DAYS = int(os.environ.get('BACKUP_COLD_AFTER_DAYS', '3'))
+
+# S3 分片上传要求除最后一片外每片至少 5 MiB，最多 10000 片
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PARTS = 10000
+
+# 每上传这么多分片，分片大小翻倍（很大的备份也不会超过分片数上限）
+PART_GROWTH_INTERVAL = 1000
+
+# 复制和下载时每次读取的字节数
+CHUNK_SIZE = 1024 * 1024
+
+# 保留策略清理的备份文件（含分段索引）
+ARTIFACT_SUFFIXES = ('.sql.gz', '.sql.gz.idx', '.tar.gz', '.dump',
+                     '.sql.gz.enc', '.sql.gz.enc.idx', '.dump.enc',
+                     '.sql.zst', '.sql.zst.idx', '.sql.zst.enc', '.sql.zst.enc.idx')
+
+# 本地写入未完成的临时文件后缀
+PARTIAL_SUFFIX = '.uploading'
+
+# 远程存储列表的缓存时间（秒，见 list_remote_cached）
+REMOTE_LIST_TTL = float(os.environ.get('BACKUP_REMOTE_LIST_TTL', '60'))
+
+
+class StorageError(OSError):
+    """远程存储请求失败"""
+
+
+S3_PART_SIZE = max(parse_rate(os.environ.get('BACKUP_S3_PART_SIZE', '16M')), MIN_PART_SIZE)
+S3_CONCURRENCY = max(1, int(os.environ.get('BACKUP_S3_CONCURRENCY', '8')))
+
+
+# ===== 本地目录 =====
+
+class LocalWriter:
+    """写入临时文件，close() 时改名为目标文件"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.f = open(path + PARTIAL_SUFFIX, 'wb')
+
+    def write(self, data):
+        return self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        if self.f.closed:
+            return
+        # 先同步到磁盘再改名，调用方随后删除源文件（移到冷层）时不会因断电丢失数据
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.f.close()
+        os.replace(self.path + PARTIAL_SUFFIX, self.path)
+
+    def abort(self):
+        self.f.close()
+        try:
+            os.remove(self.path + PARTIAL_SUFFIX)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class LocalStorage:
+    """本地目录"""
+
+    name = 'local'
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def _path(self, key):
+        path = os.path.normpath(os.path.join(self.root, key))
+        if path != self.root and not path.startswith(self.root + os.sep):
+            raise ValueError(f"非法的对象键: {key}")
+        return path
+
+    def open_writer(self, key):
+        return LocalWriter(self._path(key))
+
+    def open(self, key):
+        return open(self._path(key), 'rb')
+
+    def stat(self, key):
+        """返回 {'key', 'size', 'mtime'}，不存在返回 None"""
+        try:
+            st = os.stat(self._path(key))
+        except FileNotFoundError:
+            return None
+        return {'key': key, 'size': st.st_size, 'mtime': st.st_mtime}
+
+    def list(self, prefix=''):
+        top = self._path(prefix)
+        for directory, _, files in os.walk(top):
+            for name in files:
+                path = os.path.join(directory, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield {'key': os.path.relpath(path, self.root).replace(os.sep, '/'),
+                       'size': st.st_size, 'mtime': st.st_mtime}
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+# ===== S3 兼容存储 =====
+
+class MultipartWriter:
+    """
+    S3 分片上传的流式写入
+
+    攒够一个分片就交给线程池上传，最多 concurrency 个分片同时在途，再写入时阻塞等待，
+    内存占用不超过 (concurrency + 1) 个分片。总大小不足一个分片的文件在 close() 时用一次 PUT 上传。
+    """
+
+    def __init__(self, storage, key):
+        self.storage = storage
+        self.key = key
+        self.part_size = storage.part_size
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.executor = None
+        self.futures = []
+        self.slots = threading.Semaphore(storage.concurrency)
+        self.error = None
+        self.done = False
+
+    def _upload_part(self, number, body):
+        response = self.storage._call('upload_part', Key=self.key, UploadId=self.upload_id,
+                                      PartNumber=number, Body=body)
+        return {'PartNumber': number, 'ETag': response['ETag']}
+
+    def _part_done(self, future):
+        if not future.cancelled() and future.exception() is not None and self.error is None:
+            self.error = future.exception()
+        self.slots.release()
+
+    def _submit(self, body):
+        if self.upload_id is None:
+            self.upload_id = self.storage._call('create_multipart_upload', Key=self.key)['UploadId']
+            self.executor = ThreadPoolExecutor(self.storage.concurrency)
+        self.slots.acquire()
+        if self.error is not None:
+            self.slots.release()
+            raise StorageError(f"上传分片失败: {self.error}")
+        number = len(self.futures) + 1
+        if number > MAX_PARTS:
+            self.slots.release()
+            raise StorageError(f"分片数超过上限 {MAX_PARTS}")
+        future = self.executor.submit(self._upload_part, number, body)
+        future.add_done_callback(self._part_done)
+        self.futures.append(future)
+        if number % PART_GROWTH_INTERVAL == 0:
+            self.part_size *= 2
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.part_size:
+            body = bytes(self.buffer[:self.part_size])
+            del self.buffer[:self.part_size]
+            self._submit(body)
+        return len(data)
+
+    def close(self):
+        """上传剩余数据并提交，失败时放弃已上传的分片"""
+        if self.done:
+            return
+        try:
+            if self.upload_id is None:
+                self.storage._call('put_object', Key=self.key, Body=bytes(self.buffer))
+            else:
+                if self.buffer:
+                    self._submit(bytes(self.buffer))
+                parts = [future.result() for future in self.futures]
+                self.storage._call('complete_multipart_upload', Key=self.key, UploadId=self.upload_id,
+                                   MultipartUpload={'Parts': parts})
+        except BaseException:
+            self.abort()
+            raise
+        self.buffer = bytearray()
+        self.done = True
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def abort(self):
+        """放弃上传（已上传的分片由存储服务删除）"""
+        if self.done:
+            return
+        self.done = True
+        self.buffer = bytearray()
+        if self.executor is not None:
+            for future in self.futures:
+                future.cancel()
+            self.executor.shutdown()
+        if self.upload_id is not None:
+            try:
+                self.storage._call('abort_multipart_upload', Key=self.key, UploadId=self.upload_id)
+            except StorageError as e:
+                print(f"放弃分片上传失败: {str(e)}", file=sys.stderr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class S3Reader:
+    """
+    S3 对象的只读文件对象：顺序读取复用同一个响应流，seek 到别处时重新发起范围请求
+    """
+
+    def __init__(self, storage, key, size):
+        self.storage = storage
+        self.key = key
+        self.size = size
+        self.position = 0
+        self._body = None
+        self._body_position = None
+
+    def _close_body(self):
+        if self._body is not None:
+            self._body.close()
+            self._body = None
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self.position
+        size = min(size, self.size - self.position)
+        if size <= 0:
+            return b''
+        if self._body is None or self._body_position != self.position:
+            self._close_body()
+            self._body = self.storage._call('get_object', Key=self.key,
+                                            Range=f'bytes={self.position}-')['Body']
+            self._body_position = self.position
+        data = self._body.read(size)
+        self.position += len(data)
+        self._body_position = self.position
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        self.position = max(0, offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        self._close_body()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class S3Storage:
+    """S3 兼容的对象存储（需要 boto3）"""
+
+    name = 's3'
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None, part_size=None, concurrency=None):
+        if not bucket:
+            raise ValueError("未配置 S3 存储桶（BACKUP_S3_BUCKET）")
+        boto3 = optional_deps.load('boto3')
+        from botocore.config import Config
+
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self.part_size = max(part_size or S3_PART_SIZE, MIN_PART_SIZE)
+        self.concurrency = concurrency or S3_CONCURRENCY
+        # MinIO 等自建服务一般不支持虚拟主机风格的地址，指定 endpoint 时使用路径风格
+        config = Config(retries={'max_attempts': 5, 'mode': 'standard'},
+                        max_pool_connections=max(10, self.concurrency * 2),
+                        s3={'addressing_style': 'path'} if endpoint_url else None)
+        self.client = boto3.client('s3', endpoint_url=endpoint_url or None, region_name=region or None,
+                                   config=config)
+
+    def _call(self, operation, **kwargs):
+        """调用 S3 接口，对象不存在时抛出 FileNotFoundError，其他错误抛出 StorageError"""
+        from botocore.exceptions import BotoCoreError, ClientError
+        try:
+            return getattr(self.client, operation)(Bucket=self.bucket, **kwargs)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                raise FileNotFoundError(f"远程存储中不存在: {kwargs.get('Key')}")
+            raise StorageError(f"{operation} 失败: {str(e)}") from e
+        except BotoCoreError as e:
+            raise StorageError(f"{operation} 失败: {str(e)}") from e
+
+    def open_writer(self, key):
+        return MultipartWriter(self, self.prefix + key)
+
+    def open(self, key):
+        response = self._call('head_object', Key=self.prefix + key)
+        return S3Reader(self, self.prefix + key, response['ContentLength'])
+
+    def stat(self, key):
+        try:
+            response = self._call('head_object', Key=self.prefix + key)
+        except FileNotFoundError:
+            return None
+        return {'key': key, 'size': response['ContentLength'], 'mtime': response['LastModified'].timestamp()}
+
+    def list(self, prefix=''):
+        from botocore.exceptions import BotoCoreError, ClientError
+        paginator = self.client.get_paginator('list_objects_v2')
+        try:
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix + prefix):
+                for item in page.get('Contents', []):
+                    yield {'key': item['Key'][len(self.prefix):], 'size': item['Size'],
+                           'mtime': item['LastModified'].timestamp()}
+        except (BotoCoreError, ClientError) as e:
+            raise StorageError(f"列出对象失败: {str(e)}") from e
+
+    def delete(self, key):
+        self._call('delete_object', Key=self.prefix + key)
+
+
+# ===== 备份文件 =====
+
+class TeeWriter:
+    """写入本地文件的同时写入远程存储，tell() 为本地文件的位置"""
+
+    def __init__(self, local, remote):
+        self.local = local
+        self.remote = remote
+
+    def write(self, data):
+        self.local.write(data)
+        self.remote.write(data)
+        return len(data)
+
+    def tell(self):
+        return self.local.tell()
+
+    def flush(self):
+        self.local.flush()
+
+
+_remote = None
+_remote_lock = threading.Lock()
+
+# 对象键前缀 -> (列出的时间, 对象列表)
+_listing_cache = {}
+_listing_lock = threading.Lock()
+
+
+def get_local():
+    """本地备份目录（热层）"""
+    return LocalStorage(BACKUP_BASE_DIR)
+
+
+def get_cold():
+    """冷层目录，未配置返回 None"""
+    return LocalStorage(COLD_DIR) if COLD_DIR else None
+
+
+def get_remote():
+    """
+    远程存储后端（每个进程创建一次），未配置返回 None
+
+    Raises:
+        ValueError: 配置不完整或类型不支持
+        ImportError: s3 需要的 boto3 未安装
+    """
+    global _remote
+    if not STORAGE_BACKEND:
+        return None
+    with _remote_lock:
+        if _remote is None:
+            if STORAGE_BACKEND == 'local':
+                if not STORAGE_DIR:
+                    raise ValueError("未配置远程存储目录（BACKUP_STORAGE_DIR）")
+                _remote = LocalStorage(STORAGE_DIR)
+            elif STORAGE_BACKEND == 's3':
+                _remote = S3Storage(S3_BUCKET, S3_PREFIX, S3_ENDPOINT, S3_REGION)
+            else:
+                raise ValueError(f"不支持的远程存储类型: {STORAGE_BACKEND}")
+    return _remote
+
+
+def list_remote_cached(prefix):
+    """
+    远程存储中 prefix 下的对象，结果缓存 REMOTE_LIST_TTL 秒（主页每次加载都要显示只剩远程副本的备份，
+    不必每次都请求 S3 列表）
+
+    Returns:
+        list: list() 列出的对象（含 key、size、mtime），未配置远程存储返回空列表
+    """
+    remote = get_remote()
+    if remote is None:
+        return []
+    now = time.monotonic()
+    with _listing_lock:
+        cached = _listing_cache.get(prefix)
+        if cached is not None and now - cached[0] < REMOTE_LIST_TTL:
+            return cached[1]
+    items = list(remote.list(prefix))
+    with _listing_lock:
+        _listing_cache[prefix] = (now, items)
+    return items
+
+
+def _relative(path, root):
+    """path 在 root 下时返回相对路径，否则返回 None"""
+    relative = os.path.relpath(os.path.abspath(path), os.path.abspath(root))
+    if relative == '.' or relative.startswith('..'):
+        return None
+    return relative
+
+
+def key_for(path):
+    """备份文件对应的对象键（相对热层或冷层根目录的路径，都不在其中时取文件名）"""
+    relative = _relative(path, BACKUP_BASE_DIR)
+    if relative is None and COLD_DIR:
+        relative = _relative(path, COLD_DIR)
+    return (relative or os.path.basename(path)).replace(os.sep, '/')
+
+
+def tier_of(path):
+    """备份文件所在的层：cold 或 hot"""
+    return 'cold' if COLD_DIR and _relative(path, COLD_DIR) is not None else 'hot'
+
+
+def hot_path(path):
+    """备份文件在热层中的路径"""
+    return os.path.join(BACKUP_BASE_DIR, key_for(path))
+
+
+def cold_path(path):
+    """备份文件在冷层中的路径，未配置冷层返回 None"""
+    return os.path.join(COLD_DIR, key_for(path)) if COLD_DIR else None
+
+
+def locate(path):
+    """
+    备份文件在本地的实际位置：依次查找 path、热层和冷层
+
+    Returns:
+        str: 存在的路径，都不存在返回 None
+    """
+    for candidate in (path, hot_path(path), cold_path(path)):
+        if candidate and os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def open_upload(path):
+    """
+    为备份文件 path 打开远程存储的写入对象，未配置远程存储返回 None
+
+    写入对象支持 with 语句：正常退出时提交，出错时放弃已上传的部分。
+    """
+    remote = get_remote()
+    return remote.open_writer(key_for(path)) if remote is not None else None
+
+
+def upload_file(path, upload_as=None):
+    """
+    把本地文件上传到远程存储（键按 upload_as 计算，默认与 path 相同）
+
+    Returns:
+        int: 上传的字节数，未配置远程存储返回 0
+    """
+    remote = get_remote()
+    if remote is None:
+        return 0
+    with open(path, 'rb') as f, remote.open_writer(key_for(upload_as or path)) as writer:
+        shutil.copyfileobj(f, writer, CHUNK_SIZE)
+        return f.tell()
+
+
+def upload_artifact(path):
+    """上传备份文件及其分段索引（如有），返回上传的字节数"""
+    total = upload_file(path)
+    if os.path.exists(path + '.idx'):
+        total += upload_file(path + '.idx')
+    return total
+
+
+def store_stream(source, path, upload_as=None):
+    """
+    把 source 追加写入本地文件 path，配置了远程存储时同时上传
+
+    本地文件已有内容时（追加写入）无法续传分片，写完后整体重新上传。
+
+    Returns:
+        int: 写入的字节数
+    """
+    appending = os.path.exists(path) and os.path.getsize(path) > 0
+    upload = None if appending else open_upload(upload_as or path)
+    written = 0
+    with open(path, 'ab') as f:
+        out = TeeWriter(f, upload) if upload is not None else f
+        try:
+            while True:
+                chunk = source.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                out.write(chunk)
+                written += len(chunk)
+        except BaseException:
+            if upload is not None:
+                upload.abort()
+            raise
+        if upload is not None:
+            upload.close()
+    if appending:
+        upload_file(path, upload_as)
+    return written
+
+
+def open_artifact(path):
+    """
+    打开备份文件用于读取：依次查找热层、冷层，本地都不存在时从远程存储读取
+
+    Returns:
+        tuple: (只读文件对象, 字节数)
+
+    Raises:
+        FileNotFoundError: 本地和远程都不存在
+    """
+    local = locate(path)
+    if local is not None:
+        return open(local, 'rb'), os.path.getsize(local)
+    remote = get_remote()
+    if remote is None:
+        raise FileNotFoundError(f"备份文件不存在: {os.path.basename(path)}")
+    reader = remote.open(key_for(path))
+    reader.seek(0, os.SEEK_END)
+    size = reader.tell()
+    reader.seek(0)
+    return reader, size
+
+
+def fetch(path):
+    """
+    从远程存储下载备份文件（及其分段索引）到本地 path
+
+    Returns:
+        bool: 是否下载成功
+    """
+    remote = get_remote()
+    if remote is None:
+        return False
+    for target in (path, path + '.idx'):
+        key = key_for(target)
+        if target != path and remote.stat(key) is None:
+            continue
+        with remote.open(key) as reader, LocalWriter(os.path.abspath(target)) as writer:
+            shutil.copyfileobj(reader, writer, CHUNK_SIZE)
+    return True
+
+
+def delete_artifact(path):
+    """
+    删除备份文件及其分段索引，热层、冷层和远程存储中的都删除
+
+    Returns:
+        int: 删除的本地文件数
+    """
+    deleted = 0
+    for location in {path, hot_path(path), cold_path(path)} - {None}:
+        for target in (location, location + '.idx'):
+            try:
+                os.remove(target)
+                deleted += 1
+            except FileNotFoundError:
+                pass
+    remote = get_remote()
+    if remote is not None:
+        for target in (path, path + '.idx'):
+            remote.delete(key_for(target))
+        with _listing_lock:
+            _listing_cache.clear()
+    return deleted
+
+
+def prune(backend, prefix, days, now=None):
+    """
+    删除 prefix 下超过保留天数的备份文件
+
+    Args:
+        backend: LocalStorage 或 S3Storage
+        prefix: 对象键前缀（用户目录，如 user_2）
+        days: 保留天数
+
+    Returns:
+        int: 删除的文件数
+    """
+    cutoff = (now or time.time()) - days * 86400
+    expired = [item['key'] for item in backend.list(prefix)
+               if item['key'].endswith(ARTIFACT_SUFFIXES) and item['mtime'] < cutoff]
+    for key in expired:
+        backend.delete(key)
+    return len(expired)
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='备份存储工具')
+    subparsers = parser.add_subparsers(dest='command', help='可用命令')
+
+    store_parser = subparsers.add_parser('store', help='标准输入追加写入备份文件，同时上传远程存储')
+    store_parser.add_argument('path', help='备份文件路径')
+    store_parser.add_argument('--upload-as', help='按该路径计算对象键（默认与 path 相同）')
+
+    upload_parser = subparsers.add_parser('upload', help='上传已有的备份文件及其分段索引')
+    upload_parser.add_argument('paths', nargs='+', help='备份文件路径')
+
+    subparsers.add_parser('fetch', help='从远程存储下载备份文件到本地').add_argument('path', help='备份文件路径')
+
+    subparsers.add_parser('delete', help='删除备份文件（本地和远程）').add_argument('path', help='备份文件路径')
+
+    list_parser = subparsers.add_parser('list', help='列出存储中的文件')
+    list_parser.add_argument('--prefix', default='', help='对象键前缀')
+    list_parser.add_argument('--remote', action='store_true', help='列出远程存储（默认本地）')
+
+    prune_parser = subparsers.add_parser('prune', help='按保留天数清理本地和远程的旧备份')
+    prune_parser.add_argument('--dir', required=True, help='备份目录')
+    prune_parser.add_argument('--days', type=int, required=True, help='本地保留天数')
+    prune_parser.add_argument('--remote-days', type=int, help='远程保留天数（默认 BACKUP_REMOTE_RETENTION_DAYS 或与本地相同）')
+
+    subparsers.add_parser('check', help='检查远程存储配置和连通性')
+
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'store':
+            store_stream(sys.stdin.buffer, args.path, args.upload_as)
+        elif args.command == 'upload':
+            for path in args.paths:
+                print(f"{path}: {upload_artifact(path)} 字节")
+        elif args.command == 'fetch':
+            if not fetch(args.path):
+                print("未配置远程存储", file=sys.stderr)
+                sys.exit(1)
+        elif args.command == 'delete':
+            delete_artifact(args.path)
+        elif args.command == 'list':
+            backend = get_remote() if args.remote else get_local()
+            if backend is None:
+                print("未配置远程存储", file=sys.stderr)
+                sys.exit(1)
+            print(json.dumps(list(backend.list(args.prefix)), indent=2, ensure_ascii=False))
+        elif args.command == 'prune':
+            prefix = (_relative(args.dir, BACKUP_BASE_DIR) or '').replace(os.sep, '/')
+            local_deleted = prune(get_local(), prefix, args.days)
+            if get_cold() is not None:
+                local_deleted += prune(get_cold(), prefix, args.days)
+            remote = get_remote()
+            if remote is None:
+                print(f"删除了 {local_deleted} 个文件")
+            else:
+                remote_days = args.remote_days
+                if remote_days is None:
+                    remote_days = int(os.environ.get('BACKUP_REMOTE_RETENTION_DAYS') or args.days)
+                remote_deleted = prune(remote, prefix, remote_days)
+                print(f"删除了 {local_deleted} 个本地文件，{remote_deleted} 个远程文件（远程保留 {remote_days} 天）")
+        elif args.command == 'check':
+            remote = get_remote()
+            if remote is None:
+                print("未配置远程存储，备份只保存在本地")
+            else:
+                next(iter(remote.list('')), None)
+                print(f"远程存储可用: {remote.name}")
+        else:
+            parser.print_help()
+            sys.exit(1)
+    except (OSError, ValueError, ImportError) as e:
+        print(f"错误: {str(e)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,18 +7,24 @@
 
 import sys
 import os
+import sqlite3
+import time
 import argparse
 from datetime import datetime
 
-# 添加项目根目录到路径
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DB_FILE = os.environ.get('BACKUP_DB_FILE', "/backups/users.db")
 
-DB_FILE = "/backups/users.db"
+# 冷日志归档目录：超出热窗口的日志按月存放为独立的 SQLite 文件 system_logs_YYYYMM.db
+ARCHIVE_DIR = os.environ.get('BACKUP_LOG_ARCHIVE_DIR', "/backups/logs/archive")
+
+# 分批清理参数：每批删除的行数、批次间让出写锁的时间（秒）、每段增量 VACUUM 的页数
+CLEAR_BATCH_SIZE = 500
+CLEAR_BATCH_PAUSE = 0.05
+CLEAR_VACUUM_PAGES = 256
 
 
 def get_db_connection():
     """获取数据库连接"""
-    import sqlite3
     conn = sqlite3.connect(DB_FILE)
     conn.row_factory = sqlite3.Row
     return conn
@@ -51,64 +57,297 @@ def log_to_db(log_type, category, message, details=None):
         return False
 
 
-def get_logs(limit=100, log_type=None, category=None):
+def _query_logs(conn, limit, log_type=None, category=None, start_date=None, end_date=None):
+    """在指定连接（热库或归档分区）上执行日志查询"""
+    cursor = conn.cursor()
+
+    query = "SELECT * FROM system_logs WHERE 1=1"
+    params = []
+
+    if log_type:
+        query += " AND log_type = ?"
+        params.append(log_type)
+
+    if category:
+        query += " AND category = ?"
+        params.append(category)
+
+    if start_date:
+        query += " AND created_at >= ?"
+        params.append(start_date)
+
+    if end_date:
+        query += " AND created_at <= ?"
+        params.append(end_date)
+
+    query += " ORDER BY created_at DESC LIMIT ?"
+    params.append(limit)
+
+    cursor.execute(query, params)
+    return [dict(row) for row in cursor.fetchall()]
+
+
+def get_logs(limit=100, log_type=None, category=None, start_date=None, end_date=None):
     """
     获取日志列表
 
+    指定 start_date 且早于热窗口时，会依次查询覆盖该时间范围的月度归档分区，
+    结果与热库合并后按时间倒序返回。
+
     Args:
         limit: 返回的记录数
         log_type: 过滤日志类型
         category: 过滤分类
+        start_date: 开始时间（含），格式 YYYY-MM-DD[ HH:MM:SS]
+        end_date: 结束时间（含）
 
     Returns:
         日志记录列表
     """
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
+        logs = _query_logs(conn, limit, log_type, category, start_date, end_date)
+        conn.close()
+
+        if not start_date:
+            return logs
+
+        # 分区按月份从新到旧查询；一旦已凑够 limit 条且都比该分区更新，就不必再往前查
+        for month, path in reversed(list_archive_partitions(start_date, end_date)):
+            if len(logs) >= limit and logs[limit - 1]['created_at'] >= _next_month_start(month):
+                break
+
+            part_conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+            part_conn.row_factory = sqlite3.Row
+            try:
+                logs.extend(_query_logs(part_conn, limit, log_type, category, start_date, end_date))
+            finally:
+                part_conn.close()
+
+            logs.sort(key=lambda row: row['created_at'] or '', reverse=True)
+            del logs[limit:]
+
+        return logs
+    except Exception as e:
+        print(f"获取日志失败: {str(e)}", file=sys.stderr)
+        return []
 
-        query = "SELECT * FROM system_logs WHERE 1=1"
-        params = []
 
-        if log_type:
-            query += " AND log_type = ?"
-            params.append(log_type)
+def build_fts_query(query):
+    """
+    将用户输入转换为 FTS5 MATCH 表达式
 
-        if category:
-            query += " AND category = ?"
-            params.append(category)
+    每个空白分隔的词都加引号作为短语匹配，词之间为 AND 关系，
+    避免用户输入中的 FTS 语法字符（如 - : *）被解释为运算符。
 
-        query += " ORDER BY created_at DESC LIMIT ?"
-        params.append(limit)
+    Args:
+        query: 用户输入的检索词
 
-        cursor.execute(query, params)
+    Returns:
+        str: MATCH 表达式；若某个词短于 3 个字符（trigram 分词器无法匹配）则返回 None
+    """
+    terms = query.split()
+    if not terms or any(len(term) < 3 for term in terms):
+        return None
+    return ' '.join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def _search_logs(conn, query, limit, log_type=None, category=None, start_date=None, end_date=None, order='rank'):
+    """在一个库（热库或归档分区）中检索日志，没有全文索引时使用 LIKE 查询"""
+    cursor = conn.cursor()
+
+    filters = ""
+    params = []
+
+    if log_type:
+        filters += " AND l.log_type = ?"
+        params.append(log_type)
+
+    if category:
+        filters += " AND l.category = ?"
+        params.append(category)
+
+    if start_date:
+        filters += " AND l.created_at >= ?"
+        params.append(start_date)
+
+    if end_date:
+        filters += " AND l.created_at <= ?"
+        params.append(end_date)
+
+    match_expr = build_fts_query(query)
+    rows = None
+
+    if match_expr:
+        order_by = "rank" if order == 'rank' else "l.created_at DESC"
+        try:
+            cursor.execute(f'''
+                SELECT l.*, bm25(system_logs_fts) AS rank
+                FROM system_logs_fts
+                JOIN system_logs l ON l.id = system_logs_fts.rowid
+                WHERE system_logs_fts MATCH ?{filters}
+                ORDER BY {order_by}
+                LIMIT ?
+            ''', [match_expr] + params + [limit])
+            rows = cursor.fetchall()
+        except sqlite3.OperationalError:
+            # 全文索引不存在（旧库、归档分区或 SQLite 未启用 FTS5），退回 LIKE 查询
+            rows = None
+
+    if rows is None:
+        like_filters = ""
+        like_params = []
+        for term in query.split():
+            like_filters += " AND (l.message LIKE ? OR l.details LIKE ?)"
+            like_params.extend([f'%{term}%', f'%{term}%'])
+
+        cursor.execute(f'''
+            SELECT l.* FROM system_logs l
+            WHERE 1=1{like_filters}{filters}
+            ORDER BY l.created_at DESC
+            LIMIT ?
+        ''', like_params + params + [limit])
         rows = cursor.fetchall()
-        conn.close()
 
-        return [dict(row) for row in rows]
+    return [dict(row) for row in rows]
+
+
+def _sort_search_results(logs, order):
+    """合并热库和归档分区结果：按时间倒序，rank 时有相关度的（热库全文检索）再按相关度排在前面"""
+    logs.sort(key=lambda row: row['created_at'] or '', reverse=True)
+    if order == 'rank':
+        logs.sort(key=lambda row: (row.get('rank') is None, row.get('rank') or 0))
+
+
+def search_logs(query, limit=100, log_type=None, category=None,
+                start_date=None, end_date=None, order='rank'):
+    """
+    全文检索系统日志（message 和 details）
+
+    热库使用全文索引；已移入月度归档分区的日志（见 archive_old_logs）在与时间范围重叠的分区中
+    按 LIKE 检索，分区从新到旧依次查询，结果与热库合并后取前 limit 条。
+
+    Args:
+        query: 检索词，多个词以空格分隔，需同时命中
+        limit: 返回的记录数
+        log_type: 过滤日志类型
+        category: 过滤分类
+        start_date: 开始时间（含），格式 YYYY-MM-DD[ HH:MM:SS]
+        end_date: 结束时间（含）
+        order: 排序方式，rank 按相关度，time 按时间倒序
+
+    Returns:
+        日志记录列表，热库全文检索的结果附带 rank 字段（越小越相关），排在归档分区的结果之前
+    """
+    try:
+        conn = get_db_connection()
+        try:
+            logs = _search_logs(conn, query, limit, log_type, category, start_date, end_date, order)
+        finally:
+            conn.close()
+
+        # 分区按月份从新到旧查询；一旦已凑够 limit 条且都排在该分区的结果之前，就不必再往前查
+        for month, path in reversed(list_archive_partitions(start_date, end_date)):
+            if len(logs) >= limit and (logs[limit - 1].get('rank') is not None
+                                       or logs[limit - 1]['created_at'] >= _next_month_start(month)):
+                break
+
+            part_conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+            part_conn.row_factory = sqlite3.Row
+            try:
+                logs.extend(_search_logs(part_conn, query, limit, log_type, category, start_date, end_date, order))
+            finally:
+                part_conn.close()
+
+            _sort_search_results(logs, order)
+            del logs[limit:]
+
+        return logs
     except Exception as e:
-        print(f"获取日志失败: {str(e)}", file=sys.stderr)
+        print(f"检索日志失败: {str(e)}", file=sys.stderr)
         return []
 
 
-def clear_old_logs(days=30):
+def incremental_vacuum(conn, pages=CLEAR_VACUUM_PAGES, pause=CLEAR_BATCH_PAUSE):
     """
-    清理旧日志
+    分段执行增量 VACUUM，把空闲页归还给文件系统
+
+    仅在数据库处于 auto_vacuum=INCREMENTAL 模式时生效（由 migrate_db 设置），
+    否则 PRAGMA 为空操作。每段释放有限页数并短暂休眠，避免长时间占用写锁。
+
+    Args:
+        conn: 数据库连接
+        pages: 每段释放的页数
+        pause: 段间休眠秒数
+
+    Returns:
+        int: 释放的页数
+    """
+    cursor = conn.cursor()
+    freed = 0
+    while True:
+        cursor.execute('PRAGMA freelist_count')
+        free_pages = cursor.fetchone()[0]
+        if free_pages == 0:
+            break
+        cursor.execute(f'PRAGMA incremental_vacuum({int(pages)})')
+        cursor.fetchall()
+        cursor.execute('PRAGMA freelist_count')
+        remaining = cursor.fetchone()[0]
+        if remaining >= free_pages:
+            # 非增量模式下空闲页不会减少，直接退出
+            break
+        freed += free_pages - remaining
+        time.sleep(pause)
+    return freed
+
+
+def clear_old_logs(days=30, batch_size=CLEAR_BATCH_SIZE, pause=CLEAR_BATCH_PAUSE):
+    """
+    分批清理旧日志
+
+    按 id 分批删除，每批单独提交并短暂休眠，让出写锁给备份日志和 Web 请求，
+    避免一次性大范围 DELETE 长时间阻塞其他写入者。清理完成后执行增量 VACUUM。
 
     Args:
         days: 保留最近多少天的日志
+        batch_size: 每批删除的行数
+        pause: 批次间休眠秒数
+
+    Returns:
+        int: 删除的记录数
     """
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
 
+        # 先确定截止 id，之后按主键范围分批删除，不再重复扫描时间索引
         cursor.execute('''
-            DELETE FROM system_logs
+            SELECT MAX(id) FROM system_logs
             WHERE created_at < datetime('now', '-' || ? || ' days')
         ''', (days,))
-
-        deleted_count = cursor.rowcount
-        conn.commit()
+        max_id = cursor.fetchone()[0]
+
+        deleted_count = 0
+        while max_id is not None:
+            cursor.execute('''
+                DELETE FROM system_logs WHERE id IN (
+                    SELECT id FROM system_logs
+                    WHERE id <= ? AND created_at < datetime('now', '-' || ? || ' days')
+                    ORDER BY id
+                    LIMIT ?
+                )
+            ''', (max_id, days, batch_size))
+            batch_count = cursor.rowcount
+            conn.commit()
+
+            deleted_count += batch_count
+            if batch_count < batch_size:
+                break
+            time.sleep(pause)
+
+        if deleted_count:
+            incremental_vacuum(conn, pause=pause)
         conn.close()
 
         return deleted_count
@@ -117,6 +356,158 @@ def clear_old_logs(days=30):
         return 0
 
 
+# ===== 冷日志归档 =====
+
+def _next_month_start(month):
+    """返回 YYYYMM 下一个月第一天的时间字符串"""
+    year, mon = int(month[:4]), int(month[4:])
+    if mon == 12:
+        year, mon = year + 1, 1
+    else:
+        mon += 1
+    return f"{year:04d}-{mon:02d}-01 00:00:00"
+
+
+def list_archive_partitions(start_date=None, end_date=None):
+    """
+    列出与时间范围重叠的月度归档分区
+
+    Args:
+        start_date: 开始时间（含）
+        end_date: 结束时间（含）
+
+    Returns:
+        list: [(YYYYMM, 文件路径)]，按月份升序
+    """
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+
+    start_month = start_date[:7].replace('-', '') if start_date else None
+    end_month = end_date[:7].replace('-', '') if end_date else None
+
+    partitions = []
+    for filename in os.listdir(ARCHIVE_DIR):
+        if not (filename.startswith('system_logs_') and filename.endswith('.db')):
+            continue
+        month = filename[len('system_logs_'):-len('.db')]
+        if len(month) != 6 or not month.isdigit():
+            continue
+        if start_month and month < start_month:
+            continue
+        if end_month and month > end_month:
+            continue
+        partitions.append((month, os.path.join(ARCHIVE_DIR, filename)))
+
+    return sorted(partitions)
+
+
+def _open_archive_partition(month):
+    """打开（必要时创建）指定月份的归档分区"""
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(ARCHIVE_DIR, f'system_logs_{month}.db'))
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS system_logs (
+            id INTEGER PRIMARY KEY,
+            log_type TEXT NOT NULL,
+            category TEXT,
+            message TEXT,
+            details TEXT,
+            created_at TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_system_logs_type ON system_logs(log_type)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_system_logs_category ON system_logs(category)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_system_logs_created_at ON system_logs(created_at)')
+    return conn
+
+
+def archive_old_logs(hot_days=30, keep_months=12, batch_size=CLEAR_BATCH_SIZE, pause=CLEAR_BATCH_PAUSE):
+    """
+    将热窗口之外的日志按月移入归档分区
+
+    每批先写入并提交归档分区，再从热库删除同一批 id，中途中断重跑也不会丢失或重复
+    （分区以 id 为主键，重复写入会被忽略）。批次间让出写锁，结束后执行增量 VACUUM，
+    并删除超过 keep_months 个月的分区文件。
+
+    Args:
+        hot_days: 热库保留最近多少天的日志
+        keep_months: 归档分区保留的月数（0 表示不删除）
+        batch_size: 每批移动的行数
+        pause: 批次间休眠秒数
+
+    Returns:
+        int: 归档的记录数
+    """
+    partitions = {}
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT MAX(id) FROM system_logs
+            WHERE created_at < datetime('now', '-' || ? || ' days')
+        ''', (hot_days,))
+        max_id = cursor.fetchone()[0]
+
+        archived_count = 0
+        while max_id is not None:
+            cursor.execute('''
+                SELECT id, log_type, category, message, details, created_at
+                FROM system_logs
+                WHERE id <= ? AND created_at < datetime('now', '-' || ? || ' days')
+                ORDER BY id
+                LIMIT ?
+            ''', (max_id, hot_days, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            by_month = {}
+            for row in rows:
+                month = (row['created_at'] or '')[:7].replace('-', '')
+                by_month.setdefault(month if len(month) == 6 else '000000', []).append(tuple(row))
+
+            for month, month_rows in by_month.items():
+                if month not in partitions:
+                    partitions[month] = _open_archive_partition(month)
+                part_conn = partitions[month]
+                part_conn.executemany('''
+                    INSERT OR IGNORE INTO system_logs (id, log_type, category, message, details, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', month_rows)
+                part_conn.commit()
+
+            ids = [row['id'] for row in rows]
+            cursor.execute(f"DELETE FROM system_logs WHERE id IN ({','.join('?' * len(ids))})", ids)
+            conn.commit()
+
+            archived_count += len(rows)
+            if len(rows) < batch_size:
+                break
+            time.sleep(pause)
+
+        if archived_count:
+            incremental_vacuum(conn, pause=pause)
+        conn.close()
+
+        if keep_months:
+            # 以当前月份往前推 keep_months 个月为界，删除更早的分区
+            now = datetime.now()
+            index = now.year * 12 + now.month - 1 - keep_months
+            oldest_month = f"{index // 12:04d}{index % 12 + 1:02d}"
+            for month, path in list_archive_partitions():
+                if month < oldest_month:
+                    os.remove(path)
+
+        return archived_count
+    except Exception as e:
+        print(f"归档旧日志失败: {str(e)}", file=sys.stderr)
+        return 0
+    finally:
+        for part_conn in partitions.values():
+            part_conn.close()
+
+
 def main():
     """命令行入口"""
     parser = argparse.ArgumentParser(description='系统日志管理工具')
@@ -134,10 +525,31 @@ def main():
     get_parser.add_argument('--limit', type=int, default=100, help='返回记录数')
     get_parser.add_argument('--type', help='过滤日志类型')
     get_parser.add_argument('--category', help='过滤分类')
+    get_parser.add_argument('--start', help='开始时间 (YYYY-MM-DD[ HH:MM:SS])，早于热窗口时会查询归档分区')
+    get_parser.add_argument('--end', help='结束时间 (YYYY-MM-DD[ HH:MM:SS])')
+
+    # search 命令
+    search_parser = subparsers.add_parser('search', help='全文检索日志')
+    search_parser.add_argument('query', help='检索词（多个词以空格分隔）')
+    search_parser.add_argument('--limit', type=int, default=100, help='返回记录数')
+    search_parser.add_argument('--type', help='过滤日志类型')
+    search_parser.add_argument('--category', help='过滤分类')
+    search_parser.add_argument('--start', help='开始时间 (YYYY-MM-DD[ HH:MM:SS])')
+    search_parser.add_argument('--end', help='结束时间 (YYYY-MM-DD[ HH:MM:SS])')
+    search_parser.add_argument('--order', choices=['rank', 'time'], default='rank', help='排序方式')
 
     # clear 命令
     clear_parser = subparsers.add_parser('clear', help='清理旧日志')
     clear_parser.add_argument('--days', type=int, default=30, help='保留最近多少天的日志')
+    clear_parser.add_argument('--batch-size', type=int, default=CLEAR_BATCH_SIZE, help='每批删除的行数')
+    clear_parser.add_argument('--pause', type=float, default=CLEAR_BATCH_PAUSE, help='批次间休眠秒数')
+
+    # archive 命令
+    archive_parser = subparsers.add_parser('archive', help='将旧日志按月移入归档分区')
+    archive_parser.add_argument('--hot-days', type=int, default=30, help='热库保留最近多少天的日志')
+    archive_parser.add_argument('--keep-months', type=int, default=12, help='归档分区保留的月数（0 表示不删除）')
+    archive_parser.add_argument('--batch-size', type=int, default=CLEAR_BATCH_SIZE, help='每批移动的行数')
+    archive_parser.add_argument('--pause', type=float, default=CLEAR_BATCH_PAUSE, help='批次间休眠秒数')
 
     args = parser.parse_args()
 
@@ -152,13 +564,25 @@ def main():
 
     elif args.command == 'get':
         import json
-        logs = get_logs(limit=args.limit, log_type=args.type, category=args.category)
+        logs = get_logs(limit=args.limit, log_type=args.type, category=args.category,
+                        start_date=args.start, end_date=args.end)
+        print(json.dumps(logs, indent=2, ensure_ascii=False))
+
+    elif args.command == 'search':
+        import json
+        logs = search_logs(args.query, limit=args.limit, log_type=args.type, category=args.category,
+                           start_date=args.start, end_date=args.end, order=args.order)
         print(json.dumps(logs, indent=2, ensure_ascii=False))
 
     elif args.command == 'clear':
-        deleted_count = clear_old_logs(days=args.days)
+        deleted_count = clear_old_logs(days=args.days, batch_size=args.batch_size, pause=args.pause)
         print(f"已清理 {deleted_count} 条旧日志")
 
+    elif args.command == 'archive':
+        archived_count = archive_old_logs(hot_days=args.hot_days, keep_months=args.keep_months,
+                                          batch_size=args.batch_size, pause=args.pause)
+        print(f"已归档 {archived_count} 条旧日志")
+
     else:
         parser.print_help()
         sys.exit(1)
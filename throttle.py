@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+备份限速模块
+按时间窗口限制备份对源数据库和本地磁盘的影响：白天业务高峰限速、夜间全速。
+
+限速规则（throttle_windows 表）:
+    每条规则包含生效时间段（HH:MM-HH:MM，开始晚于结束表示跨午夜，相同表示全天）、
+    读取速率（转储输出，即从源数据库读出的未压缩字节）和写入速率（写入备份文件的压缩后字节）。
+    connection_id 为空的规则是全局限速，由本机同时运行的所有备份共享；
+    指定连接的规则只限制该连接的备份。同一时刻有多条规则生效时取最小速率，0 表示不限速。
+
+多个进程（逐库转储的 pg_dump、多用户同时运行的 backup.sh）共享同一个令牌桶：
+桶的状态保存在 THROTTLE_STATE_DIR 下的小文件中，通过 flock 加锁更新（GCRA 算法，
+只记录"理论到达时间"一个数值）。
+
+用法（backup.sh 中作为管道的一级）:
+    pg_dump -d app | python3 throttle.py pipe --connection 3 --scope read | gzip > app.sql.gz
+
+环境变量:
+    THROTTLE_STATE_DIR  令牌桶状态目录（默认 /run/backup-throttle）
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import fcntl
+import sqlite3
+import argparse
+from datetime import datetime
+
+from metrics import TimedConnection
+import config_manager
+
+# 数据库文件路径
+DB_FILE = os.environ.get('BACKUP_DB_FILE', "/backups/users.db")
+
+# 令牌桶状态目录（重启后清空即可，不需要持久化）
+THROTTLE_STATE_DIR = os.environ.get('THROTTLE_STATE_DIR', "/run/backup-throttle")
+
+# 管道每次读取的字节数，同时也是限速的粒度
+CHUNK_SIZE = 64 * 1024
+
+# 允许的突发量（秒）：令牌桶最多可以提前这么久放行，避免每个块都 sleep
+BURST_SECONDS = 0.25
+
+# 重新读取限速规则的间隔（秒），长时间的备份跨越时间窗口时随之调整速率
+REFRESH_INTERVAL = 10
+
+# 桶中积压超过这么多秒视为残留状态（例如系统时钟跳变），直接重置
+MAX_BACKLOG_SECONDS = 3600
+
+SCOPES = ('read', 'write')
+
+TIME_PATTERN = re.compile(r'^([01]?\d|2[0-3]):([0-5]\d)$')
+
+
+def get_db_connection():
+    """获取数据库连接"""
+    conn = sqlite3.connect(DB_FILE, factory=TimedConnection)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def parse_rate(value):
+    """解析带 K/M/G 后缀的速率（字节/秒），也用于解析字节数（如 S3 分片大小）"""
+    value = str(value or '0').strip().upper()
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    if value[-1:] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(float(value))
+
+
+def format_rate(rate):
+    """速率转换为便于阅读的形式，0 表示不限速"""
+    if not rate:
+        return '不限速'
+    for unit, size in (('G', 1024 ** 3), ('M', 1024 ** 2), ('K', 1024)):
+        if rate >= size:
+            return f"{rate / size:g}{unit}/s"
+    return f"{rate}B/s"
+
+
+def _parse_time(value):
+    """HH:MM 转换为当天的分钟数"""
+    match = TIME_PATTERN.match(str(value or '').strip())
+    if not match:
+        raise ValueError(f"时间格式应为 HH:MM: {value}")
+    return int(match.group(1)) * 60 + int(match.group(2))
+
+
+def window_active(start_time, end_time, now=None):
+    """判断 now 是否落在 [start_time, end_time) 内，开始晚于结束表示跨午夜"""
+    now = now or datetime.now()
+    start = _parse_time(start_time)
+    end = _parse_time(end_time)
+    minute = now.hour * 60 + now.minute
+    if start == end:
+        return True
+    if start < end:
+        return start <= minute < end
+    return minute >= start or minute < end
+
+
+# ===== 限速规则 =====
+
+def add_window(start_time, end_time, read_rate=0, write_rate=0, connection_id=None, user_id=None):
+    """
+    添加一条限速规则
+
+    Args:
+        start_time: 开始时间 HH:MM
+        end_time: 结束时间 HH:MM
+        read_rate: 读取速率上限（字节/秒），0 表示不限
+        write_rate: 写入速率上限（字节/秒），0 表示不限
+        connection_id: 只限制该连接，为空表示全局限速
+        user_id: 指定时检查连接属于该用户
+
+    Returns:
+        int: 规则 ID
+
+    Raises:
+        ValueError: 参数不合法或连接不存在
+    """
+    _parse_time(start_time)
+    _parse_time(end_time)
+    read_rate = int(read_rate or 0)
+    write_rate = int(write_rate or 0)
+    if read_rate < 0 or write_rate < 0:
+        raise ValueError("速率不能为负数")
+    if not read_rate and not write_rate:
+        raise ValueError("读取速率和写入速率至少指定一个")
+
+    if connection_id:
+        connection = config_manager.get_database_connection(connection_id)
+        if not connection or (user_id is not None and connection['user_id'] != user_id):
+            raise ValueError(f"数据库连接不存在: {connection_id}")
+    elif user_id is not None:
+        raise ValueError("全局限速只能通过命令行配置")
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO throttle_windows (user_id, connection_id, start_time, end_time, read_rate, write_rate)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (user_id, str(connection_id) if connection_id else None, start_time.strip(), end_time.strip(),
+              read_rate, write_rate))
+        conn.commit()
+        return cursor.lastrowid
+    finally:
+        conn.close()
+
+
+def list_windows(user_id=None):
+    """
+    列出限速规则
+
+    Args:
+        user_id: 指定时只列出该用户连接的规则和全局规则
+    """
+    query = 'SELECT * FROM throttle_windows'
+    params = []
+    if user_id is not None:
+        query += ' WHERE user_id = ? OR connection_id IS NULL'
+        params.append(user_id)
+    query += ' ORDER BY connection_id IS NOT NULL, connection_id, start_time, id'
+
+    try:
+        conn = get_db_connection()
+        try:
+            rows = conn.execute(query, params).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"获取限速规则失败: {str(e)}", file=sys.stderr)
+        return []
+
+    windows = []
+    for row in rows:
+        window = dict(row)
+        window['active'] = window_active(window['start_time'], window['end_time'])
+        windows.append(window)
+    return windows
+
+
+def delete_window(window_id, user_id=None):
+    """删除限速规则，user_id 指定时只能删除该用户的规则；返回是否删除成功"""
+    query = 'DELETE FROM throttle_windows WHERE id = ?'
+    params = [window_id]
+    if user_id is not None:
+        query += ' AND user_id = ?'
+        params.append(user_id)
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.execute(query, params)
+        conn.commit()
+        return cursor.rowcount > 0
+    finally:
+        conn.close()
+
+
+def _load_windows(connection_id):
+    """读取适用于该连接的规则（包括全局规则），表不存在时返回空列表"""
+    try:
+        conn = get_db_connection()
+        try:
+            return conn.execute('''
+                SELECT * FROM throttle_windows WHERE connection_id IS NULL OR connection_id = ?
+            ''', (str(connection_id or ''),)).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"读取限速规则失败: {str(e)}", file=sys.stderr)
+        return []
+
+
+def has_windows(connection_id):
+    """该连接的备份是否需要经过限速（不论当前是否在时间窗口内）"""
+    return bool(_load_windows(connection_id))
+
+
+def active_limits(connection_id, now=None):
+    """
+    当前生效的速率上限
+
+    Returns:
+        dict: {'connection': {'read', 'write'}, 'global': {'read', 'write'}}，0 表示不限速
+    """
+    limits = {'connection': {'read': 0, 'write': 0}, 'global': {'read': 0, 'write': 0}}
+    for row in _load_windows(connection_id):
+        try:
+            if not window_active(row['start_time'], row['end_time'], now):
+                continue
+        except ValueError:
+            continue
+        level = limits['global' if row['connection_id'] is None else 'connection']
+        for scope in SCOPES:
+            rate = row[f'{scope}_rate'] or 0
+            if rate > 0 and (level[scope] == 0 or rate < level[scope]):
+                level[scope] = rate
+    return limits
+
+
+# ===== 令牌桶 =====
+
+class TokenBucket:
+    """
+    跨进程共享的令牌桶（GCRA）
+
+    状态文件中只保存理论到达时间（TAT）：每消耗 n 字节向后推 n / rate 秒，
+    TAT 超过当前时间 BURST_SECONDS 以上时调用方需要等待。CLOCK_MONOTONIC 在同一台机器的
+    所有进程间一致，状态目录在 /run 下，重启后随之清空。
+    """
+
+    def __init__(self, name, state_dir=None):
+        self.path = os.path.join(state_dir or THROTTLE_STATE_DIR, f"{name}.tat")
+
+    def reserve(self, nbytes, rate):
+        """
+        预约 nbytes 字节
+
+        Returns:
+            float: 需要等待的秒数
+        """
+        if rate <= 0 or nbytes <= 0:
+            return 0.0
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                tat = float(f.read().strip() or 0)
+            except ValueError:
+                tat = 0.0
+            now = time.monotonic()
+            if tat < now or tat > now + MAX_BACKLOG_SECONDS:
+                tat = now
+            tat += nbytes / rate
+            f.seek(0)
+            f.truncate()
+            f.write(repr(tat))
+        return max(0.0, tat - now - BURST_SECONDS)
+
+
+class Throttle:
+    """一个连接在若干方向（read / write）上的限速，同时受连接级和全局速率约束"""
+
+    def __init__(self, connection_id, scopes=('read',), state_dir=None):
+        self.connection_id = connection_id
+        self.scopes = tuple(scopes)
+        self.buckets = {}
+        for scope in self.scopes:
+            self.buckets[('global', scope)] = TokenBucket(f"global-{scope}", state_dir)
+            if connection_id:
+                self.buckets[('connection', scope)] = TokenBucket(f"connection-{connection_id}-{scope}", state_dir)
+        self.limits = None
+        self.refreshed = 0.0
+        self.waited = 0.0
+
+    def refresh(self):
+        """定期重新读取规则，进入或离开时间窗口后随之调整速率"""
+        now = time.monotonic()
+        if self.limits is None or now - self.refreshed >= REFRESH_INTERVAL:
+            self.limits = active_limits(self.connection_id)
+            self.refreshed = now
+
+    def consume(self, nbytes):
+        """消耗 nbytes 字节，必要时等待；各个桶都预约后按最长的等待时间休眠"""
+        self.refresh()
+        wait = 0.0
+        for (level, scope), bucket in self.buckets.items():
+            wait = max(wait, bucket.reserve(nbytes, self.limits[level][scope]))
+        if wait > 0:
+            time.sleep(wait)
+            self.waited += wait
+
+
+class ThrottledWriter:
+    """包装文件对象，写入前按 throttle 限速（artifact_index.py 写备份文件时使用）"""
+
+    def __init__(self, out, throttle):
+        self.out = out
+        self.throttle = throttle
+
+    def write(self, data):
+        self.throttle.consume(len(data))
+        return self.out.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.out, name)
+
+
+def copy_stream(src, dst, throttle, chunk_size=CHUNK_SIZE):
+    """
+    从 src 复制到 dst 并限速
+
+    Returns:
+        int: 复制的字节数
+    """
+    total = 0
+    while True:
+        chunk = src.read1(chunk_size)
+        if not chunk:
+            break
+        throttle.consume(len(chunk))
+        dst.write(chunk)
+        total += len(chunk)
+    dst.flush()
+    return total
+
+
+# ===== 运行环境 =====
+
+def effective_cpus():
+    """
+    当前进程实际可用的 CPU 数：CPU 亲和性和 cgroup 配额（v2 的 cpu.max 或 v1 的 cfs_quota）中较小者
+
+    容器中 os.cpu_count() 返回宿主机的 CPU 数，按它安排并发会远超容器的配额
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        cpus = os.cpu_count() or 1
+
+    quota = None
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            limit, period = f.read().split()[:2]
+            if limit != 'max':
+                quota = int(limit) / int(period)
+    except (OSError, ValueError):
+        try:
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+                limit = int(f.read())
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+                period = int(f.read())
+            if limit > 0 and period > 0:
+                quota = limit / period
+        except (OSError, ValueError):
+            pass
+
+    if quota:
+        cpus = min(cpus, max(1, int(quota + 0.5)))
+    return max(1, cpus)
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='备份限速工具')
+    subparsers = parser.add_subparsers(dest='command', help='可用命令')
+
+    pipe_parser = subparsers.add_parser('pipe', help='把标准输入限速复制到标准输出')
+    pipe_parser.add_argument('--connection', help='数据库连接 ID')
+    pipe_parser.add_argument('--scope', action='append', choices=SCOPES, help='限速方向，可重复指定（默认 read）')
+
+    enabled_parser = subparsers.add_parser('enabled', help='连接配置了限速规则时退出码为 0')
+    enabled_parser.add_argument('--connection', help='数据库连接 ID')
+
+    status_parser = subparsers.add_parser('status', help='显示当前生效的速率和可用 CPU 数')
+    status_parser.add_argument('--connection', help='数据库连接 ID')
+
+    list_parser = subparsers.add_parser('list', help='列出限速规则')
+    list_parser.add_argument('--user-id', type=int, help='用户 ID')
+
+    add_parser = subparsers.add_parser('add', help='添加限速规则')
+    add_parser.add_argument('--start', required=True, help='开始时间 HH:MM')
+    add_parser.add_argument('--end', required=True, help='结束时间 HH:MM（早于开始时间表示跨午夜）')
+    add_parser.add_argument('--read-rate', default='0', help='读取速率上限（字节/秒），支持 K/M/G 后缀')
+    add_parser.add_argument('--write-rate', default='0', help='写入速率上限（字节/秒），支持 K/M/G 后缀')
+    add_parser.add_argument('--connection', help='只限制该连接（默认全局）')
+
+    delete_parser = subparsers.add_parser('delete', help='删除限速规则')
+    delete_parser.add_argument('id', type=int, help='规则 ID')
+
+    args = parser.parse_args()
+
+    if args.command == 'pipe':
+        throttle = Throttle(args.connection, args.scope or ['read'])
+        try:
+            copy_stream(sys.stdin.buffer, sys.stdout.buffer, throttle)
+        except BrokenPipeError:
+            sys.stderr.close()
+            sys.exit(1)
+        if throttle.waited >= 1:
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 限速等待 {throttle.waited:.1f} 秒"
+                  f"（连接 {args.connection or '-'}）", file=sys.stderr)
+    elif args.command == 'enabled':
+        sys.exit(0 if has_windows(args.connection) else 1)
+    elif args.command == 'status':
+        limits = active_limits(args.connection)
+        print(json.dumps({
+            'connection': {scope: format_rate(rate) for scope, rate in limits['connection'].items()},
+            'global': {scope: format_rate(rate) for scope, rate in limits['global'].items()},
+            'effective_cpus': effective_cpus(),
+        }, indent=2, ensure_ascii=False))
+    elif args.command == 'list':
+        print(json.dumps(list_windows(args.user_id), indent=2, ensure_ascii=False, default=str))
+    elif args.command == 'add':
+        try:
+            window_id = add_window(args.start, args.end, parse_rate(args.read_rate), parse_rate(args.write_rate),
+                                   args.connection)
+        except ValueError as e:
+            print(f"错误: {str(e)}", file=sys.stderr)
+            sys.exit(1)
+        print(f"已添加限速规则: {window_id}")
+    elif args.command == 'delete':
+        if not delete_window(args.id):
+            print(f"规则不存在: {args.id}", file=sys.stderr)
+            sys.exit(1)
+        print(f"已删除限速规则: {args.id}")
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()